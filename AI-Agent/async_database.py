@@ -0,0 +1,271 @@
+"""
+Async MongoDB Data Access for FINTEL AI
+Motor-based mirror of FintelDatabase so FastAPI endpoints never block the event loop.
+Other backends (sqlite://) have no async driver; get_async_database wraps their
+InvoiceStore in AsyncStoreAdapter, which runs each call in a worker thread.
+"""
+
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any
+import os
+
+from database import (
+    DEFAULT_CONNECTION_STRING, get_database, vendor_stats_update, to_object_id, details_doc, anomaly_upserts, anomaly_types_updates,
+    duplicate_invoice_query, gst_vendor_mismatch_query, vendor_stats_pipeline, PRICE_MERGE_RETRIES,
+    price_sketch_write, invoice_price_sketches, vendor_baseline_update, split_rollup_updates,
+    TOTAL_AMOUNT_PIPELINE, anomaly_trends_pipeline, invoice_search_pipeline, shape_search_result
+)
+from storage import (
+    InvoiceStore, build_invoice_doc, decompress_details, anomaly_lookups, apply_anomaly_rules, anomaly_record,
+    serialize_invoice, serialize_vendor, serialize_anomaly, shape_anomaly_trends
+)
+from price_index import KLLSketch
+from split_billing import rollup_entries
+
+# One Motor client per connection string, created on first request (the API does so at import;
+# Motor only attaches to the event loop on its first operation)
+_async_databases: Dict[str, Any] = {}
+
+
+def _reset_async_registry_after_fork():
+    """Forked workers must build their own Motor clients"""
+    _async_databases.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_async_registry_after_fork)
+
+
+def get_async_database(connection_string: str = DEFAULT_CONNECTION_STRING):
+    """
+    Get the process-wide async repository
+    AsyncFintelDatabase for mongodb:// URLs, else the sync store of get_database behind an AsyncStoreAdapter
+    """
+    database = _async_databases.get(connection_string)
+    if database is None:
+        if connection_string.startswith(("mongodb://", "mongodb+srv://")):
+            database = AsyncFintelDatabase(connection_string)
+        else:
+            database = AsyncStoreAdapter(get_database(connection_string))
+        _async_databases[connection_string] = database
+    return database
+
+
+def close_async_clients():
+    """Close every Motor client (call on application shutdown)"""
+    for database in _async_databases.values():
+        database.close()
+    _async_databases.clear()
+
+
+class AsyncStoreAdapter:
+    """
+    Awaitable view of a synchronous InvoiceStore: `await adapter.method(...)` runs
+    store.method(...) through asyncio.to_thread, so the same request handlers work
+    on the embedded backend. The store itself is shared and closed by database.close_all_clients()
+    """
+
+    def __init__(self, store: InvoiceStore):
+        self.store = store
+
+    def __getattr__(self, name: str):
+        method = getattr(self.store, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+        return call
+
+    def close(self):
+        pass
+
+
+class AsyncFintelDatabase:
+    """
+    Async counterpart of FintelDatabase
+    Queries and anomaly rules are shared with database.py; only the I/O is awaited
+    """
+
+    def __init__(self, connection_string=DEFAULT_CONNECTION_STRING):
+        self.client = AsyncIOMotorClient(connection_string)
+        self.db = self.client['fintel_ai']
+
+        # Collections
+        self.invoices = self.db['invoices']
+        self.vendors = self.db['vendors']
+        self.anomalies = self.db['anomalies']
+        self.invoice_details = self.db['invoice_details']
+        self.price_index = self.db['price_index']
+        self.vendor_clusters = self.db['vendor_clusters']
+        self.vendor_baselines = self.db['vendor_baselines']
+        self.split_rollups = self.db['split_rollups']
+
+    def close(self):
+        self.client.close()
+
+    async def store_invoice(self, invoice_data: Dict[str, Any]) -> str:
+        """
+        Store invoice in database
+        Returns: invoice_id
+        """
+        invoice_doc = build_invoice_doc(invoice_data)
+
+        result = await self.invoices.insert_one(invoice_doc)
+        invoice_id = str(result.inserted_id)
+
+        await self.invoice_details.insert_one(details_doc(result.inserted_id, invoice_data))
+
+        upsert = vendor_stats_update(invoice_doc)
+        if upsert:
+            await self.vendors.update_one(*upsert, upsert=True)
+        await self.merge_price_sketches(invoice_price_sketches(invoice_doc))
+        updates = split_rollup_updates(rollup_entries(invoice_data, invoice_id))
+        if updates:
+            await self.split_rollups.bulk_write(updates, ordered=False)
+
+        print(f"✅ Invoice stored: {invoice_doc['invoiceNumber']} (ID: {invoice_id})")
+        return invoice_id
+
+    async def detect_anomalies(self, invoice_data: Dict[str, Any], invoice_id: str,
+                               price_stats: Optional[Dict] = None) -> List[Dict]:
+        """
+        Detect anomalies by comparing with historical data
+        price_stats: price index entries read before store_invoice (see storage.anomaly_lookups)
+        Returns: List of detected anomalies
+        """
+        anomalies = await self.find_anomalies(invoice_data, invoice_id, price_stats)
+        if anomalies:
+            await self.insert_anomalies([anomaly_record(invoice_id, invoice_data, a) for a in anomalies])
+        return anomalies
+
+    async def find_anomalies(self, invoice_data: Dict[str, Any], invoice_id: str,
+                             price_stats: Optional[Dict] = None) -> List[Dict]:
+        """The shared rule list (storage.apply_anomaly_rules); its lookups run concurrently"""
+        lookups = anomaly_lookups(invoice_data, invoice_id, price_stats)
+        results = await asyncio.gather(*(getattr(self, method)(*args) for method, args in lookups.values()))
+        return apply_anomaly_rules(invoice_data, invoice_id, dict(zip(lookups, results)), price_stats)
+
+    async def insert_anomalies(self, records: List[Dict]) -> None:
+        """Upsert already-built anomaly records (one per invoice and type)"""
+        if records:
+            await self.anomalies.bulk_write(anomaly_upserts(records), ordered=False)
+            updates = anomaly_types_updates(records)
+            if updates:
+                await self.invoices.bulk_write(updates, ordered=False)
+
+    async def find_invoice_by_number(self, invoice_number: Optional[str], exclude_id: Optional[str] = None) -> Optional[Dict]:
+        """Another invoice carrying the same invoice number"""
+        return await self.invoices.find_one(duplicate_invoice_query({'invoice_number': invoice_number}, to_object_id(exclude_id)))
+
+    async def find_gst_vendor_mismatch(self, gst_number: str, vendor_name: Optional[str],
+                                       exclude_id: Optional[str] = None) -> Optional[Dict]:
+        """An invoice with this GST number but a different vendor name"""
+        return await self.invoices.find_one(gst_vendor_mismatch_query({'vendor_name': vendor_name}, gst_number, to_object_id(exclude_id)))
+
+    async def merge_price_sketches(self, sketches: Dict[str, KLLSketch]) -> None:
+        """Same optimistic read-merge-write as FintelDatabase.merge_price_sketches"""
+        for key, sketch in sketches.items():
+            for _ in range(PRICE_MERGE_RETRIES):
+                stored = await self.price_index.find_one({'_id': key})
+                query, doc = price_sketch_write(stored, sketch)
+                try:
+                    if query is None:
+                        await self.price_index.insert_one({'_id': key, **doc})
+                        break
+                    if (await self.price_index.replace_one(query, doc)).matched_count:
+                        break
+                except DuplicateKeyError:
+                    continue
+            else:
+                print(f"⚠️ Price index entry {key} kept changing - skipped this invoice's prices")
+
+    async def get_price_stats(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Precomputed percentiles of the price index entries that exist among `keys`"""
+        if not keys:
+            return {}
+        cursor = self.price_index.find({'_id': {'$in': list(keys)}}, {'stats': 1})
+        return {doc['_id']: doc['stats'] for doc in await cursor.to_list(length=None)}
+
+    async def get_vendor_cluster(self, gst_number: str) -> Optional[Dict[str, Any]]:
+        """The vendor's behaviour-cluster assignment from the last clustering run"""
+        return await self.vendor_clusters.find_one({'_id': gst_number}, {'_id': 0})
+
+    async def get_vendor_baseline(self, gst_number: str) -> Optional[Dict[str, Any]]:
+        """The vendor's running baseline sums (vendor_baselines.py)"""
+        return await self.vendor_baselines.find_one({'_id': gst_number}, {'_id': 0})
+
+    async def merge_vendor_baseline(self, gst_number: str, observation: Dict[str, Any]) -> None:
+        await self.vendor_baselines.update_one({'_id': gst_number}, vendor_baseline_update(observation), upsert=True)
+
+    async def get_split_rollups(self, rollup_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """{rollup id: rollup} for the split rollups that exist among `rollup_ids` (split_billing.py)"""
+        cursor = self.split_rollups.find({'_id': {'$in': list(rollup_ids)}})
+        return {doc['_id']: doc for doc in await cursor.to_list(length=None)}
+
+    async def get_invoice(self, invoice_id: str) -> Optional[Dict]:
+        """Fetch one invoice by id"""
+        return await self.invoices.find_one({'_id': to_object_id(invoice_id)})
+
+    async def get_invoice_details(self, invoice_id: str) -> Optional[Dict]:
+        """Decompressed detail payload for detail views"""
+        doc = await self.invoice_details.find_one({'_id': to_object_id(invoice_id)})
+        return decompress_details(doc['payload']) if doc else None
+
+    async def vendors_stats(self, vendor_name: str) -> List[Dict]:
+        """Get statistics for a vendor"""
+        return await self.invoices.aggregate(vendor_stats_pipeline(vendor_name)).to_list(length=None)
+
+    async def get_invoice_history(self, limit: int = 50) -> List[Dict]:
+        """Get recent invoice history"""
+        invoices = await self.invoices.find().sort('uploadDate', DESCENDING).limit(limit).to_list(length=limit)
+        return [serialize_invoice(inv) for inv in invoices]
+
+    async def search_invoices(self, filters: Dict[str, Any], text: Optional[str] = None,
+                              page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+        """Faceted invoice search (single $facet aggregation)"""
+        results = await self.invoices.aggregate(invoice_search_pipeline(filters, text, page, page_size)).to_list(length=1)
+        return shape_search_result(results[0] if results else None, page, page_size)
+
+    async def get_vendor_list(self) -> List[Dict]:
+        """Get list of all vendors"""
+        vendors = await self.vendors.find().sort('totalAmount', DESCENDING).to_list(length=None)
+        return [serialize_vendor(vendor) for vendor in vendors]
+
+    async def get_anomalies(self, severity: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        """Get detected anomalies"""
+        query = {}
+        if severity:
+            query['severity'] = severity
+
+        anomalies = await self.anomalies.find(query).sort('detectedDate', DESCENDING).limit(limit).to_list(length=limit)
+        return [serialize_anomaly(anomaly) for anomaly in anomalies]
+
+    async def get_dashboard_stats(self) -> Dict:
+        """Get statistics for dashboard"""
+        total_invoices = await self.invoices.estimated_document_count()
+        total_vendors = await self.vendors.estimated_document_count()
+        total_anomalies = await self.anomalies.estimated_document_count()
+        high_severity_anomalies = await self.anomalies.count_documents({'severity': 'HIGH'})
+
+        amount_result = await self.invoices.aggregate(TOTAL_AMOUNT_PIPELINE).to_list(length=1)
+        total_amount = amount_result[0]['totalAmount'] if amount_result else 0
+
+        return {
+            'totalInvoices': total_invoices,
+            'totalVendors': total_vendors,
+            'totalAnomalies': total_anomalies,
+            'highSeverityAnomalies': high_severity_anomalies,
+            'totalAmountProcessed': total_amount
+        }
+
+    async def get_anomaly_trends(self, days: int = 30) -> List[Dict[str, Any]]:
+        """Get daily anomaly counts by type for the last N days"""
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
+
+        results = await self.anomalies.aggregate(anomaly_trends_pipeline(start_date, end_date)).to_list(length=None)
+        return shape_anomaly_trends(results, start_date, end_date)
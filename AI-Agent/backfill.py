@@ -0,0 +1,401 @@
+"""
+Backfill / Migration Runner for FINTEL AI
+Runs a registered job over a collection in _id order with constant memory:
+keyset-paged batches, _id-range partitions spread over worker processes,
+unordered bulk writes, a checkpoint per partition (an interrupted run resumes,
+a finished one runs again), dry-run mode and throughput reporting.
+
+Usage:
+    python backfill.py --list
+    python backfill.py <job> [--workers 4] [--batch-size 500] [--throttle-ms 0] [--dry-run] [--restart]
+"""
+
+import sys
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Any, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, DeleteOne, ReplaceOne, UpdateOne
+
+from database import (
+    DEFAULT_CONNECTION_STRING, FintelDatabase, get_database, details_doc,
+    anomaly_upserts, anomaly_types_updates
+)
+from storage import (
+    HOT_COMPLIANCE_FIELDS, HOT_ML_FIELDS, summarize_payload, search_terms,
+    anomaly_record, invoice_data_from_doc, decompress_details
+)
+
+CHECKPOINTS = 'backfill_checkpoints'
+MISSING_GST_VALUES = [None, '', 'N/A', 'Unknown']
+
+JOBS: Dict[str, type] = {}
+
+
+def register_job(cls):
+    """Class decorator: make a job runnable as `python backfill.py <name>`"""
+    JOBS[cls.name] = cls
+    return cls
+
+
+class BackfillJob(ABC):
+    """
+    One backfill or migration
+    The runner feeds batches of `source` documents matching `query` (in _id order);
+    the job returns the writes for them, grouped by target collection.
+    Writes must be idempotent - a batch is replayed when a worker dies before its checkpoint.
+    """
+
+    name: str = ''
+    description: str = ''
+    source: str = 'invoices'
+    query: Dict = {}
+    projection: Optional[Dict] = None
+
+    def prepare(self, db: FintelDatabase):
+        """Called once before any worker starts (indexes the job relies on, etc.)"""
+        pass
+
+    @abstractmethod
+    def operations(self, db: FintelDatabase, batch: List[Dict]) -> Dict[str, List]:
+        """{collection: [pymongo write ops]}, applied in insertion order"""
+
+
+@register_job
+class MissingGstJob(BackfillJob):
+    name = 'missing-gst'
+    description = 'Create MISSING_GST anomalies for invoices stored without a GST number'
+    query = {'gstNumber': {'$in': MISSING_GST_VALUES}}
+    projection = {'invoiceNumber': 1, 'vendorName': 1, 'uploadDate': 1}
+
+    def prepare(self, db):
+        db.ensure_unique_anomaly_key()
+
+    def operations(self, db, batch):
+        records = []
+        for invoice in batch:
+            vendor_name = invoice.get('vendorName', 'Unknown')
+            records.append({
+                'invoiceId': str(invoice['_id']),
+                'invoiceNumber': invoice.get('invoiceNumber', 'Unknown'),
+                'anomalyType': 'MISSING_GST',
+                'severity': 'HIGH',
+                'description': f"Invoice missing GST number - Vendor: {vendor_name}",
+                'detectedAt': invoice.get('uploadDate', datetime.now()),  # Use invoice upload date
+                'status': 'OPEN',
+                'vendorName': vendor_name
+            })
+        return {'anomalies': anomaly_upserts(records), 'invoices': anomaly_types_updates(records)}
+
+
+@register_job
+class DetectAnomaliesJob(BackfillJob):
+    name = 'detect-anomalies'
+    description = 'Re-run every anomaly rule against stored invoices (after a rule change)'
+    projection = {'searchTerms': 0}
+
+    def prepare(self, db):
+        db.ensure_unique_anomaly_key()
+
+    def operations(self, db, batch):
+        details = {
+            doc['_id']: decompress_details(doc['payload'])
+            for doc in db.invoice_details.find({'_id': {'$in': [inv['_id'] for inv in batch]}})
+        }
+        records = []
+        for invoice in batch:
+            invoice_id = str(invoice['_id'])
+            invoice_data = invoice_data_from_doc(invoice, details.get(invoice['_id']))
+            records.extend(anomaly_record(invoice_id, invoice_data, anomaly)
+                           for anomaly in db.find_anomalies(invoice_data, invoice_id))
+        return {'anomalies': anomaly_upserts(records), 'invoices': anomaly_types_updates(records)}
+
+
+@register_job
+class VendorRollupJob(BackfillJob):
+    name = 'vendor-rollups'
+    description = 'Recompute vendors.totalInvoices / totalAmount / first and last invoice dates'
+    query = {'gstNumber': {'$nin': MISSING_GST_VALUES}}
+    projection = {'gstNumber': 1}
+
+    def __init__(self):
+        self.rebuilt = set()  # per worker; a resumed run just recomputes again
+
+    def operations(self, db, batch):
+        updates = []
+        for gst_number in {invoice['gstNumber'] for invoice in batch} - self.rebuilt:
+            self.rebuilt.add(gst_number)
+            pipeline = [
+                {'$match': {'gstNumber': gst_number}},
+                {'$sort': {'uploadDate': ASCENDING}},
+                {'$group': {
+                    '_id': None,
+                    'totalInvoices': {'$sum': 1},
+                    'totalAmount': {'$sum': '$totalAmount'},
+                    'firstInvoiceDate': {'$first': '$uploadDate'},
+                    'lastInvoiceDate': {'$last': '$uploadDate'},
+                    'vendorName': {'$last': '$vendorName'}
+                }}
+            ]
+            for totals in db.invoices.aggregate(pipeline):
+                totals.pop('_id')
+                updates.append(UpdateOne({'gstNumber': gst_number}, {'$set': totals}, upsert=True))
+        return {'vendors': updates}
+
+
+@register_job
+class DedupeAnomaliesJob(BackfillJob):
+    name = 'dedupe-anomalies'
+    description = 'Keep the oldest anomaly per (invoiceId, anomalyType) so the key can be made unique'
+    source = 'anomalies'
+    projection = {'invoiceId': 1, 'anomalyType': 1}
+
+    def operations(self, db, batch):
+        pairs = {(a.get('invoiceId'), a.get('anomalyType')) for a in batch}
+        oldest: Dict[Tuple, ObjectId] = {}
+        # Look across the whole collection, not just this partition
+        for anomaly in db.anomalies.find(
+                {'$or': [{'invoiceId': i, 'anomalyType': t} for i, t in pairs]},
+                {'invoiceId': 1, 'anomalyType': 1}):
+            key = (anomaly.get('invoiceId'), anomaly.get('anomalyType'))
+            oldest[key] = min(oldest.get(key, anomaly['_id']), anomaly['_id'])
+        return {'anomalies': [
+            DeleteOne({'_id': a['_id']}) for a in batch
+            if oldest.get((a.get('invoiceId'), a.get('anomalyType')), a['_id']) != a['_id']
+        ]}
+
+
+@register_job
+class CompactInvoicesJob(BackfillJob):
+    name = 'compact-invoices'
+    description = 'Move rawText / full analysis payloads of legacy invoices into invoice_details'
+    query = {'rawText': {'$exists': True}}
+
+    def operations(self, db, batch):
+        details, invoices = [], []
+        for invoice in batch:
+            details.append(ReplaceOne({'_id': invoice['_id']}, details_doc(invoice['_id'], legacy_to_invoice_data(invoice)),
+                                      upsert=True))
+            invoices.append(UpdateOne({'_id': invoice['_id']}, compaction_update(invoice)))
+        # Details first: an interrupted run never leaves a slimmed invoice without its payload
+        return {'invoice_details': details, 'invoices': invoices}
+
+
+@register_job
+class RescoreComplianceJob(BackfillJob):
+    name = 'rescore-compliance'
+    description = 'Re-score complianceResults / mlPrediction summaries with the batch engine (after a rule change)'
+    projection = {'rawText': 0, 'searchTerms': 0}
+
+    def __init__(self):
+        import batch_compliance  # pandas / scikit-learn, only needed by this job
+        self.engine = batch_compliance
+        self.trainer = batch_compliance.load_ml_trainer()
+
+    def operations(self, db, batch):
+        results = self.engine.score_frame(self.engine.invoice_frame(batch), self.trainer)
+        return {'invoices': [
+            UpdateOne({'_id': ObjectId(invoice_id)}, {'$set': fields})
+            for invoice_id, fields in self.engine.summary_updates(batch, results).items()
+        ]}
+
+
+def legacy_to_invoice_data(invoice: dict) -> dict:
+    """Rebuild the upload-handler field names the details builder expects"""
+    return {
+        'compliance_results': invoice.get('complianceResults', {}),
+        'ml_prediction': invoice.get('mlPrediction', {}),
+        'gst_verification': invoice.get('gst_verification', []),
+        'raw_text': invoice.get('rawText', '')
+    }
+
+
+def compaction_update(invoice: dict) -> dict:
+    """$set the hot summaries, $unset the payloads that moved out"""
+    unset = {'rawText': '', 'gst_verification': ''}
+    all_gst = invoice.get('allGstNumbers') or []
+    if len(all_gst) <= 1:
+        unset['allGstNumbers'] = ''
+    return {
+        '$set': {
+            'complianceResults': summarize_payload(invoice.get('complianceResults'), HOT_COMPLIANCE_FIELDS),
+            'mlPrediction': summarize_payload(invoice.get('mlPrediction'), HOT_ML_FIELDS),
+            'searchTerms': search_terms({'raw_text': invoice.get('rawText')})
+        },
+        '$unset': unset
+    }
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def _mongo(connection_string: str) -> FintelDatabase:
+    db = get_database(connection_string)
+    if not isinstance(db, FintelDatabase):
+        raise SystemExit("❌ Backfills run against MongoDB (the embedded SQLite store needs no migrations)")
+    return db
+
+
+def plan_partitions(db: FintelDatabase, job: BackfillJob, workers: int) -> List[List[Optional[ObjectId]]]:
+    """
+    Split the source collection into `workers` _id ranges [lo, hi)
+    ObjectIds grow with time, so boundaries are spread evenly between the first and
+    last creation timestamps. The last range is open-ended.
+    """
+    collection = db.db[job.source]
+    first = collection.find_one(job.query, {'_id': 1}, sort=[('_id', ASCENDING)])
+    last = collection.find_one(job.query, {'_id': 1}, sort=[('_id', -1)])
+    if workers <= 1 or not first or not isinstance(first['_id'], ObjectId) or not isinstance(last['_id'], ObjectId):
+        return [[None, None]]
+
+    start, end = first['_id'].generation_time, last['_id'].generation_time
+    step = (end - start) / workers
+    bounds = [None] + [ObjectId.from_datetime(start + step * i) for i in range(1, workers)] + [None]
+    return [[bounds[i], bounds[i + 1]] for i in range(workers)]
+
+
+def run_partition(job_name: str, connection_string: str, index: int, lo: Optional[ObjectId], hi: Optional[ObjectId],
+                  batch_size: int, dry_run: bool, throttle_ms: int) -> Dict[str, Any]:
+    """Worker: page through one _id range, write, checkpoint after every batch"""
+    job = JOBS[job_name]()
+    db = _mongo(connection_string)
+    source = db.db[job.source]
+    checkpoints = db.db[CHECKPOINTS]
+    checkpoint_id = f"{job_name}:{index}"
+
+    checkpoint = {} if dry_run else checkpoints.find_one({'_id': checkpoint_id}) or {}
+    if checkpoint.get('done'):  # finished before the interrupted run stopped
+        return {'partition': index, 'processed': 0, 'written': 0, 'seconds': 0.0}
+    last_id = checkpoint.get('lastId')
+    processed, written = checkpoint.get('processed', 0), checkpoint.get('written', 0)
+    resumed_from, batches = processed, 0
+
+    start = time.perf_counter()
+    while True:
+        id_range = {}
+        if last_id is not None:
+            id_range['$gt'] = last_id
+        elif lo is not None:
+            id_range['$gte'] = lo
+        if hi is not None:
+            id_range['$lt'] = hi
+        query = dict(job.query)
+        if id_range:
+            query['_id'] = id_range
+
+        batch = list(source.find(query, job.projection).sort('_id', ASCENDING).limit(batch_size))
+        if not batch:
+            break
+
+        for collection, ops in job.operations(db, batch).items():
+            if ops and not dry_run:
+                result = db.db[collection].bulk_write(ops, ordered=False)
+                written += result.upserted_count + result.modified_count + result.deleted_count
+            elif dry_run:
+                written += len(ops)
+
+        processed += len(batch)
+        last_id = batch[-1]['_id']
+        if not dry_run:
+            checkpoints.update_one(
+                {'_id': checkpoint_id},
+                {'$set': {'job': job_name, 'partition': index, 'lastId': last_id, 'processed': processed,
+                          'written': written, 'updatedAt': datetime.now()}},
+                upsert=True
+            )
+
+        batches += 1
+        if batches % 20 == 0:
+            print(f"   [partition {index}] {processed} docs, {written} writes "
+                  f"({(processed - resumed_from) / (time.perf_counter() - start):.0f} docs/sec)")
+        if throttle_ms:
+            time.sleep(throttle_ms / 1000)  # leave room for production traffic
+
+    if not dry_run:
+        checkpoints.update_one({'_id': checkpoint_id}, {'$set': {'done': True, 'updatedAt': datetime.now()}},
+                               upsert=True)
+    return {'partition': index, 'processed': processed - resumed_from, 'written': written,
+            'seconds': time.perf_counter() - start}
+
+
+def run_job(job_name: str, connection_string: str = DEFAULT_CONNECTION_STRING, workers: int = 1,
+            batch_size: int = 500, dry_run: bool = False, restart: bool = False, throttle_ms: int = 0) -> Dict[str, int]:
+    """Run (or resume) a registered job. Returns total processed / written counts."""
+    if job_name not in JOBS:
+        raise SystemExit(f"❌ Unknown job: {job_name} (see --list)")
+    job = JOBS[job_name]()
+    db = _mongo(connection_string)
+    checkpoints = db.db[CHECKPOINTS]
+
+    print("=" * 60)
+    print(f"BACKFILL: {job_name}" + (" (DRY RUN)" if dry_run else ""))
+    print(f"   {job.description}")
+    print("=" * 60)
+
+    # Only an unfinished plan is resumed; after a finished one, re-running starts a fresh run
+    plan = None if restart or dry_run else checkpoints.find_one({'_id': job_name})
+    if plan and plan.get('done'):
+        plan = None
+    if not plan and not dry_run:
+        checkpoints.delete_many({'job': job_name})
+
+    if plan:
+        partitions = plan['partitions']
+        print(f"⏯️  Resuming {len(partitions)} partitions from their checkpoints")
+    else:
+        if not dry_run:
+            job.prepare(db)
+        partitions = plan_partitions(db, job, workers)
+        if not dry_run:
+            checkpoints.replace_one({'_id': job_name}, {'job': job_name, 'partitions': partitions,
+                                                        'startedAt': datetime.now()}, upsert=True)
+
+    start = time.perf_counter()
+    args = [(job_name, connection_string, i, lo, hi, batch_size, dry_run, throttle_ms)
+            for i, (lo, hi) in enumerate(partitions)]
+    if len(args) == 1:
+        results = [run_partition(*args[0])]
+    else:
+        # spawn: every worker builds its own MongoClient
+        with ProcessPoolExecutor(max_workers=len(args), mp_context=get_context('spawn')) as pool:
+            results = list(pool.map(run_partition, *zip(*args)))
+    elapsed = time.perf_counter() - start
+
+    processed = sum(r['processed'] for r in results)
+    written = sum(r['written'] for r in results)
+    if not dry_run:
+        checkpoints.update_one({'_id': job_name}, {'$set': {'done': True, 'finishedAt': datetime.now()}})
+
+    print(f"\n✅ {job_name}: {processed} docs scanned, {written} {'planned ' if dry_run else ''}writes "
+          f"in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.0f} docs/sec)")
+    return {'processed': processed, 'written': written}
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] == '--list':
+        print("Registered jobs:")
+        for name, cls in JOBS.items():
+            print(f"   {name:<20} {cls.description}")
+        return
+
+    def option(name: str, default: int) -> int:
+        return int(args[args.index(name) + 1]) if name in args else default
+
+    run_job(
+        args[0],
+        workers=option('--workers', 1),
+        batch_size=option('--batch-size', 500),
+        throttle_ms=option('--throttle-ms', 0),
+        dry_run='--dry-run' in args,
+        restart='--restart' in args
+    )
+
+
+if __name__ == "__main__":
+    main()
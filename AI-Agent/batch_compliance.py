@@ -0,0 +1,272 @@
+"""
+Batch Compliance Re-scoring for FINTEL AI
+Re-scores stored invoices after a rule or model change. Invoices are loaded in
+columnar chunks, the compiled compliance rule plan (compliance_rules.json) and
+ML scoring run as pandas/NumPy array operations, and the hot summaries
+(complianceResults.* and mlPrediction.*) are written back with one bulk update
+per chunk. `--profile` prints the per-rule cost.
+
+Results are identical to compliance.process_complete_compliance; `--verify N`
+re-runs the single-invoice path on N invoices and diffs the two. Like the upload
+handler, a vendor-baseline verdict decides over the global model's; it is the one
+recorded at upload (mlPrediction.vendor_baseline), as only then was the vendor's
+history the invoice's past.
+
+`--changed` only re-scores the invoices whose recorded rule versions or HSN
+rates (complianceDeps) changed since the last run.
+
+Usage:
+    python batch_compliance.py [database_url] [--changed] [--chunk-size 5000] [--no-ml] [--dry-run] [--profile]
+    python batch_compliance.py [database_url] --verify 500
+"""
+
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from compliance import (
+    COMPLIANCE_PLAN, process_complete_compliance, price_verdict,
+    reference_snapshot, stale_dependencies, added_rules
+)
+from database import DEFAULT_CONNECTION_STRING, get_database
+from ml_features import INPUT_FIELDS, column_features
+from ml_forest import CompiledForest
+from model_registry import load_active_scorer
+from price_index import normalize_line_items
+from rule_engine import print_timing_report
+from storage import InvoiceStore, HOT_COMPLIANCE_FIELDS, HOT_ML_FIELDS, invoice_data_from_doc
+from vendor_baselines import combine_predictions
+
+SNAPSHOT_NAME = 'compliance'
+
+FRAME_COLUMNS = [
+    'invoice_number', 'vendor_name', 'gst_numbers', 'total_amount', 'invoice_date',
+    'hsn_sac_codes', 'item_descriptions', 'ocr_confidence', 'raw_text'
+]
+
+
+def load_ml_trainer() -> Optional[CompiledForest]:
+    """Load the same model as the API (the registry's active version); None when no usable model exists"""
+    scorer = load_active_scorer()
+    if scorer is None:
+        print("⚠️ Keeping the stored ML predictions")
+    return scorer
+
+
+def invoice_frame(invoices: List[Dict], details: Optional[Dict[str, Dict]] = None) -> pd.DataFrame:
+    """
+    One row per stored invoice, in the upload-handler field names
+    Object columns keep None/'' exactly as stored so truthiness matches the single path
+    """
+    details = details or {}
+    records = [invoice_data_from_doc(inv, details.get(str(inv['_id']))) for inv in invoices]
+    frame = pd.DataFrame({
+        column: pd.Series([record[column] for record in records], dtype=object)
+        for column in FRAME_COLUMNS
+    })
+    frame['stored_ml_anomaly'] = [bool((inv.get('mlPrediction') or {}).get('is_anomaly')) for inv in invoices]
+    # The price verdict comes from the index entries stored with the invoice at upload
+    verdicts = [price_verdict(normalize_line_items(record), inv.get('priceStats')) for record, inv in zip(records, invoices)]
+    frame['price_checked'] = [checked for checked, _ in verdicts]
+    frame['price_outlier'] = [outlier for _, outlier in verdicts]
+    frame['vendor_baseline'] = pd.Series([(inv.get('mlPrediction') or {}).get('vendor_baseline') for inv in invoices],
+                                         dtype=object)
+    return frame
+
+
+def score_ml(trainer: CompiledForest, frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Isolation Forest over the whole chunk, on the same ml_features matrix the single path builds;
+    rows with a stored vendor-baseline verdict keep it (vendor_baselines.combine_predictions)
+    """
+    features = column_features({field: frame[field].tolist() for field in INPUT_FIELDS}, trainer.feature_fill)
+    scores = trainer.predict_anomaly_batch(features)
+    baselines = frame['vendor_baseline'].tolist()
+    decided = np.array([baseline is not None for baseline in baselines], dtype=bool)
+    is_anomaly = np.where(decided, [bool(b and b['is_anomaly']) for b in baselines], scores['is_anomaly'])
+    anomaly_score = np.where(decided, [b['anomaly_score'] if b else 0.0 for b in baselines], scores['anomaly_score'])
+    return pd.DataFrame({'is_anomaly': is_anomaly, 'anomaly_score': anomaly_score, 'model_version': trainer.version,
+                         'vendor_baseline': pd.Series(baselines, dtype=object, index=frame.index),
+                         'ml_scored': True}, index=frame.index)
+
+
+def score_frame(frame: pd.DataFrame, trainer: Optional[CompiledForest] = None) -> pd.DataFrame:
+    """Compliance (+ ML when a trainer is given) for a chunk"""
+    if trainer is not None:
+        ml = score_ml(trainer, frame)
+        ml_anomaly = ml['is_anomaly'].to_numpy(bool)
+    else:
+        ml = pd.DataFrame({'is_anomaly': False, 'anomaly_score': np.nan, 'model_version': None,
+                           'vendor_baseline': None, 'ml_scored': False}, index=frame.index)
+        ml_anomaly = frame['stored_ml_anomaly'].to_numpy(bool)
+    return pd.concat([COMPLIANCE_PLAN.evaluate_frame(frame.assign(ml_anomaly=ml_anomaly)), ml], axis=1)
+
+
+def result_summaries(results: pd.DataFrame) -> List[Tuple[Dict, Optional[Dict], List[str]]]:
+    """Plain-Python (complianceResults, mlPrediction, complianceDeps), typed like the single path"""
+    columns = {column: results[column].tolist() for column in results.columns}
+    summaries = []
+    for i in range(len(results)):
+        compliance = {field: columns[field][i] for field in HOT_COMPLIANCE_FIELDS}
+        if not columns['float_checks'][i]:
+            compliance['checks_passed'] = int(compliance['checks_passed'])
+        ml = {field: columns[field][i] for field in HOT_ML_FIELDS} if columns['ml_scored'][i] else None
+        summaries.append((compliance, ml, columns['dependencies'][i]))
+    return summaries
+
+
+def summary_updates(invoices: List[Dict], results: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """{invoice_id: {'complianceResults.x': value, ...}} for the invoices whose summary changed"""
+    updates = {}
+    for invoice, (compliance, ml, dependencies) in zip(invoices, result_summaries(results)):
+        fields = {}
+        if invoice.get('complianceDeps') != dependencies:
+            fields['complianceDeps'] = dependencies
+        for prefix, summary in (('complianceResults', compliance), ('mlPrediction', ml)):
+            stored = invoice.get(prefix) or {}
+            for field, value in (summary or {}).items():
+                if stored.get(field) != value or type(stored.get(field)) is not type(value):
+                    fields[f"{prefix}.{field}"] = value
+        if fields:
+            updates[str(invoice['_id'])] = fields
+    return updates
+
+
+def _chunks(invoices: Iterator[Dict], chunk_size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for invoice in invoices:
+        chunk.append(invoice)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _rescore(store: InvoiceStore, invoices: Iterator[Dict], chunk_size: int,
+             trainer: Optional[CompiledForest], dry_run: bool) -> Dict[str, Any]:
+    """Score `invoices` chunk by chunk; returns {'processed', 'updated', 'fields': {path: changes}}"""
+    totals = {'processed': 0, 'updated': 0, 'fields': Counter()}
+    started = time.perf_counter()
+    for chunk in _chunks(invoices, chunk_size):
+        # Every rule and ML feature reads hot fields: the compressed details are never fetched
+        results = score_frame(invoice_frame(chunk), trainer)
+        updates = summary_updates(chunk, results)
+        if updates and not dry_run:
+            store.set_invoice_fields(updates)
+        totals['processed'] += len(chunk)
+        totals['updated'] += len(updates)
+        for fields in updates.values():
+            totals['fields'].update(fields.keys())
+        elapsed = time.perf_counter() - started
+        print(f"   {totals['processed']} invoices, {totals['updated']} changed "
+              f"({totals['processed'] / elapsed:,.0f}/s)")
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Re-scored {totals['processed']} invoices in {elapsed:.1f}s "
+          f"({totals['processed'] / max(elapsed, 1e-9):,.0f}/s), {totals['updated']} "
+          f"{'would change' if dry_run else 'updated'}")
+    for path, count in totals['fields'].most_common():
+        print(f"   {path}: {count}")
+    return totals
+
+
+def rescore_invoices(store: InvoiceStore, chunk_size: int = 5000, trainer: Optional[CompiledForest] = None,
+                     dry_run: bool = False) -> Dict[str, Any]:
+    """Re-score every stored invoice, then record the reference data it was scored with"""
+    print(f"\n🔄 Re-scoring all invoices (chunks of {chunk_size}, ML {'on' if trainer else 'stored'}"
+          f"{', dry run' if dry_run else ''})")
+    totals = _rescore(store, store.iter_invoices(batch_size=chunk_size), chunk_size, trainer, dry_run)
+    if not dry_run:
+        store.save_reference_snapshot(SNAPSHOT_NAME, reference_snapshot())
+    return totals
+
+
+def rescore_changed(store: InvoiceStore, chunk_size: int = 5000, trainer: Optional[CompiledForest] = None,
+                    dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Re-score only the invoices that relied on a rule version or HSN rate that changed
+    since the last run (found through the complianceDeps index)
+    """
+    previous = store.get_reference_snapshot(SNAPSHOT_NAME)
+    if previous is None:
+        print("⚠️ No reference snapshot yet - re-scoring everything once")
+        return rescore_invoices(store, chunk_size, trainer, dry_run)
+    new_rules = added_rules(previous)
+    if new_rules:
+        print(f"⚠️ New rules {new_rules} apply to every invoice - re-scoring everything")
+        return rescore_invoices(store, chunk_size, trainer, dry_run)
+
+    stale = stale_dependencies(previous)
+    if not stale:
+        print("✅ No rule or HSN changes since the last run")
+        return {'processed': 0, 'updated': 0, 'fields': Counter()}
+
+    print(f"\n🔄 Re-scoring invoices affected by {len(stale)} changes"
+          f"{' (dry run)' if dry_run else ''}:")
+    for dependency in stale:
+        print(f"   {dependency}")
+    totals = _rescore(store, store.iter_invoices_with_dependencies(stale, batch_size=chunk_size),
+                      chunk_size, trainer, dry_run)
+    if not dry_run:
+        store.save_reference_snapshot(SNAPSHOT_NAME, reference_snapshot())
+    return totals
+
+
+def verify(store: InvoiceStore, sample: int = 500, trainer: Optional[CompiledForest] = None) -> int:
+    """Score `sample` invoices both ways; returns the number of invoices that differ"""
+    chunk = next(_chunks(store.iter_invoices(batch_size=sample), sample), [])
+    details = store.get_invoice_details_many([str(inv['_id']) for inv in chunk])
+    batch = result_summaries(score_frame(invoice_frame(chunk, details if trainer else None), trainer))
+
+    mismatches = 0
+    for invoice, (batch_compliance, batch_ml, batch_deps) in zip(chunk, batch):
+        invoice_data = invoice_data_from_doc(invoice, details.get(str(invoice['_id'])))
+        if trainer is not None:
+            ml_result = combine_predictions(trainer.predict_anomaly(invoice_data),
+                                            (invoice.get('mlPrediction') or {}).get('vendor_baseline'))
+        else:
+            ml_result = invoice.get('mlPrediction') or {}
+        enhanced_data = {
+            'hsn_sac_codes': invoice_data['hsn_sac_codes'],
+            'item_descriptions': invoice_data['item_descriptions']
+        }
+        single = process_complete_compliance(invoice_data, enhanced_data, ml_result, invoice.get('priceStats'))
+        expected = {field: single[field] for field in HOT_COMPLIANCE_FIELDS}
+        expected_ml = {field: ml_result.get(field) for field in HOT_ML_FIELDS} if trainer and ml_result else None
+        if expected_ml:
+            expected_ml['is_anomaly'] = bool(expected_ml['is_anomaly'])
+
+        if single['dependencies'] != batch_deps:
+            mismatches += 1
+            print(f"❌ {invoice['_id']} dependencies: single={single['dependencies']} batch={batch_deps}")
+            continue
+        for label, want, got in (('compliance', expected, batch_compliance), ('ml', expected_ml, batch_ml)):
+            if want != got or any(type(want[k]) is not type(got[k]) for k in (want or {})):
+                mismatches += 1
+                print(f"❌ {invoice['_id']} {label}: single={want} batch={got}")
+                break
+
+    print(f"{'✅' if not mismatches else '❌'} Verified {len(chunk)} invoices: {mismatches} mismatches")
+    return mismatches
+
+
+if __name__ == "__main__":
+    def option(name: str, default: int) -> int:
+        return int(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+    has_url = len(sys.argv) > 1 and not sys.argv[1].startswith('--')
+    store = get_database(sys.argv[1] if has_url else DEFAULT_CONNECTION_STRING)
+    trainer = None if "--no-ml" in sys.argv else load_ml_trainer()
+
+    if "--verify" in sys.argv:
+        sys.exit(1 if verify(store, sample=option("--verify", 500), trainer=trainer) else 0)
+    COMPLIANCE_PLAN.profile = "--profile" in sys.argv
+    rescore = rescore_changed if "--changed" in sys.argv else rescore_invoices
+    rescore(store, chunk_size=option("--chunk-size", 5000), trainer=trainer, dry_run="--dry-run" in sys.argv)
+    if COMPLIANCE_PLAN.profile:
+        print_timing_report(COMPLIANCE_PLAN, "Rule cost (batch)")
@@ -0,0 +1,85 @@
+"""
+Concurrency benchmark for the FINTEL AI read endpoints
+Checks that concurrent requests overlap instead of queueing behind each other
+
+Usage (API server must be running):
+    python benchmark_async_endpoints.py [base_url] [concurrency]
+"""
+
+import sys
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+READ_ENDPOINTS = [
+    "/api/invoices/history?limit=50",
+    "/api/vendors",
+    "/api/anomalies?limit=50",
+    "/api/dashboard/stats",
+    "/api/dashboard/anomaly-trends?days=30",
+]
+
+
+def timed_get(session: requests.Session, url: str) -> float:
+    start = time.perf_counter()
+    response = session.get(url, timeout=60)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def benchmark_endpoint(base_url: str, path: str, concurrency: int, warmup: int = 3):
+    """
+    Compare one-at-a-time latency with the wall time of `concurrency` parallel requests.
+    serialization = wall / mean_single: ~1 means requests overlap, ~concurrency means they serialize.
+    """
+    url = base_url + path
+    session = requests.Session()
+
+    for _ in range(warmup):
+        timed_get(session, url)
+
+    singles = [timed_get(session, url) for _ in range(concurrency)]
+    mean_single = statistics.mean(singles)
+
+    sessions = [requests.Session() for _ in range(concurrency)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(timed_get, sessions, [url] * concurrency))
+        wall = time.perf_counter() - start
+
+    return {
+        'endpoint': path,
+        'mean_single_ms': mean_single * 1000,
+        'concurrent_wall_ms': wall * 1000,
+        'p95_concurrent_ms': sorted(latencies)[int(len(latencies) * 0.95) - 1] * 1000,
+        'serialization': wall / mean_single if mean_single else 0.0
+    }
+
+
+def main():
+    base_url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000"
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    print("=" * 78)
+    print(f"⏱️  READ ENDPOINT CONCURRENCY BENCHMARK ({concurrency} parallel requests)")
+    print("=" * 78)
+    print(f"{'Endpoint':<40}{'single':>9}{'wall':>10}{'p95':>10}{'serial.':>9}")
+    print("-" * 78)
+
+    for path in READ_ENDPOINTS:
+        try:
+            r = benchmark_endpoint(base_url, path, concurrency)
+        except requests.RequestException as e:
+            print(f"{path:<40} ❌ {e}")
+            continue
+        print(f"{r['endpoint']:<40}{r['mean_single_ms']:>7.1f}ms{r['concurrent_wall_ms']:>8.1f}ms"
+              f"{r['p95_concurrent_ms']:>8.1f}ms{r['serialization']:>8.1f}x")
+
+    print("-" * 78)
+    print(f"serial. ≈ 1x: requests overlap   |   serial. ≈ {concurrency}x: requests are serialized")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+HSN Classifier Benchmark for FINTEL AI
+Builds the classifier from a rate list, then reports accuracy on noisy line-item
+style queries derived from it (dropped words, OCR typos, quantities / model
+numbers appended) and batch / single-query latency.
+
+Without a rate-list file or a stored hsn_codes table a synthetic catalogue is
+used, which is fine for timings but not representative for accuracy.
+
+Usage:
+    python benchmark_hsn_classifier.py [hsn_gst_rates.json ...] [--queries 5000] [--batch 256]
+"""
+
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from hsn_classifier import HSNClassifier, load_entries
+
+MATERIALS = ['steel', 'iron', 'aluminium', 'copper', 'plastic', 'rubber', 'wood', 'glass', 'cotton', 'leather',
+             'paper', 'ceramic', 'silk', 'wool', 'nylon', 'brass']
+PRODUCTS = ['pipes', 'tubes', 'sheets', 'wires', 'fasteners', 'screws', 'containers', 'furniture', 'cables',
+            'bags', 'bottles', 'tiles', 'fabric', 'garments', 'footwear', 'toys', 'tools', 'valves',
+            'pumps', 'motors', 'lamps', 'books', 'boxes', 'filters']
+QUALIFIERS = ['seamless', 'welded', 'printed', 'coated', 'woven', 'knitted', 'moulded', 'polished',
+              'industrial', 'household', 'electric', 'portable', 'laminated', 'insulated']
+NOISE = ['pcs', 'nos', 'set of 2', 'qty 10', 'model AX-200', 'size 12mm', 'grade A', 'box', 'new']
+
+
+def synthetic_catalogue(rng: random.Random, chapters: int = 60) -> List[Dict[str, str]]:
+    rows = []
+    for chapter in range(10, 10 + chapters):
+        material = MATERIALS[chapter % len(MATERIALS)]
+        for heading in range(1, rng.randint(4, 9)):
+            product = rng.choice(PRODUCTS)
+            for sub in range(10, 10 + 10 * rng.randint(2, 6), 10):
+                qualifier = rng.choice(QUALIFIERS)
+                rows.append({'hsn_code': f"{chapter}{heading:02d}{sub}",
+                             'description': f"{qualifier} {product} of {material} {rng.choice(QUALIFIERS)}",
+                             'gst_rate': rng.choice(['5%', '12%', '18%'])})
+    return rows
+
+
+def _typo(word: str, rng: random.Random) -> str:
+    if len(word) < 4:
+        return word
+    i = rng.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def noisy_query(description: str, rng: random.Random) -> str:
+    """A line item as it shows up on an invoice: partial, misspelt, with extras"""
+    words = description.lower().replace(',', ' ').split()
+    if len(words) > 3:
+        words = [w for w in words if rng.random() > 0.25] or words
+    words = [_typo(w, rng) if rng.random() < 0.15 else w for w in words]
+    if rng.random() < 0.6:
+        words.append(rng.choice(NOISE))
+    return ' '.join(words)
+
+
+def queries_for(rows: List[Dict[str, str]], count: int, rng: random.Random) -> List[Tuple[str, str]]:
+    described = [row for row in rows if str(row.get('description') or '').strip()]
+    sample = [rng.choice(described) for _ in range(count)]
+    return [(noisy_query(row['description'], rng), ''.join(ch for ch in str(row['hsn_code']) if ch.isdigit()))
+            for row in sample]
+
+
+def accuracy(classifier: HSNClassifier, queries: List[Tuple[str, str]]) -> Dict[str, float]:
+    suggestions = classifier.suggest([query for query, _ in queries], top_k=3)
+    hits = {'top1': 0, 'top3': 0, 'heading@1': 0, 'chapter@1': 0}
+    for (_, code), ranked in zip(queries, suggestions):
+        codes = [s.hsn_code for s in ranked]
+        hits['top1'] += bool(codes) and codes[0] == code
+        hits['top3'] += code in codes
+        hits['heading@1'] += bool(codes) and codes[0][:4] == code[:4]
+        hits['chapter@1'] += bool(codes) and codes[0][:2] == code[:2]
+    return {name: 100 * value / len(queries) for name, value in hits.items()}
+
+
+def main():
+    args = sys.argv[1:]
+
+    def option(name: str, default: int) -> int:
+        if name in args:
+            value = int(args[args.index(name) + 1])
+            del args[args.index(name):args.index(name) + 2]
+            return value
+        return default
+
+    n_queries, batch_size = option('--queries', 5000), option('--batch', 256)
+    rng = random.Random(11)
+    try:
+        rows = load_entries(args)
+    except Exception as e:
+        print(f"⚠️ No stored HSN table ({e})")
+        rows = []
+    synthetic = not rows
+    if synthetic:
+        rows = synthetic_catalogue(rng)
+
+    print("=" * 70)
+    print(f"🔍 HSN CLASSIFIER BENCHMARK ({len(rows)} rate-list rows{', synthetic' if synthetic else ''})")
+    print("=" * 70)
+
+    started = time.perf_counter()
+    classifier = HSNClassifier.build(rows)
+    print(f"🏗️  Built in {time.perf_counter() - started:.2f}s: {len(classifier)} descriptions, "
+          f"{classifier.matrix.nnz:,} non-zeros")
+
+    queries = queries_for(rows, n_queries, rng)
+    report = accuracy(classifier, queries)
+    print(f"\n🎯 Accuracy on {n_queries} noisy queries" + (" (synthetic catalogue)" if synthetic else ""))
+    for name, value in report.items():
+        print(f"   {name:<10} {value:6.1f}%")
+
+    texts = [query for query, _ in queries]
+    batch_times = []
+    for start in range(0, len(texts), batch_size):
+        started = time.perf_counter()
+        classifier.suggest(texts[start:start + batch_size])
+        batch_times.append(time.perf_counter() - started)
+    single_times = []
+    for text in texts[:500]:
+        started = time.perf_counter()
+        classifier.suggest([text])
+        single_times.append(time.perf_counter() - started)
+
+    print(f"\n⏱️  Batches of {batch_size}: {len(texts) / sum(batch_times):,.0f} descriptions/s, "
+          f"p50 {statistics.median(batch_times) * 1000:.1f} ms per batch")
+    print(f"⏱️  Single description: p50 {statistics.median(single_times) * 1000:.2f} ms, "
+          f"p95 {statistics.quantiles(single_times, n=20)[-1] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+ML Scoring Benchmark for FINTEL AI
+Rows per second of FintelMLTrainer.predict_anomaly (one call per invoice, as the
+upload handler does) against predict_anomaly_batch (one call per batch, as
+batch_compliance.py and POST /api/ml/score-batch do), and checks both give the
+same scores. Then the same two calls on the compiled model (ml_forest.py, pure
+NumPy), whose scores must equal scikit-learn's bit for bit. Uses the active
+registry model (or --model), otherwise trains a throwaway model on synthetic invoices.
+
+Usage:
+    python benchmark_ml_scoring.py [--rows 100000] [--single 2000] [--batch 10000] [--model models/<version>/model.pkl]
+"""
+
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from ml_trainer import FintelMLTrainer
+from model_registry import ModelRegistry
+
+
+def load_or_train(path: str) -> FintelMLTrainer:
+    trainer = FintelMLTrainer()
+    if os.path.exists(path) and trainer.load_models(path):
+        return trainer
+    print("⚠️ Training a throwaway model on synthetic invoices")
+    random.seed(42)
+    trainer.train_models(*trainer.generate_training_data(2000))
+    return trainer
+
+
+def main():
+    args = sys.argv[1:]
+
+    def option(name: str, default):
+        return type(default)(args[args.index(name) + 1]) if name in args else default
+
+    n_rows, n_single, batch_size = option('--rows', 100000), option('--single', 2000), option('--batch', 10000)
+    registry = ModelRegistry()
+    active = registry.active_version()
+    trainer = load_or_train(option('--model', registry.model_path(active) if active else 'fintel_models.pkl'))
+    random.seed(7)
+    invoices, _ = trainer.generate_training_data(n_rows)
+
+    print("=" * 70)
+    print(f"⚡ ML SCORING BENCHMARK ({n_rows:,} invoices)")
+    print("=" * 70)
+
+    started = time.perf_counter()
+    single = [trainer.predict_anomaly(invoice) for invoice in invoices[:n_single]]
+    single_rate = n_single / (time.perf_counter() - started)
+    print(f"🐢 predict_anomaly (per row):       {single_rate:>12,.0f} rows/s")
+
+    started = time.perf_counter()
+    features = trainer.feature_matrix(invoices)
+    feature_time = time.perf_counter() - started
+    scores = np.concatenate([trainer.predict_anomaly_batch(features[start:start + batch_size])['anomaly_score']
+                             for start in range(0, n_rows, batch_size)])
+    batch_rate = n_rows / (time.perf_counter() - started)
+    print(f"🚀 predict_anomaly_batch ({batch_size:,}/call): {batch_rate:>8,.0f} rows/s "
+          f"(features {n_rows / feature_time:,.0f} rows/s)")
+    print(f"   speed-up: {batch_rate / single_rate:.0f}x")
+
+    expected = np.array([result['anomaly_score'] for result in single])
+    worst = float(np.max(np.abs(expected - scores[:n_single]))) if n_single else 0.0
+    print(f"{'✅' if worst < 1e-12 else '❌'} batch scores match per-row scores (max difference {worst:.2e})")
+    print(f"📅 1M stored invoices: {1_000_000 / batch_rate:,.1f}s batched vs "
+          f"{1_000_000 / single_rate / 60:,.0f} min per row")
+
+    compiled = trainer.compile()
+    print(f"\n⚙️  Compiled model: {compiled.n_trees} trees, {len(compiled.node_feature):,} nodes")
+    started = time.perf_counter()
+    for invoice in invoices[:n_single]:
+        compiled.predict_anomaly(invoice)
+    compiled_single_rate = n_single / (time.perf_counter() - started)
+    print(f"🐢 compiled predict_anomaly (per row):       {compiled_single_rate:>12,.0f} rows/s "
+          f"({compiled_single_rate / single_rate:.0f}x scikit-learn)")
+    started = time.perf_counter()
+    compiled_features = compiled.feature_matrix(invoices)
+    compiled_scores = np.concatenate([compiled.predict_anomaly_batch(compiled_features[start:start + batch_size])
+                                      ['anomaly_score'] for start in range(0, n_rows, batch_size)])
+    compiled_rate = n_rows / (time.perf_counter() - started)
+    print(f"🚀 compiled predict_anomaly_batch ({batch_size:,}/call): {compiled_rate:>8,.0f} rows/s")
+    identical = np.array_equal(compiled_scores, scores)
+    print(f"{'✅' if identical else '❌'} compiled scores equal scikit-learn's bit for bit")
+    if worst >= 1e-12 or not identical:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Split-Billing Benchmark for FINTEL AI
+What the split-billing rule (split_billing.py) adds to an upload: reading the
+rollups around the invoice date (from an in-memory dict here, so the numbers
+exclude the store's `$in` lookup), split_billing_anomaly and folding the
+invoice's rollup entries in, per invoice. Then the batch scan's clustering
+(find_split_clusters) over the same invoices.
+
+Invoices come from synthetic_invoices.py, whose labelled split-billing
+clusters give the precision and recall of both modes. On upload an invoice is
+only flagged once the cluster it belongs to is complete enough (the first
+invoices of a split arrive before the rest), so upload recall is lower than
+the batch scan's.
+
+Usage:
+    python benchmark_split_billing.py [--vendors 500] [--rows 100000]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from split_billing import (
+    APPROVAL_THRESHOLD, WINDOW_DAYS, apply_rollup, find_split_clusters, invoice_day, is_near_threshold,
+    rollup_entries, split_billing_anomaly, split_keys, window_rollup_ids
+)
+from synthetic_invoices import SyntheticInvoiceGenerator, labels_of
+
+
+def precision_recall(flagged: set, truth: set) -> str:
+    hits = len(flagged & truth)
+    return f"precision {hits / max(len(flagged), 1):.3f}, recall {hits / max(len(truth), 1):.3f}"
+
+
+def main():
+    args = sys.argv[1:]
+
+    def option(name: str, default: int) -> int:
+        return int(args[args.index(name) + 1]) if name in args else default
+
+    n_vendors, rows = option('--vendors', 500), option('--rows', 100_000)
+    generator = SyntheticInvoiceGenerator(n_vendors=n_vendors, seed=5)
+    records, labels = [], []
+    for columns in generator.iter_batches(rows, 20_000):
+        records.extend(generator.records(columns))
+        labels.extend(labels_of(columns))
+    truth = {i for i, label in enumerate(labels) if label == 'split'}
+
+    print("=" * 70)
+    print("⚡ SPLIT-BILLING BENCHMARK")
+    print("=" * 70)
+    print(f"{rows:,} invoices from {n_vendors:,} vendors, {len(truth):,} in split-billing clusters "
+          f"(threshold ₹{APPROVAL_THRESHOLD:,.0f}, {WINDOW_DAYS}-day window)")
+
+    rollups, flagged = {}, set()
+    started = time.perf_counter()
+    for i, record in enumerate(records):
+        invoice_id = str(i)
+        window = {rollup_id: rollups[rollup_id] for rollup_id in window_rollup_ids(record) if rollup_id in rollups}
+        if split_billing_anomaly(record, invoice_id, window):
+            flagged.add(i)
+        for entry in rollup_entries(record, invoice_id):
+            rollups[entry['_id']] = apply_rollup(rollups.get(entry['_id']), entry)
+    per_upload = (time.perf_counter() - started) / rows
+    print(f"\n📤 Upload path:  {per_upload * 1e6:6.1f}µs / invoice, {len(rollups):,} rollups, "
+          f"{precision_recall(flagged, truth)}")
+
+    started = time.perf_counter()
+    keys, days, amounts, members = [], [], [], []
+    for i, record in enumerate(records):
+        if is_near_threshold(record['total_amount']):
+            for key in split_keys(record):
+                keys.append(key)
+                days.append(invoice_day(record))
+                amounts.append(record['total_amount'])
+                members.append(i)
+    clusters = find_split_clusters(keys, np.array(days, dtype=np.int64), np.array(amounts))
+    flagged = {members[row] for cluster in clusters for row in cluster['rows']}
+    batch_seconds = time.perf_counter() - started
+    print(f"📦 Batch scan:   {batch_seconds:6.2f}s ({rows / batch_seconds:,.0f} invoices/s), "
+          f"{len(clusters):,} clusters, {precision_recall(flagged, truth)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Storage Throughput Benchmark for FINTEL AI
+Runs the store + detect_anomalies pipeline and the read queries against any
+storage backend. Defaults to the embedded SQLite backend, so no mongod is needed.
+
+Usage:
+    python benchmark_storage.py [num_invoices] [database_url]
+    python benchmark_storage.py 5000 sqlite:///:memory:
+    python benchmark_storage.py 5000 mongodb://localhost:27017/
+"""
+
+import contextlib
+import io
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+from database import get_database
+
+VENDORS = [(f"Vendor {i}", f"24AAACV{i:04d}A1Z{i % 10}") for i in range(50)]
+HSN_CODES = ["8517", "8471", "9403", "7326", "3926", "8443", "4901", "9983"]
+
+
+def synthetic_invoice(i: int) -> Dict:
+    """A small, deterministic invoice in the shape produced by the upload handler"""
+    vendor_name, gst_number = random.choice(VENDORS)
+    has_gst = random.random() > 0.05
+    return {
+        'filename': f"bench_{i}.pdf",
+        'invoice_number': f"INV-{random.randint(1, max(10, i)):06d}",  # some duplicates
+        'vendor_name': vendor_name,
+        'gst_numbers': [gst_number] if has_gst else [],
+        'gst_missing': not has_gst,
+        'gst_verification': [{'success': True, 'is_active': random.random() > 0.02}] if has_gst else [],
+        'total_amount': round(random.lognormvariate(10, 0.8), 2),
+        'invoice_date': f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+        'hsn_sac_codes': random.sample(HSN_CODES, 2),
+        'item_descriptions': ["Bench item"],
+        'ocr_confidence': 95.0,
+        'raw_text': "benchmark invoice " * 20
+    }
+
+
+def time_call(fn: Callable, repeat: int = 20) -> float:
+    """Mean milliseconds per call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    num_invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    database_url = sys.argv[2] if len(sys.argv) > 2 else "sqlite:///:memory:"
+    random.seed(42)
+
+    db = get_database(database_url)
+    db.create_indexes()
+
+    print("=" * 60)
+    print(f"📦 STORAGE BENCHMARK: {num_invoices} invoices on {database_url}")
+    print("=" * 60)
+
+    store_seconds = 0.0
+    detect_seconds = 0.0
+    anomalies_found = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(num_invoices):
+            invoice = synthetic_invoice(i)
+
+            start = time.perf_counter()
+            invoice_id = db.store_invoice(invoice)
+            store_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            anomalies_found += len(db.detect_anomalies(invoice, invoice_id))
+            detect_seconds += time.perf_counter() - start
+
+    total = store_seconds + detect_seconds
+    print(f"store_invoice:     {num_invoices / store_seconds:>10.0f} invoices/sec")
+    print(f"detect_anomalies:  {num_invoices / detect_seconds:>10.0f} invoices/sec")
+    print(f"full pipeline:     {num_invoices / total:>10.0f} invoices/sec ({anomalies_found} anomalies)")
+
+    print("\n⏱️  Read query latency (mean of 20 calls):")
+    vendor_name = VENDORS[0][0]
+    queries: List = [
+        ("get_invoice_history(50)", lambda: db.get_invoice_history(50)),
+        ("get_vendor_list()", db.get_vendor_list),
+        ("get_anomalies(HIGH, 50)", lambda: db.get_anomalies('HIGH', 50)),
+        ("get_dashboard_stats()", db.get_dashboard_stats),
+        ("get_anomaly_trends(30)", lambda: db.get_anomaly_trends(30)),
+        ("vendors_stats(vendor)", lambda: db.vendors_stats(vendor_name)),
+        ("find_invoices_with_hsn", lambda: db.find_invoices_with_hsn(HSN_CODES[0])),
+        ("iter_invoices() full scan", lambda: sum(1 for _ in db.iter_invoices())),
+    ]
+    for name, fn in queries:
+        print(f"  {name:<28}{time_call(fn):>10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
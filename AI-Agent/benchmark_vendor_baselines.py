@@ -0,0 +1,101 @@
+"""
+Vendor Baseline Benchmark for FINTEL AI
+Per-upload cost of the vendor-baseline path in the upload handler (LRU cache
+lookup, score_invoice, baseline_observation and the cache merge) at growing
+vendor counts; it should stay flat apart from LRU misses. Baselines are built with
+vendor_baselines.build_baselines from synthetic invoices (synthetic_invoices.py),
+and cache misses read from an in-memory dict, so the numbers exclude the store's
+point lookup.
+
+Also shows why per-vendor baselines matter: the same ₹5,00,000 invoice judged
+against a vendor who usually bills ₹5,000 and one who usually bills ₹5,00,000.
+
+Usage:
+    python benchmark_vendor_baselines.py [--vendors 1000,10000,50000] [--per-vendor 40] [--uploads 20000]
+"""
+
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from synthetic_invoices import SyntheticInvoiceGenerator
+from vendor_baselines import (
+    BaselineCache, apply_observation, baseline_observation, build_baselines, score_invoice
+)
+
+
+class GeneratedInvoices:
+    """Just enough of an InvoiceStore (iter_invoices) to build baselines from generated rows"""
+
+    def __init__(self, generator: SyntheticInvoiceGenerator, rows: int):
+        self.generator, self.rows = generator, rows
+
+    def iter_invoices(self, batch_size: int = 5000):
+        generator = self.generator
+        for columns in generator.iter_batches(self.rows, 100_000):
+            dates = [f"{d[8:10]}/{d[5:7]}/{d[:4]}" for d in np.datetime_as_string(columns['date'])]
+            for vendor, amount, invoice_date in zip(columns['gstin_vendor'].tolist(),
+                                                    columns['total_amount'].tolist(), dates):
+                yield {'gstNumber': generator.vendor_gstins[vendor], 'vendorName': generator.vendor_names[vendor],
+                       'totalAmount': amount, 'invoiceDate': invoice_date}
+
+
+def vendor_history(name: str, amount: float, invoices: int = 36) -> dict:
+    """Baseline of a vendor billing around `amount` on the 1st of every month"""
+    baseline, day = None, date(2023, 1, 1)
+    rng = np.random.default_rng(0)
+    for _ in range(invoices):
+        record = {'vendor_name': name, 'total_amount': amount * rng.lognormal(0, 0.1),
+                  'invoice_date': day.strftime('%d/%m/%Y')}
+        baseline = apply_observation(baseline, baseline_observation(record))
+        day = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return baseline
+
+
+def main():
+    args = sys.argv[1:]
+
+    def option(name: str, default):
+        return type(default)(args[args.index(name) + 1]) if name in args else default
+
+    sizes = [int(n) for n in option('--vendors', '1000,10000,50000').split(',')]
+    per_vendor, uploads = option('--per-vendor', 40), option('--uploads', 20000)
+
+    print("=" * 70)
+    print("⚡ VENDOR BASELINE BENCHMARK")
+    print("=" * 70)
+    print(f"{'vendors':>10} {'build':>10} {'baselines':>10} {'per upload':>12} {'cache hits':>11}")
+    for n_vendors in sizes:
+        generator = SyntheticInvoiceGenerator(n_vendors=n_vendors, seed=1)
+        started = time.perf_counter()
+        baselines = build_baselines(GeneratedInvoices(generator, n_vendors * per_vendor))
+        build_seconds = time.perf_counter() - started
+
+        records = generator.records(generator.batch(uploads))
+        cache = BaselineCache()
+        started = time.perf_counter()
+        for record in records:
+            gst_number = record['gst_numbers'][0]
+            baseline = cache.get(gst_number, baselines.get)
+            score_invoice(baseline, record)
+            observation = baseline_observation(record)
+            if observation:
+                cache.apply(gst_number, observation)
+        per_upload = (time.perf_counter() - started) / uploads
+        stats = cache.stats()
+        print(f"{n_vendors:>10,} {build_seconds:>9.1f}s {len(baselines):>10,} {per_upload * 1e6:>10.1f}µs "
+              f"{stats['hits'] / max(stats['hits'] + stats['misses'], 1):>10.0%}")
+
+    print("\n🧾 The same ₹5,00,000 invoice, dated the 1st, against two vendors' baselines")
+    invoice = {'total_amount': 500000, 'invoice_date': '01/07/2026'}
+    for name, usual in (("Small Stationers", 5000), ("Steel Wholesale", 500000)):
+        result = score_invoice(vendor_history(name, usual), {**invoice, 'vendor_name': name})
+        verdict = '🚨 anomaly' if result['is_anomaly'] else '✅ normal'
+        detail = '; '.join(result['reasons']) or f"amount z {result['amount_z']:+.1f}"
+        print(f"   usually ₹{usual:>9,}: {verdict:<10} score {result['anomaly_score']:+.2f}  {detail}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Vendor Clustering Benchmark for FINTEL AI
+Scaling curve of the clustering step in vendor_clusters.py (mini-batch k-means
+over per-vendor behaviour vectors) against DBSCAN(eps=0.5), which the trainer
+used to fit on every training row. DBSCAN is only run up to --dbscan-max rows;
+beyond that its time and memory grow too quickly to be worth waiting for.
+
+Also shows what dropping DBSCAN from FintelMLTrainer.train_models saves: the
+training time and pickled size with and without it.
+
+Usage:
+    python benchmark_vendor_clusters.py [--sizes 1000,10000,100000,1000000] [--dbscan-max 50000]
+"""
+
+import pickle
+import random
+import sys
+import time
+
+import numpy as np
+from sklearn.cluster import DBSCAN
+from sklearn.preprocessing import StandardScaler
+
+from ml_features import feature_matrix, fill_missing
+from ml_trainer import FintelMLTrainer
+from vendor_clusters import BEHAVIOUR_FEATURES, cluster_vendors
+
+
+def synthetic_vectors(n: int, seed: int = 0) -> np.ndarray:
+    """Behaviour vectors drawn around 8 vendor archetypes"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0, 3, (8, len(BEHAVIOUR_FEATURES)))
+    return centres[rng.integers(0, len(centres), n)] + rng.normal(0, 1, (n, len(BEHAVIOUR_FEATURES)))
+
+
+def main():
+    args = sys.argv[1:]
+    sizes = [int(n) for n in (args[args.index('--sizes') + 1] if '--sizes' in args
+                              else '1000,10000,100000,1000000').split(',')]
+    dbscan_max = int(args[args.index('--dbscan-max') + 1]) if '--dbscan-max' in args else 50000
+
+    print("=" * 70)
+    print("⚡ VENDOR CLUSTERING BENCHMARK")
+    print("=" * 70)
+    print(f"{'vendors':>10} {'k-means':>12} {'per 1k':>10} {'DBSCAN':>12}")
+    for n in sizes:
+        vectors = synthetic_vectors(n)
+        started = time.perf_counter()
+        cluster_vendors(vectors, np.ones(n, dtype=bool))
+        kmeans_seconds = time.perf_counter() - started
+        if n <= dbscan_max:
+            started = time.perf_counter()
+            DBSCAN(eps=0.5, min_samples=5).fit(StandardScaler().fit_transform(vectors))
+            dbscan = f"{time.perf_counter() - started:>11.2f}s"
+        else:
+            dbscan = f"{'skipped':>12}"
+        print(f"{n:>10,} {kmeans_seconds:>11.2f}s {kmeans_seconds / n * 1000 * 1000:>8.1f}ms {dbscan}")
+
+    print("\n🧠 Trainer on 20,000 synthetic invoices")
+    random.seed(42)
+    trainer = FintelMLTrainer()
+    invoices, labels = trainer.generate_training_data(20000)
+    started = time.perf_counter()
+    trainer.train_models(invoices, labels)
+    train_seconds = time.perf_counter() - started
+    size = len(pickle.dumps(trainer.models))
+
+    scaled = trainer.scaler.transform(fill_missing(feature_matrix(invoices), trainer.feature_fill))
+    started = time.perf_counter()
+    dbscan = DBSCAN(eps=0.5, min_samples=5).fit(scaled[:16000])  # the 80% training split
+    dbscan_seconds = time.perf_counter() - started
+    print(f"   without DBSCAN: {train_seconds:6.2f}s, models pickle {size / 1024:,.0f} KB")
+    print(f"   with DBSCAN:    {train_seconds + dbscan_seconds:6.2f}s, models pickle "
+          f"{(size + len(pickle.dumps(dbscan))) / 1024:,.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
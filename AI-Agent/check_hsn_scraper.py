@@ -0,0 +1,244 @@
+"""
+HSN Scraper Check for FINTEL AI
+Runs hsn_scraper against a local fixture server that behaves like the ICAI
+ASP.NET GridView (postback paging with a 10-page pager, per-block view state and
+event validation, ETag / 304) and checks a full load, an unchanged re-run, a
+diff refresh with no read gap, the compiled index and the shrink guard.
+
+Usage (no network access needed):
+    python check_hsn_scraper.py [database_url] [--pages 45] [--page-size 50] [--latency-ms 20] [--workers 8]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs
+
+from database import get_database
+from hsn_index import HSNIndex, normalize_code, parse_rate
+from hsn_scraper import SNAPSHOT_NAME, make_session, refresh_hsn_codes, row_key, scrape_hsn_pages
+
+GRID_TARGET = 'ctl00$ContentPlaceHolder1$GridView1'
+PAGER_SIZE = 10
+
+
+class FixtureSite:
+    """The rate list as the ICAI page serves it; `rows` can be edited between refreshes"""
+
+    def __init__(self, rows: List[Dict[str, str]], page_size: int, latency: float):
+        self.rows, self.page_size, self.latency = rows, page_size, latency
+        self.version = 1
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def page_count(self) -> int:
+        return max(1, -(-len(self.rows) // self.page_size))
+
+    def pager_pages(self, page: int) -> List[int]:
+        """Pages linked from `page`: its block of 10, plus '...' to the neighbouring blocks"""
+        first = (page - 1) // PAGER_SIZE * PAGER_SIZE + 1
+        linked = list(range(first, min(first + PAGER_SIZE, self.page_count + 1)))
+        if first > 1:
+            linked.insert(0, first - 1)
+        if first + PAGER_SIZE <= self.page_count:
+            linked.append(first + PAGER_SIZE)
+        return [p for p in linked if p != page]
+
+    def render(self, page: int) -> str:
+        rows = self.rows[(page - 1) * self.page_size:page * self.page_size]
+        block = (page - 1) // PAGER_SIZE
+        body = ''.join(
+            f"<tr><td>{row['hsn_code']}</td><td>{row['description']}</td><td>{row['gst_rate']}</td></tr>\n"
+            for row in rows
+        )
+        pager = ''.join(
+            f"<td><a href=\"javascript:__doPostBack(&#39;{GRID_TARGET}&#39;,&#39;Page${p}&#39;)\">"
+            f"{p if (p - 1) // PAGER_SIZE == block else '...'}</a></td>"
+            for p in self.pager_pages(page)
+        )
+        return (
+            "<html><head><title>HSN Rate List</title></head><body>"
+            "<form method=\"post\" action=\"./HSN_RATE_LIST.aspx\" id=\"form1\">"
+            f"<input type=\"hidden\" name=\"__VIEWSTATE\" id=\"__VIEWSTATE\" value=\"v{self.version}-b{block}\" />"
+            f"<input type=\"hidden\" name=\"__EVENTVALIDATION\" value=\"ev-{page}\" />"
+            "<table class=\"nav\"><tr><td>Home</td><td>Utilities</td></tr></table>"
+            "<table id=\"ContentPlaceHolder1_GridView1\">"
+            "<tr><th>HSN Code</th><th>Description of Goods</th><th>Rate of GST (%)</th></tr>\n"
+            f"{body}<tr><td colspan=\"3\"><table><tr><td><span>{page}</span></td>{pager}</tr></table></td></tr>"
+            "</table></form></body></html>"
+        )
+
+    def handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, html: str = ''):
+                payload = html.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('ETag', f'"hsn-v{site.version}"')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                with site.lock:
+                    site.requests += 1
+                time.sleep(site.latency)
+                if self.headers.get('If-None-Match') == f'"hsn-v{site.version}"':
+                    self._send(304)
+                else:
+                    self._send(200, site.render(1))
+
+            def do_POST(self):
+                with site.lock:
+                    site.requests += 1
+                time.sleep(site.latency)
+                form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                argument = form.get('__EVENTARGUMENT', [''])[0]
+                source = int(form.get('__EVENTVALIDATION', ['ev-0'])[0][3:])
+                page = int(argument[len('Page$'):]) if argument.startswith('Page$') else 0
+                # ASP.NET event validation: only pages the posting page linked to are accepted
+                if form.get('__EVENTTARGET', [''])[0] != GRID_TARGET or page not in site.pager_pages(source):
+                    self._send(400, 'Invalid postback or callback argument')
+                else:
+                    self._send(200, site.render(page))
+
+        return Handler
+
+
+def fixture_rows(count: int, rng: random.Random) -> List[Dict[str, str]]:
+    rows = []
+    for i in range(count):
+        code = f"{rng.randint(1, 97):02d}{rng.randint(1, 99):02d}" + rng.choice(['', f"{rng.randint(10, 99)}",
+                                                                                   f"{rng.randint(1000, 9999)}"])
+        rows.append({'hsn_code': code, 'description': f"Goods &amp; articles {i} of heading {code[:4]}",
+                     'gst_rate': rng.choice(['5%', '12%', '18%', '28%', 'Nil'])})
+    return rows
+
+
+def expected(rows: List[Dict[str, str]]) -> Dict[str, Dict[str, str]]:
+    """Rows as the parser should see them (entities decoded), by key"""
+    decoded = [{**row, 'description': row['description'].replace('&amp;', '&')} for row in rows]
+    return {row_key(row): row for row in decoded}
+
+
+def main():
+    args = sys.argv[1:]
+
+    def option(name: str, default):
+        return type(default)(args[args.index(name) + 1]) if name in args else default
+
+    pages, page_size, workers = option('--pages', 45), option('--page-size', 50), option('--workers', 8)
+    url_arg = args[0] if args and not args[0].startswith('--') else 'sqlite:///:memory:'
+    rng = random.Random(7)
+    site = FixtureSite(fixture_rows(pages * page_size, rng), page_size, option('--latency-ms', 20) / 1000)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), site.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/HSN_RATE_LIST.aspx"
+    db = get_database(url_arg)
+    index_path = os.path.join(tempfile.mkdtemp(), 'hsn_index.bin')
+    session = make_session(workers)
+    failures = 0
+
+    def check(label: str, ok: bool, detail: str = ''):
+        nonlocal failures
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {label}{': ' + detail if detail else ''}")
+
+    print("=" * 80)
+    print(f"🔍 HSN SCRAPER CHECK ({site.page_count} pages x {page_size} rows, "
+          f"{site.latency * 1000:.0f} ms per request)")
+    print("=" * 80)
+    try:
+        # 1. Paging: every page is reached, concurrently
+        timings = {}
+        for label, pool in (('sequential', 1), ('concurrent', workers)):
+            started = time.perf_counter()
+            result = scrape_hsn_pages(url, pool, session=make_session(pool))
+            timings[label] = time.perf_counter() - started
+            check(f"{label} scrape", result.pages == site.page_count and len(result.rows) == len(site.rows),
+                  f"{result.pages} pages, {len(result.rows)} rows in {timings[label]:.2f}s")
+        check("parsed rows match the fixture",
+              {row_key(row): row for row in result.rows} == expected(site.rows))
+        print(f"   speed-up with {workers} workers: {timings['sequential'] / timings['concurrent']:.1f}x")
+
+        # 2. First refresh loads everything as version 1 and builds the index
+        summary = refresh_hsn_codes(db, url, workers, index_path=index_path, session=session)
+        stored = {row['key']: row for row in db.get_hsn_codes()}
+        check("initial load", summary['version'] == 1 and len(stored) == len(expected(site.rows)),
+              f"{len(stored)} rows, version {summary['version']}")
+        sample = site.rows[-1]
+        match = HSNIndex.open(index_path).lookup(sample['hsn_code'])
+        check("index compiled from the table", match is not None and match.matched == normalize_code(sample['hsn_code']))
+
+        # 3. Unchanged list: one conditional request, no writes
+        before = site.requests
+        summary = refresh_hsn_codes(db, url, workers, index_path=index_path, session=session)
+        check("unchanged list is a 304", not summary['modified'] and site.requests - before == 1,
+              f"{site.requests - before} request(s)")
+
+        # 4. Edits become a diff applied in place, while readers keep seeing a full table
+        for row in site.rows[10:15]:
+            row['gst_rate'] = '40%' if row['gst_rate'] != '40%' else '5%'
+        removed = [site.rows.pop(200) for _ in range(3)]
+        site.rows.extend(fixture_rows(4, random.Random(99)))
+        site.version += 1
+
+        smallest, stop = [len(stored)], threading.Event()
+
+        def reader():
+            while not stop.is_set():
+                smallest[0] = min(smallest[0], len(db.get_hsn_codes()))
+
+        watcher = threading.Thread(target=reader)
+        watcher.start()
+        summary = refresh_hsn_codes(db, url, workers, index_path=index_path, session=session)
+        stop.set()
+        watcher.join()
+        stored = {row['key']: row for row in db.get_hsn_codes()}
+        check("diff refresh", summary['version'] == 2 and summary['upserted'] == 9 and summary['deleted'] == 3,
+              f"version {summary['version']}, {summary['upserted']} upserted, {summary['deleted']} deleted")
+        check("stored table matches the page", {k: {f: r[f] for f in ('hsn_code', 'description', 'gst_rate')}
+                                                for k, r in stored.items()} == expected(site.rows))
+        check("only changed rows carry the new version",
+              sum(1 for row in stored.values() if row['version'] == 2) == 9)
+        check("no read gap", smallest[0] >= len(stored) - 4, f"smallest table seen: {smallest[0]} rows")
+        check("removed rows are gone", not any(row_key(row) in stored for row in expected(removed).values()))
+        changed = site.rows[10]
+        match = HSNIndex.open(index_path).lookup(changed['hsn_code'])
+        check("index rebuilt with the new rate", match is not None and match.matched == normalize_code(changed['hsn_code'])
+              and match.gst_rate in {parse_rate(r['gst_rate']) for r in site.rows if r['hsn_code'] == changed['hsn_code']})
+        snapshot = db.get_reference_snapshot(SNAPSHOT_NAME)
+        check("snapshot recorded", snapshot['version'] == 2 and snapshot['rows'] == len(stored))
+
+        # 5. A page that suddenly lists far fewer rows is refused
+        kept = site.rows
+        site.rows, site.version = kept[:page_size], site.version + 1
+        try:
+            refresh_hsn_codes(db, url, workers, index_path=index_path, session=session)
+            check("shrink guard", False, "a 1-page list was applied")
+        except RuntimeError as e:
+            check("shrink guard", len(db.get_hsn_codes()) == len(stored), str(e))
+        site.rows = kept
+    finally:
+        server.shutdown()
+
+    print("-" * 80)
+    if failures:
+        print(f"❌ {failures} checks failed")
+        sys.exit(1)
+    print("✅ HSN scraper checks passed")
+
+
+if __name__ == "__main__":
+    main()
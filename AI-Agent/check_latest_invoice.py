@@ -2,7 +2,7 @@
 Check latest invoice in MongoDB and verify GST
 """
 
-from database import FintelDatabase
+from database import get_database
 from gst_verifier import GSTVerifier
 
 print("=" * 70)
@@ -11,16 +11,14 @@ print("=" * 70)
 print()
 
 # Connect to database
-db = FintelDatabase()
+db = get_database()
 
 # Get latest invoice
-invoices = list(db.invoices.find().sort('_id', -1).limit(1))
+invoice = db.get_latest_invoice()
 
-if not invoices:
+if not invoice:
     print("❌ No invoices found in database!")
 else:
-    invoice = invoices[0]
-    
     print("✅ LATEST INVOICE FOUND:")
     print("-" * 70)
     print(f"Invoice Number: {invoice.get('invoiceNumber', 'N/A')}")
@@ -0,0 +1,343 @@
+"""
+Query-plan regression check for FINTEL AI
+Seeds a scratch database on a local mongod with a synthetic dataset, calls every
+FintelDatabase read path (the agents and maintenance scripts only go through these),
+captures the commands it sends and explain()s each of them.
+
+Fails (exit code 1) when a plan contains a COLLSCAN or examines too many documents
+per returned document, so index regressions are caught before deploy.
+
+Usage (needs a running mongod; the scratch database is dropped afterwards):
+    python check_query_plans.py [--invoices 20000] [--max-ratio 10] [--repeats 20] [--keep]
+"""
+
+import copy
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, List, Optional
+
+from pymongo import monitoring
+
+from database import DEFAULT_CONNECTION_STRING, FintelDatabase, close_all_clients
+from compliance import compliance_dependencies, hsn_dependency
+from storage import build_invoice_doc, anomaly_record
+from split_billing import APPROVAL_THRESHOLD, window_rollup_ids
+
+SCRATCH_DATABASE = 'fintel_ai_plan_check'
+EXPLAINED_COMMANDS = ('find', 'aggregate', 'count', 'distinct', 'update', 'delete')
+# Session / routing fields the driver adds that explain does not accept
+DRIVER_FIELDS = ('$db', 'lsid', '$clusterTime', '$readPreference', 'txnNumber', 'writeConcern', 'apiVersion')
+
+VENDOR_WORDS = ['Shree', 'Ganesh', 'Tech', 'Global', 'Traders', 'Enterprises', 'Steel', 'Office', 'Print', 'Solutions']
+ITEMS = ['Dell laptop', 'HP printer', 'Office chair', 'Steel rack', 'A4 paper ream', 'Mobile phone',
+         'Consulting services', 'Plastic crates', 'Toner cartridge', 'LED monitor']
+HSN_CODES = ['8471', '8443', '9403', '7326', '4802', '8517', '9983', '3926', '8528', '4901']
+ANOMALY_TYPES = ['DUPLICATE_INVOICE', 'MISSING_GST', 'INVALID_GST', 'GST_VENDOR_MISMATCH',
+                 'UNUSUAL_AMOUNT', 'HSN_PRICE_DEVIATION', 'VENDOR_BEHAVIOUR_OUTLIER']
+RISK_LEVELS = ['LOW', 'LOW', 'LOW', 'MEDIUM', 'HIGH']
+
+
+class CommandCapture(monitoring.CommandListener):
+    """Records the read/write commands issued while capturing is on"""
+
+    def __init__(self):
+        self.capturing = False
+        self.commands: List[Dict] = []
+
+    def started(self, event):
+        if self.capturing and event.command_name in EXPLAINED_COMMANDS:
+            command = copy.deepcopy(dict(event.command))
+            for field in DRIVER_FIELDS:
+                command.pop(field, None)
+            self.commands.append(command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def random_gstin(rng: random.Random) -> str:
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return (f"{rng.randint(1, 37):02d}" + ''.join(rng.choice(letters) for _ in range(5)) +
+            f"{rng.randint(0, 9999):04d}" + rng.choice(letters) + '1Z' + rng.choice('0123456789'))
+
+
+def seed(db: FintelDatabase, n_invoices: int, rng: random.Random) -> Dict:
+    """Insert a realistic synthetic dataset; returns sample values for the checks"""
+    print(f"\n🌱 Seeding {n_invoices} invoices...")
+    start = time.perf_counter()
+    vendors = [(f"{rng.choice(VENDOR_WORDS)} {rng.choice(VENDOR_WORDS)} {i}", random_gstin(rng)) for i in range(300)]
+    now = datetime.now()
+
+    vendor_totals: Dict[str, Dict] = {}
+    invoices, anomalies = [], []
+    for i in range(n_invoices):
+        vendor_name, gstin = rng.choice(vendors)
+        if rng.random() < 0.01:
+            gstin = rng.choice(vendors)[1]  # GST reused by another vendor
+        items = rng.sample(ITEMS, rng.randint(1, 3))
+        hsn_codes = rng.sample(HSN_CODES, rng.randint(1, 2))
+        amount = round(rng.lognormvariate(10, 1), 2)
+        invoice_data = {
+            'filename': f"invoice_{i}.pdf",
+            'invoice_number': f"INV/{2024 + i % 2}/{i:06d}",
+            'vendor_name': vendor_name,
+            'gst_numbers': [gstin] if rng.random() > 0.1 else [],
+            'total_amount': amount,
+            'hsn_sac_codes': hsn_codes,
+            'item_descriptions': items,
+            'raw_text': f"TAX INVOICE {vendor_name} GSTIN {gstin} " + ' '.join(items) + f" HSN {' '.join(hsn_codes)}",
+            'compliance_results': {'risk_level': rng.choice(RISK_LEVELS), 'compliance_score': rng.randint(40, 100)},
+            'ml_prediction': {'is_anomaly': rng.random() < 0.1, 'anomaly_score': rng.random()}
+        }
+        invoice_data['compliance_results']['dependencies'] = compliance_dependencies(invoice_data, invoice_data)
+        doc = build_invoice_doc(invoice_data)
+        doc['uploadDate'] = now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+
+        if rng.random() < 0.15:
+            types = rng.sample(ANOMALY_TYPES, rng.randint(1, 2))
+            doc['anomalyTypes'] = sorted(types)
+            invoice_data['_types'] = types
+        invoices.append((doc, invoice_data))
+
+        if doc['gstNumber']:
+            totals = vendor_totals.setdefault(doc['gstNumber'], {
+                'gstNumber': doc['gstNumber'], 'vendorName': vendor_name, 'totalInvoices': 0,
+                'totalAmount': 0.0, 'firstInvoiceDate': doc['uploadDate'], 'lastInvoiceDate': doc['uploadDate']
+            })
+            totals['totalInvoices'] += 1
+            totals['totalAmount'] += amount
+            totals['firstInvoiceDate'] = min(totals['firstInvoiceDate'], doc['uploadDate'])
+            totals['lastInvoiceDate'] = max(totals['lastInvoiceDate'], doc['uploadDate'])
+
+    for batch_start in range(0, len(invoices), 5000):
+        batch = invoices[batch_start:batch_start + 5000]
+        result = db.invoices.insert_many([doc for doc, _ in batch])
+        for inserted_id, (doc, invoice_data) in zip(result.inserted_ids, batch):
+            for anomaly_type in invoice_data.get('_types', []):
+                record = anomaly_record(str(inserted_id), invoice_data,
+                                        {'type': anomaly_type, 'severity': rng.choice(['HIGH', 'MEDIUM']),
+                                         'description': anomaly_type})
+                record['detectedDate'] = doc['uploadDate']
+                if rng.random() < 0.2:
+                    record['detectedAt'] = record.pop('detectedDate')  # older backfilled records
+                anomalies.append(record)
+    if anomalies:
+        db.anomalies.insert_many(anomalies)
+    db.vendors.insert_many(list(vendor_totals.values()))
+
+    db.create_indexes()
+    print(f"   {len(invoices)} invoices, {len(anomalies)} anomalies, {len(vendor_totals)} vendors "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    sample_doc, sample_data = next(pair for pair in invoices[len(invoices) // 2:] if pair[0]['gstNumber'])
+    sample = db.invoices.find_one({'invoiceNumber': sample_doc['invoiceNumber']})
+    return {
+        'id': str(sample['_id']),
+        'invoice_data': sample_data,
+        'vendor': sample['vendorName'],
+        'gst': sample['gstNumber'],
+        'hsn': sample['hsnCodes'][0],
+        'anomaly_id': str(db.anomalies.find_one()['invoiceId'])
+    }
+
+
+def build_checks(db: FintelDatabase, s: Dict) -> List[tuple]:
+    """
+    (label, call, full_scan_reason) for every query path
+    full_scan_reason documents queries that must read the whole collection
+    """
+    month_ago = datetime.now() - timedelta(days=30)
+    week_ago = datetime.now() - timedelta(days=7)
+    return [
+        # Point lookups (upload pipeline, agents, ai-analysis / detail endpoints, check_latest_invoice.py)
+        ('get_invoice', lambda: db.get_invoice(s['id']), None),
+        ('get_invoice_details', lambda: db.get_invoice_details(s['id']), None),
+        ('get_latest_invoice', db.get_latest_invoice, None),
+        ('find_invoice_by_number', lambda: db.find_invoice_by_number(s['invoice_data']['invoice_number'], s['id']), None),
+        ('find_gst_vendor_mismatch', lambda: db.find_gst_vendor_mismatch(s['gst'], s['vendor'], s['id']), None),
+        ('find_invoices_with_hsn', lambda: db.find_invoices_with_hsn(s['hsn'], s['id']), None),
+        ('get_price_stats', lambda: db.get_price_stats([f"hsn:{s['hsn'][:4]}"]), None),
+        ('get_vendor_cluster', lambda: db.get_vendor_cluster(s['gst']), None),
+        ('get_vendor_baseline', lambda: db.get_vendor_baseline(s['gst']), None),
+        ('get_split_rollups', lambda: db.get_split_rollups(window_rollup_ids(
+            {**s['invoice_data'], 'total_amount': APPROVAL_THRESHOLD * 0.9})), None),
+        ('vendors_stats', lambda: db.vendors_stats(s['vendor']), None),
+        ('anomaly_exists', lambda: db.anomaly_exists(s['anomaly_id'], 'MISSING_GST'), None),
+        # Listings (API read endpoints, exports, fix_missing_gst_anomalies.py)
+        ('get_invoice_history', db.get_invoice_history, None),
+        ('iter_invoices(date range)', lambda: list(islice(db.iter_invoices(start_date=week_ago), 1000)), None),
+        ('iter_invoices(vendor)', lambda: list(db.iter_invoices(vendor_name=s['vendor'])), None),
+        ('iter_anomalies(date range)', lambda: list(islice(db.iter_anomalies(start_date=week_ago), 1000)), None),
+        ('iter_anomalies(vendor)', lambda: list(db.iter_anomalies(vendor_name=s['vendor'])), None),
+        ('get_vendor_list', db.get_vendor_list, None),
+        ('get_anomalies', db.get_anomalies, None),
+        ('get_anomalies(HIGH)', lambda: db.get_anomalies('HIGH'), None),
+        ('get_anomaly_trends', db.get_anomaly_trends, None),
+        ('get_dashboard_stats', db.get_dashboard_stats, 'totalAmountProcessed sums every invoice'),
+        ('anomaly_type_counts', db.anomaly_type_counts, 'groups every anomaly by type'),
+        # Search
+        ('search(vendor)', lambda: db.search_invoices({'vendorName': s['vendor']}), None),
+        ('search(gstin + date)', lambda: db.search_invoices({'gstNumber': s['gst'], 'startDate': month_ago}), None),
+        ('search(hsn)', lambda: db.search_invoices({'hsnCode': s['hsn']}), None),
+        ('search(anomaly type)', lambda: db.search_invoices({'anomalyType': 'INVALID_GST'}), None),
+        ('search(risk level)', lambda: db.search_invoices({'riskLevel': 'HIGH', 'startDate': month_ago}), None),
+        ('search(amount range)', lambda: db.search_invoices({'minAmount': 500000, 'maxAmount': 900000}), None),
+        ('search(text)', lambda: db.search_invoices({}, text='toner cartridge'), None),
+
+        # Incremental compliance re-evaluation (batch_compliance.py --changed)
+        ('iter_invoices_with_dependencies(hsn)',
+         lambda: list(db.iter_invoices_with_dependencies([hsn_dependency(s['hsn'])])), None),
+    ]
+
+
+def plan_stages(node, in_winning_plan: bool = False) -> List[str]:
+    """Every stage name of the winning plans in an explain document"""
+    stages = []
+    if isinstance(node, dict):
+        if in_winning_plan and 'stage' in node:
+            stages.append(node['stage'])
+        for key, value in node.items():
+            if key == 'rejectedPlans':
+                continue
+            stages.extend(plan_stages(value, in_winning_plan or key in ('winningPlan', 'queryPlan')))
+    elif isinstance(node, list):
+        for item in node:
+            stages.extend(plan_stages(item, in_winning_plan))
+    return stages
+
+
+def execution_totals(node) -> tuple:
+    """(docsExamined, nReturned) summed over every executionStats block"""
+    examined = returned = 0
+    if isinstance(node, dict):
+        stats = node.get('executionStats')
+        if isinstance(stats, dict):
+            examined += stats.get('totalDocsExamined', 0)
+            returned += stats.get('nReturned', 0)
+        for key, value in node.items():
+            if key != 'executionStats':
+                e, r = execution_totals(value)
+                examined, returned = examined + e, returned + r
+    elif isinstance(node, list):
+        for item in node:
+            e, r = execution_totals(item)
+            examined, returned = examined + e, returned + r
+    return examined, returned
+
+
+def explain(db: FintelDatabase, command: Dict) -> Dict:
+    return db.db.command({'explain': command, 'verbosity': 'executionStats'})
+
+
+def run_check(db: FintelDatabase, capture: CommandCapture, label: str, call, full_scan_reason: Optional[str],
+              repeats: int, max_ratio: float) -> Dict:
+    capture.commands.clear()
+    capture.capturing = True
+    try:
+        call()
+    finally:
+        capture.capturing = False
+    commands = list(capture.commands)
+
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    problems, stages, examined, returned = [], set(), 0, 0
+    for command in commands:
+        plan = explain(db, command)
+        command_stages = plan_stages(plan)
+        stages.update(command_stages)
+        e, r = execution_totals(plan)
+        examined, returned = examined + e, returned + r
+        target = next(iter(command.values()))
+        if 'COLLSCAN' in command_stages and not full_scan_reason:
+            problems.append(f"COLLSCAN on {target}")
+        if not full_scan_reason and e > 100 and e / max(r, 1) > max_ratio:
+            problems.append(f"{target}: examined {e} docs for {r} returned")
+
+    return {
+        'label': label,
+        'commands': len(commands),
+        'stages': sorted(stages),
+        'examined': examined,
+        'returned': returned,
+        'median_ms': statistics.median(latencies) if latencies else 0.0,
+        'p95_ms': sorted(latencies)[max(int(len(latencies) * 0.95) - 1, 0)] if latencies else 0.0,
+        'allowed': full_scan_reason,
+        'problems': problems
+    }
+
+
+def main():
+    args = sys.argv[1:]
+
+    def option(name: str, default):
+        return type(default)(args[args.index(name) + 1]) if name in args else default
+
+    n_invoices = option('--invoices', 20000)
+    max_ratio = option('--max-ratio', 10.0)
+    repeats = option('--repeats', 20)
+
+    if DEFAULT_CONNECTION_STRING.startswith('sqlite://'):
+        print("❌ Query plans are checked against MongoDB; point FINTEL_DATABASE_URL at a mongod")
+        sys.exit(2)
+
+    capture = CommandCapture()
+    monitoring.register(capture)  # must happen before the pooled client is created
+
+    db = FintelDatabase(DEFAULT_CONNECTION_STRING, database_name=SCRATCH_DATABASE)
+    db.client.drop_database(SCRATCH_DATABASE)
+
+    print("=" * 100)
+    print("🔍 QUERY PLAN REGRESSION CHECK")
+    print("=" * 100)
+
+    failures = 0
+    try:
+        sample = seed(db, n_invoices, random.Random(42))
+        print(f"\n{'Query':<30}{'median':>9}{'p95':>10}{'examined':>10}{'returned':>10}  Plan")
+        print("-" * 100)
+        for label, call, full_scan_reason in build_checks(db, sample):
+            r = run_check(db, capture, label, call, full_scan_reason, repeats, max_ratio)
+            status = "❌" if r['problems'] else ("⚠️ " if r['allowed'] else "✅")
+            print(f"{status} {r['label']:<27}{r['median_ms']:>7.2f}ms{r['p95_ms']:>8.2f}ms"
+                  f"{r['examined']:>10}{r['returned']:>10}  {', '.join(r['stages'])}")
+            if r['allowed']:
+                print(f"      full scan allowed: {r['allowed']}")
+            for problem in r['problems']:
+                print(f"      {problem}")
+            failures += bool(r['problems'])
+
+        # The upload path: anomaly checks, vendor-stats upsert and anomalyTypes tagging
+        r = run_check(db, capture, 'detect_anomalies', lambda: db.detect_anomalies(sample['invoice_data'], sample['id']),
+                      None, 1, max_ratio)
+        status = "❌" if r['problems'] else "✅"
+        print(f"{status} {r['label']:<27}{r['median_ms']:>7.2f}ms{r['p95_ms']:>8.2f}ms"
+              f"{r['examined']:>10}{r['returned']:>10}  {', '.join(r['stages'])}")
+        for problem in r['problems']:
+            print(f"      {problem}")
+        failures += bool(r['problems'])
+    finally:
+        if '--keep' not in args:
+            db.client.drop_database(SCRATCH_DATABASE)
+        close_all_clients()
+
+    print("-" * 100)
+    if failures:
+        print(f"❌ {failures} queries are not index-backed")
+        sys.exit(1)
+    print("✅ Every query is index-backed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Compliance Checks for FINTEL AI
+Single-invoice compliance scoring used by the upload handler. The score comes
+from the rule plan compiled from compliance_rules.json (rule_engine.py); this
+module adds the per-check detail payloads shown in the detail view.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from hsn_index import MIN_KNOWN_DIGITS, CurrentHSNIndex, get_hsn_index, normalize_code
+from price_index import line_item_positions, normalize_line_items
+from rule_engine import RulePlan, load_rules
+
+# Checks, weights, score bands and messages live in compliance_rules.json
+COMPLIANCE_RULES = load_rules()
+
+# GSTIN format: state code, PAN, entity number, 'Z', checksum
+GST_PATTERN = COMPLIANCE_RULES['patterns']['gstin']
+
+# HSN/SAC rates: longest-prefix index compiled from the scraped rate list (hsn_index.py),
+# always read through get_hsn_index() so a rebuilt index is picked up without a restart
+
+
+def hsn_dependency(hsn_code: str) -> str:
+    """
+    Matched HSN prefix + the GST rate it had, or the code's heading with '-' when unknown
+    (so adding any code under that heading marks the invoice stale)
+    """
+    known = get_hsn_index().known(hsn_code)
+    if known:
+        return f"hsn:{known[0]}@{known[1]}"
+    return f"hsn:{normalize_code(hsn_code)[:MIN_KNOWN_DIGITS] or hsn_code}@-"
+
+
+COMPLIANCE_PLAN = RulePlan(COMPLIANCE_RULES, references={'hsn': (CurrentHSNIndex(), hsn_dependency)})
+
+# Bump a rule's version in compliance_rules.json whenever its logic changes. Every
+# invoice records the rule versions and HSN rates it was scored with (complianceDeps),
+# so a change only re-evaluates the invoices that depended on it (batch_compliance.py --changed)
+RULE_VERSIONS = COMPLIANCE_PLAN.rule_versions
+CONDITIONAL_RULES = tuple(COMPLIANCE_PLAN.conditional_rules)
+
+
+def rule_dependency(rule_id: str, version: Optional[int] = None) -> str:
+    return f"rule:{rule_id}@{version or RULE_VERSIONS[rule_id]}"
+
+
+def price_verdict(line_items: List[Dict], price_stats: Optional[Dict]) -> Tuple[bool, bool]:
+    """(any item had comparable prices, any item outside the fences) for the price_outlier rule"""
+    positions = line_item_positions(line_items, price_stats or {})
+    return bool(positions), any(position['is_outlier'] for position in positions)
+
+
+def used_price_stats(invoice_data, enhanced_data, price_stats: Optional[Dict]) -> Dict[str, Dict]:
+    """
+    The price index entries the invoice's items were compared with, stored on the invoice
+    (priceStats) so re-scoring judges it against the same prices as the upload did
+    """
+    line_items = normalize_line_items({**invoice_data, **enhanced_data})
+    return {position['basis']: price_stats[position['basis']]
+            for position in line_item_positions(line_items, price_stats or {})}
+
+
+def compliance_record(invoice_data, enhanced_data, ml_result, price_stats: Optional[Dict] = None) -> Dict:
+    """Flat input record for the rule plan"""
+    record = {
+        **invoice_data,
+        'hsn_sac_codes': enhanced_data.get('hsn_sac_codes', []),
+        'item_descriptions': enhanced_data.get('item_descriptions', []),
+        'ml_anomaly': bool(ml_result and ml_result.get('is_anomaly'))
+    }
+    line_items = normalize_line_items({**invoice_data, **enhanced_data})
+    record['price_checked'], record['price_outlier'] = price_verdict(line_items, price_stats)
+    return record
+
+
+def compliance_dependencies(invoice_data, enhanced_data) -> List[str]:
+    """Rule versions and reference data process_complete_compliance reads for this invoice"""
+    return COMPLIANCE_PLAN.dependencies(compliance_record(invoice_data, enhanced_data, None))
+
+
+def reference_snapshot() -> Dict[str, List[str]]:
+    """Current rule versions and HSN rates, saved after each re-evaluation"""
+    return {
+        'rules': sorted(rule_dependency(rule) for rule in RULE_VERSIONS),
+        'hsn': sorted(f"hsn:{code}@{rate}" for code, rate in get_hsn_index().rated_codes()
+                      if len(code) >= MIN_KNOWN_DIGITS)
+    }
+
+
+def stale_dependencies(previous: Dict[str, List[str]]) -> List[str]:
+    """
+    Dependencies recorded under `previous` that no longer hold: older rule versions,
+    changed or removed HSN rates, and for codes added since, the prefix invoices under
+    them used to resolve to (or their unknown heading, '-')
+    """
+    current = reference_snapshot()
+    stale = set()
+    for kind in ('rules', 'hsn'):
+        stale.update(set(previous.get(kind, [])) - set(current[kind]))
+    rates_before = dict(dep[len('hsn:'):].rsplit('@', 1) for dep in previous.get('hsn', []))
+    for dep in current['hsn']:
+        code = dep[len('hsn:'):].rsplit('@', 1)[0]
+        if code in rates_before:
+            continue
+        stale.add(f"hsn:{code[:MIN_KNOWN_DIGITS]}@-")
+        parent = next((code[:n] for n in range(len(code) - 1, MIN_KNOWN_DIGITS - 1, -1)
+                       if code[:n] in rates_before), None)
+        if parent:
+            stale.add(f"hsn:{parent}@{rates_before[parent]}")
+    return sorted(stale)
+
+
+def added_rules(previous: Dict[str, List[str]]) -> List[str]:
+    """Rules no stored invoice has run yet (need a full re-score)"""
+    known_before = {dep.rsplit('@', 1)[0] for dep in previous.get('rules', [])}
+    return [rule for rule in RULE_VERSIONS if f"rule:{rule}" not in known_before]
+
+
+def process_complete_compliance(invoice_data, enhanced_data, ml_result, price_stats: Optional[Dict] = None):
+    """
+    Process complete compliance check: score from the rule plan, plus per-check details
+    price_stats: price index entries for the invoice's line items (InvoiceStore.get_price_stats,
+    or the invoice's stored priceStats when re-scoring)
+    """
+    compliance_results = COMPLIANCE_PLAN.evaluate(compliance_record(invoice_data, enhanced_data, ml_result, price_stats))
+    
+    # GST validation details
+    gst_validations = [validate_gst_number(gst_num) for gst_num in invoice_data.get('gst_numbers', [])]
+    
+    # HSN validation details (first known code)
+    hsn_validations = []
+    hsn_index = get_hsn_index()
+    for hsn_code in enhanced_data.get('hsn_sac_codes', []):
+        match = hsn_index.lookup(hsn_code)
+        if match and len(match.matched) >= MIN_KNOWN_DIGITS:
+            hsn_validations.append({
+                'hsn_code': hsn_code,
+                'is_correct': True,
+                'regulatory_rate': match.gst_rate,
+                'matched_code': match.matched,
+                'level': match.level,
+                'description': match.description
+            })
+            break
+    
+    compliance_results.update({
+        'gst_validations': gst_validations,
+        'hsn_validations': hsn_validations,
+        'duplicate_check': [],
+        'arithmetic_check': check_arithmetic_accuracy(invoice_data),
+        'price_analysis': analyze_market_prices(enhanced_data, invoice_data, price_stats),
+        'price_stats': used_price_stats(invoice_data, enhanced_data, price_stats)
+    })
+    
+    return compliance_results
+
+def validate_gst_number(gst_number):
+    """Validate GST number format"""
+    try:
+        if re.match(GST_PATTERN, gst_number):
+            return {'valid': True, 'status': 'active', 'format_valid': True}
+        else:
+            return {'valid': False, 'status': 'invalid_format', 'format_valid': False}
+    except:
+        return {'valid': False, 'status': 'error', 'format_valid': False}
+
+def check_arithmetic_accuracy(invoice_data):
+    """Check arithmetic accuracy"""
+    try:
+        total_amount = invoice_data.get('total_amount')
+        if total_amount:
+            amount = float(str(total_amount).replace(',', ''))
+            # Simple check - assume 18% GST
+            base_amount = amount / 1.18
+            expected_gst = base_amount * 0.18
+            expected_total = base_amount + expected_gst
+            
+            return {
+                'overall_accurate': abs(amount - expected_total) < 1.0,
+                'base_amount': base_amount,
+                'expected_gst': expected_gst,
+                'expected_total': expected_total
+            }
+    except:
+        pass
+    
+    return {'overall_accurate': False}
+
+def analyze_market_prices(enhanced_data, invoice_data, price_stats: Optional[Dict] = None):
+    """
+    Analyze market prices: each line item's unit price against the price index
+    (median / percentile of the same item or HSN heading); items without comparable prices are left out
+    """
+    line_items = normalize_line_items({**invoice_data, **enhanced_data})
+    return [{
+        'item': position['item'].get('description') or f"HSN {position['item'].get('hsnCode')}",
+        'billed_price': position['unit_price'],
+        'market_avg': position['median'],
+        'variance_percent': position['variance_percent'],
+        'is_outlier': position['is_outlier'],
+        'percentile': position['percentile'],
+        'basis': position['basis'],
+        'samples': position['samples']
+    } for position in line_item_positions(line_items, price_stats or {})]
@@ -1,284 +1,752 @@
 """
 MongoDB Database Module for FINTEL AI
 Handles invoice storage, vendor tracking, and anomaly detection
+MongoDB implementation of storage.InvoiceStore plus the process-wide backend registry
 """
 
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient, UpdateOne, ReplaceOne, DeleteMany, ASCENDING, DESCENDING, TEXT
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Iterator
 import json
+import os
+import sys
+import threading
 
-class FintelDatabase:
-    def __init__(self, connection_string="mongodb://localhost:27017/"):
-        """Initialize MongoDB connection"""
-        self.client = MongoClient(connection_string)
-        self.db = self.client['fintel_ai']
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+from storage import (
+    InvoiceStore, build_invoice_doc, build_invoice_details, compress_details, decompress_details, DETAILS_ENCODING,
+    SEARCH_FACET_LIMIT, search_page, serialize_invoice, serialize_vendor, serialize_anomaly, shape_anomaly_trends
+)
+from price_index import KLLSketch, build_sketches, merge_into, price_index_doc, price_observations
+from split_billing import MAX_ROLLUP_IDS, merge_rollup_entries, rollup_entries
+
+# mongodb://... selects MongoDB, sqlite:///path (or sqlite:///:memory:) the embedded SQLite backend
+DEFAULT_CONNECTION_STRING = os.getenv("FINTEL_DATABASE_URL", os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
+
+# Process-wide client registry: one pooled MongoClient per connection string
+_registry_lock = threading.RLock()
+_clients: Dict[str, MongoClient] = {}
+_shared_databases: Dict[str, InvoiceStore] = {}
+
+
+def _reset_registry_after_fork():
+    """
+    MongoClient is not fork-safe, so a forked worker must never reuse the
+    parent's pools. The inherited clients are dropped (not closed, their
+    sockets belong to the parent) and recreated lazily on first use.
+    """
+    global _registry_lock
+    _registry_lock = threading.RLock()
+    _clients.clear()
+    _shared_databases.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_registry_after_fork)
+
+
+def get_client(connection_string: str = DEFAULT_CONNECTION_STRING) -> MongoClient:
+    """Get the shared, pooled MongoClient for a connection string"""
+    client = _clients.get(connection_string)
+    if client is not None:
+        return client
+    
+    with _registry_lock:
+        client = _clients.get(connection_string)
+        if client is None:
+            client = MongoClient(connection_string)
+            _clients[connection_string] = client
+        return client
+
+
+def get_database(connection_string: str = DEFAULT_CONNECTION_STRING) -> InvoiceStore:
+    """
+    Get the process-wide repository for a connection string
+    Use this instead of constructing FintelDatabase per call
+    """
+    database = _shared_databases.get(connection_string)
+    if database is not None:
+        return database
+    
+    with _registry_lock:
+        database = _shared_databases.get(connection_string)
+        if database is None:
+            if connection_string.startswith("sqlite://"):
+                from sqlite_store import SQLiteFintelDatabase
+                database = SQLiteFintelDatabase.from_url(connection_string)
+            else:
+                database = FintelDatabase(connection_string)
+            _shared_databases[connection_string] = database
+        return database
+
+
+def close_all_clients():
+    """Close every pooled client (call on application shutdown)"""
+    with _registry_lock:
+        for database in _shared_databases.values():
+            database.disconnect()
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _shared_databases.clear()
+
+
+def _date_range(start_date: Optional[datetime], end_date: Optional[datetime]) -> Dict:
+    """Build a Mongo range filter from optional bounds (end_date is exclusive)"""
+    date_range = {}
+    if start_date:
+        date_range['$gte'] = start_date
+    if end_date:
+        date_range['$lt'] = end_date
+    return date_range
+
+
+# ---------------------------------------------------------------------------
+# Mongo query builders (shared with AsyncFintelDatabase in async_database.py)
+# ---------------------------------------------------------------------------
+
+def vendor_stats_update(invoice_doc: Dict) -> Optional[tuple]:
+    """
+    Build the (filter, update) upsert for vendor statistics
+    Returns None when the invoice has no usable GST number
+    """
+    gst_number = invoice_doc.get('gstNumber')
+    if not gst_number or gst_number == 'Unknown':
+        return None
+    
+    now = datetime.now()
+    update = {
+        '$inc': {
+            'totalInvoices': 1,
+            'totalAmount': invoice_doc.get('totalAmount', 0)
+        },
+        '$set': {
+            'lastInvoiceDate': now,
+            'vendorName': invoice_doc.get('vendorName')  # Update in case name changed
+        },
+        '$setOnInsert': {
+            'firstInvoiceDate': now  # gstNumber is copied from the filter on insert
+        }
+    }
+    return {'gstNumber': gst_number}, update
+
+
+def vendor_stats_updates(invoice_docs: List[Dict]) -> List[UpdateOne]:
+    """vendor_stats_update for a batch: one upsert per vendor with the batch's count and total"""
+    merged: Dict[str, tuple] = {}
+    for invoice_doc in invoice_docs:
+        upsert = vendor_stats_update(invoice_doc)
+        if not upsert:
+            continue
+        query, update = upsert
+        if query['gstNumber'] in merged:
+            increments = merged[query['gstNumber']][1]['$inc']
+            increments['totalInvoices'] += 1
+            increments['totalAmount'] += update['$inc']['totalAmount']
+            merged[query['gstNumber']][1]['$set'] = update['$set']
+        else:
+            merged[query['gstNumber']] = upsert
+    return [UpdateOne(query, update, upsert=True) for query, update in merged.values()]
+
+
+def details_doc(invoice_obj_id, invoice_data: Dict[str, Any]) -> Dict:
+    """invoice_details document: compressed payload sharing the invoice's _id"""
+    payload = compress_details(build_invoice_details(invoice_data))
+    return {'_id': invoice_obj_id, 'encoding': DETAILS_ENCODING, 'size': len(payload), 'payload': Binary(payload)}
+
+
+def to_object_id(invoice_id: str):
+    """Convert invoice_id to ObjectId for comparison, falling back to the raw value"""
+    from bson import ObjectId
+    if invoice_id is None:
+        return None
+    try:
+        return ObjectId(invoice_id)
+    except Exception:
+        return invoice_id
+
+
+def duplicate_invoice_query(invoice_data: Dict[str, Any], obj_id) -> Dict:
+    return {'invoiceNumber': invoice_data.get('invoice_number'), '_id': {'$ne': obj_id}}
+
+
+def gst_vendor_mismatch_query(invoice_data: Dict[str, Any], gst_number: str, obj_id) -> Dict:
+    return {
+        'gstNumber': gst_number,
+        'vendorName': {'$ne': invoice_data.get('vendor_name')},
+        '_id': {'$ne': obj_id}
+    }
+
+
+def similar_hsn_query(hsn: str, obj_id) -> Dict:
+    return {'hsnCodes': hsn, '_id': {'$ne': obj_id}}
+
+
+# Optimistic price-index merges retry when another upload wrote the same key in between
+PRICE_MERGE_RETRIES = 8
+
+
+def price_sketch_write(stored: Optional[Dict], sketch: KLLSketch) -> tuple:
+    """(filter, document) replacing the stored entry only if its version is still the one read"""
+    version = (stored or {}).get('version', 0)
+    query = {'_id': stored['_id'], 'version': version} if stored else None
+    return query, price_index_doc(merge_into(stored, sketch), version + 1)
+
+
+def invoice_price_sketches(invoice_doc: Dict) -> Dict[str, KLLSketch]:
+    return build_sketches(price_observations(invoice_doc.get('lineItems') or []))
+
+
+def vendor_baseline_update(observation: Dict[str, Any]) -> List[Dict]:
+    """
+    Pipeline update folding one observation into a vendor baseline (see vendor_baselines.apply_observation)
+    The cadence gap is taken from the stored lastDay inside the update, never from a worker's cached copy
+    """
+    def plus(field: str, value) -> Dict:
+        return {'$add': [{'$ifNull': [f"${field}", 0]}, value]}
+
+    fields = {'vendorName': {'$literal': observation['vendorName']}, 'updatedAt': datetime.now()}
+    log_amount = observation['logAmount']
+    if log_amount is not None:
+        fields.update(count=plus('count', 1), logSum=plus('logSum', log_amount), logSumSq=plus('logSumSq', log_amount ** 2))
+    day = observation['day']
+    if day is not None:
+        key = str(observation['dayOfMonth'])
+        fields['dated'] = plus('dated', 1)
+        fields[f"days.{key}"] = plus(f"days.{key}", 1)
+        fields['lastDay'] = {'$max': ['$lastDay', day]}
+        # Every expression of one $set stage reads the document as it was, so $lastDay is the previous date
+        has_gap = {'$and': [{'$gt': ['$lastDay', 0]}, {'$gte': [day, '$lastDay']}]}
+        gap_log = {'$ln': {'$add': [1, {'$subtract': [day, '$lastDay']}]}}
+        fields['gapCount'] = plus('gapCount', {'$cond': [has_gap, 1, 0]})
+        fields['gapLogSum'] = plus('gapLogSum', {'$cond': [has_gap, gap_log, 0]})
+        fields['gapLogSumSq'] = plus('gapLogSumSq', {'$cond': [has_gap, {'$pow': [gap_log, 2]}, 0]})
+    return [{'$set': fields}]
+
+
+def split_rollup_updates(entries: List[Dict[str, Any]]) -> List[UpdateOne]:
+    """
+    One upsert per split rollup: $inc count / amount, plus the latest invoice ids for a daily rollup
+    or $min / $max of the day for a key's running total (see split_billing.apply_rollup)
+    """
+    updates = []
+    for rollup_id, entry in merge_rollup_entries(entries).items():
+        update = {'$setOnInsert': {'key': entry['key'], 'day': entry['day']},
+                  '$inc': {'count': entry['count'], 'amount': entry['amount']}}
+        if 'invoiceIds' in entry:
+            update['$push'] = {'invoiceIds': {'$each': entry['invoiceIds'], '$slice': -MAX_ROLLUP_IDS}}
+        else:
+            update['$min'], update['$max'] = {'firstDay': entry['firstDay']}, {'lastDay': entry['lastDay']}
+        updates.append(UpdateOne({'_id': rollup_id}, update, upsert=True))
+    return updates
+
+
+def batch_price_sketches(invoice_docs: List[Dict]) -> Dict[str, KLLSketch]:
+    """One sketch per key over a whole batch of invoices (merged into the index once)"""
+    return build_sketches(price_observations([item for doc in invoice_docs for item in doc.get('lineItems') or []]))
+
+
+def vendor_stats_pipeline(vendor_name: str) -> List[Dict]:
+    return [
+        {'$match': {'vendorName': vendor_name}},
+        {'$group': {
+            '_id': None,
+            'avgAmount': {'$avg': '$totalAmount'},
+            'maxAmount': {'$max': '$totalAmount'},
+            'minAmount': {'$min': '$totalAmount'},
+            'totalInvoices': {'$sum': 1}
+        }}
+    ]
+
+
+ANOMALY_KEY_INDEX = 'invoiceId_1_anomalyType_1'
+
+# Single-field indexes superseded by compound indexes (dropped by create_indexes)
+REDUNDANT_INDEXES = {
+    'invoices': ['vendorName_1', 'gstNumber_1'],
+    'anomalies': ['invoiceId_1', 'severity_1']
+}
+
+
+TOTAL_AMOUNT_PIPELINE = [
+    {'$group': {
+        '_id': None,
+        'totalAmount': {'$sum': '$totalAmount'}
+    }}
+]
+
+
+def anomaly_upserts(records: List[Dict]) -> List[UpdateOne]:
+    """Insert-if-absent under the unique (invoiceId, anomalyType) key, so re-runs never duplicate"""
+    return [
+        UpdateOne({'invoiceId': record['invoiceId'], 'anomalyType': record['anomalyType']},
+                  {'$setOnInsert': record}, upsert=True)
+        for record in records
+    ]
+
+
+def anomaly_types_updates(records: List[Dict]) -> List[UpdateOne]:
+    """
+    Denormalize anomaly types onto their invoices (invoices.anomalyTypes)
+    so search can filter and facet on them without joining anomalies
+    """
+    types_by_invoice: Dict[str, set] = {}
+    for record in records:
+        if record.get('invoiceId') and record.get('anomalyType'):
+            types_by_invoice.setdefault(record['invoiceId'], set()).add(record['anomalyType'])
+    return [
+        UpdateOne({'_id': to_object_id(invoice_id)}, {'$addToSet': {'anomalyTypes': {'$each': sorted(types)}}})
+        for invoice_id, types in types_by_invoice.items()
+    ]
+
+
+def invoice_search_query(filters: Dict[str, Any], text: Optional[str] = None) -> Dict:
+    """
+    $match for InvoiceStore.search_invoices
+    Equality filters line up with the (field, uploadDate) compound indexes
+    """
+    query = {}
+    if text:
+        query['$text'] = {'$search': text}
+    if filters.get('vendorName'):
+        query['vendorName'] = filters['vendorName']
+    if filters.get('gstNumber'):
+        query['gstNumber'] = filters['gstNumber']
+    if filters.get('hsnCode'):
+        query['hsnCodes'] = filters['hsnCode']
+    if filters.get('anomalyType'):
+        query['anomalyTypes'] = filters['anomalyType']
+    if filters.get('riskLevel'):
+        query['complianceResults.risk_level'] = filters['riskLevel']
+    if filters.get('startDate') or filters.get('endDate'):
+        query['uploadDate'] = _date_range(filters.get('startDate'), filters.get('endDate'))
+    amount_range = {}
+    if filters.get('minAmount') is not None:
+        amount_range['$gte'] = filters['minAmount']
+    if filters.get('maxAmount') is not None:
+        amount_range['$lte'] = filters['maxAmount']
+    if amount_range:
+        query['totalAmount'] = amount_range
+    return query
+
+
+def invoice_search_pipeline(filters: Dict[str, Any], text: Optional[str], page: int, page_size: int) -> List[Dict]:
+    """One round trip: the requested page, the total and facet counts over the matching set"""
+    sort = {'score': {'$meta': 'textScore'}, 'uploadDate': DESCENDING} if text else {'uploadDate': DESCENDING}
+    return [
+        {'$match': invoice_search_query(filters, text)},
+        {'$facet': {
+            'results': [
+                {'$sort': sort},
+                {'$skip': (page - 1) * page_size},
+                {'$limit': page_size},
+                {'$project': {'searchTerms': 0}}
+            ],
+            'total': [{'$count': 'count'}],
+            'vendorName': [{'$sortByCount': '$vendorName'}, {'$limit': SEARCH_FACET_LIMIT}],
+            'riskLevel': [{'$sortByCount': '$complianceResults.risk_level'}],
+            'anomalyType': [{'$unwind': '$anomalyTypes'}, {'$sortByCount': '$anomalyTypes'}]
+        }}
+    ]
+
+
+def shape_search_result(result: Optional[Dict], page: int, page_size: int) -> Dict[str, Any]:
+    """Turn the $facet output of invoice_search_pipeline into search_page()"""
+    result = result or {}
+    total = result['total'][0]['count'] if result.get('total') else 0
+    facets = {
+        name: [{'value': bucket['_id'], 'count': bucket['count']} for bucket in result.get(name, [])]
+        for name in ('vendorName', 'riskLevel', 'anomalyType')
+    }
+    return search_page(result.get('results', []), total, page, page_size, facets)
+
+
+def anomaly_trends_pipeline(start_date: datetime, end_date: datetime) -> List[Dict]:
+    """Aggregate anomalies by date and type"""
+    return [
+        {
+            '$match': {
+                'detectedAt': {'$gte': start_date, '$lte': end_date}
+            }
+        },
+        {
+            '$group': {
+                '_id': {
+                    'date': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$detectedAt'}},
+                    'type': '$anomalyType'
+                },
+                'count': {'$sum': 1}
+            }
+        },
+        {
+            '$sort': {'_id.date': 1}
+        }
+    ]
+
+
+class FintelDatabase(InvoiceStore):
+    def __init__(self, connection_string=DEFAULT_CONNECTION_STRING, database_name: str = 'fintel_ai'):
+        """
+        Initialize MongoDB repository on top of the shared client pool
+        Indexes are not created here - run `python database.py --create-indexes` at deploy time
+        """
+        self.client = get_client(connection_string)
+        self.db = self.client[database_name]
         
         # Collections
         self.invoices = self.db['invoices']
         self.vendors = self.db['vendors']
         self.anomalies = self.db['anomalies']
-        
-        # Create indexes for faster queries
-        self._create_indexes()
-        
-        print("✅ MongoDB connected successfully!")
-        print(f"   Database: fintel_ai")
-        print(f"   Collections: invoices, vendors, anomalies")
+        self.invoice_details = self.db['invoice_details']  # compressed bulky payloads, keyed by invoice _id
+        self.price_index = self.db['price_index']  # unit-price sketches + percentiles, keyed by 'hsn:…' / 'item:…'
+        self.vendor_clusters = self.db['vendor_clusters']  # behaviour-cluster assignment per GST number
+        self.vendor_baselines = self.db['vendor_baselines']  # per-vendor amount / cadence / day-of-month sums
+        self.split_rollups = self.db['split_rollups']  # daily near-threshold invoice counts per GSTIN / vendor
     
-    def _create_indexes(self):
-        """Create indexes for optimized queries"""
+    def create_indexes(self):
+        """Create indexes for optimized queries (deploy/migration step, idempotent)"""
         # Invoice indexes
         self.invoices.create_index([("invoiceNumber", ASCENDING)], unique=False)
-        self.invoices.create_index([("gstNumber", ASCENDING)])
-        self.invoices.create_index([("vendorName", ASCENDING)])
         self.invoices.create_index([("uploadDate", DESCENDING)])
+        self.invoices.create_index([("totalAmount", ASCENDING)])
+        
+        # Search: equality filter first, then the newest-first sort (also serve plain
+        # vendorName / gstNumber / hsnCodes lookups, so the old single-field indexes go)
+        for field in ("vendorName", "gstNumber", "hsnCodes", "anomalyTypes", "complianceResults.risk_level"):
+            self.invoices.create_index([(field, ASCENDING), ("uploadDate", DESCENDING)])
+        
+        # Incremental re-evaluation: invoices that relied on a changed rule / HSN rate
+        self.invoices.create_index([("complianceDeps", ASCENDING)])
+        
+        # GST mismatch check: gstNumber equality + $ne on vendorName is answered from index keys alone
+        self.invoices.create_index([("gstNumber", ASCENDING), ("vendorName", ASCENDING)])
+        
+        # Full-text search over item descriptions, vendor and OCR words
+        self.invoices.create_index(
+            [("itemDescriptions", TEXT), ("vendorName", TEXT), ("searchTerms", TEXT)],
+            name="invoice_text",
+            weights={"itemDescriptions": 5, "vendorName": 3, "searchTerms": 1}
+        )
         
         # Vendor indexes
         self.vendors.create_index([("gstNumber", ASCENDING)], unique=True)
         self.vendors.create_index([("vendorName", ASCENDING)])
+        self.vendors.create_index([("totalAmount", DESCENDING)])
         
         # Anomaly indexes
-        self.anomalies.create_index([("invoiceId", ASCENDING)])
+        self.ensure_unique_anomaly_key()
         self.anomalies.create_index([("anomalyType", ASCENDING)])
-        self.anomalies.create_index([("severity", ASCENDING)])
+        self.anomalies.create_index([("severity", ASCENDING), ("detectedDate", DESCENDING)])
+        self.anomalies.create_index([("detectedDate", DESCENDING)])
+        self.anomalies.create_index([("detectedAt", ASCENDING)])
+        self.anomalies.create_index([("vendorName", ASCENDING)])
+        
+        # Prefixes of the compound indexes above
+        for collection, names in REDUNDANT_INDEXES.items():
+            existing = self.db[collection].index_information()
+            for name in names:
+                if name in existing:
+                    self.db[collection].drop_index(name)
+        
+        print("✅ MongoDB indexes created")
+    
+    def ensure_unique_anomaly_key(self):
+        """
+        One anomaly per (invoiceId, anomalyType): backs the idempotent upserts of
+        insert_anomalies and the backfill jobs. Upgrades an existing non-unique index.
+        """
+        keys = [("invoiceId", ASCENDING), ("anomalyType", ASCENDING)]
+        existing = self.anomalies.index_information().get(ANOMALY_KEY_INDEX)
+        if existing and existing.get('unique'):
+            return
+        if existing:
+            self.anomalies.drop_index(ANOMALY_KEY_INDEX)
+        try:
+            self.anomalies.create_index(keys, name=ANOMALY_KEY_INDEX, unique=True)
+        except DuplicateKeyError:
+            self.anomalies.create_index(keys, name=ANOMALY_KEY_INDEX)
+            print("⚠️  Duplicate anomalies found - run `python backfill.py dedupe-anomalies`, "
+                  "then `python database.py --create-indexes` again")
     
     def store_invoice(self, invoice_data: Dict[str, Any]) -> str:
         """
         Store invoice in database
         Returns: invoice_id
         """
-        invoice_doc = {
-            'filename': invoice_data.get('filename'),
-            'uploadDate': datetime.now(),
-            'invoiceNumber': invoice_data.get('invoice_number'),
-            'vendorName': invoice_data.get('vendor_name'),
-            'gstNumber': invoice_data.get('gst_numbers', [])[0] if invoice_data.get('gst_numbers') else None,
-            'allGstNumbers': invoice_data.get('gst_numbers', []),
-            'totalAmount': float(invoice_data.get('total_amount', 0)),
-            'invoiceDate': invoice_data.get('invoice_date'),
-            'gstRate': invoice_data.get('gst_rate', 'Unknown'),
-            'hsnNumber': invoice_data.get('hsn_number', 'Unknown'),
-            'hsnCodes': invoice_data.get('hsn_sac_codes', []),
-            'itemDescriptions': invoice_data.get('item_descriptions', []),
-            'quantities': invoice_data.get('quantities', []),
-            'ocrConfidence': float(invoice_data.get('ocr_confidence', 0)),
-            'complianceResults': invoice_data.get('compliance_results', {}),
-            'mlPrediction': invoice_data.get('ml_prediction', {}),
-            'rawText': invoice_data.get('raw_text', '')[:1000]  # Store first 1000 chars
-        }
+        invoice_doc = build_invoice_doc(invoice_data)
         
         result = self.invoices.insert_one(invoice_doc)
         invoice_id = str(result.inserted_id)
         
+        self.invoice_details.insert_one(details_doc(result.inserted_id, invoice_data))
+        
         # Update vendor statistics
         self._update_vendor_stats(invoice_doc)
+        self.merge_price_sketches(invoice_price_sketches(invoice_doc))
+        self.merge_split_rollups(rollup_entries(invoice_data, invoice_id))
         
         print(f"✅ Invoice stored: {invoice_doc['invoiceNumber']} (ID: {invoice_id})")
         return invoice_id
     
+    def store_invoices(self, invoices: List[Dict[str, Any]]) -> List[str]:
+        """Bulk store: two unordered insert_many calls, one vendor bulk_write, one price-index merge"""
+        if not invoices:
+            return []
+        invoice_docs = [build_invoice_doc(invoice_data) for invoice_data in invoices]
+        self.invoices.insert_many(invoice_docs, ordered=False)  # fills in each doc's _id
+        self.invoice_details.insert_many(
+            [details_doc(doc['_id'], invoice_data) for doc, invoice_data in zip(invoice_docs, invoices)], ordered=False
+        )
+        vendor_updates = vendor_stats_updates(invoice_docs)
+        if vendor_updates:
+            self.vendors.bulk_write(vendor_updates, ordered=False)
+        self.merge_price_sketches(batch_price_sketches(invoice_docs))
+        self.merge_split_rollups([entry for doc, invoice_data in zip(invoice_docs, invoices)
+                                  for entry in rollup_entries(invoice_data, str(doc['_id']))])
+        return [str(doc['_id']) for doc in invoice_docs]
+    
     def _update_vendor_stats(self, invoice_doc: Dict):
-        """Update or create vendor statistics"""
-        gst_number = invoice_doc.get('gstNumber')
-        vendor_name = invoice_doc.get('vendorName')
-        
-        if not gst_number or gst_number == 'Unknown':
-            return
-        
-        vendor = self.vendors.find_one({'gstNumber': gst_number})
-        
-        if vendor:
-            # Update existing vendor
-            self.vendors.update_one(
-                {'gstNumber': gst_number},
-                {
-                    '$inc': {
-                        'totalInvoices': 1,
-                        'totalAmount': invoice_doc.get('totalAmount', 0)
-                    },
-                    '$set': {
-                        'lastInvoiceDate': datetime.now(),
-                        'vendorName': vendor_name  # Update in case name changed
-                    }
-                }
-            )
-        else:
-            # Create new vendor
-            self.vendors.insert_one({
-                'gstNumber': gst_number,
-                'vendorName': vendor_name,
-                'totalInvoices': 1,
-                'totalAmount': invoice_doc.get('totalAmount', 0),
-                'firstInvoiceDate': datetime.now(),
-                'lastInvoiceDate': datetime.now()
-            })
-    
-    def detect_anomalies(self, invoice_data: Dict[str, Any], invoice_id: str) -> List[Dict]:
-        """
-        Detect anomalies by comparing with historical data
-        Returns: List of detected anomalies
-        """
-        from bson import ObjectId
-        anomalies = []
-        
-        # Convert invoice_id to ObjectId for comparison
-        try:
-            obj_id = ObjectId(invoice_id)
-        except:
-            obj_id = invoice_id
-        
-        # 1. Check for duplicate invoice number
-        duplicate = self.invoices.find_one({
-            'invoiceNumber': invoice_data.get('invoice_number'),
-            '_id': {'$ne': obj_id}
-        })
-        if duplicate:
-            anomalies.append({
-                'type': 'DUPLICATE_INVOICE',
-                'severity': 'HIGH',
-                'description': f"Duplicate invoice number: {invoice_data.get('invoice_number')}",
-                'relatedInvoiceId': str(duplicate['_id'])
-            })
-        
-        # 2. Check for missing GST number (No GST found in invoice)
-        gst_numbers = invoice_data.get('gst_numbers', [])
-        gst_missing = invoice_data.get('gst_missing', False)
-        
-        if not gst_numbers or len(gst_numbers) == 0 or gst_missing:
-            anomalies.append({
-                'type': 'MISSING_GST',
-                'severity': 'HIGH',
-                'description': f"No GST number found in invoice - Vendor: {invoice_data.get('vendor_name', 'Unknown')}",
-            })
-        
-        # 3. Check for invalid GST number (GST found but invalid format/verification failed)
-        gst_number = gst_numbers[0] if gst_numbers else None
-        if gst_number:
-            # Check if GST verification failed
-            gst_verification = invoice_data.get('gst_verification', [])
-            if gst_verification and len(gst_verification) > 0:
-                verification_result = gst_verification[0]
-                if not verification_result.get('success') or not verification_result.get('is_active'):
-                    anomalies.append({
-                        'type': 'INVALID_GST',
-                        'severity': 'HIGH',
-                        'description': f"Invalid GST number: {gst_number} - Verification failed",
-                    })
-        
-        # 4. Check for GST number with different vendor name
-        if gst_number:
-            different_vendor = self.invoices.find_one({
-                'gstNumber': gst_number,
-                'vendorName': {'$ne': invoice_data.get('vendor_name')},
-                '_id': {'$ne': obj_id}
-            })
-            if different_vendor:
-                anomalies.append({
-                    'type': 'GST_VENDOR_MISMATCH',
-                    'severity': 'HIGH',
-                    'description': f"GST {gst_number} used by different vendor: {different_vendor['vendorName']} vs {invoice_data.get('vendor_name')}",
-                    'relatedInvoiceId': str(different_vendor['_id'])
-                })
-        
-        # 4. Check for unusual amount from same vendor
-        vendor_name = invoice_data.get('vendor_name')
-        if vendor_name and vendor_name != 'Unknown':
-            # Get average amount for this vendor
-            pipeline = [
-                {'$match': {'vendorName': vendor_name}},
-                {'$group': {
-                    '_id': None,
-                    'avgAmount': {'$avg': '$totalAmount'},
-                    'maxAmount': {'$max': '$totalAmount'},
-                    'minAmount': {'$min': '$totalAmount'}
-                }}
-            ]
-            stats = list(self.vendors_stats(vendor_name))
-            if stats:
-                avg_amount = stats[0].get('avgAmount', 0)
-                current_amount = float(invoice_data.get('total_amount', 0))
-                
-                # If amount is 3x more than average
-                if avg_amount > 0 and current_amount > (avg_amount * 3):
-                    anomalies.append({
-                        'type': 'UNUSUAL_AMOUNT',
-                        'severity': 'MEDIUM',
-                        'description': f"Amount ₹{current_amount} is 3x higher than vendor average ₹{avg_amount:.2f}"
-                    })
-        
-        # 5. Check for same HSN code with very different price
-        hsn_codes = invoice_data.get('hsn_sac_codes', [])
-        if hsn_codes:
-            for hsn in hsn_codes[:3]:  # Check first 3 HSN codes
-                similar_invoices = list(self.invoices.find({
-                    'hsnCodes': hsn,
-                    '_id': {'$ne': invoice_id}
-                }).limit(10))
-                
-                if len(similar_invoices) >= 3:
-                    amounts = [inv['totalAmount'] for inv in similar_invoices if inv.get('totalAmount', 0) > 0]
-                    if amounts:
-                        avg_hsn_amount = sum(amounts) / len(amounts)
-                        current_amount = float(invoice_data.get('total_amount', 0))
-                        
-                        # If amount differs by more than 50%
-                        if avg_hsn_amount > 0 and abs(current_amount - avg_hsn_amount) > (avg_hsn_amount * 0.5):
-                            anomalies.append({
-                                'type': 'HSN_PRICE_DEVIATION',
-                                'severity': 'MEDIUM',
-                                'description': f"HSN {hsn}: Amount ₹{current_amount} deviates significantly from historical average ₹{avg_hsn_amount:.2f}"
-                            })
-                            break  # Only report once
-        
-        # Store anomalies in database
-        for anomaly in anomalies:
-            self.anomalies.insert_one({
-                'invoiceId': invoice_id,
-                'invoiceNumber': invoice_data.get('invoice_number'),
-                'anomalyType': anomaly['type'],
-                'severity': anomaly['severity'],
-                'description': anomaly['description'],
-                'detectedDate': datetime.now(),
-                'relatedInvoiceId': anomaly.get('relatedInvoiceId')
-            })
-        
-        return anomalies
+        """Update or create vendor statistics (single upsert)"""
+        upsert = vendor_stats_update(invoice_doc)
+        if upsert:
+            self.vendors.update_one(*upsert, upsert=True)
+    
+    def insert_anomalies(self, records: List[Dict]) -> None:
+        """Upsert already-built anomaly records (one per invoice and type)"""
+        if records:
+            self.anomalies.bulk_write(anomaly_upserts(records), ordered=False)
+            updates = anomaly_types_updates(records)
+            if updates:
+                self.invoices.bulk_write(updates, ordered=False)
+    
+    def set_invoice_fields(self, updates: Dict[str, Dict[str, Any]]) -> int:
+        """Bulk partial update in one unordered bulk_write"""
+        if not updates:
+            return 0
+        result = self.invoices.bulk_write(
+            [UpdateOne({'_id': to_object_id(invoice_id)}, {'$set': fields}) for invoice_id, fields in updates.items()],
+            ordered=False
+        )
+        return result.matched_count
+    
+    def sync_anomaly_types(self) -> int:
+        """Rebuild invoices.anomalyTypes from the anomalies collection (for data stored before it existed)"""
+        updates = [
+            UpdateOne({'_id': to_object_id(group['_id'])}, {'$set': {'anomalyTypes': sorted(group['types'])}})
+            for group in self.anomalies.aggregate([
+                {'$group': {'_id': '$invoiceId', 'types': {'$addToSet': '$anomalyType'}}}
+            ])
+            if group['_id']
+        ]
+        if updates:
+            self.invoices.bulk_write(updates, ordered=False)
+        return len(updates)
+    
+    def apply_hsn_changes(self, upserts: List[Dict[str, Any]], deletes: List[Any], version: int) -> int:
+        """Upsert changed HSN rows by key, then drop removed ones (ordered, no empty window)"""
+        now = datetime.now()
+        operations = [
+            ReplaceOne({'_id': row['key']}, {**{k: v for k, v in row.items() if k != 'key'},
+                                             'version': version, 'updatedAt': now}, upsert=True)
+            for row in upserts
+        ]
+        if deletes:
+            operations.append(DeleteMany({'_id': {'$in': list(deletes)}}))
+        if operations:
+            self.db['hsn_codes'].bulk_write(operations, ordered=True)
+        return len(upserts) + len(deletes)
+    
+    def get_hsn_codes(self) -> List[Dict[str, Any]]:
+        return [{'key': doc.pop('_id'), **doc} for doc in self.db['hsn_codes'].find({}, {'updatedAt': 0})]
+    
+    def merge_price_sketches(self, sketches: Dict[str, KLLSketch]) -> None:
+        """Read-merge-write per key, retried when the version moved (no lost concurrent updates)"""
+        for key, sketch in sketches.items():
+            for _ in range(PRICE_MERGE_RETRIES):
+                stored = self.price_index.find_one({'_id': key})
+                query, doc = price_sketch_write(stored, sketch)
+                try:
+                    if query is None:
+                        self.price_index.insert_one({'_id': key, **doc})
+                        break
+                    if self.price_index.replace_one(query, doc).matched_count:
+                        break
+                except DuplicateKeyError:
+                    continue
+            else:
+                print(f"⚠️ Price index entry {key} kept changing - skipped this invoice's prices")
+    
+    def replace_price_index(self, sketches: Dict[str, KLLSketch]) -> None:
+        """Replace entries by key, then drop the ones that no longer exist (no empty window)"""
+        operations = [ReplaceOne({'_id': key}, price_index_doc(sketch, 0), upsert=True)
+                      for key, sketch in sketches.items()]
+        operations.append(DeleteMany({'_id': {'$nin': list(sketches)}}))
+        self.price_index.bulk_write(operations, ordered=True)
+    
+    def get_price_stats(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not keys:
+            return {}
+        return {doc['_id']: doc['stats'] for doc in self.price_index.find({'_id': {'$in': list(keys)}}, {'stats': 1})}
+    
+    def replace_vendor_clusters(self, assignments: Dict[str, Dict[str, Any]]) -> None:
+        """Same replace-then-prune as replace_price_index"""
+        operations = [ReplaceOne({'_id': gst_number}, assignment, upsert=True)
+                      for gst_number, assignment in assignments.items()]
+        operations.append(DeleteMany({'_id': {'$nin': list(assignments)}}))
+        self.vendor_clusters.bulk_write(operations, ordered=True)
+    
+    def get_vendor_cluster(self, gst_number: str) -> Optional[Dict[str, Any]]:
+        return self.vendor_clusters.find_one({'_id': gst_number}, {'_id': 0})
+    
+    def merge_vendor_baseline(self, gst_number: str, observation: Dict[str, Any]) -> None:
+        """One atomic upsert; concurrent uploads for the same vendor never lose an increment"""
+        self.vendor_baselines.update_one({'_id': gst_number}, vendor_baseline_update(observation), upsert=True)
+    
+    def replace_vendor_baselines(self, baselines: Dict[str, Dict[str, Any]]) -> None:
+        """Same replace-then-prune as replace_price_index"""
+        operations = [ReplaceOne({'_id': gst_number}, baseline, upsert=True)
+                      for gst_number, baseline in baselines.items()]
+        operations.append(DeleteMany({'_id': {'$nin': list(baselines)}}))
+        self.vendor_baselines.bulk_write(operations, ordered=True)
+    
+    def get_vendor_baseline(self, gst_number: str) -> Optional[Dict[str, Any]]:
+        return self.vendor_baselines.find_one({'_id': gst_number}, {'_id': 0})
+    
+    def merge_split_rollups(self, entries: List[Dict[str, Any]]) -> None:
+        """Atomic upserts in one unordered bulk_write (concurrent uploads never lose a count)"""
+        updates = split_rollup_updates(entries)
+        if updates:
+            self.split_rollups.bulk_write(updates, ordered=False)
+    
+    def replace_split_rollups(self, rollups: Dict[str, Dict[str, Any]]) -> None:
+        """Same replace-then-prune as replace_price_index"""
+        operations = [ReplaceOne({'_id': rollup_id}, {k: v for k, v in rollup.items() if k != '_id'}, upsert=True)
+                      for rollup_id, rollup in rollups.items()]
+        operations.append(DeleteMany({'_id': {'$nin': list(rollups)}}))
+        self.split_rollups.bulk_write(operations, ordered=True)
+    
+    def get_split_rollups(self, rollup_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not rollup_ids:
+            return {}
+        return {doc['_id']: doc for doc in self.split_rollups.find({'_id': {'$in': list(rollup_ids)}})}
+    
+    def save_reference_snapshot(self, name: str, snapshot: Dict[str, Any]):
+        self.db['reference_snapshots'].replace_one(
+            {'_id': name}, {**snapshot, 'savedAt': datetime.now()}, upsert=True
+        )
+    
+    def get_reference_snapshot(self, name: str) -> Optional[Dict[str, Any]]:
+        return self.db['reference_snapshots'].find_one({'_id': name}, {'_id': 0})
+    
+    def get_invoice(self, invoice_id: str) -> Optional[Dict]:
+        """Fetch one invoice by id"""
+        return self.invoices.find_one({'_id': to_object_id(invoice_id)})
+    
+    def get_invoice_details(self, invoice_id: str) -> Optional[Dict]:
+        """Decompressed detail payload for detail views"""
+        doc = self.invoice_details.find_one({'_id': to_object_id(invoice_id)})
+        return decompress_details(doc['payload']) if doc else None
+    
+    def get_invoice_details_many(self, invoice_ids: List[str]) -> Dict[str, Dict]:
+        """Decompressed details for a batch of invoices (single $in query)"""
+        cursor = self.invoice_details.find({'_id': {'$in': [to_object_id(i) for i in invoice_ids]}})
+        return {str(doc['_id']): decompress_details(doc['payload']) for doc in cursor}
+    
+    def get_latest_invoice(self) -> Optional[Dict]:
+        """Most recently uploaded invoice"""
+        return self.invoices.find_one(sort=[('uploadDate', DESCENDING)])
+    
+    def find_invoice_by_number(self, invoice_number: Optional[str], exclude_id: Optional[str] = None) -> Optional[Dict]:
+        """Another invoice carrying the same invoice number"""
+        return self.invoices.find_one(duplicate_invoice_query({'invoice_number': invoice_number}, to_object_id(exclude_id)))
+    
+    def find_gst_vendor_mismatch(self, gst_number: str, vendor_name: Optional[str],
+                                 exclude_id: Optional[str] = None) -> Optional[Dict]:
+        """An invoice with this GST number but a different vendor name"""
+        return self.invoices.find_one(gst_vendor_mismatch_query({'vendor_name': vendor_name}, gst_number, to_object_id(exclude_id)))
+    
+    def find_invoices_with_hsn(self, hsn: str, exclude_id: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        """Invoices containing an HSN code"""
+        return list(self.invoices.find(similar_hsn_query(hsn, to_object_id(exclude_id))).limit(limit))
+    
+    def anomaly_exists(self, invoice_id: str, anomaly_type: str) -> bool:
+        """Whether an anomaly of this type is already recorded for the invoice"""
+        return self.anomalies.find_one({'invoiceId': invoice_id, 'anomalyType': anomaly_type}) is not None
+    
+    def anomaly_type_counts(self) -> List[Dict]:
+        """Anomaly counts grouped by type"""
+        return list(self.anomalies.aggregate([{'$group': {'_id': '$anomalyType', 'count': {'$sum': 1}}}]))
     
     def vendors_stats(self, vendor_name: str) -> List[Dict]:
         """Get statistics for a vendor"""
-        pipeline = [
-            {'$match': {'vendorName': vendor_name}},
-            {'$group': {
-                '_id': None,
-                'avgAmount': {'$avg': '$totalAmount'},
-                'maxAmount': {'$max': '$totalAmount'},
-                'minAmount': {'$min': '$totalAmount'},
-                'totalInvoices': {'$sum': 1}
-            }}
-        ]
-        return list(self.invoices.aggregate(pipeline))
+        return list(self.invoices.aggregate(vendor_stats_pipeline(vendor_name)))
     
     def get_invoice_history(self, limit: int = 50) -> List[Dict]:
         """Get recent invoice history"""
-        invoices = list(self.invoices.find().sort('uploadDate', DESCENDING).limit(limit))
+        invoices = self.invoices.find().sort('uploadDate', DESCENDING).limit(limit)
+        return [serialize_invoice(inv) for inv in invoices]
+    
+    def iter_invoices(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                      vendor_name: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict]:
+        """
+        Stream invoices from a batched server-side cursor
+        Memory stays constant regardless of how many invoices match
+        """
+        query = {}
+        if start_date or end_date:
+            query['uploadDate'] = _date_range(start_date, end_date)
+        if vendor_name:
+            query['vendorName'] = vendor_name
         
-        # Convert ObjectId to string
-        for inv in invoices:
-            inv['_id'] = str(inv['_id'])
-            inv['uploadDate'] = inv['uploadDate'].isoformat() if inv.get('uploadDate') else None
+        cursor = self.invoices.find(query, projection={'rawText': 0, 'searchTerms': 0}).sort('uploadDate', ASCENDING).batch_size(batch_size)
+        try:
+            for invoice in cursor:
+                yield invoice
+        finally:
+            cursor.close()
+    
+    def iter_invoices_with_dependencies(self, dependencies: List[str], batch_size: int = 500) -> Iterator[Dict]:
+        """Answered from the complianceDeps index"""
+        cursor = self.invoices.find(
+            {'complianceDeps': {'$in': dependencies}}, projection={'rawText': 0, 'searchTerms': 0}
+        ).batch_size(batch_size)
+        try:
+            for invoice in cursor:
+                yield invoice
+        finally:
+            cursor.close()
+    
+    def iter_anomalies(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                       vendor_name: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict]:
+        """
+        Stream anomalies from a batched server-side cursor
+        Older backfilled anomalies carry detectedAt instead of detectedDate, so both are matched
+        """
+        query = {}
+        if start_date or end_date:
+            date_range = _date_range(start_date, end_date)
+            query['$or'] = [{'detectedDate': date_range}, {'detectedAt': date_range}]
+        if vendor_name:
+            query['vendorName'] = vendor_name
         
-        return invoices
+        cursor = self.anomalies.find(query).sort('_id', ASCENDING).batch_size(batch_size)
+        try:
+            for anomaly in cursor:
+                yield anomaly
+        finally:
+            cursor.close()
+    
+    def search_invoices(self, filters: Dict[str, Any], text: Optional[str] = None,
+                        page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+        """Faceted invoice search (single $facet aggregation)"""
+        result = next(self.invoices.aggregate(invoice_search_pipeline(filters, text, page, page_size)), None)
+        return shape_search_result(result, page, page_size)
     
     def get_vendor_list(self) -> List[Dict]:
         """Get list of all vendors"""
-        vendors = list(self.vendors.find().sort('totalAmount', DESCENDING))
-        
-        for vendor in vendors:
-            vendor['_id'] = str(vendor['_id'])
-            vendor['firstInvoiceDate'] = vendor['firstInvoiceDate'].isoformat() if vendor.get('firstInvoiceDate') else None
-            vendor['lastInvoiceDate'] = vendor['lastInvoiceDate'].isoformat() if vendor.get('lastInvoiceDate') else None
-        
-        return vendors
+        vendors = self.vendors.find().sort('totalAmount', DESCENDING)
+        return [serialize_vendor(vendor) for vendor in vendors]
     
     def get_anomalies(self, severity: Optional[str] = None, limit: int = 50) -> List[Dict]:
         """Get detected anomalies"""
@@ -286,29 +754,19 @@ class FintelDatabase:
         if severity:
             query['severity'] = severity
         
-        anomalies = list(self.anomalies.find(query).sort('detectedDate', DESCENDING).limit(limit))
-        
-        for anomaly in anomalies:
-            anomaly['_id'] = str(anomaly['_id'])
-            anomaly['detectedDate'] = anomaly['detectedDate'].isoformat() if anomaly.get('detectedDate') else None
-        
-        return anomalies
+        anomalies = self.anomalies.find(query).sort('detectedDate', DESCENDING).limit(limit)
+        return [serialize_anomaly(anomaly) for anomaly in anomalies]
     
     def get_dashboard_stats(self) -> Dict:
         """Get statistics for dashboard"""
-        total_invoices = self.invoices.count_documents({})
-        total_vendors = self.vendors.count_documents({})
-        total_anomalies = self.anomalies.count_documents({})
+        # Unfiltered totals come from collection metadata instead of a full scan
+        total_invoices = self.invoices.estimated_document_count()
+        total_vendors = self.vendors.estimated_document_count()
+        total_anomalies = self.anomalies.estimated_document_count()
         high_severity_anomalies = self.anomalies.count_documents({'severity': 'HIGH'})
         
         # Total amount processed
-        pipeline = [
-            {'$group': {
-                '_id': None,
-                'totalAmount': {'$sum': '$totalAmount'}
-            }}
-        ]
-        amount_result = list(self.invoices.aggregate(pipeline))
+        amount_result = list(self.invoices.aggregate(TOTAL_AMOUNT_PIPELINE))
         total_amount = amount_result[0]['totalAmount'] if amount_result else 0
         
         return {
@@ -326,89 +784,28 @@ class FintelDatabase:
         """
         from datetime import timedelta
         
-        # Calculate date range
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
         
-        # Aggregate anomalies by date and type
-        pipeline = [
-            {
-                '$match': {
-                    'detectedAt': {'$gte': start_date, '$lte': end_date}
-                }
-            },
-            {
-                '$group': {
-                    '_id': {
-                        'date': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$detectedAt'}},
-                        'type': '$anomalyType'
-                    },
-                    'count': {'$sum': 1}
-                }
-            },
-            {
-                '$sort': {'_id.date': 1}
-            }
-        ]
-        
-        results = list(self.anomalies.aggregate(pipeline))
-        
-        # Organize data by date
-        trends_by_date = {}
-        for result in results:
-            date = result['_id']['date']
-            anomaly_type = result['_id']['type']
-            count = result['count']
-            
-            if date not in trends_by_date:
-                trends_by_date[date] = {
-                    'date': date,
-                    'duplicates': 0,
-                    'invalidGst': 0,
-                    'missingGst': 0,
-                    'total': 0
-                }
-            
-            # Map anomaly types to keys
-            if anomaly_type == 'DUPLICATE_INVOICE':
-                trends_by_date[date]['duplicates'] = count
-            elif anomaly_type == 'INVALID_GST':
-                trends_by_date[date]['invalidGst'] = count
-            elif anomaly_type == 'MISSING_GST':
-                trends_by_date[date]['missingGst'] = count
-            
-            trends_by_date[date]['total'] += count
-        
-        # Fill in missing dates with zeros
-        all_trends = []
-        current_date = start_date
-        while current_date <= end_date:
-            date_str = current_date.strftime('%Y-%m-%d')
-            if date_str in trends_by_date:
-                all_trends.append(trends_by_date[date_str])
-            else:
-                all_trends.append({
-                    'date': date_str,
-                    'duplicates': 0,
-                    'invalidGst': 0,
-                    'missingGst': 0,
-                    'total': 0
-                })
-            current_date += timedelta(days=1)
-        
-        return all_trends
-    
-    def close(self):
-        """Close database connection"""
-        self.client.close()
-        print("MongoDB connection closed")
+        results = list(self.anomalies.aggregate(anomaly_trends_pipeline(start_date, end_date)))
+        return shape_anomaly_trends(results, start_date, end_date)
 
 
-# Test connection
+# Test connection / deploy-time index creation
 if __name__ == "__main__":
-    db = FintelDatabase()
+    db = get_database()
+    print("✅ MongoDB connected successfully!")
+    print(f"   Database: fintel_ai")
+    print(f"   Collections: invoices, vendors, anomalies")
+    
+    if "--create-indexes" in sys.argv:
+        db.create_indexes()
+    
+    if "--sync-anomaly-types" in sys.argv:
+        print(f"✅ anomalyTypes rebuilt on {db.sync_anomaly_types()} invoices")
+    
     print("\n📊 Database Stats:")
     stats = db.get_dashboard_stats()
     for key, value in stats.items():
         print(f"  {key}: {value}")
-    db.close()
+    close_all_clients()
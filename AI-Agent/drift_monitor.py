@@ -0,0 +1,328 @@
+"""
+Model Drift Monitor for FINTEL AI
+Tells when the active anomaly model has gone stale. Training records a reference
+profile with every model: decile histograms of each ml_features column (plus a
+bucket for unknown values) and a histogram of the training anomaly scores.
+`DriftMonitor` keeps the same histograms for live invoices in a ring of hourly
+windows (one small integer array; a few vector operations per upload) and
+compares the last 24 hours with the reference: population stability index (PSI)
+and a binned Kolmogorov-Smirnov distance per feature and for the anomaly score.
+
+The API feeds it from the upload handler and serves the report at /api/ml/drift
+and in Prometheus text format at /metrics (numbers are per worker process). Run
+this module from cron (hourly is fine): it checks the invoices stored in the
+last --hours against the active model, saves the report as the `model_drift`
+reference snapshot and, with --retrain, trains and registers a new version only
+when the data has drifted, never on a schedule.
+
+Usage:
+    python drift_monitor.py [database_url] [--hours 24] [--retrain] [--train-days 90] [--activate]
+"""
+
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from ml_features import FEATURE_NAMES, feature_matrix, fill_missing
+from storage import InvoiceStore, invoice_data_from_doc
+
+SNAPSHOT_NAME = 'model_drift'
+SCORE = 'anomaly_score'
+REFERENCE_BINS = 10           # decile bins per feature
+SCORE_BINS = 20
+WINDOW_SECONDS = 3600
+WINDOWS = 24                  # the report covers the last WINDOWS x WINDOW_SECONDS
+PSI_MODERATE = 0.1            # the usual PSI reading: < 0.1 stable, 0.1-0.25 shifting, > 0.25 drifted
+PSI_DRIFT = 0.25
+PSI_EPSILON = 1e-4            # share given to empty bins (PSI takes the log of the ratio)
+MIN_DRIFT_ROWS = 500          # fewer live invoices are too noisy to judge
+RETRAIN_FEATURES = 2          # drifted features that call for retraining (a drifted score always does)
+DEFAULT_TRAIN_DAYS = 90
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def _histogram(values: np.ndarray, bins: int) -> Dict[str, Any]:
+    """Quantile bin edges and counts of `values` (NaN counted as missing)"""
+    known = values[~np.isnan(values)]
+    distinct = np.unique(known)
+    if len(distinct) <= bins + 1:
+        edges = distinct[1:]  # flags and small counts: one bin per value (deciles would merge them)
+    else:
+        edges = np.unique(np.quantile(known, np.linspace(0, 1, bins + 1)[1:-1]))
+    counts = np.bincount(np.searchsorted(edges, known, side='right'), minlength=len(edges) + 1)
+    return {'edges': edges.tolist(), 'counts': counts.tolist(), 'missing': int(len(values) - len(known))}
+
+
+def reference_profile(features: np.ndarray, scores: Sequence[float]) -> Dict[str, Any]:
+    """Training-time histograms of every feature (raw rows, NaN = unknown) and of the anomaly scores"""
+    features = np.asarray(features, dtype=float)
+    scores = np.asarray(scores, dtype=float)
+    histograms = {name: _histogram(features[:, i], REFERENCE_BINS) for i, name in enumerate(FEATURE_NAMES)}
+    histograms[SCORE] = _histogram(scores, SCORE_BINS)
+    return {
+        'rows': len(features),
+        'anomaly_rate': round(float(np.mean(scores < 0)), 4) if len(scores) else 0.0,
+        'histograms': histograms
+    }
+
+
+def psi(expected: np.ndarray, actual: np.ndarray) -> float:
+    """Population stability index between two histograms over the same bins"""
+    p = np.maximum(expected / max(expected.sum(), 1), PSI_EPSILON)
+    q = np.maximum(actual / max(actual.sum(), 1), PSI_EPSILON)
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+def ks_distance(expected: np.ndarray, actual: np.ndarray) -> float:
+    """Largest gap between the two cumulative distributions (Kolmogorov-Smirnov, on the bins)"""
+    gaps = np.cumsum(expected) / max(expected.sum(), 1) - np.cumsum(actual) / max(actual.sum(), 1)
+    return float(np.max(np.abs(gaps), initial=0.0))
+
+
+def _status(value: float) -> str:
+    return 'drift' if value >= PSI_DRIFT else 'shifting' if value >= PSI_MODERATE else 'stable'
+
+
+class DriftMonitor:
+    """
+    Live histograms of the model inputs and anomaly scores in a ring of time windows,
+    compared with the training reference of the model that scored them
+    """
+
+    def __init__(self, reference: Optional[Dict[str, Any]] = None, version: Optional[str] = None,
+                 window_seconds: float = WINDOW_SECONDS, windows: int = WINDOWS):
+        self.window_seconds, self.windows = window_seconds, windows
+        self.names = list(FEATURE_NAMES) + [SCORE]
+        self._lock = threading.Lock()
+        self.reset(reference, version)
+
+    def reset(self, reference: Optional[Dict[str, Any]], version: Optional[str] = None):
+        """Start over against `reference` (a model's reference_profile; None = nothing to compare with)"""
+        histograms = [reference['histograms'][name] for name in self.names] if reference else []
+        width = max((len(h['edges']) for h in histograms), default=0)
+        # Edges padded with +inf, so a value's bin is the number of edges <= it; the last bin is "unknown"
+        edges = np.full((len(self.names), width), np.inf)
+        expected = np.zeros((len(self.names), width + 2), dtype=np.int64)
+        for row, histogram in enumerate(histograms):
+            edges[row, :len(histogram['edges'])] = histogram['edges']
+            expected[row, :len(histogram['counts'])] = histogram['counts']
+            expected[row, -1] = histogram['missing']
+        with self._lock:
+            self.reference, self.version = reference, version
+            self._edges, self._expected = edges, expected
+            self._offsets = np.arange(len(self.names)) * expected.shape[1]  # column starts in a flattened window
+            self._counts = np.zeros((self.windows,) + expected.shape, dtype=np.int64)
+            self._anomalies = np.zeros(self.windows, dtype=np.int64)
+            self._bucket = None
+            self.observed, self.observe_seconds = 0, 0.0
+
+    def follow(self, scorer):
+        """Switch to the reference of `scorer` when another model version took over"""
+        reference = getattr(scorer, 'reference', None)
+        if reference is not self.reference:
+            self.reset(reference, getattr(scorer, 'version', None))
+
+    def _slot(self, now: float) -> int:
+        """Ring slot of the window holding `now`, clearing the windows that have aged out"""
+        bucket = int(now // self.window_seconds)
+        if self._bucket is None or bucket - self._bucket >= self.windows:
+            self._counts[:] = 0
+            self._anomalies[:] = 0
+            self._bucket = bucket
+        elif bucket > self._bucket:
+            stale = np.arange(self._bucket + 1, bucket + 1) % self.windows
+            self._counts[stale] = 0
+            self._anomalies[stale] = 0
+            self._bucket = bucket
+        return self._bucket % self.windows
+
+    def observe_batch(self, features: np.ndarray, scores: Sequence[float], now: Optional[float] = None):
+        """Count raw feature rows (NaN = unknown) and their anomaly scores into the current window"""
+        if self.reference is None or not len(scores):
+            return
+        scores = np.asarray(scores, dtype=float)
+        values = np.column_stack([np.asarray(features, dtype=float), scores])
+        bins = np.where(np.isnan(values), self._expected.shape[1] - 1,
+                        (self._edges <= values[..., None]).sum(axis=-1))
+        flat = bins + self._offsets
+        with self._lock:
+            slot = self._slot(time.time() if now is None else now)
+            window = self._counts[slot].reshape(-1)  # a view of the slot
+            if len(flat) == 1:
+                window[flat[0]] += 1  # one row touches each column once (the upload path)
+            else:
+                window += np.bincount(flat.ravel(), minlength=window.size)
+            self._anomalies[slot] += int(np.count_nonzero(scores < 0))
+
+    def observe(self, scorer, invoice_data: Dict[str, Any], prediction: Optional[Dict[str, Any]],
+                features: Optional[np.ndarray] = None, now: Optional[float] = None):
+        """
+        Upload-path hook: one invoice record and the global model's prediction for it
+        (pass the raw feature row the prediction was made from to skip rebuilding it)
+        """
+        started = time.perf_counter()
+        self.follow(scorer)
+        if self.reference is None or not prediction or 'anomaly_score' not in prediction:
+            return
+        self.observe_batch(feature_matrix([invoice_data]) if features is None else features,
+                           [prediction['anomaly_score']], now)
+        self.observed += 1
+        self.observe_seconds += time.perf_counter() - started
+
+    def report(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """Drift of the rolling window against the reference (what /api/ml/drift returns)"""
+        if self.reference is None:
+            return {'model_version': self.version, 'status': 'no_reference', 'rows': 0,
+                    'retrain_recommended': False,
+                    'reasons': ["the serving model has no training reference - retrain it to monitor drift"]}
+        with self._lock:
+            if self._bucket is not None:
+                self._slot(time.time() if now is None else now)
+            counts = self._counts.sum(axis=0)
+            anomalies = int(self._anomalies.sum())
+        rows = int(counts[0].sum())
+        columns = {}
+        for index, name in enumerate(self.names):
+            if rows < MIN_DRIFT_ROWS:  # PSI of a near-empty window only measures the smoothing
+                columns[name] = {'psi': None, 'ks': None, 'status': 'insufficient_data'}
+                continue
+            value = psi(self._expected[index], counts[index])
+            columns[name] = {'psi': round(value, 4), 'ks': round(ks_distance(self._expected[index], counts[index]), 4),
+                             'status': _status(value)}
+        drifted = [name for name in FEATURE_NAMES if columns[name]['status'] == 'drift']
+
+        reasons = []
+        if columns[SCORE]['status'] == 'drift':
+            reasons.append(f"anomaly score distribution moved (PSI {columns[SCORE]['psi']:.2f})")
+        if len(drifted) >= RETRAIN_FEATURES:
+            reasons.append(f"{len(drifted)} features drifted: {', '.join(drifted)}")
+        if rows < MIN_DRIFT_ROWS:
+            status = 'insufficient_data'
+        elif reasons:
+            status = 'drift'
+        else:
+            status = 'shifting' if any(column['status'] != 'stable' for column in columns.values()) else 'stable'
+        return {
+            'model_version': self.version,
+            'window_hours': round(self.window_seconds * self.windows / 3600, 2),
+            'rows': rows,
+            'reference_rows': self.reference['rows'],
+            'anomaly_rate': round(anomalies / rows, 4) if rows else None,
+            'reference_anomaly_rate': self.reference['anomaly_rate'],
+            'status': status,
+            'drifted_features': drifted,
+            'features': {name: columns[name] for name in FEATURE_NAMES},
+            'anomaly_score': columns[SCORE],
+            'retrain_recommended': bool(reasons),
+            'reasons': reasons,
+            'overhead_us': round(self.observe_seconds / self.observed * 1e6, 1) if self.observed else None
+        }
+
+
+def prometheus_metrics(report: Dict[str, Any]) -> str:
+    """A drift report in the Prometheus text exposition format"""
+    model = report.get('model_version') or 'none'
+    lines = []
+
+    def gauge(name: str, help_text: str, samples):
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+        lines.extend(f'{name}{{model="{model}"{labels}}} {value}' for labels, value in samples)
+
+    gauge('fintel_drift_rows', 'Invoices in the rolling drift window', [('', report['rows'])])
+    gauge('fintel_drift_retrain_recommended', '1 when the live data has drifted from the training reference',
+          [('', int(report['retrain_recommended']))])
+    if report.get('anomaly_rate') is not None:
+        gauge('fintel_anomaly_rate', 'Share of invoices the model flags',
+              [(',scope="live"', report['anomaly_rate']), (',scope="reference"', report['reference_anomaly_rate'])])
+    if 'features' in report and report['status'] != 'insufficient_data':
+        columns = {**report['features'], SCORE: report['anomaly_score']}
+        for metric, help_text in (('psi', 'Population stability index against the training reference'),
+                                  ('ks', 'Binned Kolmogorov-Smirnov distance to the training reference')):
+            gauge(f'fintel_drift_{metric}', help_text,
+                  [(f',feature="{name}"', column[metric]) for name, column in columns.items()])
+    if report.get('overhead_us') is not None:
+        gauge('fintel_drift_overhead_microseconds', 'Mean time the upload path spends in the drift monitor',
+              [('', report['overhead_us'])])
+    return '\n'.join(lines) + '\n'
+
+
+def check_store(store: InvoiceStore, scorer, hours: float = 24, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+    """Drift of the invoices stored in the last `hours`, re-scored with `scorer`, against its reference"""
+    now = time.time()
+    monitor = DriftMonitor(scorer.reference, scorer.version, window_seconds=hours * 3600, windows=1)
+    chunk = []
+
+    def flush():
+        features = feature_matrix(chunk)
+        scores = scorer.predict_anomaly_batch(fill_missing(features.copy(), scorer.feature_fill))['anomaly_score']
+        monitor.observe_batch(features, scores, now)
+        chunk.clear()
+
+    for invoice in store.iter_invoices(start_date=datetime.now() - timedelta(hours=hours), batch_size=chunk_size):
+        chunk.append(invoice_data_from_doc(invoice))
+        if len(chunk) == chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return monitor.report(now)
+
+
+def main():
+    from database import DEFAULT_CONNECTION_STRING, get_database
+    from model_registry import ModelRegistry, load_active_scorer
+
+    def option(name: str, default):
+        return type(default)(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+    has_url = len(sys.argv) > 1 and not sys.argv[1].startswith('--')
+    store = get_database(sys.argv[1] if has_url else DEFAULT_CONNECTION_STRING)
+    registry = ModelRegistry()
+    scorer = load_active_scorer(registry)
+    if scorer is None:
+        sys.exit(1)
+    if scorer.reference is None:
+        print(f"⚠️ Model {scorer.version or '(legacy)'} has no training reference - retrain it "
+              f"(python ml_history_trainer.py --activate) to enable drift checks")
+        sys.exit(1)
+
+    hours = option('--hours', 24.0)
+    started = time.perf_counter()
+    report = check_store(store, scorer, hours)
+    print(f"📊 {report['rows']:,} invoices from the last {hours:g}h checked against model "
+          f"{scorer.version or '(legacy)'} in {time.perf_counter() - started:.1f}s")
+    print(f"{'feature':<24} {'PSI':>7} {'KS':>7}  status")
+    for name, column in {**report['features'], SCORE: report['anomaly_score']}.items():
+        if column['psi'] is None:
+            print(f"{name:<24} {'-':>7} {'-':>7}  {column['status']}")
+        else:
+            print(f"{name:<24} {column['psi']:>7.3f} {column['ks']:>7.3f}  {column['status']}")
+    if report['anomaly_rate'] is not None:
+        print(f"🚨 Anomaly rate {report['anomaly_rate']:.1%} (training {report['reference_anomaly_rate']:.1%})")
+    store.save_reference_snapshot(SNAPSHOT_NAME, report)
+
+    if not report['retrain_recommended']:
+        print(f"✅ {report['status']} - no retraining needed")
+        return
+    print(f"⚠️ Drift: {'; '.join(report['reasons'])}")
+    if '--retrain' not in sys.argv:
+        print("🎯 Retrain with: python drift_monitor.py --retrain [--activate]")
+        return
+
+    from ml_history_trainer import train_from_store
+    train_days = option('--train-days', DEFAULT_TRAIN_DAYS)
+    trainer, training = train_from_store(store, start_date=datetime.now() - timedelta(days=train_days))
+    if trainer is None:
+        sys.exit(1)
+    trainer.training_info = {**training, 'trigger': {'reason': 'drift', 'details': report['reasons'],
+                                                     'replaces': scorer.version}}
+    version = registry.register(trainer, activate='--activate' in sys.argv)
+    if '--activate' not in sys.argv:
+        print(f"🎉 Activate it with: python model_registry.py activate {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,15 @@ FINTEL AI - Fixed API Server
 Working version with all compliance features
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 import uvicorn
 import os
+import hmac
 import shutil
+import asyncio
 import json
 from pathlib import Path
 from datetime import datetime
@@ -24,9 +26,21 @@ import io
 
 # Import our existing components
 from gemini_vision_ocr import gemini_vision_ocr  # Gemini Vision OCR
-from ml_trainer import FintelMLTrainer
-from database import FintelDatabase
+from model_registry import ActiveModel
+from vendor_baselines import BaselineCache, baseline_observation, combine_predictions, score_invoice
+from drift_monitor import DriftMonitor, prometheus_metrics, SNAPSHOT_NAME as DRIFT_SNAPSHOT
+from ml_features import FEATURE_NAMES, FEATURE_VERSION, feature_matrix
+from database import get_database, close_all_clients
+from async_database import get_async_database, close_async_clients
+from storage import serialize_invoice, all_gst_numbers, merge_invoice_details, SEARCH_MAX_PAGE_SIZE
+from compliance import process_complete_compliance
+from hsn_classifier import classify_line_items, suggested_codes
+from price_index import line_item_keys, normalize_line_items
 from gst_verifier import gst_verifier
+from invoice_export import (
+    export_stream, export_filename, parse_export_date, parse_export_end_date,
+    EXPORT_FORMATS, INVOICE_CSV_COLUMNS, ANOMALY_CSV_COLUMNS
+)
 
 # NEW: Import LangChain integration (optional)
 try:
@@ -59,16 +73,15 @@ print("Initializing FINTEL AI Complete System...")
 # Core components
 # ocr_engine = EasyOCREngine()  # Old OCR
 # Using enhanced_ocr instead (imported above)
-ml_trainer = FintelMLTrainer()
-db = FintelDatabase()  # MongoDB connection
-
-# Load trained models
-if not ml_trainer.load_models():
-    print("Loading real trained models...")
-    if os.path.exists("fintel_real_trained_models.pkl"):
-        ml_trainer.load_models("fintel_real_trained_models.pkl")
-    else:
-        ml_trainer.load_models("fintel_models.pkl")
+db = get_database()  # Shared MongoDB connection pool (sync: exports, agents)
+adb = get_async_database()  # Async repository used by the request handlers
+
+# Active model from the registry (memory-mapped, hot-swapped when another version is activated)
+ml_model = ActiveModel()
+# Per-vendor baselines read through a bounded LRU (vendors without enough history use the global model)
+vendor_baselines = BaselineCache()
+# Live feature / anomaly-score histograms against the serving model's training reference (per worker)
+drift_monitor = DriftMonitor()
 
 print("FINTEL AI Complete System ready!")
 
@@ -82,17 +95,11 @@ print("Gemini AI configured!")
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-# HSN/SAC Database
-HSN_SAC_DATABASE = {
-    "8517": {"description": "Telephone sets, mobile phones", "gst_rate": 12.0},
-    "8471": {"description": "Computers and computer peripherals", "gst_rate": 18.0},
-    "9403": {"description": "Office furniture", "gst_rate": 12.0},
-    "7326": {"description": "Articles of iron or steel", "gst_rate": 18.0},
-    "3926": {"description": "Articles of plastics", "gst_rate": 18.0},
-    "8443": {"description": "Printing machinery", "gst_rate": 18.0},
-    "4901": {"description": "Printed books, brochures", "gst_rate": 12.0},
-    "9983": {"description": "Professional services", "gst_rate": 18.0}
-}
+@app.on_event("shutdown")
+async def shutdown_database():
+    """Close pooled MongoDB clients"""
+    close_async_clients()
+    close_all_clients()
 
 @app.get("/")
 async def root():
@@ -126,16 +133,40 @@ async def health_check():
 async def get_invoice_history(limit: int = 50):
     """Get invoice history from database"""
     try:
-        invoices = db.get_invoice_history(limit)
+        invoices = await adb.get_invoice_history(limit)
         return {"success": True, "invoices": invoices, "count": len(invoices)}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@app.get("/api/invoices/search")
+async def search_invoices(q: str = None, vendor: str = None, gstin: str = None, start_date: str = None,
+                          end_date: str = None, min_amount: float = None, max_amount: float = None,
+                          hsn: str = None, anomaly_type: str = None, risk_level: str = None,
+                          page: int = 1, page_size: int = 20):
+    """Filter invoices, search item descriptions / OCR text, with facet counts and paging"""
+    if page < 1 or not 1 <= page_size <= SEARCH_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"page must be >= 1 and page_size between 1 and {SEARCH_MAX_PAGE_SIZE}")
+    try:
+        start, end = parse_export_date(start_date), parse_export_end_date(end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO formatted, e.g. 2024-11-01")
+    
+    filters = {
+        'vendorName': vendor, 'gstNumber': gstin, 'startDate': start, 'endDate': end,
+        'minAmount': min_amount, 'maxAmount': max_amount, 'hsnCode': hsn,
+        'anomalyType': anomaly_type, 'riskLevel': risk_level
+    }
+    try:
+        result = await adb.search_invoices(filters, text=q, page=page, page_size=page_size)
+        return {"success": True, **result}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
 @app.get("/api/vendors")
 async def get_vendors():
     """Get list of all vendors"""
     try:
-        vendors = db.get_vendor_list()
+        vendors = await adb.get_vendor_list()
         return {"success": True, "vendors": vendors, "count": len(vendors)}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -144,7 +175,7 @@ async def get_vendors():
 async def get_anomalies(severity: str = None, limit: int = 50):
     """Get detected anomalies"""
     try:
-        anomalies = db.get_anomalies(severity, limit)
+        anomalies = await adb.get_anomalies(severity, limit)
         return {"success": True, "anomalies": anomalies, "count": len(anomalies)}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -153,7 +184,7 @@ async def get_anomalies(severity: str = None, limit: int = 50):
 async def get_dashboard_stats():
     """Get dashboard statistics"""
     try:
-        stats = db.get_dashboard_stats()
+        stats = await adb.get_dashboard_stats()
         return {"success": True, "stats": stats}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -162,11 +193,132 @@ async def get_dashboard_stats():
 async def get_anomaly_trends(days: int = 30):
     """Get anomaly trends for the last N days"""
     try:
-        trends = db.get_anomaly_trends(days=days)
+        trends = await adb.get_anomaly_trends(days=days)
         return {"success": True, "trends": trends}
     except Exception as e:
         return {"success": False, "error": str(e), "trends": []}
 
+def _export_response(name: str, documents, fmt: str, columns, gzip: bool) -> StreamingResponse:
+    """Wrap a document iterator into a streaming download"""
+    headers = {"Content-Disposition": f'attachment; filename="{export_filename(name, fmt, gzip)}"'}
+    media_type = "application/gzip" if gzip else EXPORT_FORMATS[fmt]
+    return StreamingResponse(export_stream(documents, fmt, columns, gzip), media_type=media_type, headers=headers)
+
+def _parse_export_params(fmt: str, start_date: str, end_date: str):
+    """Validate export query parameters"""
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt} (use ndjson or csv)")
+    try:
+        return parse_export_date(start_date), parse_export_end_date(end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO formatted, e.g. 2024-11-01")
+
+@app.get("/api/export/invoices")
+async def export_invoices(format: str = "ndjson", start_date: str = None, end_date: str = None,
+                          vendor: str = None, gzip: bool = False):
+    """Stream all matching invoices as NDJSON or CSV (constant memory)"""
+    start, end = _parse_export_params(format, start_date, end_date)
+    documents = db.iter_invoices(start_date=start, end_date=end, vendor_name=vendor)
+    return _export_response("invoices", documents, format, INVOICE_CSV_COLUMNS, gzip)
+
+@app.get("/api/export/anomalies")
+async def export_anomalies(format: str = "ndjson", start_date: str = None, end_date: str = None,
+                           vendor: str = None, gzip: bool = False):
+    """Stream all matching anomalies as NDJSON or CSV (constant memory)"""
+    start, end = _parse_export_params(format, start_date, end_date)
+    documents = db.iter_anomalies(start_date=start, end_date=end, vendor_name=vendor)
+    return _export_response("anomalies", documents, format, ANOMALY_CSV_COLUMNS, gzip)
+
+# Rows accepted by one /api/ml/score-batch call
+ML_SCORE_BATCH_MAX = 50000
+
+class ScoreBatchRequest(BaseModel):
+    invoices: List[Dict[str, Any]] = []  # invoice records (upload-handler field names)
+    features: List[List[float]] = []     # or precomputed ml_features rows
+
+@app.post("/api/ml/score-batch")
+async def score_batch(request: ScoreBatchRequest):
+    """Anomaly scores for many invoices in one vectorized model call"""
+    scorer = ml_model.get()
+    if scorer is None:
+        raise HTTPException(status_code=503, detail="No trained ML model loaded")
+    if bool(request.invoices) == bool(request.features):
+        raise HTTPException(status_code=400, detail="Send either invoices or features")
+    rows = len(request.invoices or request.features)
+    if rows > ML_SCORE_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {ML_SCORE_BATCH_MAX} rows per call")
+    if request.features and any(len(row) != len(FEATURE_NAMES) for row in request.features):
+        raise HTTPException(status_code=400, detail=f"Feature rows must have {len(FEATURE_NAMES)} values "
+                                                    f"({', '.join(FEATURE_NAMES)})")
+
+    def score():
+        features = scorer.feature_matrix(request.invoices) if request.invoices else np.array(request.features)
+        return scorer.predict_anomaly_batch(features)
+
+    # CPU-bound: keep the event loop free
+    scores = await asyncio.to_thread(score)
+    return {
+        "success": True,
+        "count": rows,
+        "featureVersion": FEATURE_VERSION,
+        "modelVersion": scorer.version,
+        "isAnomaly": scores['is_anomaly'].tolist(),
+        "anomalyScore": scores['anomaly_score'].tolist(),
+        "confidence": scores['confidence'].tolist()
+    }
+
+@app.get("/api/ml/drift")
+async def model_drift():
+    """Feature and anomaly-score drift of this worker's last 24h of uploads, plus the last stored check"""
+    drift_monitor.follow(ml_model.get())
+    return {
+        "success": True,
+        "live": drift_monitor.report(),
+        "lastCheck": await asyncio.to_thread(db.get_reference_snapshot, DRIFT_SNAPSHOT)
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Drift metrics in Prometheus text format (this worker)"""
+    drift_monitor.follow(ml_model.get())
+    return PlainTextResponse(prometheus_metrics(drift_monitor.report()), media_type="text/plain; version=0.0.4")
+
+# Model registry admin (send the FINTEL_ADMIN_TOKEN value as X-Admin-Token)
+FINTEL_ADMIN_TOKEN = os.getenv("FINTEL_ADMIN_TOKEN")
+
+def _require_admin(token: str):
+    if not FINTEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model admin is disabled (FINTEL_ADMIN_TOKEN is not set)")
+    if not hmac.compare_digest(token or "", FINTEL_ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+class ActivateModelRequest(BaseModel):
+    version: str
+
+@app.get("/api/admin/models")
+async def list_models(x_admin_token: str = Header(None)):
+    """Registered model versions with their metadata, and the active one"""
+    _require_admin(x_admin_token)
+    scorer = ml_model.get()
+    return {
+        "active": ml_model.registry.active_version(),
+        "serving": scorer.version if scorer is not None else None,
+        "versions": await asyncio.to_thread(ml_model.registry.versions),
+        "baselineCache": vendor_baselines.stats()
+    }
+
+@app.post("/api/admin/models/activate")
+async def activate_model(request: ActivateModelRequest, x_admin_token: str = Header(None)):
+    """Atomically switch every worker to another registered version (no restart)"""
+    _require_admin(x_admin_token)
+    try:
+        await asyncio.to_thread(ml_model.activate, request.version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version {request.version} is not registered")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"success": True, "active": request.version}
+
 # Pydantic model for chat request
 class ChatRequest(BaseModel):
     message: str
@@ -176,10 +328,12 @@ async def chat_with_gemini(request: ChatRequest):
     """Chat with Gemini AI about invoices"""
     try:
         # Get context from database
-        stats = db.get_dashboard_stats()
-        vendors = db.get_vendor_list()
-        anomalies = db.get_anomalies(limit=10)
-        invoices = db.get_invoice_history(limit=10)
+        stats, vendors, anomalies, invoices = await asyncio.gather(
+            adb.get_dashboard_stats(),
+            adb.get_vendor_list(),
+            adb.get_anomalies(limit=10),
+            adb.get_invoice_history(limit=10)
+        )
         
         # Build context for Gemini
         context = f"""You are FINTEL AI, a friendly Financial Assistant. Answer questions about invoices in simple, clear language.
@@ -251,6 +405,11 @@ async def upload_invoice_complete(file: UploadFile = File(...)):
         # Enhanced data extraction
         enhanced_data = extract_enhanced_invoice_data(ocr_result['raw_text'])
         
+        # Suggest HSN codes for line items returned without one (local text index, no LLM call)
+        line_items = classify_line_items(ocr_result['structured_data'].get('line_items', []))
+        enhanced_data['hsn_sac_codes'] = list(dict.fromkeys(enhanced_data['hsn_sac_codes'] + suggested_codes(line_items)))
+        enhanced_data['line_items'] = line_items
+        
         # Prepare invoice data
         # Convert total_amount to float
         total_amount_raw = ocr_result['structured_data'].get('total_amount', 0)
@@ -306,14 +465,23 @@ async def upload_invoice_complete(file: UploadFile = File(...)):
         invoice_data['gst_verification'] = gst_verification_results
         invoice_data['gst_missing'] = gst_missing
         
-        # ML Anomaly Detection
-        ml_features = extract_ml_features(invoice_data)
+        # ML Anomaly Detection (features built by ml_features, same as training)
         ml_result = None
-        if ml_features:
-            ml_result = ml_trainer.predict_anomaly(ml_features)
-        
-        # Complete Compliance Processing
-        compliance_results = process_complete_compliance(invoice_data, enhanced_data, ml_result)
+        scorer = ml_model.get()
+        if scorer is not None:
+            ml_record = {**invoice_data, 'item_descriptions': enhanced_data.get('item_descriptions', [])}
+            features = feature_matrix([ml_record])  # raw row, shared with the drift monitor
+            ml_result = scorer.predict_anomaly(ml_record, features)
+            drift_monitor.observe(scorer, ml_record, ml_result, features)
+        
+        # The vendor's own baseline overrides the global verdict once it has enough history
+        gst_number = invoice_data['gst_numbers'][0] if invoice_data.get('gst_numbers') else None
+        baseline = await vendor_baselines.aget(gst_number, adb.get_vendor_baseline) if gst_number else None
+        ml_result = combine_predictions(ml_result, score_invoice(baseline, invoice_data))
+        
+        # Complete Compliance Processing (unit prices checked against the price index)
+        price_stats = await adb.get_price_stats(line_item_keys(normalize_line_items({**invoice_data, **enhanced_data})))
+        compliance_results = process_complete_compliance(invoice_data, enhanced_data, ml_result, price_stats)
         
         # Store invoice in MongoDB
         invoice_storage_data = {
@@ -326,15 +494,21 @@ async def upload_invoice_complete(file: UploadFile = File(...)):
             'hsn_sac_codes': enhanced_data.get('hsn_sac_codes', []),
             'item_descriptions': enhanced_data.get('item_descriptions', []),
             'quantities': enhanced_data.get('quantities', []),
+            'line_items': line_items,
             'compliance_results': compliance_results,
             'ml_prediction': ml_result,
             'gst_verification': gst_verification_results,
             'gst_missing': gst_missing
         }
-        invoice_id = db.store_invoice(invoice_storage_data)
+        invoice_id = await adb.store_invoice(invoice_storage_data)
+        
+        # Detect anomalies by comparing with historical data (prices against the index as read before storing)
+        db_anomalies = await adb.detect_anomalies(invoice_storage_data, invoice_id, price_stats)
         
-        # Detect anomalies by comparing with historical data
-        db_anomalies = db.detect_anomalies(invoice_storage_data, invoice_id)
+        observation = baseline_observation(invoice_data) if gst_number else None
+        if observation:
+            await adb.merge_vendor_baseline(gst_number, observation)
+            vendor_baselines.apply(gst_number, observation)
         
         # NEW: AI-Powered Analysis with LangChain
         ai_analysis_result = None
@@ -376,6 +550,7 @@ async def upload_invoice_complete(file: UploadFile = File(...)):
                 "hsnSacCodes": enhanced_data.get('hsn_sac_codes', []),
                 "itemDescriptions": enhanced_data.get('item_descriptions', []),
                 "quantities": enhanced_data.get('quantities', []),
+                "lineItems": line_items,  # with hsn_suggestions / hsn_source / hsn_mismatch
                 
                 # ML Analysis
                 "mlPrediction": convert_numpy_types(ml_result) if ml_result else {"is_anomaly": False, "confidence": 0},
@@ -492,207 +667,6 @@ def extract_enhanced_invoice_data(ocr_text):
     
     return enhanced_data
 
-def process_complete_compliance(invoice_data, enhanced_data, ml_result):
-    """Process complete compliance check"""
-    compliance_results = {
-        'compliance_score': 0,
-        'checks_passed': 0,
-        'total_checks': 12
-    }
-    
-    # Basic field checks (5 points)
-    basic_fields = ['invoice_number', 'total_amount', 'invoice_date', 'vendor_name', 'gst_numbers']
-    for field in basic_fields:
-        if invoice_data.get(field):
-            compliance_results['checks_passed'] += 1
-    
-    # Enhanced extraction check (1 point)
-    if enhanced_data.get('hsn_sac_codes') or enhanced_data.get('item_descriptions'):
-        compliance_results['checks_passed'] += 1
-    
-    # OCR accuracy check (1 point)
-    if invoice_data.get('ocr_confidence', 0) >= 80:
-        compliance_results['checks_passed'] += 1
-    
-    # GST validation (1 point)
-    gst_validations = []
-    for gst_num in invoice_data.get('gst_numbers', []):
-        validation = validate_gst_number(gst_num)
-        gst_validations.append(validation)
-        if validation.get('valid'):
-            compliance_results['checks_passed'] += 0.5
-    
-    # HSN validation (1 point)
-    hsn_validations = []
-    for hsn_code in enhanced_data.get('hsn_sac_codes', []):
-        if hsn_code in HSN_SAC_DATABASE:
-            hsn_validations.append({
-                'hsn_code': hsn_code,
-                'is_correct': True,
-                'regulatory_rate': HSN_SAC_DATABASE[hsn_code]['gst_rate']
-            })
-            compliance_results['checks_passed'] += 1
-            break
-    
-    # Arithmetic check (1 point)
-    arithmetic_check = check_arithmetic_accuracy(invoice_data)
-    if arithmetic_check.get('overall_accurate'):
-        compliance_results['checks_passed'] += 1
-    
-    # Duplicate check (1 point) - assume no duplicates for now
-    duplicate_check = []
-    compliance_results['checks_passed'] += 1
-    
-    # Price analysis (1 point)
-    price_analysis = analyze_market_prices(enhanced_data, invoice_data)
-    if not any(p.get('is_outlier', False) for p in price_analysis):
-        compliance_results['checks_passed'] += 1
-    
-    # Calculate final score
-    compliance_results['compliance_score'] = (compliance_results['checks_passed'] / compliance_results['total_checks']) * 100
-    
-    # Determine status and risk
-    if compliance_results['compliance_score'] >= 90:
-        compliance_results['compliance_status'] = "Excellent"
-        compliance_results['risk_level'] = "Low Risk"
-        compliance_results['risk_score'] = 10
-    elif compliance_results['compliance_score'] >= 75:
-        compliance_results['compliance_status'] = "Good"
-        compliance_results['risk_level'] = "Low Risk"
-        compliance_results['risk_score'] = 25
-    elif compliance_results['compliance_score'] >= 60:
-        compliance_results['compliance_status'] = "Fair"
-        compliance_results['risk_level'] = "Medium Risk"
-        compliance_results['risk_score'] = 50
-    else:
-        compliance_results['compliance_status'] = "Poor"
-        compliance_results['risk_level'] = "High Risk"
-        compliance_results['risk_score'] = 75
-    
-    # Add ML risk
-    if ml_result and ml_result.get('is_anomaly'):
-        compliance_results['risk_score'] += 20
-        if compliance_results['risk_score'] > 50:
-            compliance_results['risk_level'] = "High Risk"
-    
-    # Anomalies summary
-    anomalies = []
-    if ml_result and ml_result.get('is_anomaly'):
-        anomalies.append("ML anomaly detected")
-    if invoice_data.get('ocr_confidence', 0) < 70:
-        anomalies.append("Low OCR confidence")
-    if not arithmetic_check.get('overall_accurate'):
-        anomalies.append("Arithmetic error")
-    
-    compliance_results.update({
-        'gst_validations': gst_validations,
-        'hsn_validations': hsn_validations,
-        'duplicate_check': duplicate_check,
-        'arithmetic_check': arithmetic_check,
-        'price_analysis': price_analysis,
-        'anomalies_detected': anomalies
-    })
-    
-    return compliance_results
-
-def validate_gst_number(gst_number):
-    """Validate GST number format"""
-    try:
-        gst_pattern = r'^[0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}[Z]{1}[0-9A-Z]{1}$'
-        
-        if re.match(gst_pattern, gst_number):
-            return {'valid': True, 'status': 'active', 'format_valid': True}
-        else:
-            return {'valid': False, 'status': 'invalid_format', 'format_valid': False}
-    except:
-        return {'valid': False, 'status': 'error', 'format_valid': False}
-
-def check_arithmetic_accuracy(invoice_data):
-    """Check arithmetic accuracy"""
-    try:
-        total_amount = invoice_data.get('total_amount')
-        if total_amount:
-            amount = float(str(total_amount).replace(',', ''))
-            # Simple check - assume 18% GST
-            base_amount = amount / 1.18
-            expected_gst = base_amount * 0.18
-            expected_total = base_amount + expected_gst
-            
-            return {
-                'overall_accurate': abs(amount - expected_total) < 1.0,
-                'base_amount': base_amount,
-                'expected_gst': expected_gst,
-                'expected_total': expected_total
-            }
-    except:
-        pass
-    
-    return {'overall_accurate': False}
-
-def analyze_market_prices(enhanced_data, invoice_data):
-    """Analyze market prices"""
-    price_analysis = []
-    
-    items = enhanced_data.get('item_descriptions', [])
-    if items and invoice_data.get('total_amount'):
-        amount = float(str(invoice_data['total_amount']).replace(',', ''))
-        
-        for item in items:
-            # Mock market analysis
-            market_avg = 25000  # Default market average
-            variance_percent = ((amount - market_avg) / market_avg) * 100
-            is_outlier = abs(variance_percent) > 50
-            
-            price_analysis.append({
-                'item': item,
-                'billed_price': amount,
-                'market_avg': market_avg,
-                'variance_percent': variance_percent,
-                'is_outlier': is_outlier
-            })
-    
-    return price_analysis
-
-def extract_ml_features(invoice_data):
-    """Extract ML features"""
-    try:
-        features = []
-        
-        # Amount features
-        if invoice_data.get('total_amount'):
-            amount = float(str(invoice_data['total_amount']).replace(',', ''))
-            features.extend([amount, amount % 1000, len(str(int(amount)))])
-        else:
-            features.extend([0, 0, 0])
-        
-        # Date features
-        if invoice_data.get('invoice_date'):
-            try:
-                date_obj = pd.to_datetime(invoice_data['invoice_date'])
-                features.extend([date_obj.dayofweek, date_obj.day, date_obj.month])
-            except:
-                features.extend([0, 0, 0])
-        else:
-            features.extend([0, 0, 0])
-        
-        # Quality features
-        features.extend([
-            invoice_data.get('ocr_confidence', 0),
-            len(invoice_data.get('raw_text', '')),
-            len(invoice_data.get('gst_numbers', [])),
-            1 if invoice_data.get('vendor_name') else 0,
-            1 if invoice_data.get('invoice_number') else 0,
-            1 if invoice_data.get('invoice_date') else 0,
-            1 if invoice_data.get('total_amount') else 0,
-            0  # Additional feature
-        ])
-        
-        return features if len(features) >= 16 else None
-        
-    except Exception as e:
-        print(f"ML feature extraction error: {e}")
-        return None
-
 def convert_numpy_types(obj):
     """Convert numpy types to Python native types"""
     if hasattr(obj, 'item'):
@@ -727,7 +701,7 @@ async def get_ai_analysis(invoice_id: str):
     
     try:
         # Get invoice from database
-        invoice = db.invoices.find_one({"_id": invoice_id})
+        invoice = await adb.get_invoice(invoice_id)
         
         if not invoice:
             raise HTTPException(status_code=404, detail="Invoice not found")
@@ -738,7 +712,7 @@ async def get_ai_analysis(invoice_id: str):
                 "invoice_number": invoice.get("invoiceNumber"),
                 "vendor_name": invoice.get("vendorName"),
                 "total_amount": invoice.get("totalAmount", 0),
-                "gst_numbers": invoice.get("gstNumbers", [])
+                "gst_numbers": all_gst_numbers(invoice)
             },
             use_ai=True
         )
@@ -755,6 +729,17 @@ async def get_ai_analysis(invoice_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/invoices/{invoice_id}")
+async def get_invoice_detail(invoice_id: str):
+    """Full invoice for detail views: hot document plus the compressed analysis payloads"""
+    invoice = await adb.get_invoice(invoice_id)
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    
+    # Invoices stored before compaction still carry their payloads inline
+    details = await adb.get_invoice_details(invoice_id) or {}
+    return {"success": True, "invoice": serialize_invoice(merge_invoice_details(invoice, details))}
+
 if __name__ == "__main__":
     print("Starting FINTEL AI Complete API Server...")
     print("React Dashboard: http://localhost:8080")
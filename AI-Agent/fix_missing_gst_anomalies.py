@@ -1,93 +1,35 @@
 """
 Fix Missing GST Anomalies
-Scans all existing invoices and creates MISSING_GST anomalies for those without GST numbers
+Creates MISSING_GST anomalies for existing invoices without GST numbers.
+Runs the `missing-gst` job of backfill.py (streaming, resumable, bulk upserts).
+
+Usage:
+    python fix_missing_gst_anomalies.py [--workers 4] [--dry-run] [--restart]
 """
 
-from database import FintelDatabase
-from datetime import datetime
+import sys
 
-def fix_missing_gst_anomalies():
-    """Scan all invoices and create missing GST anomalies"""
-    
-    print("=" * 60)
-    print("FIXING MISSING GST ANOMALIES")
-    print("=" * 60)
-    
-    db = FintelDatabase()
-    
-    # Get all invoices
-    all_invoices = list(db.invoices.find())
-    print(f"\n📊 Total invoices in database: {len(all_invoices)}")
-    
-    missing_gst_count = 0
-    anomalies_created = 0
-    
-    for invoice in all_invoices:
-        invoice_id = str(invoice['_id'])
-        invoice_number = invoice.get('invoiceNumber', 'Unknown')
-        vendor_name = invoice.get('vendorName', 'Unknown')
-        gst_numbers = invoice.get('gstNumbers', [])
-        upload_date = invoice.get('uploadDate', datetime.now())
-        
-        # Check if GST is missing
-        is_missing = False
-        
-        if not gst_numbers or len(gst_numbers) == 0:
-            is_missing = True
-        elif gst_numbers == ['N/A'] or gst_numbers == ['Unknown'] or gst_numbers == ['']:
-            is_missing = True
-        
-        if is_missing:
-            missing_gst_count += 1
-            
-            # Check if anomaly already exists
-            existing_anomaly = db.anomalies.find_one({
-                'invoiceId': invoice_id,
-                'anomalyType': 'MISSING_GST'
-            })
-            
-            if not existing_anomaly:
-                # Create MISSING_GST anomaly
-                anomaly_data = {
-                    'invoiceId': invoice_id,
-                    'invoiceNumber': invoice_number,
-                    'anomalyType': 'MISSING_GST',
-                    'severity': 'HIGH',
-                    'description': f"Invoice missing GST number - Vendor: {vendor_name}",
-                    'detectedAt': upload_date,  # Use invoice upload date
-                    'status': 'OPEN',
-                    'vendorName': vendor_name
-                }
-                
-                db.anomalies.insert_one(anomaly_data)
-                anomalies_created += 1
-                print(f"✅ Created MISSING_GST anomaly for invoice: {invoice_number}")
-            else:
-                print(f"⏭️  Anomaly already exists for invoice: {invoice_number}")
+from backfill import run_job
+from database import get_database
+
+def fix_missing_gst_anomalies(workers: int = 1, dry_run: bool = False, restart: bool = False):
+    """Create missing GST anomalies (safe to interrupt and re-run)"""
+    totals = run_job('missing-gst', workers=workers, dry_run=dry_run, restart=restart)
     
     print("\n" + "=" * 60)
     print("SUMMARY")
     print("=" * 60)
-    print(f"📊 Total invoices scanned: {len(all_invoices)}")
-    print(f"🟣 Invoices with missing GST: {missing_gst_count}")
-    print(f"✅ New anomalies created: {anomalies_created}")
-    print(f"⏭️  Anomalies already existed: {missing_gst_count - anomalies_created}")
+    print(f"🟣 Invoices with missing GST scanned: {totals['processed']}")
+    print(f"✅ Anomalies {'to create' if dry_run else 'created or tagged'}: {totals['written']}")
     print("=" * 60)
     
     # Show anomaly breakdown
     print("\n📊 ANOMALY BREAKDOWN:")
-    anomaly_types = db.anomalies.aggregate([
-        {'$group': {
-            '_id': '$anomalyType',
-            'count': {'$sum': 1}
-        }}
-    ])
-    
-    for anomaly in anomaly_types:
+    for anomaly in get_database().anomaly_type_counts():
         print(f"   {anomaly['_id']}: {anomaly['count']}")
     
-    db.close()
     print("\n✅ Done! Refresh your dashboard to see updated anomaly trends.")
 
 if __name__ == "__main__":
-    fix_missing_gst_anomalies()
+    workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 1
+    fix_missing_gst_anomalies(workers=workers, dry_run="--dry-run" in sys.argv, restart="--restart" in sys.argv)
@@ -0,0 +1,231 @@
+"""
+HSN Code Classifier for FINTEL AI
+Suggests HSN/SAC codes for line-item descriptions by nearest-neighbour search over
+the scraped rate-list descriptions. Descriptions are embedded as hashed TF-IDF
+character + word n-grams (no vocabulary to load) and compared by cosine similarity
+with one sparse matrix product per batch. The matrix is precomputed at build time.
+
+Used by the upload handler to fill line items Gemini returned without a code and
+to flag codes the description disagrees with.
+
+Usage:
+    python hsn_classifier.py build [hsn_gst_rates.json ...] [-o hsn_classifier.pkl]   (default: hsn_codes table)
+    python hsn_classifier.py suggest "dell laptop 15 inch" "steel almirah"
+"""
+
+import os
+import pickle
+import re
+import sys
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from hsn_index import normalize_code, parse_rate
+
+DEFAULT_CLASSIFIER_PATH = os.getenv(
+    "FINTEL_HSN_CLASSIFIER", os.path.join(os.path.dirname(os.path.abspath(__file__)), "hsn_classifier.pkl")
+)
+FORMAT_VERSION = 1
+
+# Below this cosine similarity a suggestion is shown but never used to fill a code
+MIN_FILL_SCORE = 0.35
+QUERY_CHUNK = 512  # queries per sparse product (bounds the dense score block)
+
+_CHAR_FEATURES = HashingVectorizer(analyzer='char_wb', ngram_range=(3, 5), n_features=2 ** 19,
+                                   alternate_sign=False, norm=None, dtype=np.float32)
+_WORD_FEATURES = HashingVectorizer(analyzer='word', ngram_range=(1, 2), n_features=2 ** 18,
+                                   alternate_sign=False, norm=None, dtype=np.float32)
+WORD_WEIGHT = 0.6  # word matches count a bit less than character n-grams (which absorb OCR typos)
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+class Suggestion(NamedTuple):
+    hsn_code: str
+    description: str
+    score: float
+    gst_rate: Optional[float]
+
+
+def normalize_description(text: Any) -> str:
+    """'- - Laptops, (Notebooks)' -> 'laptops notebooks'"""
+    return _NON_WORD.sub(' ', str(text or '').lower()).strip()
+
+
+def _term_counts(texts: List[str]) -> sparse.csr_matrix:
+    texts = [normalize_description(text) for text in texts]
+    chars, words = _CHAR_FEATURES.transform(texts), _WORD_FEATURES.transform(texts)
+    for counts in (chars, words):
+        counts.data = 1 + np.log(counts.data)  # sublinear tf
+    return sparse.hstack([chars, words * WORD_WEIGHT], format='csr')
+
+
+def _tfidf(counts: sparse.csr_matrix, idf: np.ndarray) -> sparse.csr_matrix:
+    counts.data *= idf[counts.indices]
+    return normalize(counts, copy=False)
+
+
+class HSNClassifier:
+    """Precomputed, L2-normalized TF-IDF matrix of the rate list plus the idf weights"""
+
+    def __init__(self, codes: List[str], descriptions: List[str], rates: List[Optional[float]],
+                 idf: np.ndarray, matrix: sparse.csr_matrix, built_at: Optional[datetime] = None):
+        self.codes, self.descriptions, self.rates = codes, descriptions, rates
+        self.idf, self.matrix = idf, matrix
+        self._matrix_t = matrix.T.tocsr()
+        self.built_at = built_at
+
+    @classmethod
+    def build(cls, entries: Iterable[Dict[str, Any]]) -> "HSNClassifier":
+        """One row per (code, description) with a description (hsn_scraper rows or hsn_codes table)"""
+        seen, codes, descriptions, rates = set(), [], [], []
+        for row in entries:
+            code, description = normalize_code(row.get('hsn_code')), str(row.get('description') or '').strip()
+            if not code or not normalize_description(description) or (code, description) in seen:
+                continue
+            seen.add((code, description))
+            codes.append(code)
+            descriptions.append(description)
+            rates.append(parse_rate(row.get('gst_rate')))
+        counts = _term_counts(descriptions)
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = (np.log((1 + len(codes)) / (1 + document_frequency)) + 1).astype(np.float32)
+        return cls(codes, descriptions, rates, idf, _tfidf(counts, idf), datetime.now())
+
+    def save(self, path: str = DEFAULT_CLASSIFIER_PATH):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'format': FORMAT_VERSION, 'codes': self.codes, 'descriptions': self.descriptions,
+                         'rates': self.rates, 'idf': self.idf, 'matrix': self.matrix,
+                         'built_at': self.built_at}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_CLASSIFIER_PATH) -> "HSNClassifier":
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('format') != FORMAT_VERSION:
+            raise ValueError(f"{path} was built by another classifier version, rebuild it")
+        return cls(data['codes'], data['descriptions'], data['rates'], data['idf'], data['matrix'], data['built_at'])
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def embed(self, texts: List[str]) -> sparse.csr_matrix:
+        return _tfidf(_term_counts(texts), self.idf)
+
+    def suggest(self, descriptions: List[str], top_k: int = 3) -> List[List[Suggestion]]:
+        """Ranked distinct codes for every description, best first (batch API)"""
+        results: List[List[Suggestion]] = []
+        candidates = min(len(self.codes), top_k * 4)  # a code can own several close rows
+        for start in range(0, len(descriptions), QUERY_CHUNK):
+            chunk = descriptions[start:start + QUERY_CHUNK]
+            scores = (self.embed(chunk) @ self._matrix_t).toarray()
+            if not candidates:
+                results.extend([] for _ in chunk)
+                continue
+            top = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+            for row, row_top in zip(scores, top):
+                ranked, seen = [], set()
+                for index in row_top[np.argsort(-row[row_top], kind='stable')]:
+                    if row[index] <= 0 or len(ranked) == top_k:
+                        break
+                    if self.codes[index] in seen:
+                        continue
+                    seen.add(self.codes[index])
+                    ranked.append(Suggestion(self.codes[index], self.descriptions[index],
+                                             round(float(row[index]), 4), self.rates[index]))
+                results.append(ranked)
+        return results
+
+
+_shared_classifier: Optional[HSNClassifier] = None
+_classifier_loaded = False
+_classifier_lock = threading.Lock()
+
+
+def get_hsn_classifier(path: str = DEFAULT_CLASSIFIER_PATH) -> Optional[HSNClassifier]:
+    """Process-wide classifier, or None until one has been built"""
+    global _shared_classifier, _classifier_loaded
+    if _classifier_loaded:
+        return _shared_classifier
+    with _classifier_lock:
+        if not _classifier_loaded:
+            if os.path.exists(path):
+                _shared_classifier = HSNClassifier.load(path)
+            else:
+                print(f"⚠️ {os.path.basename(path)} not found - HSN suggestions disabled "
+                      f"(build it with: python hsn_classifier.py build)")
+            _classifier_loaded = True
+        return _shared_classifier
+
+
+def classify_line_items(line_items: List[Dict[str, Any]], classifier: Optional[HSNClassifier] = None,
+                        min_score: float = MIN_FILL_SCORE, top_k: int = 3) -> List[Dict[str, Any]]:
+    """
+    Copies of the line items with `hsn_suggestions`. Items without a code get the best
+    suggestion scoring at least min_score (`hsn_source: 'classifier'`); items whose
+    code's chapter matches none of the confident suggestions get `hsn_mismatch: True`
+    """
+    classifier = classifier or get_hsn_classifier()
+    items = [dict(item) for item in line_items or []]
+    if classifier is None:
+        return items
+    described = [item for item in items if normalize_description(item.get('description'))]
+    suggestions = classifier.suggest([item['description'] for item in described], top_k)
+    for item, ranked in zip(described, suggestions):
+        item['hsn_suggestions'] = [s._asdict() for s in ranked]
+        confident = [s for s in ranked if s.score >= min_score]
+        code = normalize_code(item.get('hsn_code'))
+        if not code and confident:
+            item['hsn_code'] = confident[0].hsn_code
+            item['hsn_source'] = 'classifier'
+            item['hsn_confidence'] = confident[0].score
+        elif code and confident and not any(s.hsn_code[:2] == code[:2] for s in confident):
+            item['hsn_mismatch'] = True
+    return items
+
+
+def suggested_codes(line_items: List[Dict[str, Any]]) -> List[str]:
+    """Codes classify_line_items filled in (to add to the invoice's hsn_sac_codes)"""
+    return [item['hsn_code'] for item in line_items if item.get('hsn_source') == 'classifier']
+
+
+def load_entries(sources: List[str]) -> List[Dict[str, Any]]:
+    """Rows from rate-list files, or the stored hsn_codes table when none are given"""
+    if sources:
+        from hsn_index import read_entries
+        return [row for source in sources for row in read_entries(source)]
+    from database import get_database
+    return get_database().get_hsn_codes()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    command = args.pop(0) if args else ''
+    if command == 'build':
+        output = DEFAULT_CLASSIFIER_PATH
+        if '-o' in args:
+            output = args[args.index('-o') + 1]
+            del args[args.index('-o'):args.index('-o') + 2]
+        classifier = HSNClassifier.build(load_entries(args))
+        classifier.save(output)
+        print(f"✅ Indexed {len(classifier)} HSN descriptions into {output} "
+              f"({os.path.getsize(output) / 1024:.0f} KiB)")
+    elif command == 'suggest':
+        classifier = get_hsn_classifier()
+        if classifier is None:
+            sys.exit(1)
+        for description, ranked in zip(args, classifier.suggest(args)):
+            print(f"🔍 {description}")
+            for s in ranked:
+                print(f"   {s.hsn_code:<10} {s.score:.3f}  {s.gst_rate}%  {s.description[:60]}")
+    else:
+        print(__doc__)
+        sys.exit(2)
@@ -0,0 +1,392 @@
+"""
+HSN/SAC Rate Index for FINTEL AI
+Compiles the scraped HSN/SAC rate list (hsn_scraper.py JSON/CSV) into a compact,
+memory-mapped digit trie: longest-prefix lookup in O(digits) with chapter (2) /
+heading (4) / subheading (6) / tariff item (8) fallback, descriptions and rate history.
+Opening the artifact is an mmap, so worker start does not parse anything.
+
+Usage:
+    python hsn_index.py build [hsn_gst_rates.json ...] [-o hsn_index.bin]
+    python hsn_index.py lookup 85171210 [--date 2023-07-01]
+    python hsn_index.py stats [hsn_index.bin]
+"""
+
+import csv
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+DEFAULT_INDEX_PATH = os.getenv(
+    "FINTEL_HSN_INDEX", os.path.join(os.path.dirname(os.path.abspath(__file__)), "hsn_index.bin")
+)
+
+# Codes shorter than a heading only resolve descriptions; "known" needs 4+ digits,
+# otherwise any 4-digit number on the page (a year, a PIN fragment) matches a chapter
+MIN_KNOWN_DIGITS = 4
+
+REFRESH_SECONDS = 5.0  # how often a process checks whether the artifact was rebuilt
+
+LEVELS = {2: 'chapter', 4: 'heading', 6: 'subheading', 8: 'tariff_item'}
+
+# Used when no index has been built yet (the original hard-coded table)
+SEED_ENTRIES = [
+    {"hsn_code": "8517", "description": "Telephone sets, mobile phones", "gst_rate": "12"},
+    {"hsn_code": "8471", "description": "Computers and computer peripherals", "gst_rate": "18"},
+    {"hsn_code": "9403", "description": "Office furniture", "gst_rate": "12"},
+    {"hsn_code": "7326", "description": "Articles of iron or steel", "gst_rate": "18"},
+    {"hsn_code": "3926", "description": "Articles of plastics", "gst_rate": "18"},
+    {"hsn_code": "8443", "description": "Printing machinery", "gst_rate": "18"},
+    {"hsn_code": "4901", "description": "Printed books, brochures", "gst_rate": "12"},
+    {"hsn_code": "9983", "description": "Professional services", "gst_rate": "18"}
+]
+
+# File layout (native int32, sections 8-byte aligned):
+#   header | nodes[n][3] (digit bitmask, first child, entry or -1) - nodes are in
+#            breadth-first order so a node's children are contiguous, child d is
+#            first child + number of set bits below d
+#   | entries[n][6] (code off, code len, desc off, desc len, history start, history count)
+#   | history[n][2] (effective yyyymmdd, 0 = always; rate x 100, -1 = unknown) | utf-8 strings
+MAGIC = b"FHSNIDX1"
+HEADER = struct.Struct("<8s2sxxIIII")
+NODE_WIDTH = 3
+ENTRY_WIDTH = 6
+NO_RATE = -1
+
+_BITS_BELOW = [bytes(bin(mask & ((1 << digit) - 1)).count('1') for mask in range(1024)) for digit in range(10)]
+
+_RATE_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+
+class HSNMatch(NamedTuple):
+    code: str                  # normalized query (digits only)
+    matched: str               # longest prefix with a known rate
+    level: str                 # chapter / heading / subheading / tariff_item
+    description: str           # from the deepest prefix that has one
+    gst_rate: float
+    history: Tuple[Tuple[str, float], ...]  # (effective from, rate), oldest first; '' = always
+
+
+def normalize_code(code: Any) -> str:
+    """'8517.12-10' -> '85171210'"""
+    return ''.join(ch for ch in str(code or '') if ch.isdigit())
+
+
+def parse_rate(value: Any) -> Optional[float]:
+    """'18%' -> 18.0, 'Nil' / 'Exempt' -> 0.0, '' -> None (first figure of '5% / 12%')"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value or '').strip().lower()
+    match = _RATE_PATTERN.search(text)
+    if match:
+        return float(match.group())
+    if text.startswith(('nil', 'exempt')):
+        return 0.0
+    return None
+
+
+def _date_key(value: Any) -> int:
+    if not value:
+        return 0
+    if isinstance(value, (date, datetime)):
+        return value.year * 10000 + value.month * 100 + value.day
+    return int(str(value)[:10].replace('-', ''))
+
+
+def _date_text(key: int) -> str:
+    return f"{key // 10000:04d}-{key // 100 % 100:02d}-{key % 100:02d}" if key else ''
+
+
+# ----- build ------------------------------------------------------------------
+
+def read_entries(path: str) -> List[Dict[str, str]]:
+    """Rows as written by hsn_scraper.save_to_json / save_to_csv"""
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def build_index(entries: Iterable[Dict[str, Any]]) -> bytes:
+    """
+    Compile rows ({hsn_code, description, gst_rate[, effective_from]}) into index bytes
+    Rows for the same code become its rate history, ordered by effective_from
+    """
+    codes: Dict[str, Dict[str, Any]] = {}
+    for row in entries:
+        code = normalize_code(row.get('hsn_code'))
+        if not code:
+            continue
+        entry = codes.setdefault(code, {'description': '', 'history': {}})
+        entry['description'] = entry['description'] or str(row.get('description') or '').strip()
+        rate = parse_rate(row.get('gst_rate'))
+        if rate is not None:
+            entry['history'][_date_key(row.get('effective_from'))] = round(rate * 100)
+
+    trie: Dict[str, Any] = {}
+    entry_rows, history, strings = array('i'), array('i'), bytearray()
+    for entry_id, code in enumerate(sorted(codes)):
+        node = trie
+        for digit in code:
+            node = node.setdefault(digit, {})
+        node[''] = entry_id
+
+        entry = codes[code]
+        code_bytes, desc_bytes = code.encode(), entry['description'].encode('utf-8')
+        entry_rows.extend([len(strings), len(code_bytes), len(strings) + len(code_bytes), len(desc_bytes),
+                           len(history) // 2, len(entry['history'])])
+        strings += code_bytes + desc_bytes
+        for effective in sorted(entry['history']):
+            history.extend([effective, entry['history'][effective]])
+
+    node_data, queue = array('i'), [trie]
+    for node in queue:  # breadth-first: queue grows while iterating
+        digits = sorted(key for key in node if key)
+        node_data.extend([sum(1 << int(d) for d in digits), len(queue), node.get('', -1)])
+        queue.extend(node[d] for d in digits)
+    sections = [node_data.tobytes(), entry_rows.tobytes(), history.tobytes(), bytes(strings)]
+    header = HEADER.pack(MAGIC, sys.byteorder[:2].encode(), len(queue), len(codes), len(history) // 2, len(strings))
+    out = bytearray(header)
+    for section in sections:
+        out += b'\0' * (-len(out) % 8) + section
+    return bytes(out)
+
+
+def write_index(entries: Iterable[Dict[str, Any]], path: str = DEFAULT_INDEX_PATH) -> int:
+    """Build and atomically replace the artifact (running workers keep their mapping)"""
+    data = build_index(entries)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+# ----- lookup -----------------------------------------------------------------
+
+class HSNIndex:
+    """Read-only view over index bytes (an mmap of the artifact, or bytes in memory)"""
+
+    def __init__(self, buffer, source: str = '<memory>'):
+        self.source = source
+        self._buffer = buffer
+        magic, byteorder, node_count, entry_count, history_count, strings_len = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{source} is not an HSN index")
+        if byteorder != sys.byteorder[:2].encode():
+            raise ValueError(f"{source} was built on a {byteorder.decode()}-endian machine, rebuild it here")
+
+        view, offset = memoryview(buffer), HEADER.size
+        sections = []
+        for size in (node_count * NODE_WIDTH * 4, entry_count * ENTRY_WIDTH * 4, history_count * 8, strings_len):
+            offset += -offset % 8
+            sections.append(view[offset:offset + size])
+            offset += size
+        self._nodes = sections[0].cast('i')
+        self._entries = sections[1].cast('i')
+        self._history = sections[2].cast('i')
+        self._strings = sections[3]
+        self.node_count, self.entry_count = node_count, entry_count
+
+    @classmethod
+    def open(cls, path: str = DEFAULT_INDEX_PATH) -> "HSNIndex":
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), path)
+
+    def __len__(self) -> int:
+        return self.entry_count
+
+    def _path(self, code: str) -> Iterator[Tuple[int, int]]:
+        """(prefix length, entry id) for every entry on the code's trie path"""
+        nodes, node = self._nodes, 0
+        for depth, ch in enumerate(code, 1):
+            digit = ord(ch) - 48
+            mask = nodes[node * NODE_WIDTH]
+            if not 0 <= digit <= 9 or not mask >> digit & 1:
+                return
+            node = nodes[node * NODE_WIDTH + 1] + _BITS_BELOW[digit][mask]
+            entry_id = nodes[node * NODE_WIDTH + 2]
+            if entry_id >= 0:
+                yield depth, entry_id
+
+    def _current_rate(self, entry_id: int) -> int:
+        base = entry_id * ENTRY_WIDTH
+        count = self._entries[base + 5]
+        return self._history[(self._entries[base + 4] + count - 1) * 2 + 1] if count else NO_RATE
+
+    def _string(self, entry_id: int, slot: int) -> str:
+        base = entry_id * ENTRY_WIDTH + slot
+        offset, length = self._entries[base], self._entries[base + 1]
+        return bytes(self._strings[offset:offset + length]).decode('utf-8')
+
+    def resolve(self, code: Any) -> Optional[Tuple[str, float]]:
+        """(matched prefix, current rate) of the longest rated prefix - the hot path"""
+        code = normalize_code(code)
+        best = None
+        for depth, entry_id in self._path(code):
+            rate = self._current_rate(entry_id)
+            if rate != NO_RATE:
+                best = (depth, rate)
+        return (code[:best[0]], best[1] / 100) if best else None
+
+    def lookup(self, code: Any) -> Optional[HSNMatch]:
+        """Longest-prefix match with description and rate history"""
+        code = normalize_code(code)
+        rated, described = None, ''
+        for depth, entry_id in self._path(code):
+            if self._current_rate(entry_id) != NO_RATE:
+                rated = (depth, entry_id)
+            described = self._string(entry_id, 2) or described
+        if rated is None:
+            return None
+        depth, entry_id = rated
+        base = entry_id * ENTRY_WIDTH
+        start, count = self._entries[base + 4], self._entries[base + 5]
+        history = tuple((_date_text(self._history[i * 2]), self._history[i * 2 + 1] / 100)
+                        for i in range(start, start + count))
+        return HSNMatch(code, code[:depth], LEVELS.get(depth, f"{depth}-digit"), described, history[-1][1], history)
+
+    def rate_on(self, code: Any, when: Any = None) -> Optional[float]:
+        """GST rate in force on a date (current rate when no date is given)"""
+        match = self.lookup(code)
+        if match is None:
+            return None
+        key = _date_key(when)
+        rate = match.history[0][1]
+        for effective, history_rate in match.history:
+            if key and _date_key(effective) > key:
+                break
+            rate = history_rate
+        return rate
+
+    def known(self, code: Any) -> Optional[Tuple[str, float]]:
+        """resolve() when the match is at least a heading, else None"""
+        resolved = self.resolve(code)
+        return resolved if resolved and len(resolved[0]) >= MIN_KNOWN_DIGITS else None
+
+    def __contains__(self, code: Any) -> bool:
+        return self.known(code) is not None
+
+    def rated_codes(self) -> Iterator[Tuple[str, float]]:
+        """(code, current rate) for every entry with a rate"""
+        for entry_id in range(self.entry_count):
+            rate = self._current_rate(entry_id)
+            if rate != NO_RATE:
+                yield self._string(entry_id, 0), rate / 100
+
+
+_shared_index: Optional[HSNIndex] = None
+_shared_file: Optional[Tuple[int, int, int]] = None
+_checked = 0.0
+_index_lock = threading.Lock()
+
+
+def _file_id(path: str) -> Optional[Tuple[int, int, int]]:
+    """(inode, mtime, size) of the artifact; write_index's os.replace changes it"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def get_hsn_index(path: str = DEFAULT_INDEX_PATH) -> HSNIndex:
+    """
+    Process-wide index: the built artifact, or the seed table until one exists
+    Every REFRESH_SECONDS one stat() checks whether the file was rebuilt (hsn_scraper.py);
+    a new file is opened and swapped in, callers holding the old index keep their mapping
+    """
+    global _shared_index, _shared_file, _checked
+    if _shared_index is not None and time.monotonic() - _checked < REFRESH_SECONDS:
+        return _shared_index
+    with _index_lock:
+        if _shared_index is not None and time.monotonic() - _checked < REFRESH_SECONDS:
+            return _shared_index
+        _checked = time.monotonic()
+        file_id = _file_id(path)
+        if _shared_index is not None and (file_id is None or file_id == _shared_file):
+            return _shared_index  # unchanged (or removed: keep what is loaded)
+        if file_id is not None:
+            try:
+                index = HSNIndex.open(path)
+            except (OSError, ValueError) as e:
+                if _shared_index is not None:
+                    print(f"❌ {path} not reopened, keeping the loaded index: {e}")
+                    return _shared_index
+                raise
+            if _shared_index is not None:
+                print(f"🔄 Reloaded {os.path.basename(path)} ({len(index):,} codes)")
+            _shared_index, _shared_file = index, file_id
+        else:
+            print(f"⚠️ {os.path.basename(path)} not found - using the {len(SEED_ENTRIES)}-code seed table "
+                  f"(build it with: python hsn_index.py build hsn_gst_rates.json)")
+            _shared_index = HSNIndex(build_index(SEED_ENTRIES), '<seed>')
+        return _shared_index
+
+
+class CurrentHSNIndex:
+    """Membership test against whatever get_hsn_index() currently serves (a RulePlan reference table)"""
+
+    def __contains__(self, code: Any) -> bool:
+        return code in get_hsn_index()
+
+
+# ----- CLI --------------------------------------------------------------------
+
+def _option(args: List[str], name: str, default: Optional[str] = None) -> Optional[str]:
+    if name in args:
+        position = args.index(name)
+        value = args[position + 1]
+        del args[position:position + 2]
+        return value
+    return default
+
+
+def print_stats(path: str, probes: int = 200000):
+    started = time.perf_counter()
+    index = HSNIndex.open(path)
+    load_ms = (time.perf_counter() - started) * 1000
+    codes = [code for code, _ in index.rated_codes()] or ['0000']
+    queries = [codes[i % len(codes)] + '12' for i in range(probes)]
+    started = time.perf_counter()
+    for code in queries:
+        index.resolve(code)
+    elapsed = time.perf_counter() - started
+    print(f"📚 {path}: {index.entry_count} codes, {index.node_count} trie nodes, "
+          f"{os.path.getsize(path) / 1024:.0f} KiB")
+    print(f"⏱️ Opened in {load_ms:.2f} ms, {probes / elapsed:,.0f} lookups/s")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    command = args.pop(0) if args else 'stats'
+    if command == 'build':
+        output = _option(args, '-o', DEFAULT_INDEX_PATH)
+        rows = [row for source in (args or ['hsn_gst_rates.json']) for row in read_entries(source)]
+        size = write_index(rows, output)
+        print(f"✅ Compiled {len(rows)} rows into {output} ({size / 1024:.0f} KiB)")
+    elif command == 'lookup':
+        when = _option(args, '--date')
+        index = get_hsn_index()
+        for code in args:
+            match = index.lookup(code)
+            if match is None:
+                print(f"❌ {code}: no matching chapter or heading")
+                continue
+            print(f"✅ {code} -> {match.matched} ({match.level}): {match.description} "
+                  f"@ {index.rate_on(code, when)}%")
+            for effective, rate in match.history:
+                print(f"   {effective or 'always':<10} {rate}%")
+    elif command == 'stats':
+        print_stats(args[0] if args else DEFAULT_INDEX_PATH)
+    else:
+        print(__doc__)
+        sys.exit(2)
@@ -1,88 +1,291 @@
 """
 HSN Code and GST Rate Scraper
 Extracts HSN codes and their corresponding GST rates from ICAI website
+
+The rate list is an ASP.NET GridView spread over many postback pages. Pages are
+fetched concurrently over one pooled session and parsed as they stream in (no
+DOM tree); the first GET is conditional (ETag / Last-Modified), so an unchanged
+list costs one request. The stored table is updated in place with the computed
+diff (bulk upserts, then deletes) under a new snapshot version, and the
+memory-mapped HSN index (hsn_index.py) is recompiled - readers never see an
+empty table.
+
+Usage (nightly):
+    python hsn_scraper.py [url] [--database URL] [--workers 8] [--force] [--files]
 """
 
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
+import hashlib
 import json
+import os
+import re
+import sys
 import time
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html.parser import HTMLParser
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from hsn_index import DEFAULT_INDEX_PATH, normalize_code, write_index
+
+DEFAULT_URL = "https://www.vasai.icai.org/resources/Utilities/HSN_RATE_LIST/HSN_RATE_LIST.aspx"
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# reference_snapshots entry holding the applied version, HTTP validators and counts
+SNAPSHOT_NAME = 'hsn_codes'
+HSN_FIELDS = ('hsn_code', 'description', 'gst_rate')
+
+# A refresh that would drop more than half the stored rows is treated as a broken
+# page (layout change, error page) and refused unless --force
+MIN_KEPT_RATIO = 0.5
+
+STREAM_CHUNK_SIZE = 64 * 1024
+PAGE_LINK = re.compile(r"__doPostBack\('([^']+)','Page\$(\d+)'\)")
+
+
+class GridViewParser(HTMLParser):
+    """
+    Streaming parser for one GridView page: rows of the HSN table, hidden form
+    fields (__VIEWSTATE, __EVENTVALIDATION, ...) and the pager's postback links
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: List[Dict[str, str]] = []
+        self.hidden: Dict[str, str] = {}
+        self.pages = set()
+        self.pager_target: Optional[str] = None
+        self._tables: List[Dict[str, Any]] = []  # open tables, innermost last (the pager is nested)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            self._tables.append({'rows': [], 'cell': None})
+        elif not self._tables:
+            pass
+        elif tag == 'tr':
+            self._tables[-1]['rows'].append([])
+        elif tag in ('td', 'th') and self._tables[-1]['rows']:
+            self._tables[-1]['cell'] = []
+        if tag == 'input':
+            attributes = dict(attrs)
+            if (attributes.get('type') or '').lower() == 'hidden' and attributes.get('name'):
+                self.hidden[attributes['name']] = attributes.get('value') or ''
+        elif tag == 'a':
+            link = PAGE_LINK.search(dict(attrs).get('href') or '')
+            if link:
+                self.pager_target = link.group(1)
+                self.pages.add(int(link.group(2)))
+
+    def handle_data(self, data):
+        if self._tables and self._tables[-1]['cell'] is not None:
+            self._tables[-1]['cell'].append(data)
+
+    def handle_endtag(self, tag):
+        if not self._tables:
+            return
+        table = self._tables[-1]
+        if tag in ('td', 'th') and table['cell'] is not None:
+            table['rows'][-1].append(' '.join(''.join(table['cell']).split()))
+            table['cell'] = None
+        elif tag == 'table':
+            self._tables.pop()
+            self.rows.extend(_hsn_rows(table['rows']))
+
+
+def _hsn_rows(rows: List[List[str]]) -> List[Dict[str, str]]:
+    """Rows of a table whose header mentions HSN (other tables yield nothing)"""
+    if len(rows) < 2 or not any('HSN' in header.upper() for header in rows[0]):
+        return []
+    header = [h.upper() for h in rows[0]]
+
+    def column(*words, skip=()):
+        return next((i for i, h in enumerate(header) if i not in skip and any(w in h for w in words)), None)
+
+    code = column('HSN', 'SAC')
+    description = column('DESC', skip=(code,))
+    rate = column('RATE', 'GST', skip=(code, description))
+    entries = []
+    for cells in rows[1:]:
+        if len(cells) < 2:
+            continue
+        hsn_entry = {
+            'hsn_code': cells[code] if code is not None and code < len(cells) else cells[0],
+            'description': cells[description] if description is not None and description < len(cells) else cells[1],
+            'gst_rate': cells[rate] if rate is not None and rate < len(cells) else (cells[-1] if len(cells) > 2 else ''),
+        }
+        # Only add if HSN code looks valid (numeric)
+        if hsn_entry['hsn_code'] and any(char.isdigit() for char in hsn_entry['hsn_code']):
+            entries.append(hsn_entry)
+    return entries
+
+
+class ScrapeResult(NamedTuple):
+    rows: Optional[List[Dict[str, str]]]  # None: not modified since the validators were issued
+    validators: Dict[str, Optional[str]]
+    pages: int
+
+
+def make_session(workers: int = 8) -> requests.Session:
+    """One keep-alive connection pool shared by every page request, with retries on 5xx"""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504), allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _parse_response(response: requests.Response) -> GridViewParser:
+    parser = GridViewParser()
+    response.encoding = response.encoding or 'utf-8'
+    for chunk in response.iter_content(STREAM_CHUNK_SIZE, decode_unicode=True):
+        parser.feed(chunk)
+    parser.close()
+    return parser
+
+
+def _fetch_page(session: requests.Session, url: str, source: GridViewParser, page: int,
+                timeout: int) -> GridViewParser:
+    """Postback for one page, using the form state of the page whose pager linked to it"""
+    form = {**source.hidden, '__EVENTTARGET': source.pager_target, '__EVENTARGUMENT': f'Page${page}'}
+    with session.post(url, data=form, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        return _parse_response(response)
+
+
+def scrape_hsn_pages(url: str = DEFAULT_URL, workers: int = 8, validators: Optional[Dict] = None,
+                     session: Optional[requests.Session] = None, timeout: int = 30) -> ScrapeResult:
+    """
+    Fetch every page of the GridView. Page 1 is a conditional GET; the pages its
+    pager links to are posted back concurrently, and any further pages those reveal
+    (the pager shows 10 at a time) in the next round
+    """
+    session = session or make_session(workers)
+    conditional = {}
+    if validators and validators.get('etag'):
+        conditional['If-None-Match'] = validators['etag']
+    if validators and validators.get('last_modified'):
+        conditional['If-Modified-Since'] = validators['last_modified']
+
+    with session.get(url, headers=conditional, timeout=timeout, stream=True) as response:
+        if response.status_code == 304:
+            return ScrapeResult(None, validators, 0)
+        response.raise_for_status()
+        first = _parse_response(response)
+        fresh_validators = {'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified')}
+
+    parsed = {1: first}
+    pending = {page: first for page in first.pages if page != 1}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending:
+            futures = {pool.submit(_fetch_page, session, url, source, page, timeout): page
+                       for page, source in pending.items()}
+            requested = set(parsed) | set(pending)
+            pending = {}
+            for future in as_completed(futures):
+                parser = future.result()
+                parsed[futures[future]] = parser
+                pending.update((page, parser) for page in parser.pages
+                               if page not in requested and page not in pending)
+
+    rows = [row for page in sorted(parsed) for row in parsed[page].rows]
+    return ScrapeResult(rows, fresh_validators, len(parsed))
+
 
 def scrape_hsn_data(url: str) -> List[Dict[str, str]]:
     """
     Scrape HSN codes and GST rates from the ICAI website
     """
     print("🔍 Starting HSN data extraction...")
-    
     try:
-        # Send request with headers to mimic browser
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        print("📡 Fetching data from website...")
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        print("✅ Data fetched successfully!")
-        print("🔍 Parsing HTML content...")
-        
-        # Parse HTML
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Find the table containing HSN data
-        # The website uses ASP.NET GridView, typically in a table
-        tables = soup.find_all('table')
-        
-        hsn_data = []
-        
-        for table in tables:
-            rows = table.find_all('tr')
-            
-            # Skip if table has no rows
-            if len(rows) < 2:
-                continue
-            
-            # Try to find header row
-            headers_row = rows[0]
-            headers = [th.get_text(strip=True) for th in headers_row.find_all(['th', 'td'])]
-            
-            # Check if this looks like the HSN table
-            if not any('HSN' in h.upper() for h in headers):
-                continue
-            
-            print(f"📊 Found table with headers: {headers}")
-            
-            # Process data rows
-            for row in rows[1:]:
-                cells = row.find_all(['td', 'th'])
-                if len(cells) >= 2:
-                    row_data = [cell.get_text(strip=True) for cell in cells]
-                    
-                    # Extract HSN code and GST rate
-                    # Adjust indices based on actual table structure
-                    if len(row_data) >= 2:
-                        hsn_entry = {
-                            'hsn_code': row_data[0],
-                            'description': row_data[1] if len(row_data) > 1 else '',
-                            'gst_rate': row_data[-1] if len(row_data) > 2 else '',
-                        }
-                        
-                        # Only add if HSN code looks valid (numeric)
-                        if hsn_entry['hsn_code'] and any(char.isdigit() for char in hsn_entry['hsn_code']):
-                            hsn_data.append(hsn_entry)
-        
-        print(f"✅ Extracted {len(hsn_data)} HSN entries")
-        return hsn_data
-    
+        started = time.perf_counter()
+        result = scrape_hsn_pages(url)
+        print(f"✅ Extracted {len(result.rows)} HSN entries from {result.pages} pages "
+              f"in {time.perf_counter() - started:.1f}s")
+        return result.rows
     except requests.exceptions.RequestException as e:
         print(f"❌ Error fetching data: {e}")
         return []
-    except Exception as e:
-        print(f"❌ Error parsing data: {e}")
-        return []
+
+
+# ----- diff-based refresh -------------------------------------------------------
+
+def row_key(row: Dict[str, Any]) -> str:
+    """Stable identity of a rate-list row: code + description (a code can have several rows)"""
+    description = ' '.join(str(row.get('description') or '').lower().split())
+    return f"{normalize_code(row.get('hsn_code'))}:{hashlib.sha1(description.encode('utf-8')).hexdigest()[:12]}"
+
+
+def diff_hsn_rows(stored: List[Dict[str, Any]], scraped: List[Dict[str, str]]) -> Tuple[List[Dict], List[Any]]:
+    """(rows to upsert, keys to delete) turning the stored table into the scraped one"""
+    current = {}
+    for row in scraped:
+        key = row_key(row)
+        current[key] = {'key': key, **{field: row.get(field, '') for field in HSN_FIELDS}}
+    existing = {row['key']: row for row in stored}
+    upserts = [row for key, row in current.items()
+               if key not in existing or any(existing[key].get(field) != row[field] for field in HSN_FIELDS)]
+    deletes = [key for key in existing if key not in current]
+    return upserts, deletes
+
+
+def content_hash(rows: List[Dict[str, Any]]) -> str:
+    lines = sorted(f"{row_key(row)}\t{row.get('hsn_code')}\t{row.get('gst_rate')}" for row in rows)
+    return hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+def refresh_hsn_codes(db, url: str = DEFAULT_URL, workers: int = 8, force: bool = False,
+                      index_path: str = DEFAULT_INDEX_PATH, session: Optional[requests.Session] = None) -> Dict[str, Any]:
+    """
+    Scrape, diff against the stored table and apply the changes as a new version
+    Returns: {'version', 'modified', 'upserted', 'deleted', 'rows', 'pages'}
+    """
+    snapshot = db.get_reference_snapshot(SNAPSHOT_NAME) or {}
+    version = snapshot.get('version', 0)
+    started = time.perf_counter()
+    result = scrape_hsn_pages(url, workers, None if force else snapshot.get('validators'), session)
+    if result.rows is None:
+        print(f"✅ HSN rate list not modified since version {version}")
+        return {'version': version, 'modified': False, 'upserted': 0, 'deleted': 0,
+                'rows': snapshot.get('rows', 0), 'pages': 0}
+
+    stored = db.get_hsn_codes()
+    upserts, deletes = diff_hsn_rows(stored, result.rows)
+    kept = len(stored) - len(deletes)
+    stored_keys = {row['key'] for row in stored}
+    rows = kept + sum(1 for row in upserts if row['key'] not in stored_keys)
+    if stored and kept < len(stored) * MIN_KEPT_RATIO and not force:
+        raise RuntimeError(f"Refusing to delete {len(deletes)} of {len(stored)} HSN rows "
+                           f"({len(result.rows)} scraped) - check the page or re-run with --force")
+
+    if upserts or deletes:
+        version += 1
+        db.apply_hsn_changes(upserts, deletes, version)
+    db.save_reference_snapshot(SNAPSHOT_NAME, {
+        'version': version,
+        'source': url,
+        'validators': result.validators,
+        'contentHash': content_hash(result.rows),
+        'pages': result.pages,
+        'rows': rows,
+        'upserted': len(upserts),
+        'deleted': len(deletes)
+    })
+    if upserts or deletes or not os.path.exists(index_path):
+        write_index(db.get_hsn_codes(), index_path)
+
+    print(f"✅ HSN version {version}: {result.pages} pages, {len(result.rows)} rows scraped, "
+          f"{len(upserts)} upserted, {len(deletes)} deleted in {time.perf_counter() - started:.1f}s")
+    return {'version': version, 'modified': True, 'upserted': len(upserts), 'deleted': len(deletes),
+            'rows': rows, 'pages': result.pages}
 
 def save_to_json(data: List[Dict[str, str]], filename: str = 'hsn_gst_rates.json'):
     """Save HSN data to JSON file"""
@@ -102,28 +305,6 @@ def save_to_csv(data: List[Dict[str, str]], filename: str = 'hsn_gst_rates.csv')
     except Exception as e:
         print(f"❌ Error saving CSV: {e}")
 
-def save_to_mongodb(data: List[Dict[str, str]]):
-    """Save HSN data to MongoDB"""
-    try:
-        from database import FintelDatabase
-        
-        db = FintelDatabase()
-        
-        # Create HSN collection if it doesn't exist
-        hsn_collection = db.db['hsn_codes']
-        
-        # Clear existing data
-        hsn_collection.delete_many({})
-        
-        # Insert new data
-        if data:
-            hsn_collection.insert_many(data)
-            print(f"💾 {len(data)} HSN entries saved to MongoDB")
-        
-        db.close()
-    except Exception as e:
-        print(f"❌ Error saving to MongoDB: {e}")
-
 def create_hsn_lookup_dict(data: List[Dict[str, str]]) -> Dict[str, str]:
     """Create a dictionary for quick HSN to GST rate lookup"""
     lookup = {}
@@ -134,61 +315,14 @@ def create_hsn_lookup_dict(data: List[Dict[str, str]]) -> Dict[str, str]:
             lookup[hsn_code] = gst_rate
     return lookup
 
-if __name__ == "__main__":
-    # URL to scrape
-    url = "https://www.vasai.icai.org/resources/Utilities/HSN_RATE_LIST/HSN_RATE_LIST.aspx"
-    
-    print("=" * 60)
-    print("HSN CODE & GST RATE EXTRACTOR")
-    print("=" * 60)
-    
-    # Scrape data
-    hsn_data = scrape_hsn_data(url)
-    
-    if hsn_data:
-        print(f"\n📊 Total HSN entries extracted: {len(hsn_data)}")
-        
-        # Display first 10 entries
-        print("\n📋 Sample data (first 10 entries):")
-        print("-" * 60)
-        for i, entry in enumerate(hsn_data[:10], 1):
-            print(f"{i}. HSN: {entry.get('hsn_code', 'N/A')}")
-            print(f"   Description: {entry.get('description', 'N/A')[:50]}...")
-            print(f"   GST Rate: {entry.get('gst_rate', 'N/A')}")
-            print()
-        
-        # Save to files
-        print("\n💾 Saving data...")
-        save_to_json(hsn_data)
-        save_to_csv(hsn_data)
-        
-        # Optionally save to MongoDB
-        save_mongodb = input("\n💾 Save to MongoDB? (y/n): ").strip().lower()
-        if save_mongodb == 'y':
-            save_to_mongodb(hsn_data)
-        
-        # Create lookup dictionary
-        lookup = create_hsn_lookup_dict(hsn_data)
-        print(f"\n📚 Created lookup dictionary with {len(lookup)} HSN codes")
-        
-        # Save lookup dictionary
-        with open('hsn_lookup.json', 'w', encoding='utf-8') as f:
-            json.dump(lookup, f, indent=2, ensure_ascii=False)
-        print("💾 Lookup dictionary saved to hsn_lookup.json")
-        
-        print("\n✅ HSN data extraction completed successfully!")
-        print(f"📁 Files created:")
-        print("   - hsn_gst_rates.json (Full data)")
-        print("   - hsn_gst_rates.csv (Spreadsheet format)")
-        print("   - hsn_lookup.json (Quick lookup)")
-    else:
-        print("\n❌ No data extracted. Please check the website structure.")
-        print("\n💡 Alternative: The website might use JavaScript to load data.")
-        print("   Try using Selenium for dynamic content scraping.")
-        
-        # Provide alternative solution
-        print("\n🔧 Creating alternative scraper with Selenium...")
-        create_selenium_scraper()
+def export_files(hsn_data: List[Dict[str, str]]):
+    """JSON, CSV and code -> rate lookup copies of the rate list"""
+    save_to_json(hsn_data)
+    save_to_csv(hsn_data)
+    lookup = create_hsn_lookup_dict(hsn_data)
+    with open('hsn_lookup.json', 'w', encoding='utf-8') as f:
+        json.dump(lookup, f, indent=2, ensure_ascii=False)
+    print(f"💾 Lookup dictionary with {len(lookup)} HSN codes saved to hsn_lookup.json")
 
 def create_selenium_scraper():
     """Create an alternative scraper using Selenium for JavaScript-heavy sites"""
@@ -258,3 +392,44 @@ if __name__ == "__main__":
     
     print("📝 Created hsn_scraper_selenium.py")
     print("   Run this if the main scraper doesn't work due to JavaScript")
+
+
+if __name__ == "__main__":
+    from database import get_database, DEFAULT_CONNECTION_STRING
+
+    def option(name: str, default: str) -> str:
+        return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+    url = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith('--') else DEFAULT_URL
+    
+    print("=" * 60)
+    print("HSN CODE & GST RATE EXTRACTOR")
+    print("=" * 60)
+    
+    db = get_database(option('--database', DEFAULT_CONNECTION_STRING))
+    try:
+        summary = refresh_hsn_codes(db, url, workers=int(option('--workers', '8')), force='--force' in sys.argv)
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Error fetching data: {e}")
+        sys.exit(1)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    
+    if summary['rows'] == 0:
+        print("\n❌ No data extracted. Please check the website structure.")
+        print("\n💡 Alternative: The website might use JavaScript to load data.")
+        print("   Try using Selenium for dynamic content scraping.")
+        
+        # Provide alternative solution
+        print("\n🔧 Creating alternative scraper with Selenium...")
+        create_selenium_scraper()
+        sys.exit(1)
+    
+    if summary['upserted'] or summary['deleted']:
+        from hsn_classifier import HSNClassifier, DEFAULT_CLASSIFIER_PATH
+        HSNClassifier.build(db.get_hsn_codes()).save(DEFAULT_CLASSIFIER_PATH)
+        print(f"💾 HSN classifier rebuilt: {DEFAULT_CLASSIFIER_PATH}")
+    
+    if '--files' in sys.argv:
+        export_files([{field: row[field] for field in HSN_FIELDS} for row in db.get_hsn_codes()])
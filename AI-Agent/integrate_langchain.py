@@ -4,7 +4,7 @@ Adds AI-powered analysis alongside rule-based detection
 """
 
 from langchain_agent import analyze_invoice_with_agent
-from database import FintelDatabase
+from database import get_database
 
 def analyze_invoice_hybrid(invoice_data: dict, use_ai: bool = False):
     """
@@ -17,7 +17,7 @@ def analyze_invoice_hybrid(invoice_data: dict, use_ai: bool = False):
     Returns:
         dict with both rule-based and AI analysis
     """
-    db = FintelDatabase()
+    db = get_database()
     
     # 1. EXISTING: Rule-based detection (fast, always runs)
     rule_based_anomalies = db.detect_anomalies(invoice_data)
@@ -46,7 +46,6 @@ def analyze_invoice_hybrid(invoice_data: dict, use_ai: bool = False):
             print(f"AI analysis failed: {e}")
             result["ai_error"] = str(e)
     
-    db.close()
     return result
 
 
@@ -0,0 +1,140 @@
+"""
+Streaming Export for FINTEL AI
+Turns database cursors into NDJSON / CSV byte chunks with optional gzip
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Columns written for CSV exports (nested payloads stay in NDJSON only)
+INVOICE_CSV_COLUMNS = [
+    '_id', 'invoiceNumber', 'vendorName', 'gstNumber', 'totalAmount',
+    'invoiceDate', 'uploadDate', 'gstRate', 'hsnNumber', 'hsnCodes', 'ocrConfidence', 'filename'
+]
+
+ANOMALY_CSV_COLUMNS = [
+    '_id', 'invoiceId', 'invoiceNumber', 'vendorName', 'anomalyType',
+    'severity', 'description', 'detectedDate', 'relatedInvoiceId'
+]
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+# Flush output once this many bytes are buffered, so small rows are not sent one by one
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_export_date(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO date (YYYY-MM-DD or full timestamp) from a query parameter"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+def parse_export_end_date(value: Optional[str]) -> Optional[datetime]:
+    """
+    Exclusive upper bound for an end-date query parameter
+    A date alone (YYYY-MM-DD) covers that whole day, so it becomes the next midnight;
+    a full timestamp stays inclusive (one microsecond later)
+    """
+    end = parse_export_date(value)
+    if end is None:
+        return None
+    if 'T' not in value and ' ' not in value.strip():
+        return end + timedelta(days=1)
+    return end + timedelta(microseconds=1)
+
+
+def _to_json_value(value):
+    """Convert Mongo values (ObjectId, datetime) into JSON friendly values"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {k: _to_json_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_json_value(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _to_csv_value(value) -> str:
+    """Flatten a value into a single CSV cell"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return ';'.join(str(v) for v in value)
+    return str(value)
+
+
+def ndjson_lines(documents: Iterable[Dict]) -> Iterator[str]:
+    """One JSON document per line"""
+    for doc in documents:
+        yield json.dumps(_to_json_value(doc), ensure_ascii=False) + '\n'
+
+
+def csv_lines(documents: Iterable[Dict], columns: List[str]) -> Iterator[str]:
+    """Header row followed by one CSV row per document"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(columns)
+    yield buffer.getvalue()
+
+    for doc in documents:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerow([_to_csv_value(doc.get(col)) for col in columns])
+        yield buffer.getvalue()
+
+
+def encode_chunks(lines: Iterable[str], compress: bool = False) -> Iterator[bytes]:
+    """
+    Encode text lines into ~CHUNK_SIZE byte chunks
+    When compress is set, the output is a single gzip stream
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending = []
+    pending_size = 0
+
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        pending_size += len(data)
+
+        if pending_size >= CHUNK_SIZE:
+            chunk = b''.join(pending)
+            pending, pending_size = [], 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    chunk = b''.join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def export_stream(documents: Iterable[Dict], fmt: str, columns: List[str], compress: bool = False) -> Iterator[bytes]:
+    """Build the byte stream for an export in the requested format"""
+    if fmt == 'csv':
+        lines = csv_lines(documents, columns)
+    else:
+        lines = ndjson_lines(documents)
+    return encode_chunks(lines, compress)
+
+
+def export_filename(name: str, fmt: str, compress: bool = False) -> str:
+    """Download filename such as invoices_20241108.ndjson.gz"""
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d')}.{fmt}"
+    return filename + '.gz' if compress else filename
@@ -28,10 +28,9 @@ llm = ChatGoogleGenerativeAI(
 # Define tools that the agent can use
 def check_duplicate_tool(invoice_number: str) -> str:
     """Check if invoice number already exists in database"""
-    from database import FintelDatabase
-    db = FintelDatabase()
-    existing = db.invoices.find_one({'invoiceNumber': invoice_number})
-    db.close()
+    from database import get_database
+    db = get_database()
+    existing = db.find_invoice_by_number(invoice_number)
     
     if existing:
         return f"DUPLICATE FOUND: Invoice {invoice_number} already exists from {existing.get('uploadDate')}"
@@ -57,20 +56,18 @@ def analyze_amount_tool(input_string: str) -> str:
     except:
         return "Error: Input should be 'vendor_name,amount'"
     
-    from database import FintelDatabase
-    db = FintelDatabase()
+    from database import get_database
+    db = get_database()
     
-    # Get vendor's invoice history
-    invoices = list(db.invoices.find({'vendorName': vendor_name}))
-    db.close()
+    # Get vendor's invoice statistics (aggregated in the database)
+    stats = db.vendors_stats(vendor_name)
     
-    if not invoices:
+    if not stats:
         return f"No history for vendor {vendor_name}. Cannot determine if amount is unusual."
     
-    amounts = [inv.get('totalAmount', 0) for inv in invoices]
-    avg_amount = sum(amounts) / len(amounts)
-    max_amount = max(amounts)
-    min_amount = min(amounts)
+    avg_amount = stats[0].get('avgAmount') or 0
+    max_amount = stats[0].get('maxAmount') or 0
+    min_amount = stats[0].get('minAmount') or 0
     
     analysis = f"Vendor: {vendor_name}\n"
     analysis += f"Current Amount: ₹{amount:,.2f}\n"
@@ -96,15 +93,11 @@ def check_gst_vendor_match_tool(input_string: str) -> str:
     except:
         return "Error: Input should be 'gst_number,vendor_name'"
     
-    from database import FintelDatabase
-    db = FintelDatabase()
+    from database import get_database
+    db = get_database()
     
     # Find invoices with this GST but different vendor
-    different_vendor = db.invoices.find_one({
-        'gstNumbers': gst_number,
-        'vendorName': {'$ne': vendor_name}
-    })
-    db.close()
+    different_vendor = db.find_gst_vendor_mismatch(gst_number, vendor_name)
     
     if different_vendor:
         return f"⚠️ MISMATCH: GST {gst_number} was previously used by {different_vendor['vendorName']}, now showing as {vendor_name}"
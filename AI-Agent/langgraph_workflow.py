@@ -70,15 +70,13 @@ def detect_anomalies(state: InvoiceState) -> InvoiceState:
     """Detect various anomalies"""
     print("🚨 Step 3: Detecting anomalies...")
     
-    from database import FintelDatabase
-    db = FintelDatabase()
+    from database import get_database
+    db = get_database()
     
     invoice_data = state["ocr_result"]["structured_data"]
     
     # Check duplicates
-    duplicate = db.invoices.find_one({
-        'invoiceNumber': invoice_data.get('invoice_number')
-    })
+    duplicate = db.find_invoice_by_number(invoice_data.get('invoice_number'))
     
     if duplicate:
         state["anomalies"].append({
@@ -91,10 +89,9 @@ def detect_anomalies(state: InvoiceState) -> InvoiceState:
     vendor_name = invoice_data.get('vendor_name')
     current_amount = float(invoice_data.get('total_amount', 0))
     
-    invoices = list(db.invoices.find({'vendorName': vendor_name}))
-    if invoices:
-        amounts = [inv.get('totalAmount', 0) for inv in invoices]
-        avg_amount = sum(amounts) / len(amounts)
+    stats = db.vendors_stats(vendor_name) if vendor_name else []
+    if stats:
+        avg_amount = stats[0].get('avgAmount') or 0
         
         if current_amount > avg_amount * 3:
             state["anomalies"].append({
@@ -103,8 +100,6 @@ def detect_anomalies(state: InvoiceState) -> InvoiceState:
                 "description": f"Amount ₹{current_amount} is 3x higher than average ₹{avg_amount}"
             })
     
-    db.close()
-    
     # Decide next step based on anomalies
     if len(state["anomalies"]) > 0:
         state["next_step"] = "ai_analysis"
@@ -0,0 +1,41 @@
+"""
+Compact Invoice Migration
+Moves complianceResults / mlPrediction / rawText of existing invoices into the
+compressed invoice_details collection and slims the invoice documents down to
+the hot fields used by queries and dashboards.
+
+Runs the `compact-invoices` job of backfill.py. Safe to re-run: only invoices
+that still carry rawText are touched. An interrupted run resumes from its
+per-partition checkpoints; --restart starts over from the beginning.
+
+Usage:
+    python migrate_compact_invoices.py [--dry-run] [--batch-size 500] [--workers 4] [--restart]
+"""
+
+import sys
+
+from backfill import run_job
+from database import get_database
+
+
+def migrate(batch_size: int = 500, workers: int = 1, dry_run: bool = False, restart: bool = False):
+    db = get_database()
+    before = db.db.command('collStats', 'invoices')
+    print(f"\n📊 invoices before: {before.get('count', 0)} docs, "
+          f"avg {before.get('avgObjSize', 0):.0f} bytes, total {before.get('size', 0) / 1e6:.1f} MB")
+
+    totals = run_job('compact-invoices', batch_size=batch_size, workers=workers, dry_run=dry_run, restart=restart)
+
+    if not dry_run and totals['processed']:
+        after = db.db.command('collStats', 'invoices')
+        print(f"📊 invoices after: avg {after.get('avgObjSize', 0):.0f} bytes, "
+              f"total {after.get('size', 0) / 1e6:.1f} MB")
+        print("   Run `db.runCommand({compact: 'invoices'})` to return freed space to the OS")
+
+
+if __name__ == "__main__":
+    def option(name: str, default: int) -> int:
+        return int(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+    migrate(batch_size=option("--batch-size", 500), workers=option("--workers", 1), dry_run="--dry-run" in sys.argv,
+            restart="--restart" in sys.argv)
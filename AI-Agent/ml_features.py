@@ -0,0 +1,171 @@
+"""
+ML Feature Pipeline for FINTEL AI
+The one place invoice records become model inputs. Training (ml_trainer.py), the
+upload handler and batch re-scoring all call `feature_matrix`, which turns a batch
+of records (upload-handler field names) into a float matrix in one columnar pass.
+
+The layout is versioned: `FEATURE_SCHEMA` is saved next to every trained model
+and checked when the model is loaded, so a model is never fed columns it was not
+trained on. Bump FEATURE_VERSION whenever a feature is added, removed or changes
+meaning (and retrain).
+
+Usage:
+    python ml_features.py            (prints the schema and times a batch)
+"""
+
+import math
+import re
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+FEATURE_VERSION = 2
+FEATURE_NAMES = (
+    'amount',                  # total amount (₹)
+    'log_amount',
+    'amount_mod_1000',         # 0 for suspiciously round amounts
+    'round_amount',            # 1 when a multiple of ₹1,000
+    'day_of_week',             # Monday = 0 (missing date -> training median)
+    'day_of_month',
+    'month',
+    'weekend',
+    'invoice_number_length',
+    'invoice_number_digits',
+    'gst_count',               # GST numbers found on the invoice
+    'item_count',              # item descriptions found
+    'missing_fields'           # of vendor, invoice number, date, amount, GST number
+)
+FEATURE_SCHEMA = {'version': FEATURE_VERSION, 'names': list(FEATURE_NAMES)}
+
+# Record fields the features read (batch callers can pass just these columns)
+INPUT_FIELDS = ('total_amount', 'invoice_date', 'invoice_number', 'vendor_name', 'gst_numbers', 'item_descriptions')
+
+_MISSING = (None, '', 'Unknown', 0, 0.0)
+_DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d', '%d/%m/%y', '%d-%m-%y', '%d %b %Y', '%d %B %Y',
+                 '%d-%b-%Y', '%b %d, %Y', '%B %d, %Y')
+_DIGIT = re.compile(r'\d')
+
+
+class FeatureSchemaError(ValueError):
+    """A saved model was trained on a different feature layout"""
+
+
+def check_schema(schema: Optional[Mapping[str, Any]]):
+    """Raise FeatureSchemaError unless `schema` (saved with a model) matches this pipeline"""
+    if not schema:
+        raise FeatureSchemaError("model has no feature schema (trained before ml_features.py) - retrain it")
+    if schema.get('version') != FEATURE_VERSION or list(schema.get('names', [])) != list(FEATURE_NAMES):
+        raise FeatureSchemaError(f"model expects feature schema v{schema.get('version')} "
+                                 f"({len(schema.get('names', []))} features), pipeline is v{FEATURE_VERSION} "
+                                 f"({len(FEATURE_NAMES)} features) - retrain it")
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(text: str) -> Optional[datetime]:
+    text = text.strip()
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        for date_format in _DATE_FORMATS:
+            try:
+                return datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+    return None
+
+
+def parse_invoice_date(value: Any) -> Optional[datetime]:
+    """Date of an OCR'd invoice date (day-first, as on Indian invoices); None when unreadable"""
+    if isinstance(value, datetime):
+        return value
+    if value in _MISSING:
+        return None
+    return _parse_date(str(value))
+
+
+def _date_parts(value: Any) -> Optional[tuple]:
+    parsed = parse_invoice_date(value)
+    return (parsed.weekday(), parsed.day, parsed.month) if parsed else None
+
+
+def _amount(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else math.nan
+    try:
+        return float(str(value).replace(',', '').replace('₹', '').strip())
+    except ValueError:
+        return math.nan
+
+
+def _count(value: Any) -> int:
+    return len(value) if isinstance(value, (list, tuple)) else 0
+
+
+def column_features(columns: Mapping[str, Sequence[Any]], fill: Optional[Sequence[float]] = None) -> np.ndarray:
+    """
+    Feature matrix (rows x len(FEATURE_NAMES)) from record columns ({field: values})
+    Unknown values are NaN, or the matching `fill` value (training medians) when given
+    """
+    rows = len(next(iter(columns.values()), []))
+    features = np.empty((rows, len(FEATURE_NAMES)))
+
+    amount = np.array([_amount(v) for v in columns.get('total_amount', [None] * rows)], dtype=float)
+    amount[amount < 0] = np.nan
+    features[:, 0] = amount
+    features[:, 1] = np.log1p(amount)
+    features[:, 2] = np.mod(amount, 1000)
+    features[:, 3] = np.where(np.isnan(amount), np.nan, (features[:, 2] == 0) & (amount > 0))
+
+    dates = [_date_parts(v) for v in columns.get('invoice_date', [None] * rows)]
+    parts = np.array([d if d else (np.nan, np.nan, np.nan) for d in dates], dtype=float).reshape(rows, 3)
+    features[:, 4:7] = parts
+    features[:, 7] = np.where(np.isnan(parts[:, 0]), np.nan, parts[:, 0] >= 5)
+
+    numbers = ['' if v in _MISSING else str(v) for v in columns.get('invoice_number', [None] * rows)]
+    no_number = np.array([not n for n in numbers], dtype=bool)
+    features[:, 8] = [len(n) for n in numbers]
+    features[:, 9] = [len(_DIGIT.findall(n)) for n in numbers]
+    features[no_number, 8:10] = np.nan
+
+    features[:, 10] = [_count(v) for v in columns.get('gst_numbers', [None] * rows)]
+    features[:, 11] = [_count(v) for v in columns.get('item_descriptions', [None] * rows)]
+    no_vendor = np.array([v in _MISSING for v in columns.get('vendor_name', [None] * rows)], dtype=bool)
+    no_amount = np.isnan(amount) | (amount == 0)
+    features[:, 12] = (no_vendor.astype(int) + no_number + np.isnan(parts[:, 0]) + no_amount
+                       + (features[:, 10] == 0))
+
+    return features if fill is None else fill_missing(features, fill)
+
+
+def feature_matrix(records: Sequence[Mapping[str, Any]], fill: Optional[Sequence[float]] = None) -> np.ndarray:
+    """Feature matrix for a batch of invoice records (dicts with upload-handler field names)"""
+    return column_features({field: [record.get(field) for record in records] for field in INPUT_FIELDS}, fill)
+
+
+def fill_missing(features: np.ndarray, fill: Sequence[float]) -> np.ndarray:
+    """Replace unknown (NaN) values in place with the matching `fill` value"""
+    missing = np.isnan(features)
+    features[missing] = np.take(np.asarray(fill, dtype=float), np.nonzero(missing)[1])
+    return features
+
+
+def fill_values(features: np.ndarray) -> List[float]:
+    """Per-feature medians of a training matrix, used for unknown values at inference"""
+    known = ~np.isnan(features)
+    return [float(np.median(column[mask])) if mask.any() else 0.0 for column, mask in zip(features.T, known.T)]
+
+
+if __name__ == "__main__":
+    sample = {'total_amount': 25000.0, 'invoice_date': '14/10/2025', 'invoice_number': 'INV-2025-0147',
+              'vendor_name': 'Acme Traders', 'gst_numbers': ['27AAPFU0939F1ZV'], 'item_descriptions': ['Laptop']}
+    print(f"📐 Feature schema v{FEATURE_VERSION}: {len(FEATURE_NAMES)} features")
+    for name, value in zip(FEATURE_NAMES, feature_matrix([sample])[0]):
+        print(f"   {name:<24} {value:,.2f}")
+    batch = [dict(sample, total_amount=1000 + i, invoice_number=f"INV-{i}") for i in range(100000)]
+    started = time.perf_counter()
+    feature_matrix(batch)
+    elapsed = time.perf_counter() - started
+    print(f"⏱️  {len(batch):,} records in {elapsed * 1000:.0f} ms ({len(batch) / elapsed:,.0f}/s)")
@@ -0,0 +1,245 @@
+"""
+Compiled Isolation Forest for FINTEL AI
+The trained StandardScaler + IsolationForest exported into flat NumPy arrays
+(node features, thresholds, children, per-leaf path lengths) and evaluated by a
+pure-NumPy scorer: every tree is walked for a whole batch at once and the score
+and label come out of one pass. Scores are bit-for-bit equal to scikit-learn's
+decision_function (same float32 split comparisons, same summation order);
+benchmark_ml_scoring.py checks that.
+
+Loading a compiled model (fintel_models.npz) does not import scikit-learn, so
+the API and batch re-scoring start faster. `FintelMLTrainer.save_models` writes
+the .npz next to the pickle. The model registry (model_registry.py) saves the
+same arrays as a directory of .npy files instead, which `load_dir` memory-maps
+so every worker process shares one copy of the pages.
+
+Usage:
+    python ml_forest.py compile [fintel_models.pkl]     (writes fintel_models.npz)
+"""
+
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ml_features import FEATURE_NAMES, check_schema, feature_matrix, fill_missing
+
+COMPILED_FORMAT = 1
+ARRAY_NAMES = ('mean', 'scale', 'node_feature', 'node_threshold', 'node_left', 'node_right', 'children',
+               'leaf_depth', 'roots', 'max_depth', 'denominator', 'offset')
+MODEL_CANDIDATES = ('fintel_models', 'fintel_real_trained_models')  # API load order
+SCORE_CHUNK = 4096  # rows walked at once (bounds the rows x trees node matrix)
+
+
+def _average_path_length(n: float) -> float:
+    """Average unsuccessful-search path length in a BST of n items (as scikit-learn computes it)"""
+    n = np.array([n], dtype=float)
+    if n[0] <= 1:
+        return 0.0
+    if n[0] == 2:
+        return 1.0
+    return float((2.0 * (np.log(n - 1.0) + np.euler_gamma) - 2.0 * (n - 1.0) / n)[0])
+
+
+class CompiledForest:
+    """Anomaly scorer with the FintelMLTrainer inference API, backed by flat arrays"""
+
+    is_trained = True
+
+    def __init__(self, arrays: Dict[str, np.ndarray], feature_schema: Dict[str, Any],
+                 feature_fill: List[float], trained_at: Optional[str] = None, version: Optional[str] = None,
+                 reference: Optional[Dict[str, Any]] = None):
+        check_schema(feature_schema)
+        self.mean, self.scale = arrays['mean'], arrays['scale']
+        self.node_feature, self.node_threshold = arrays['node_feature'], arrays['node_threshold']
+        self.node_left, self.node_right = arrays['node_left'], arrays['node_right']
+        self.children = arrays.get('children')  # node * 2 + went_right
+        if self.children is None:
+            self.children = np.stack([self.node_left, self.node_right], axis=1).ravel()
+        self.leaf_depth, self.roots = arrays['leaf_depth'], arrays['roots']
+        self.max_depth = int(arrays['max_depth'])
+        self.denominator = float(arrays['denominator'])
+        self.offset = float(arrays['offset'])
+        self.feature_schema, self.feature_fill, self.trained_at = feature_schema, feature_fill, trained_at
+        self.version = version  # registry version, recorded with every prediction
+        self.reference = reference  # training-time histograms for drift_monitor.py (None for older models)
+
+    @classmethod
+    def from_sklearn(cls, scaler, forest, feature_schema: Dict[str, Any], feature_fill: List[float],
+                     trained_at: Optional[str] = None, version: Optional[str] = None,
+                     reference: Optional[Dict[str, Any]] = None) -> "CompiledForest":
+        """Flatten a fitted StandardScaler + IsolationForest (trees laid end to end)"""
+        n_features = forest.n_features_in_
+        feature, threshold, left, right, leaf_depth, roots = [], [], [], [], [], []
+        base, max_depth = 0, 0
+        for tree_index, (estimator, features) in enumerate(zip(forest.estimators_, forest.estimators_features_)):
+            tree = estimator.tree_
+            is_leaf = tree.children_left == -1
+            node_ids = np.arange(tree.node_count)
+            # Trees fitted on a feature subset index into that subset
+            tree_features = np.asarray(features) if forest._max_features != n_features else np.arange(n_features)
+            feature.append(np.where(is_leaf, 0, tree_features[np.maximum(tree.feature, 0)]))
+            # Leaves point at themselves and always "go left", so every row can take max_depth steps
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+            left.append(base + np.where(is_leaf, node_ids, tree.children_left))
+            right.append(base + np.where(is_leaf, node_ids, tree.children_right))
+            # Exactly the per-leaf term scikit-learn adds: depth + c(leaf samples) - 1
+            leaf_depth.append(forest._decision_path_lengths[tree_index]
+                              + forest._average_path_length_per_tree[tree_index] - 1.0)
+            roots.append(base)
+            base += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+        arrays = {
+            'mean': np.asarray(scaler.mean_, dtype=float), 'scale': np.asarray(scaler.scale_, dtype=float),
+            'node_feature': np.concatenate(feature).astype(np.int32),
+            'node_threshold': np.concatenate(threshold).astype(np.float64),
+            'node_left': np.concatenate(left).astype(np.int32), 'node_right': np.concatenate(right).astype(np.int32),
+            'leaf_depth': np.concatenate(leaf_depth).astype(np.float64), 'roots': np.array(roots, dtype=np.int32),
+            'max_depth': np.array(max_depth),
+            'denominator': np.array(len(forest.estimators_) * _average_path_length(forest._max_samples)),
+            'offset': np.array(forest.offset_)
+        }
+        arrays['children'] = np.stack([arrays['node_left'], arrays['node_right']], axis=1).ravel()
+        return cls(arrays, feature_schema, feature_fill, trained_at, version, reference)
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {name: np.asarray(getattr(self, name)) for name in ARRAY_NAMES}
+
+    def _meta(self) -> Dict[str, Any]:
+        return {'format': COMPILED_FORMAT, 'feature_schema': self.feature_schema,
+                'feature_fill': self.feature_fill, 'trained_at': self.trained_at, 'version': self.version,
+                'reference': self.reference}
+
+    @classmethod
+    def _from_meta(cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any], path: str) -> "CompiledForest":
+        if meta.get('format') != COMPILED_FORMAT:
+            raise ValueError(f"{path} was compiled by another version - recompile it")
+        return cls(arrays, meta['feature_schema'], meta['feature_fill'], meta.get('trained_at'), meta.get('version'),
+                   meta.get('reference'))
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, meta=np.array(json.dumps(self._meta())), **self._arrays())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledForest":
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        return cls._from_meta(arrays, json.loads(str(arrays.pop('meta'))), path)
+
+    def save_dir(self, directory: str):
+        """One .npy per array plus meta.json (the layout load_dir can memory-map)"""
+        os.makedirs(directory, exist_ok=True)
+        for name, array in self._arrays().items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(self._meta(), f)
+
+    @classmethod
+    def load_dir(cls, directory: str, mmap_mode: Optional[str] = 'r') -> "CompiledForest":
+        """Load a save_dir model; arrays are read-only memory maps unless mmap_mode is None"""
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ARRAY_NAMES}
+        return cls._from_meta(arrays, meta, directory)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def feature_matrix(self, invoices: Sequence[Dict[str, Any]]) -> np.ndarray:
+        """Model inputs (unscaled) for a batch of invoice records, unknown values filled"""
+        return feature_matrix(invoices, self.feature_fill)
+
+    def decision_function(self, features: np.ndarray) -> np.ndarray:
+        """IsolationForest.decision_function(scaler.transform(features)), without scikit-learn"""
+        scaled = np.array(features, dtype=np.float64)
+        scaled -= self.mean
+        scaled /= self.scale
+        scaled = scaled.astype(np.float32)  # trees compare float32 inputs with float64 thresholds
+        scores = np.empty(len(scaled))
+        for start in range(0, len(scaled), SCORE_CHUNK):
+            chunk = scaled[start:start + SCORE_CHUNK]
+            values = chunk.ravel()
+            row_offsets = (np.arange(len(chunk)) * chunk.shape[1])[:, None]
+            nodes = np.broadcast_to(self.roots, (len(chunk), self.n_trees))
+            for _ in range(self.max_depth):
+                went_right = values.take(row_offsets + self.node_feature.take(nodes)) > self.node_threshold.take(nodes)
+                nodes = self.children.take(nodes * 2 + went_right)
+            # Summed tree by tree, in order, like scikit-learn (cumsum is sequential)
+            depths = np.cumsum(self.leaf_depth.take(nodes), axis=1)[:, -1]
+            scores[start:start + SCORE_CHUNK] = -(2 ** (-(depths / self.denominator))) - self.offset
+        return scores
+
+    def predict_anomaly_batch(self, features: np.ndarray) -> Dict[str, np.ndarray]:
+        """Same result as FintelMLTrainer.predict_anomaly_batch"""
+        features = np.asarray(features, dtype=float)
+        if features.ndim != 2 or features.shape[1] != len(FEATURE_NAMES):
+            raise ValueError(f"expected an (n, {len(FEATURE_NAMES)}) feature matrix, got {features.shape}")
+        anomaly_scores = self.decision_function(features)
+        return {'is_anomaly': anomaly_scores < 0, 'anomaly_score': anomaly_scores,
+                'confidence': np.abs(anomaly_scores) * 100}
+
+    def predict_anomaly(self, invoice_data: Dict[str, Any], features: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """Same result as FintelMLTrainer.predict_anomaly"""
+        features = (self.feature_matrix([invoice_data]) if features is None
+                    else fill_missing(np.array(features, dtype=float), self.feature_fill))
+        batch = self.predict_anomaly_batch(features)
+        return {
+            'is_anomaly': bool(batch['is_anomaly'][0]),
+            'anomaly_score': float(batch['anomaly_score'][0]),
+            'confidence': float(batch['confidence'][0]),
+            'method': 'trained_isolation_forest',
+            'model_version': self.version
+        }
+
+
+def compiled_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + '.npz'
+
+
+def compile_model(model_path: str) -> Optional[CompiledForest]:
+    """Compile a pickled FintelMLTrainer model (needs scikit-learn) and save the .npz next to it"""
+    from ml_trainer import FintelMLTrainer
+    trainer = FintelMLTrainer()
+    if not trainer.load_models(model_path):
+        return None
+    compiled = trainer.compile()
+    compiled.save(compiled_path(model_path))
+    print(f"⚙️  Compiled {model_path} -> {compiled_path(model_path)} "
+          f"({compiled.n_trees} trees, {len(compiled.node_feature):,} nodes)")
+    return compiled
+
+
+def load_scorer(candidates: Sequence[str] = MODEL_CANDIDATES) -> Optional[CompiledForest]:
+    """
+    First usable model among `candidates` (base names): the compiled .npz when it is
+    current, else the pickle compiled once. None when no model matches the feature schema
+    """
+    for base in candidates:
+        pickle_path, npz_path = f"{base}.pkl", f"{base}.npz"
+        if os.path.exists(npz_path) and (not os.path.exists(pickle_path)
+                                         or os.path.getmtime(npz_path) >= os.path.getmtime(pickle_path)):
+            try:
+                scorer = CompiledForest.load(npz_path)
+                print(f"✅ Compiled model loaded from {npz_path}")
+                return scorer
+            except ValueError as e:
+                print(f"❌ {npz_path} not loaded: {e}")
+        if os.path.exists(pickle_path):
+            scorer = compile_model(pickle_path)
+            if scorer is not None:
+                return scorer
+    print("⚠️ No usable ML model - anomaly scoring disabled (train one with: python ml_trainer.py)")
+    return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'compile':
+        sys.exit(0 if compile_model(sys.argv[2] if len(sys.argv) > 2 else 'fintel_models.pkl') else 1)
+    print(__doc__)
+    sys.exit(2)
@@ -6,7 +6,6 @@ This is how you ACTUALLY train ML models for anomaly detection
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import IsolationForest
-from sklearn.cluster import DBSCAN
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 import pickle
@@ -14,6 +13,11 @@ import json
 from datetime import datetime, timedelta
 import random
 
+from drift_monitor import reference_profile
+from ml_features import FEATURE_SCHEMA, FeatureSchemaError, check_schema, feature_matrix, fill_missing, fill_values
+from ml_forest import CompiledForest, compiled_path
+from model_registry import ModelRegistry
+
 class FintelMLTrainer:
     """
     Proper ML training for FINTEL AI
@@ -22,12 +26,17 @@ class FintelMLTrainer:
     def __init__(self):
         self.models = {}
         self.scaler = StandardScaler()
+        self.feature_fill = None  # training medians for unknown feature values
+        self.trained_at = None
+        self.training_info = {}  # where the training rows came from, metrics, registry version
+        self.reference_profile = None  # training feature / score histograms (drift_monitor.py)
         self.is_trained = False
     
     def generate_training_data(self, num_samples=1000):
         """
         Generate synthetic training data for demonstration
         In real system, this would come from historical invoices
+        Returns invoice records (upload-handler field names) and labels
         """
         
         print(f"🔄 Generating {num_samples} synthetic invoices for training...")
@@ -47,7 +56,22 @@ class FintelMLTrainer:
             
             training_data.append(invoice)
         
-        return np.array(training_data), np.array(labels)
+        return training_data, np.array(labels)
+    
+    def _synthetic_invoice(self, amount, weekend=False):
+        """Invoice record around `amount` (dated on a working day unless `weekend`)"""
+        date = datetime(2024, 1, 1) + timedelta(days=random.randint(0, 729))
+        while (date.weekday() >= 5) != weekend:
+            date += timedelta(days=1)
+        number = f"INV-{date.year}-{random.randint(1, 10 ** random.randint(3, 6)):0{random.randint(3, 6)}d}"
+        return {
+            'total_amount': round(amount, 2),
+            'invoice_date': date.strftime('%d/%m/%Y'),
+            'invoice_number': number,
+            'vendor_name': f"Vendor {random.randint(1, 200)}",
+            'gst_numbers': ['27AAPFU0939F1ZV'],
+            'item_descriptions': [f"Item {n}" for n in range(random.randint(1, 5))]
+        }
     
     def _generate_normal_invoice(self):
         """Generate a normal invoice"""
@@ -58,19 +82,7 @@ class FintelMLTrainer:
         # Add some noise to make it realistic
         amount += random.uniform(-500, 500)
         
-        # Normal features
-        features = [
-            amount,                           # Amount
-            np.log1p(amount),                # Log amount
-            amount % 1000,                   # Remainder (usually not 0)
-            random.randint(0, 6),            # Day of week
-            random.randint(1, 28),           # Day of month
-            random.randint(1, 12),           # Month
-            random.randint(8, 15),           # Invoice number length
-            random.randint(5, 10)            # Digits in invoice number
-        ]
-        
-        return features
+        return self._synthetic_invoice(amount)
     
     def _generate_anomalous_invoice(self):
         """Generate an anomalous invoice"""
@@ -79,68 +91,73 @@ class FintelMLTrainer:
         
         if anomaly_type == 'round_amount':
             # Perfectly round amounts
-            amount = random.choice([10000, 15000, 20000, 25000, 50000, 75000, 100000])
+            return self._synthetic_invoice(random.choice([10000, 15000, 20000, 25000, 50000, 75000, 100000]))
         
         elif anomaly_type == 'high_amount':
             # Unusually high amounts
-            amount = random.uniform(100000, 500000)
+            return self._synthetic_invoice(random.uniform(100000, 500000))
         
         elif anomaly_type == 'weekend':
             # Weekend invoices (suspicious)
-            amount = random.uniform(10000, 30000)
+            return self._synthetic_invoice(random.uniform(10000, 30000), weekend=True)
         
         else:  # suspicious_pattern
-            # Other suspicious patterns
-            amount = random.uniform(8000, 40000)
-        
-        features = [
-            amount,
-            np.log1p(amount),
-            amount % 1000,  # Often 0 for round amounts
-            random.randint(0, 6),
-            random.randint(1, 28),
-            random.randint(1, 12),
-            random.randint(8, 15),
-            random.randint(5, 10)
-        ]
-        
-        return features
+            # Missing GST / vendor, bare invoice numbers
+            invoice = self._synthetic_invoice(random.uniform(8000, 40000))
+            invoice['invoice_number'] = str(random.randint(1, 999))
+            if random.random() < 0.5:
+                invoice['gst_numbers'] = []
+            else:
+                invoice['vendor_name'] = 'Unknown'
+            return invoice
     
     def train_models(self, training_data, labels):
         """
         Train ML models on historical data
+        training_data: invoice records, turned into features by ml_features
         """
         
         print("🧠 Training ML models...")
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(
-            training_data, labels, test_size=0.2, random_state=42
+            feature_matrix(training_data), labels, test_size=0.2, random_state=42
         )
         
+        # Vendor-behaviour clustering is a separate batch job (vendor_clusters.py)
+        self.fit_features(X_train)
+        
+        # Evaluate models
+        metrics = self._evaluate_models(self.scaler.transform(fill_missing(X_test, self.feature_fill)), y_test)
+        
+        self.training_info = {'source': 'synthetic', 'rows': len(training_data), 'metrics': metrics}
+        print("✅ ML models trained successfully!")
+    
+    def fit_features(self, features, contamination: float = 0.2):
+        """
+        Fit the scaler and Isolation Forest on a raw feature matrix (NaN = unknown)
+        contamination: share of rows the forest flags (0.2 matches the synthetic training set)
+        """
+        
+        self.feature_fill = fill_values(features)
+        
         # Scale features
-        X_train_scaled = self.scaler.fit_transform(X_train)
-        X_test_scaled = self.scaler.transform(X_test)
+        scaled = self.scaler.fit_transform(fill_missing(np.array(features, dtype=float), self.feature_fill))
         
         # Train Isolation Forest (unsupervised)
         print("  📊 Training Isolation Forest...")
         self.models['isolation_forest'] = IsolationForest(
-            contamination=0.2,  # Expect 20% anomalies
+            contamination=contamination,
             random_state=42,
             n_estimators=100
         )
-        self.models['isolation_forest'].fit(X_train_scaled)
+        self.models['isolation_forest'].fit(scaled)
         
-        # Train DBSCAN (unsupervised clustering)
-        print("  🔍 Training DBSCAN...")
-        self.models['dbscan'] = DBSCAN(eps=0.5, min_samples=5)
-        self.models['dbscan'].fit(X_train_scaled)
-        
-        # Evaluate models
-        self._evaluate_models(X_test_scaled, y_test)
+        # What the training data looked like, for drift monitoring of live invoices
+        self.reference_profile = reference_profile(features, self.models['isolation_forest'].decision_function(scaled))
         
         self.is_trained = True
-        print("✅ ML models trained successfully!")
+        self.trained_at = datetime.now().isoformat()
     
     def _evaluate_models(self, X_test, y_test):
         """Evaluate model performance"""
@@ -158,47 +175,96 @@ class FintelMLTrainer:
         anomalies_detected = np.sum(iso_pred)
         actual_anomalies = np.sum(y_test)
         print(f"  Anomalies Detected: {anomalies_detected}/{actual_anomalies}")
+        
+        return {'accuracy': float(accuracy), 'anomalies_detected': int(anomalies_detected),
+                'actual_anomalies': int(actual_anomalies)}
+    
+    @property
+    def version(self):
+        """Registry version of the model (None until registered)"""
+        return self.training_info.get('version')
     
-    def predict_anomaly(self, invoice_features):
+    def feature_matrix(self, invoices):
+        """Model inputs (unscaled) for a batch of invoice records, unknown values filled"""
+        return feature_matrix(invoices, self.feature_fill)
+    
+    def predict_anomaly_batch(self, features):
         """
-        Predict if an invoice is anomalous
+        Score many invoices in one vectorized pass
+        features: (n, d) matrix from feature_matrix()
+        Returns arrays of length n: is_anomaly, anomaly_score, confidence
         """
         
         if not self.is_trained:
-            return {"error": "Models not trained yet!"}
+            raise RuntimeError("Models not trained yet!")
         
-        # Scale features
-        features_scaled = self.scaler.transform([invoice_features])
+        features = np.asarray(features, dtype=float)
+        if features.ndim != 2 or features.shape[1] != len(FEATURE_SCHEMA['names']):
+            raise ValueError(f"expected an (n, {len(FEATURE_SCHEMA['names'])}) feature matrix, got {features.shape}")
         
-        # Predict with Isolation Forest
-        iso_pred = self.models['isolation_forest'].predict(features_scaled)[0]
+        # IsolationForest.predict() is exactly `decision_function < 0` -> -1, so score once
+        anomaly_scores = self.models['isolation_forest'].decision_function(self.scaler.transform(features))
         
-        # Get anomaly score
-        anomaly_score = self.models['isolation_forest'].decision_function(features_scaled)[0]
+        return {
+            'is_anomaly': anomaly_scores < 0,
+            'anomaly_score': anomaly_scores,
+            'confidence': np.abs(anomaly_scores) * 100
+        }
+    
+    def predict_anomaly(self, invoice_data, features=None):
+        """
+        Predict if an invoice is anomalous
+        invoice_data: invoice record (upload-handler field names)
+        features: its raw feature_matrix() row, when the caller already built it
+        """
+        
+        if not self.is_trained:
+            return {"error": "Models not trained yet!"}
+        
+        if features is None:
+            features = self.feature_matrix([invoice_data])
+        else:
+            features = fill_missing(np.array(features, dtype=float), self.feature_fill)
+        batch = self.predict_anomaly_batch(features)
         
         result = {
-            'is_anomaly': iso_pred == -1,
-            'anomaly_score': float(anomaly_score),
-            'confidence': abs(anomaly_score) * 100,
-            'method': 'trained_isolation_forest'
+            'is_anomaly': bool(batch['is_anomaly'][0]),
+            'anomaly_score': float(batch['anomaly_score'][0]),
+            'confidence': float(batch['confidence'][0]),
+            'method': 'trained_isolation_forest',
+            'model_version': self.version
         }
         
         return result
     
-    def save_models(self, filepath='fintel_models.pkl'):
-        """Save trained models"""
+    def compile(self):
+        """Scaler + Isolation Forest as a CompiledForest (pure-NumPy scorer, same scores)"""
         
+        return CompiledForest.from_sklearn(self.scaler, self.models['isolation_forest'], FEATURE_SCHEMA,
+                                           self.feature_fill, self.trained_at, self.version, self.reference_profile)
+    
+    def save_models(self, filepath='fintel_models.pkl', compiled=True):
+        """Save trained models (and, unless compiled=False, the compiled .npz scorer, see ml_forest.py)"""
+        
+        self.trained_at = self.trained_at or datetime.now().isoformat()
         model_data = {
             'models': self.models,
             'scaler': self.scaler,
             'is_trained': self.is_trained,
-            'trained_at': datetime.now().isoformat()
+            'feature_schema': FEATURE_SCHEMA,
+            'feature_fill': self.feature_fill,
+            'trained_at': self.trained_at,
+            'training_info': self.training_info,
+            'reference_profile': self.reference_profile
         }
         
         with open(filepath, 'wb') as f:
             pickle.dump(model_data, f)
-        
-        print(f"💾 Models saved to {filepath}")
+        if compiled:
+            self.compile().save(compiled_path(filepath))
+            print(f"💾 Models saved to {filepath} (compiled: {compiled_path(filepath)})")
+        else:
+            print(f"💾 Models saved to {filepath}")
     
     def load_models(self, filepath='fintel_models.pkl'):
         """Load pre-trained models"""
@@ -206,10 +272,16 @@ class FintelMLTrainer:
         try:
             with open(filepath, 'rb') as f:
                 model_data = pickle.load(f)
+            check_schema(model_data.get('feature_schema'))
             
             self.models = model_data['models']
+            self.models.pop('dbscan', None)  # older files pickled an unused DBSCAN fit
             self.scaler = model_data['scaler']
             self.is_trained = model_data['is_trained']
+            self.feature_fill = model_data['feature_fill']
+            self.trained_at = model_data.get('trained_at')
+            self.training_info = model_data.get('training_info', {})
+            self.reference_profile = model_data.get('reference_profile')
             
             print(f"✅ Models loaded from {filepath}")
             return True
@@ -217,6 +289,9 @@ class FintelMLTrainer:
         except FileNotFoundError:
             print(f"❌ Model file {filepath} not found")
             return False
+        except FeatureSchemaError as e:
+            print(f"❌ Model file {filepath} not loaded: {e}")
+            return False
 
 def main():
     """
@@ -244,20 +319,23 @@ def main():
     print("\n🧪 Testing Prediction:")
     
     # Test normal invoice
-    normal_invoice = [15000, 9.61, 250, 2, 15, 10, 11, 7]
+    normal_invoice = {'total_amount': 15250.40, 'invoice_date': '15/10/2025', 'invoice_number': 'INV-2025-0412',
+                      'vendor_name': 'Acme Traders', 'gst_numbers': ['27AAPFU0939F1ZV'], 'item_descriptions': ['Laptop']}
     result = trainer.predict_anomaly(normal_invoice)
     print(f"Normal invoice (₹15,000): {result}")
     
     # Test suspicious invoice
-    suspicious_invoice = [50000, 10.82, 0, 1, 29, 10, 12, 7]
+    suspicious_invoice = {'total_amount': 50000, 'invoice_date': '12/10/2025', 'invoice_number': '77',
+                          'vendor_name': 'Unknown', 'gst_numbers': [], 'item_descriptions': ['Laptop']}
     result = trainer.predict_anomaly(suspicious_invoice)
     print(f"Suspicious invoice (₹50,000): {result}")
     
-    # Save models
-    trainer.save_models()
+    # Save models (as a new registry version, made active)
+    ModelRegistry().register(trainer, activate=True)
     
     print("\n🎉 Training Complete!")
     print("🔗 Now you can use these trained models in FINTEL AI!")
+    print("📥 To train on stored invoices instead: python ml_history_trainer.py --activate")
 
 if __name__ == "__main__":
     main()
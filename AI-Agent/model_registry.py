@@ -0,0 +1,215 @@
+"""
+Model Registry for FINTEL AI
+Versioned anomaly-model artifacts and the pointer to the active one:
+
+    models/
+        ACTIVE                      active version (replaced atomically)
+        20251019143005/
+            meta.json               version, trained_at, feature schema, metrics, training report
+            model.pkl               FintelMLTrainer pickle (scikit-learn, for inspection / re-compiling)
+            compiled/*.npy          CompiledForest arrays, memory-mapped by the API
+
+Workers memory-map the compiled arrays read-only, so every uvicorn worker shares
+one copy of the pages. `ActiveModel` re-reads ACTIVE every few seconds and swaps
+the model in place, so activating a version (the admin endpoint, or
+`--activate`) reaches every worker without a restart. Before anything is
+registered, the legacy fintel_models.pkl / .npz files are used.
+
+Usage:
+    python model_registry.py list
+    python model_registry.py activate <version>
+    python model_registry.py register [fintel_models.pkl] [--activate]
+"""
+
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from ml_forest import CompiledForest, load_scorer
+
+MODEL_REGISTRY_DIR = os.getenv(
+    "FINTEL_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+)
+ACTIVE_FILE = 'ACTIVE'
+REFRESH_SECONDS = 5.0  # how often a worker checks for a newly activated version
+
+
+class ModelRegistry:
+    """Versioned model artifacts under one directory"""
+
+    def __init__(self, root: str = MODEL_REGISTRY_DIR):
+        self.root = root
+
+    def _path(self, version: str, *parts: str) -> str:
+        if not version or os.path.basename(version) != version or version.startswith('.'):
+            raise KeyError(version)
+        return os.path.join(self.root, version, *parts)
+
+    def register(self, trainer, activate: bool = False) -> str:
+        """Save a trained FintelMLTrainer as a new version; returns the version"""
+        os.makedirs(self.root, exist_ok=True)
+        trainer.trained_at = trainer.trained_at or datetime.now().isoformat()  # models saved before trained_at
+        version = datetime.fromisoformat(trainer.trained_at).strftime('%Y%m%d%H%M%S')
+        suffix = 1
+        while os.path.exists(os.path.join(self.root, version)):
+            version = f"{version.split('-')[0]}-{suffix}"
+            suffix += 1
+        trainer.training_info = {**trainer.training_info, 'version': version}
+
+        # Written under a temporary name and renamed, so a half-written version is never visible
+        staging = os.path.join(self.root, f".{version}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        trainer.save_models(os.path.join(staging, 'model.pkl'), compiled=False)
+        compiled = trainer.compile()
+        compiled.save_dir(os.path.join(staging, 'compiled'))
+        meta = {
+            'version': version,
+            'trained_at': trainer.trained_at,
+            'registered_at': datetime.now().isoformat(),
+            'feature_schema': compiled.feature_schema,
+            'metrics': trainer.training_info.get('metrics', {}),
+            'training': {k: v for k, v in trainer.training_info.items() if k not in ('metrics', 'version')},
+            'trees': compiled.n_trees,
+            'nodes': len(compiled.node_feature)
+        }
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(staging, os.path.join(self.root, version))
+        print(f"📦 Registered model {version}")
+
+        if activate:
+            self.activate(version)
+        return version
+
+    def versions(self) -> List[Dict[str, Any]]:
+        """Metadata of every registered version, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        return [meta for meta in (self.metadata(name) for name in sorted(os.listdir(self.root))
+                                  if not name.startswith('.') and name != ACTIVE_FILE) if meta]
+
+    def metadata(self, version: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(version, 'meta.json')) as f:
+                return json.load(f)
+        except (KeyError, OSError, ValueError):
+            return None
+
+    def active_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, ACTIVE_FILE)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def activate(self, version: str):
+        """Point ACTIVE at `version` (atomic rename); KeyError when it is not registered"""
+        self.load(version)  # never activate something workers cannot load
+        tmp_path = os.path.join(self.root, f".{ACTIVE_FILE}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, os.path.join(self.root, ACTIVE_FILE))
+        print(f"✅ Active model: {version}")
+
+    def load(self, version: str) -> CompiledForest:
+        """Memory-mapped scorer for `version`; KeyError when it is not registered"""
+        directory = self._path(version, 'compiled')
+        if not os.path.isdir(directory):
+            raise KeyError(version)
+        return CompiledForest.load_dir(directory)
+
+    def model_path(self, version: str) -> str:
+        """The scikit-learn pickle of `version` (for FintelMLTrainer.load_models)"""
+        return self._path(version, 'model.pkl')
+
+
+def load_active_scorer(registry: Optional[ModelRegistry] = None) -> Optional[CompiledForest]:
+    """The active registry model, else the legacy fintel_models files; None when there is no usable model"""
+    registry = registry or ModelRegistry()
+    version = registry.active_version()
+    if version:
+        try:
+            scorer = registry.load(version)
+            print(f"✅ Model {version} loaded from the registry")
+            return scorer
+        except (KeyError, OSError, ValueError) as e:
+            print(f"❌ Active model {version} not loaded: {e}")
+    return load_scorer()
+
+
+class ActiveModel:
+    """
+    The model a process predicts with. `get()` is cheap (a clock check, and every
+    REFRESH_SECONDS one small file read); when ACTIVE names another version the new
+    model is loaded first and then swapped in with one reference assignment, so
+    in-flight requests finish on the model they started with.
+    """
+
+    def __init__(self, registry: Optional[ModelRegistry] = None, refresh_seconds: float = REFRESH_SECONDS):
+        self.registry = registry or ModelRegistry()
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._scorer = load_active_scorer(self.registry)
+        version = self.registry.active_version()
+        # Only a version that actually loaded counts as switched to; otherwise refresh() retries it
+        self._active_version = version if self._scorer is not None and self._scorer.version == version else None
+        self._checked = time.monotonic()
+
+    def get(self) -> Optional[CompiledForest]:
+        if time.monotonic() - self._checked >= self.refresh_seconds:
+            self.refresh()
+        return self._scorer
+
+    def refresh(self):
+        """Swap in the registry's active version if it changed"""
+        with self._lock:
+            self._checked = time.monotonic()
+            version = self.registry.active_version()
+            if version == self._active_version:
+                return
+            try:
+                self._scorer = self.registry.load(version) if version else load_scorer()
+            except (KeyError, OSError, ValueError) as e:
+                # _active_version stays put, so the next refresh retries the load
+                print(f"❌ Model {version} not loaded, keeping {self._active_version}: {e}")
+                return
+            self._active_version = version
+            print(f"🔄 Switched to model {version}")
+
+    def activate(self, version: str):
+        """Make `version` active for every process, and switch this one now"""
+        self.registry.activate(version)
+        self.refresh()
+
+
+if __name__ == "__main__":
+    registry = ModelRegistry()
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'list':
+        active = registry.active_version()
+        for meta in registry.versions():
+            marker = '▶' if meta['version'] == active else ' '
+            print(f"{marker} {meta['version']}  trained {meta['trained_at']}  "
+                  f"source={meta['training'].get('source', '?')}  metrics={meta['metrics']}")
+    elif command == 'activate' and len(sys.argv) > 2:
+        try:
+            registry.activate(sys.argv[2])
+        except KeyError:
+            print(f"❌ No model version {sys.argv[2]} in {registry.root}")
+            sys.exit(1)
+    elif command == 'register':
+        from ml_trainer import FintelMLTrainer
+        trainer = FintelMLTrainer()
+        paths = [arg for arg in sys.argv[2:] if not arg.startswith('--')]
+        if not trainer.load_models(paths[0] if paths else 'fintel_models.pkl'):
+            sys.exit(1)
+        registry.register(trainer, activate='--activate' in sys.argv)
+    else:
+        print(__doc__)
+        sys.exit(2)
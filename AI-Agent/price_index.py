@@ -0,0 +1,323 @@
+"""
+Unit Price Index for FINTEL AI
+Line items are stored in normalized form (itemKey, hsnCode, quantity, unitPrice) and
+every unit price is folded into a mergeable KLL quantile sketch per HSN heading
+("hsn:8517") and per normalized item ("item:laptop notebook"). Each index entry keeps
+its precomputed percentiles, so an outlier check is one lookup and a comparison.
+
+Sketches are merged into the store on every upload (see InvoiceStore.merge_price_sketches);
+`--rebuild` recomputes the whole index from the stored invoices.
+
+Usage:
+    python price_index.py [database_url] --rebuild [--k 200]
+    python price_index.py [database_url] --show hsn:8517 "item:laptop notebook"
+"""
+
+import math
+import re
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from hsn_index import normalize_code
+
+DEFAULT_K = 200
+
+# Percentiles kept on every index entry
+STAT_QUANTILES = {'p01': 0.01, 'p05': 0.05, 'p10': 0.10, 'p25': 0.25, 'p50': 0.50,
+                  'p75': 0.75, 'p90': 0.90, 'p95': 0.95, 'p99': 0.99}
+
+# Outlier rule: outside the far-out fences p25 - 3*IQR / p75 + 3*IQR, once an entry
+# has enough samples to trust (IQR is floored at 10% of the median for flat prices)
+MIN_PRICE_SAMPLES = 20
+FENCE_IQRS = 3.0
+MIN_IQR_FRACTION = 0.1
+
+_TOKEN = re.compile(r'[a-z]+')
+ITEM_STOP_WORDS = {
+    'and', 'for', 'the', 'with', 'of', 'pcs', 'pc', 'nos', 'no', 'qty', 'set', 'sets', 'box', 'boxes', 'unit',
+    'units', 'each', 'pack', 'kg', 'kgs', 'gm', 'gms', 'ltr', 'mtr', 'mm', 'cm', 'inch', 'new', 'model', 'size'
+}
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch: compactors whose items weigh 2^level. Rank error is about
+    1.65 / k of the count; merging two sketches gives the sketch of the union
+    """
+
+    def __init__(self, k: int = DEFAULT_K):
+        self.k = k
+        self.levels: List[List[float]] = [[]]
+        self.n = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self._coin = 0  # alternates which half survives a compaction (deterministic)
+
+    def _capacity(self, level: int) -> int:
+        return max(2, math.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1)))
+
+    def _compress(self):
+        while sum(map(len, self.levels)) > sum(self._capacity(h) for h in range(len(self.levels))):
+            for level, items in enumerate(self.levels):
+                if len(items) < self._capacity(level):
+                    continue
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                items.sort()
+                kept = [items.pop()] if len(items) % 2 else []
+                self._coin ^= 1
+                self.levels[level + 1].extend(items[self._coin::2])
+                self.levels[level] = kept
+                break
+
+    def update(self, value: float) -> "KLLSketch":
+        return self.update_many([value])
+
+    def update_many(self, values: Iterable[float]) -> "KLLSketch":
+        values = [float(v) for v in values]
+        if not values:
+            return self
+        self.levels[0].extend(values)
+        self.n += len(values)
+        self.min = min(values) if self.min is None else min(self.min, *values)
+        self.max = max(values) if self.max is None else max(self.max, *values)
+        self._compress()
+        return self
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        if not other.n:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.n += other.n
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantiles(self, qs: Iterable[float]) -> List[Optional[float]]:
+        qs = list(qs)
+        if not self.n:
+            return [None] * len(qs)
+        weighted = sorted((value, 1 << level) for level, items in enumerate(self.levels) for value in items)
+        total = sum(weight for _, weight in weighted)
+        results = []
+        for q in qs:
+            if q <= 0:
+                results.append(self.min)
+                continue
+            if q >= 1:
+                results.append(self.max)
+                continue
+            target, cumulative = q * total, 0
+            for value, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    results.append(value)
+                    break
+        return results
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'k': self.k, 'n': self.n, 'min': self.min, 'max': self.max,
+                'levels': [[round(v, 4) for v in items] for items in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "KLLSketch":
+        sketch = cls(data.get('k', DEFAULT_K))
+        sketch.levels = [list(items) for items in data.get('levels') or [[]]]
+        sketch.n, sketch.min, sketch.max = data.get('n', 0), data.get('min'), data.get('max')
+        return sketch
+
+
+# ----- line items -----------------------------------------------------------
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        number = float(str(value).replace(',', '')) if value not in (None, '') else None
+    except ValueError:
+        return None
+    return number if number is not None and math.isfinite(number) else None
+
+
+def item_key(description: Any) -> Optional[str]:
+    """'Dell Laptop 15" (Notebook) - 2 pcs' -> 'dell laptop notebook' (word order and counts ignored)"""
+    tokens = [t for t in _TOKEN.findall(str(description or '').lower()) if len(t) > 2 and t not in ITEM_STOP_WORDS]
+    return ' '.join(sorted(set(tokens))[:6]) or None
+
+
+def normalize_line_items(invoice_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Stored form of the invoice's line items. Invoices without line items but with a
+    single HSN code get one derived item (total / quantity) so they still count
+    """
+    items = []
+    for item in invoice_data.get('line_items') or []:
+        if 'itemKey' in item:  # already normalized (stored invoice)
+            items.append(item)
+            continue
+        description = str(item.get('description') or '').strip()
+        code = normalize_code(item.get('hsn_code'))
+        if not description and not code:
+            continue
+        quantity, amount = _number(item.get('quantity')), _number(item.get('amount'))
+        unit_price = _number(item.get('rate')) or (amount / quantity if amount and quantity else None)
+        items.append({'description': description, 'itemKey': item_key(description), 'hsnCode': code or None,
+                      'quantity': quantity, 'unitPrice': unit_price, 'amount': amount})
+    if items:
+        return items
+
+    codes = [normalize_code(code) for code in invoice_data.get('hsn_sac_codes') or []]
+    total = _number(invoice_data.get('total_amount'))
+    if len(set(codes)) != 1 or not codes[0] or not total or total <= 0:
+        return []
+    descriptions = invoice_data.get('item_descriptions') or []
+    description = descriptions[0] if len(descriptions) == 1 else ''
+    quantity = sum(_number(q) or 0 for q in invoice_data.get('quantities') or []) or 1.0
+    return [{'description': description, 'itemKey': item_key(description), 'hsnCode': codes[0],
+             'quantity': quantity, 'unitPrice': total / quantity, 'amount': total, 'derived': True}]
+
+
+def price_keys(item: Dict[str, Any]) -> List[str]:
+    """Index entries a line item belongs to, most specific first"""
+    keys = []
+    if item.get('itemKey'):
+        keys.append(f"item:{item['itemKey']}")
+    if item.get('hsnCode') and len(item['hsnCode']) >= 4:
+        keys.append(f"hsn:{item['hsnCode'][:4]}")
+    return keys
+
+
+def line_item_keys(line_items: List[Dict[str, Any]]) -> List[str]:
+    """Every index entry an invoice's checks read"""
+    return sorted({key for item in line_items for key in price_keys(item)})
+
+
+def price_observations(line_items: List[Dict[str, Any]]) -> Dict[str, List[float]]:
+    observations = defaultdict(list)
+    for item in line_items:
+        if item.get('unitPrice') and item['unitPrice'] > 0:
+            for key in price_keys(item):
+                observations[key].append(item['unitPrice'])
+    return dict(observations)
+
+
+def build_sketches(observations: Dict[str, List[float]], k: int = DEFAULT_K) -> Dict[str, KLLSketch]:
+    return {key: KLLSketch(k).update_many(prices) for key, prices in observations.items()}
+
+
+def price_stats(sketch: KLLSketch) -> Dict[str, Any]:
+    """Percentiles stored next to the sketch (what outlier checks read)"""
+    stats = dict(zip(STAT_QUANTILES, sketch.quantiles(STAT_QUANTILES.values())))
+    stats.update(count=sketch.n, min=sketch.min, max=sketch.max)
+    return stats
+
+
+def price_index_doc(sketch: KLLSketch, version: int) -> Dict[str, Any]:
+    return {'sketch': sketch.to_dict(), 'stats': price_stats(sketch), 'version': version, 'updatedAt': datetime.now()}
+
+
+def merge_into(stored: Optional[Dict[str, Any]], sketch: KLLSketch) -> KLLSketch:
+    """Stored sketch (index document) merged with new observations"""
+    if not stored:
+        return KLLSketch(sketch.k).merge(sketch)
+    return KLLSketch.from_dict(stored['sketch']).merge(sketch)
+
+
+# ----- checks ---------------------------------------------------------------
+
+def price_position(price: float, stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Where a unit price sits in an index entry: approximate percentile and fence test"""
+    median = stats['p50']
+    iqr = max(stats['p75'] - stats['p25'], MIN_IQR_FRACTION * abs(median))
+    low, high = stats['p25'] - FENCE_IQRS * iqr, stats['p75'] + FENCE_IQRS * iqr
+    points = [(0.0, stats['min'])] + [(q, stats[name]) for name, q in STAT_QUANTILES.items()] + [(1.0, stats['max'])]
+    percentile = 100.0 if price >= stats['max'] else 0.0
+    for (q0, v0), (q1, v1) in zip(points, points[1:]):
+        if v0 <= price <= v1:
+            percentile = 100 * (q0 + (q1 - q0) * ((price - v0) / (v1 - v0) if v1 > v0 else 0))
+            break
+    return {
+        'median': median,
+        'percentile': round(percentile, 1),
+        'variance_percent': (price - median) / median * 100 if median else 0.0,
+        'is_outlier': stats['count'] >= MIN_PRICE_SAMPLES and not low <= price <= high,
+        'samples': stats['count']
+    }
+
+
+def line_item_positions(line_items: List[Dict[str, Any]], stats_by_key: Dict[str, Dict]) -> List[Dict[str, Any]]:
+    """Per item, its position in the most specific index entry with enough samples"""
+    positions = []
+    for item in line_items:
+        price = item.get('unitPrice')
+        if not price or price <= 0:
+            continue
+        for key in price_keys(item):
+            stats = stats_by_key.get(key)
+            if stats and stats['count'] >= MIN_PRICE_SAMPLES:
+                positions.append({'item': item, 'basis': key, 'unit_price': price, **price_position(price, stats)})
+                break
+    return positions
+
+
+def price_deviation_anomalies(line_items: List[Dict[str, Any]], stats_by_key: Dict[str, Dict]) -> List[Dict]:
+    """6. Unit price outside the far-out fences of its item / HSN price distribution"""
+    for position in line_item_positions(line_items, stats_by_key):
+        if position['is_outlier']:
+            item = position['item']
+            label = item.get('description') or f"HSN {item.get('hsnCode')}"
+            return [{
+                'type': 'HSN_PRICE_DEVIATION',
+                'severity': 'MEDIUM',
+                'description': f"{label}: unit price ₹{position['unit_price']:.2f} is at the "
+                               f"{position['percentile']:.0f}th percentile of {position['basis']} "
+                               f"(median ₹{position['median']:.2f}, {position['samples']} prices)"
+            }]  # Only report once
+    return []
+
+
+# ----- batch rebuild --------------------------------------------------------
+
+def rebuild_price_index(store, k: int = DEFAULT_K) -> int:
+    """
+    Recompute every index entry from the stored invoices' line items
+    (uploads merged while the scan runs are lost - run it when uploads are quiet)
+    """
+    started = time.perf_counter()
+    sketches: Dict[str, KLLSketch] = {}
+    invoices = 0
+    for invoice in store.iter_invoices():
+        invoices += 1
+        for key, prices in price_observations(normalize_line_items({
+            'line_items': invoice.get('lineItems'), 'hsn_sac_codes': invoice.get('hsnCodes'),
+            'item_descriptions': invoice.get('itemDescriptions'), 'quantities': invoice.get('quantities'),
+            'total_amount': invoice.get('totalAmount')
+        })).items():
+            sketches.setdefault(key, KLLSketch(k)).update_many(prices)
+    store.replace_price_index(sketches)
+    print(f"✅ Price index rebuilt from {invoices} invoices: {len(sketches)} entries "
+          f"in {time.perf_counter() - started:.1f}s")
+    return len(sketches)
+
+
+if __name__ == "__main__":
+    from database import get_database, DEFAULT_CONNECTION_STRING
+
+    has_url = len(sys.argv) > 1 and not sys.argv[1].startswith('--')
+    store = get_database(sys.argv[1] if has_url else DEFAULT_CONNECTION_STRING)
+    if "--rebuild" in sys.argv:
+        k = int(sys.argv[sys.argv.index("--k") + 1]) if "--k" in sys.argv else DEFAULT_K
+        rebuild_price_index(store, k)
+    elif "--show" in sys.argv:
+        keys = sys.argv[sys.argv.index("--show") + 1:]
+        for key, stats in store.get_price_stats(keys).items():
+            print(f"📊 {key}: " + ', '.join(f"{name} {value:,.2f}" if isinstance(value, float) else f"{name} {value}"
+                                           for name, value in stats.items()))
+    else:
+        print(__doc__)
+        sys.exit(2)
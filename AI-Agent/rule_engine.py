@@ -0,0 +1,602 @@
+"""
+Compliance Rule Engine for FINTEL AI
+Checks, point weights, score bands, risk adjustments and messages are declared
+in compliance_rules.json and compiled once into an evaluation plan. Identical
+sub-expressions compile to one shared node, `applies` guards and and/or
+short-circuit per invoice, and the same plan runs over pandas chunks
+(batch_compliance.py). Per-rule timings are collected when profiling is on.
+
+Expressions are one-key objects:
+    {"field": "total_amount", "default": 0}   {"ref": "<define>"}   {"rule": "<earlier rule id>"}
+    {"present" | "number" | "len" | "abs" | "not": expr}
+    {"add" | "mul" | "and" | "or": [expr, ...]}   {"sub" | "div" | "gt" | "gte" | "lt" | "lte": [a, b]}
+    {"count_match": [list_expr, "<pattern>"]}   {"any_in": [list_expr, "<reference>"]}
+    plain numbers and booleans are constants
+
+Usage:
+    python rule_engine.py [--profile 10000]
+"""
+
+import json
+import operator
+import os
+import re
+import sys
+import time
+from functools import reduce
+from typing import Container, Dict, List, Optional, Any, Callable, Tuple
+
+import numpy as np
+import pandas as pd
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compliance_rules.json')
+MAX_PLAN_NODES = 500  # a rule set that compiles to more nodes is rejected
+
+UNARY_OPS = ('present', 'number', 'len', 'abs', 'not')
+VARIADIC_OPS = ('add', 'mul', 'and', 'or')
+BINARY_OPS = ('sub', 'div', 'gt', 'gte', 'lt', 'lte')
+FLOAT_OPS = ('number', 'div')
+
+SCALAR_OPS: Dict[str, Callable] = {
+    'add': lambda *values: sum(values),
+    'mul': lambda *values: reduce(operator.mul, values),
+    'sub': operator.sub,
+    'div': operator.truediv,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'abs': abs,
+    'not': operator.not_,
+    'present': bool,
+}
+VECTOR_OPS: Dict[str, Callable] = {
+    'add': lambda *values: reduce(np.add, values),
+    'mul': lambda *values: reduce(np.multiply, values),
+    'sub': np.subtract,
+    'div': np.divide,
+    'gt': np.greater,
+    'gte': np.greater_equal,
+    'lt': np.less,
+    'lte': np.less_equal,
+    'abs': np.abs,
+}
+
+# reference name -> (table supporting `in`, dependency formatter for one looked-up key)
+References = Dict[str, Tuple[Container, Callable[[Any], str]]]
+
+
+def load_rules(path: str = RULES_PATH) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _to_number(value) -> float:
+    try:
+        return float(str(value).replace(',', ''))
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def _length(value) -> int:
+    return len(value) if value is not None else 0
+
+
+def _numeric(values) -> np.ndarray:
+    values = np.asarray(values)
+    return values.astype(int) if values.dtype == bool else values
+
+
+def _truthy(values) -> np.ndarray:
+    if isinstance(values, pd.Series):
+        return values.map(bool).to_numpy(bool)
+    return np.asarray(values).astype(bool)
+
+
+def _per_row(flags: pd.Series, rows: int, how: str) -> np.ndarray:
+    """Aggregate an exploded boolean column back to one value per original row"""
+    out = np.zeros(rows, dtype=int)
+    grouped = getattr(flags.groupby(level=0), how)()
+    out[grouped.index.to_numpy(int)] = grouped.to_numpy(int)
+    return out
+
+
+def _bits(flags: List[np.ndarray], rows: int) -> np.ndarray:
+    """Pack boolean columns into one int per row (column j -> bit j)"""
+    bits = np.zeros(rows, dtype=np.int64)
+    for j, flag in enumerate(flags):
+        bits |= flag.astype(np.int64) << j
+    return bits
+
+
+def _rows_from_bits(flags: List[np.ndarray], rows: int, build: Callable[[int], Any]) -> List[Any]:
+    """One build() per distinct flag combination, shared by every row that has it"""
+    cache = {bits: build(bits) for bits in set(_bits(flags, rows).tolist())}
+    return [cache[bits] for bits in _bits(flags, rows).tolist()]
+
+
+class Rule:
+    def __init__(self, spec: Dict[str, Any], points: int, applies: Optional[int], lookups: List[int]):
+        self.id = spec['id']
+        self.version = spec.get('version', 1)
+        self.description = spec.get('description', '')
+        self.weight = spec.get('weight', 1)
+        self.otherwise = spec.get('otherwise', 0)
+        self.budget_us = spec.get('budget_us')
+        self.points = points
+        self.applies = applies
+        self.lookups = lookups  # any_in nodes whose keys are recorded as dependencies
+        self.float_points = False
+
+    @property
+    def dependency(self) -> str:
+        return f"rule:{self.id}@{self.version}"
+
+
+class RulePlan:
+    """A compiled rule set; evaluate() for one invoice, evaluate_frame() for a chunk"""
+
+    def __init__(self, config: Dict[str, Any], references: Optional[References] = None):
+        self.config = config
+        self.references = references or {}
+        self.total_checks = config['total_checks']
+        self.patterns = {name: re.compile(pattern) for name, pattern in config.get('patterns', {}).items()}
+        self.default_budget_us = config.get('default_budget_us')
+
+        self.nodes: List[Tuple[str, tuple]] = []
+        self._node_ids: Dict[Tuple, int] = {}
+        self._defines: Dict[str, int] = {}
+        self._compiling: set = set()
+        self.expressions_compiled = 0
+
+        self.rules: List[Rule] = []
+        self._rules_by_id: Dict[str, Rule] = {}
+        for spec in config['rules']:
+            applies = self._compile(spec['applies']) if 'applies' in spec else None
+            points = self._compile(spec['points'])
+            rule = Rule(spec, points, applies, self._lookups(points) + (self._lookups(applies) if applies is not None else []))
+            rule.float_points = isinstance(rule.weight, float) or self._kind(points) == 'float'
+            if rule.id in self._rules_by_id:
+                raise ValueError(f"Duplicate rule id: {rule.id}")
+            self.rules.append(rule)
+            self._rules_by_id[rule.id] = rule
+
+        self.bands = config['bands']
+        self.adjustments = [(spec, self._compile(spec['when'])) for spec in config.get('adjustments', [])]
+        self.messages = [(spec['message'], self._compile(spec['when'])) for spec in config.get('messages', [])]
+
+        if len(self.nodes) > MAX_PLAN_NODES:
+            raise ValueError(f"Rule plan has {len(self.nodes)} nodes (limit {MAX_PLAN_NODES})")
+
+        self.profile = False
+        self.timings: Dict[str, List[int]] = {}
+
+    # ----- compilation ------------------------------------------------------
+
+    def _node(self, op: str, args: tuple) -> int:
+        key = (op, args)
+        if key not in self._node_ids:
+            self._node_ids[key] = len(self.nodes)
+            self.nodes.append(key)
+        return self._node_ids[key]
+
+    def _compile(self, expr) -> int:
+        self.expressions_compiled += 1
+        if isinstance(expr, (bool, int, float)):
+            return self._node('const', (expr, type(expr).__name__))  # keep 1, 1.0 and True apart
+        if not isinstance(expr, dict):
+            raise ValueError(f"Invalid rule expression: {expr!r}")
+        if 'field' in expr:
+            return self._node('field', (expr['field'], expr.get('default')))
+        if len(expr) != 1:
+            raise ValueError(f"Rule expression needs exactly one operator: {expr!r}")
+
+        (op, arg), = expr.items()
+        if op == 'ref':
+            return self._define(arg)
+        if op == 'rule':
+            if arg not in self._rules_by_id:
+                raise ValueError(f"Rule '{arg}' must be declared before it is referenced")
+            return self._node('rule', (arg,))
+        if op in UNARY_OPS:
+            return self._node(op, (self._compile(arg),))
+        if op in VARIADIC_OPS:
+            return self._node(op, tuple(self._compile(a) for a in arg))
+        if op in BINARY_OPS:
+            if len(arg) != 2:
+                raise ValueError(f"'{op}' takes two operands: {expr!r}")
+            return self._node(op, tuple(self._compile(a) for a in arg))
+        if op == 'count_match':
+            if arg[1] not in self.patterns:
+                raise ValueError(f"Unknown pattern '{arg[1]}'")
+            return self._node(op, (self._compile(arg[0]), arg[1]))
+        if op == 'any_in':
+            if arg[1] not in self.references:
+                raise ValueError(f"Unknown reference '{arg[1]}'")
+            return self._node(op, (self._compile(arg[0]), arg[1]))
+        raise ValueError(f"Unknown rule operator '{op}'")
+
+    def _define(self, name: str) -> int:
+        if name not in self._defines:
+            if name not in self.config.get('define', {}):
+                raise ValueError(f"Unknown define '{name}'")
+            if name in self._compiling:
+                raise ValueError(f"Define '{name}' refers to itself")
+            self._compiling.add(name)
+            self._defines[name] = self._compile(self.config['define'][name])
+            self._compiling.discard(name)
+        return self._defines[name]
+
+    def define(self, name: str) -> Any:
+        """Constant value of a define"""
+        op, args = self.nodes[self._define(name)]
+        if op != 'const':
+            raise ValueError(f"Define '{name}' is not a constant")
+        return args[0]
+
+    def _children(self, node_id: int) -> List[int]:
+        op, args = self.nodes[node_id]
+        if op in ('const', 'field', 'rule'):
+            return []
+        if op in ('count_match', 'any_in'):
+            return [args[0]]
+        return list(args)
+
+    def _lookups(self, node_id: int) -> List[int]:
+        found, stack, seen = [], [node_id], set()
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            if self.nodes[current][0] == 'any_in':
+                found.append(current)
+            stack.extend(self._children(current))
+        return sorted(found)
+
+    def _kind(self, node_id: int) -> str:
+        """'float' when the scalar result is a Python float, else 'int' (bools count as ints)"""
+        op, args = self.nodes[node_id]
+        if op == 'const':
+            return 'float' if isinstance(args[0], float) else 'int'
+        if op in FLOAT_OPS:
+            return 'float'
+        if op in ('add', 'mul', 'sub', 'abs'):
+            return 'float' if any(self._kind(child) == 'float' for child in self._children(node_id)) else 'int'
+        if op == 'rule':
+            return 'float' if self._rules_by_id[args[0]].float_points else 'int'
+        return 'int'
+
+    @property
+    def rule_versions(self) -> Dict[str, int]:
+        versions = {rule.id: rule.version for rule in self.rules}
+        versions[self.bands['id']] = self.bands.get('version', 1)
+        versions.update((spec['id'], spec.get('version', 1)) for spec, _ in self.adjustments)
+        return versions
+
+    @property
+    def conditional_rules(self) -> List[str]:
+        return [rule.id for rule in self.rules if rule.applies is not None]
+
+    # ----- per invoice ------------------------------------------------------
+
+    def _value(self, node_id: int, record: Dict[str, Any], memo: Dict) -> Any:
+        if node_id in memo:
+            return memo[node_id]
+        op, args = self.nodes[node_id]
+        if op == 'const':
+            value = args[0]
+        elif op == 'field':
+            value = record.get(args[0], args[1])
+        elif op == 'rule':
+            value = self._rule_points(self._rules_by_id[args[0]], record, memo)[1]
+        elif op == 'and':
+            value = all(self._value(child, record, memo) for child in args)  # short-circuits
+        elif op == 'or':
+            value = any(self._value(child, record, memo) for child in args)
+        elif op == 'number':
+            value = _to_number(self._value(args[0], record, memo))
+        elif op == 'len':
+            value = _length(self._value(args[0], record, memo))
+        elif op == 'count_match':
+            pattern = self.patterns[args[1]]
+            value = sum(1 for item in self._value(args[0], record, memo) or []
+                        if isinstance(item, str) and pattern.match(item))
+        elif op == 'any_in':
+            table = self.references[args[1]][0]
+            value = any(item in table for item in self._value(args[0], record, memo) or [])
+        else:
+            value = SCALAR_OPS[op](*(self._value(child, record, memo) for child in args))
+        memo[node_id] = value
+        return value
+
+    def _rule_points(self, rule: Rule, record: Dict[str, Any], memo: Dict) -> Tuple[bool, Any]:
+        key = ('rule', rule.id)
+        if key not in memo:
+            applied = rule.applies is None or bool(self._value(rule.applies, record, memo))
+            value = self._value(rule.points, record, memo) if applied else rule.otherwise
+            memo[key] = (applied, int(value) if isinstance(value, bool) else value)
+        return memo[key]
+
+    def _timed(self, name: str, started: int, calls: int = 1):
+        timing = self.timings.setdefault(name, [0, 0])
+        timing[0] += calls
+        timing[1] += time.perf_counter_ns() - started
+
+    def evaluate(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Score one invoice record (upload-handler field names + ml_anomaly)"""
+        memo: Dict = {}
+        checks_passed = 0
+        for rule in self.rules:
+            started = time.perf_counter_ns() if self.profile else 0
+            _, value = self._rule_points(rule, record, memo)
+            points = value * rule.weight
+            if points:
+                checks_passed += points
+            if self.profile:
+                self._timed(rule.id, started)
+
+        started = time.perf_counter_ns() if self.profile else 0
+        compliance_score = (checks_passed / self.total_checks) * 100
+        band = next((level for level in self.bands['levels'] if compliance_score >= level['min_score']),
+                    self.bands['default'])
+        risk_level, risk_score = band['risk_level'], band['risk_score']
+        if self.profile:
+            self._timed(self.bands['id'], started)
+
+        for spec, when in self.adjustments:
+            started = time.perf_counter_ns() if self.profile else 0
+            if self._value(when, record, memo):
+                risk_score += spec.get('add_risk_score', 0)
+                if 'escalate_above' in spec and risk_score > spec['escalate_above']:
+                    risk_level = spec['risk_level']
+            if self.profile:
+                self._timed(spec['id'], started)
+
+        started = time.perf_counter_ns() if self.profile else 0
+        anomalies = [message for message, when in self.messages if self._value(when, record, memo)]
+        dependencies = self._dependencies(record, memo)
+        if self.profile:
+            self._timed('messages+dependencies', started)
+
+        return {
+            'compliance_score': compliance_score,
+            'checks_passed': checks_passed,
+            'total_checks': self.total_checks,
+            'compliance_status': band['status'],
+            'risk_level': risk_level,
+            'risk_score': risk_score,
+            'anomalies_detected': anomalies,
+            'dependencies': dependencies
+        }
+
+    def dependencies(self, record: Dict[str, Any]) -> List[str]:
+        """Rule versions and reference entries evaluate() reads for this record"""
+        return self._dependencies(record, {})
+
+    def _dependencies(self, record: Dict[str, Any], memo: Dict) -> List[str]:
+        dependencies = [self.bands_dependency] + [f"rule:{spec['id']}@{spec.get('version', 1)}"
+                                                  for spec, _ in self.adjustments]
+        for rule in self.rules:
+            if not self._rule_points(rule, record, memo)[0]:
+                continue
+            dependencies.append(rule.dependency)
+            for lookup in rule.lookups:
+                items_node, reference = self.nodes[lookup][1]
+                formatter = self.references[reference][1]
+                dependencies.extend(formatter(item) for item in self._value(items_node, record, memo) or [])
+        return sorted(set(dependencies))
+
+    @property
+    def bands_dependency(self) -> str:
+        return f"rule:{self.bands['id']}@{self.bands.get('version', 1)}"
+
+    # ----- per chunk --------------------------------------------------------
+
+    def _frame_value(self, node_id: int, frame: pd.DataFrame, memo: Dict):
+        if node_id in memo:
+            return memo[node_id]
+        op, args = self.nodes[node_id]
+        rows = len(frame)
+        if op == 'const':
+            value = np.full(rows, args[0])
+        elif op == 'field':
+            value = frame[args[0]] if args[0] in frame else pd.Series([args[1]] * rows, dtype=object)
+        elif op == 'rule':
+            value = self._frame_rule_points(self._rules_by_id[args[0]], frame, memo)[1]
+        elif op in ('and', 'or'):
+            combine = np.logical_and if op == 'and' else np.logical_or
+            value = reduce(combine, (_truthy(self._frame_value(child, frame, memo)) for child in args))
+        elif op == 'present':
+            value = _truthy(self._frame_value(args[0], frame, memo))
+        elif op == 'not':
+            value = ~_truthy(self._frame_value(args[0], frame, memo))
+        elif op == 'number':
+            column = pd.Series(self._frame_value(args[0], frame, memo))
+            numbers = pd.to_numeric(column, errors='coerce')
+            leftovers = numbers.isna() & column.notna()
+            if leftovers.any():  # e.g. "1,234.00" - same parsing as the single path
+                numbers[leftovers] = column[leftovers].map(_to_number)
+            value = numbers.to_numpy(float)
+        elif op == 'len':
+            value = self._frame_value(args[0], frame, memo).str.len().fillna(0).to_numpy(int)
+        elif op in ('count_match', 'any_in'):
+            items = self._frame_value(args[0], frame, memo).explode()
+            if op == 'count_match':
+                flags = items.str.match(self.patterns[args[1]].pattern).fillna(False).astype(bool)
+                value = _per_row(flags, rows, 'sum')
+            else:
+                table = self.references[args[1]][0]
+                flags = items.isin([item for item in items.dropna().unique() if item in table])
+                value = _per_row(flags, rows, 'any').astype(bool)
+        else:
+            value = VECTOR_OPS[op](*(_numeric(self._frame_value(child, frame, memo)) for child in args))
+        memo[node_id] = value
+        return value
+
+    def _frame_rule_points(self, rule: Rule, frame: pd.DataFrame, memo: Dict) -> Tuple[np.ndarray, np.ndarray]:
+        key = ('rule', rule.id)
+        if key not in memo:
+            rows = len(frame)
+            applied = (np.ones(rows, dtype=bool) if rule.applies is None
+                       else _truthy(self._frame_value(rule.applies, frame, memo)))
+            points = _numeric(self._frame_value(rule.points, frame, memo))
+            memo[key] = (applied, np.where(applied, points, rule.otherwise))
+        return memo[key]
+
+    def evaluate_frame(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        evaluate() for every row of a chunk; columns as evaluate() plus float_checks
+        (True where the single path's checks_passed would be a float)
+        Each node runs once over the whole chunk; guards do not skip work here
+        """
+        memo: Dict = {}
+        rows = len(frame)
+        checks_passed = np.zeros(rows)
+        float_checks = np.zeros(rows, dtype=bool)
+        for rule in self.rules:
+            started = time.perf_counter_ns() if self.profile else 0
+            points = self._frame_rule_points(rule, frame, memo)[1] * rule.weight
+            checks_passed += points
+            if rule.float_points:
+                float_checks |= points != 0
+            if self.profile:
+                self._timed(rule.id, started, rows)
+
+        started = time.perf_counter_ns() if self.profile else 0
+        compliance_score = (checks_passed / self.total_checks) * 100
+        conditions = [compliance_score >= level['min_score'] for level in self.bands['levels']]
+        default = self.bands['default']
+        status = np.select(conditions, [level['status'] for level in self.bands['levels']], default['status'])
+        risk_level = np.select(conditions, [level['risk_level'] for level in self.bands['levels']],
+                               default['risk_level'])
+        risk_score = np.select(conditions, [level['risk_score'] for level in self.bands['levels']],
+                               default['risk_score'])
+        if self.profile:
+            self._timed(self.bands['id'], started, rows)
+
+        for spec, when in self.adjustments:
+            started = time.perf_counter_ns() if self.profile else 0
+            hit = _truthy(self._frame_value(when, frame, memo))
+            risk_score = risk_score + spec.get('add_risk_score', 0) * hit
+            if 'escalate_above' in spec:
+                risk_level = np.where(hit & (risk_score > spec['escalate_above']), spec['risk_level'], risk_level)
+            if self.profile:
+                self._timed(spec['id'], started, rows)
+
+        started = time.perf_counter_ns() if self.profile else 0
+        hits = [_truthy(self._frame_value(when, frame, memo)) for _, when in self.messages]
+        anomalies = _rows_from_bits(hits, rows, lambda bits: [
+            message for j, (message, _) in enumerate(self.messages) if bits >> j & 1
+        ])
+        dependencies = self._frame_dependencies(frame, memo)
+        if self.profile:
+            self._timed('messages+dependencies', started, rows)
+
+        return pd.DataFrame({
+            'compliance_score': compliance_score,
+            'checks_passed': checks_passed,
+            'float_checks': float_checks,
+            'compliance_status': status,
+            'risk_level': risk_level,
+            'risk_score': risk_score,
+            'anomalies_detected': pd.Series(anomalies, dtype=object),
+            'dependencies': pd.Series(dependencies, dtype=object)
+        }, index=frame.index)
+
+    def _frame_dependencies(self, frame: pd.DataFrame, memo: Dict) -> List[List[str]]:
+        """Built once per distinct (applied rules, looked-up keys) combination, not per row"""
+        rows = len(frame)
+        always = [self.bands_dependency] + [f"rule:{spec['id']}@{spec.get('version', 1)}"
+                                            for spec, _ in self.adjustments]
+        applied = [self._frame_rule_points(rule, frame, memo)[0] for rule in self.rules]
+        lookups = []  # (rule index, formatter, per-row key tuples)
+        for index, rule in enumerate(self.rules):
+            for lookup in rule.lookups:
+                items_node, reference = self.nodes[lookup][1]
+                keys = self._frame_value(items_node, frame, memo).map(lambda items: tuple(items) if items else ())
+                lookups.append((self.references[reference][1], np.where(applied[index], keys, None)))
+
+        def build(key) -> List[str]:
+            bits, looked_up = key[0], key[1:]
+            dependencies = always + [rule.dependency for j, rule in enumerate(self.rules) if bits >> j & 1]
+            for (formatter, _), items in zip(lookups, looked_up):
+                dependencies.extend(formatter(item) for item in items or ())
+            return sorted(set(dependencies))
+
+        bits = _bits(applied, rows)
+        cache: Dict[Tuple, List[str]] = {}
+        keys = zip(bits.tolist(), *(column.tolist() for _, column in lookups))
+        return [cache[key] if key in cache else cache.setdefault(key, build(key)) for key in keys]
+
+    # ----- profiling --------------------------------------------------------
+
+    def reset_timings(self):
+        self.timings = {}
+
+    def timing_report(self) -> List[Dict[str, Any]]:
+        """Per-rule cost, most expensive first; shared sub-expressions are charged to their first user"""
+        budgets = {rule.id: rule.budget_us for rule in self.rules}
+        report = []
+        for name, (calls, total_ns) in self.timings.items():
+            mean_us = total_ns / calls / 1000 if calls else 0.0
+            budget = budgets.get(name) or self.default_budget_us
+            report.append({
+                'rule': name,
+                'calls': calls,
+                'total_ms': total_ns / 1e6,
+                'mean_us': mean_us,
+                'budget_us': budget,
+                'over_budget': bool(budget and name in budgets and mean_us > budget)
+            })
+        return sorted(report, key=lambda r: r['total_ms'], reverse=True)
+
+
+def print_timing_report(plan: RulePlan, title: str):
+    print(f"\n⏱️ {title}")
+    print(f"   {'rule':<24}{'calls':>10}{'total ms':>12}{'mean µs':>10}{'budget':>8}")
+    for row in plan.timing_report():
+        flag = ' ⚠️' if row['over_budget'] else ''
+        print(f"   {row['rule']:<24}{row['calls']:>10}{row['total_ms']:>12.1f}{row['mean_us']:>10.2f}"
+              f"{row['budget_us'] or '-':>8}{flag}")
+
+
+if __name__ == "__main__":
+    import random
+
+    from benchmark_storage import synthetic_invoice
+    from compliance import COMPLIANCE_PLAN, compliance_record
+
+    plan = COMPLIANCE_PLAN
+    shared = plan.expressions_compiled - len(plan.nodes)
+    print(f"📋 {len(plan.rules)} rules compiled to {len(plan.nodes)} nodes "
+          f"({shared} sub-expressions shared, limit {MAX_PLAN_NODES})")
+
+    count = int(sys.argv[sys.argv.index("--profile") + 1]) if "--profile" in sys.argv else 10000
+    random.seed(42)
+    records = []
+    for i in range(count):
+        invoice_data = synthetic_invoice(i)
+        records.append(compliance_record(invoice_data, invoice_data, {'is_anomaly': random.random() < 0.1}))
+
+    plan.profile = True
+    started = time.perf_counter()
+    for record in records:
+        plan.evaluate(record)
+    elapsed = time.perf_counter() - started
+    print_timing_report(plan, f"Per invoice: {count} invoices in {elapsed * 1000:.0f} ms "
+                              f"({count / elapsed:,.0f}/s)")
+    over_budget = [row['rule'] for row in plan.timing_report() if row['over_budget']]
+
+    plan.reset_timings()
+    frame = pd.DataFrame({column: pd.Series([r.get(column) for r in records], dtype=object)
+                          for column in records[0]})
+    started = time.perf_counter()
+    plan.evaluate_frame(frame)
+    elapsed = time.perf_counter() - started
+    print_timing_report(plan, f"Batch: {count} invoices in {elapsed * 1000:.0f} ms ({count / elapsed:,.0f}/s)")
+
+    if over_budget:
+        print(f"\n❌ Over budget: {', '.join(over_budget)}")
+        sys.exit(1)
+    print("\n✅ All rules within budget")
@@ -0,0 +1,316 @@
+"""
+Split-Billing Detection for FINTEL AI
+Flags a large purchase split into several invoices just under the approval
+threshold: MIN_SPLIT_INVOICES or more invoices from the same GST number (or the
+same vendor name) dated within WINDOW_DAYS, each between NEAR_SHARE of the
+threshold and the threshold. Vendors that routinely bill close to the threshold
+get there by chance, so a cluster is only flagged when the vendor's own rate of
+near-threshold invoices outside the window makes it unlikely (Poisson tail
+under SPLIT_P_VALUE).
+
+Per upload this is O(1): only near-threshold invoices are tracked, as rollup
+documents in the `split_rollups` collection, one per key and day
+(`gst:<GSTIN>|<day>`, `vendor:<name>|<day>`: count, amount, the latest invoice
+ids) plus one running total per key (`<key>|all`: count, first and last day).
+Storing an invoice folds it into its rollups with one upsert each, and the rule
+reads the 2 x 2 x WINDOW_DAYS rollups around the invoice date by id; no history
+query. The batch mode streams the stored invoices once, finds every
+cluster with one sort and records SPLIT_BILLING on all of its invoices (the
+upload rule can only flag the invoice that completes a cluster); --rebuild also
+recomputes the rollups, e.g. for invoices stored before this rule existed. It
+replaces every rollup (the running totals included), so it cannot be combined
+with --since.
+
+Usage:
+    python split_billing.py [database_url] [--since YYYY-MM-DD] [--rebuild] [--dry-run]
+"""
+
+import math
+import os
+import sys
+import time
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from ml_features import parse_invoice_date
+
+SNAPSHOT_NAME = 'split_billing'
+APPROVAL_THRESHOLD = float(os.getenv('FINTEL_APPROVAL_THRESHOLD', 200_000))  # ₹, the sign-off limit
+NEAR_SHARE = 0.8          # an invoice from 80% of the threshold up to it counts as near the threshold
+WINDOW_DAYS = 7
+MIN_SPLIT_INVOICES = 3
+SPLIT_P_VALUE = 0.01      # chance of the cluster at the vendor's usual near-threshold rate
+RATE_MIN_DAYS = 30        # history (outside the window) needed before that rate is trusted
+MAX_ROLLUP_IDS = 20       # latest invoice ids kept per daily rollup (for relatedInvoiceId)
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def _amount(value: Any) -> float:
+    try:
+        return float(str(value).replace(',', '').replace('₹', '').strip()) if value is not None else 0.0
+    except ValueError:
+        return 0.0
+
+
+def is_near_threshold(amount: float, threshold: float = APPROVAL_THRESHOLD) -> bool:
+    return NEAR_SHARE * threshold <= amount < threshold
+
+
+def invoice_day(invoice_data: Dict[str, Any]) -> int:
+    """Ordinal of the invoice date (the upload date when unreadable)"""
+    day = parse_invoice_date(invoice_data.get('invoice_date')) or invoice_data.get('upload_date') or datetime.now()
+    return day.toordinal() if isinstance(day, (date, datetime)) else datetime.now().toordinal()
+
+
+def split_keys(invoice_data: Dict[str, Any]) -> List[str]:
+    """Rollup keys of an invoice: its first GST number and its vendor name"""
+    keys = []
+    gst_numbers = invoice_data.get('gst_numbers') or []
+    if gst_numbers and gst_numbers[0] and gst_numbers[0] != 'Unknown':
+        keys.append(f"gst:{gst_numbers[0]}")
+    vendor_name = str(invoice_data.get('vendor_name') or '').strip().lower()
+    if vendor_name and vendor_name != 'unknown':
+        keys.append(f"vendor:{vendor_name}")
+    return keys
+
+
+def rollup_id(key: str, day: int) -> str:
+    return f"{key}|{day}"
+
+
+def total_id(key: str) -> str:
+    return f"{key}|all"
+
+
+def poisson_tail(count: int, expected: float) -> float:
+    """P(N >= count) for N ~ Poisson(expected)"""
+    term = below = math.exp(-expected)
+    for k in range(1, count):
+        term *= expected / k
+        below += term
+    return max(0.0, 1.0 - below) if count > 0 else 1.0
+
+
+def cluster_p_value(count: int, key_total: int, first_day: int, last_day: int) -> float:
+    """How likely `count` near-threshold invoices in one window are at the key's rate outside it"""
+    span = last_day - first_day + 1 - WINDOW_DAYS
+    if span < RATE_MIN_DAYS:  # too little history for a rate: any cluster stands out
+        return 0.0
+    return poisson_tail(count, max(key_total - count, 0) / span * WINDOW_DAYS)
+
+
+def rollup_entries(invoice_data: Dict[str, Any], invoice_id: str) -> List[Dict[str, Any]]:
+    """The rollup increments for one stored invoice (none unless it is near the threshold)"""
+    amount = _amount(invoice_data.get('total_amount'))
+    if not is_near_threshold(amount):
+        return []
+    day = invoice_day(invoice_data)
+    entries = []
+    for key in split_keys(invoice_data):
+        entries.append({'_id': rollup_id(key, day), 'key': key, 'day': day, 'count': 1, 'amount': amount,
+                        'invoiceIds': [invoice_id]})
+        entries.append({'_id': total_id(key), 'key': key, 'day': None, 'count': 1, 'amount': amount,
+                        'firstDay': day, 'lastDay': day})
+    return entries
+
+
+def apply_rollup(rollup: Optional[Dict[str, Any]], entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Fold an entry into a stored rollup (the same result as the Mongo $inc / $push / $min / $max update)"""
+    if rollup is None:
+        rollup = {**entry, 'count': 0, 'amount': 0.0}
+        if 'invoiceIds' in entry:
+            rollup['invoiceIds'] = []
+    merged = {**rollup, 'count': rollup['count'] + entry['count'], 'amount': rollup['amount'] + entry['amount']}
+    if 'invoiceIds' in entry:
+        merged['invoiceIds'] = (rollup['invoiceIds'] + entry['invoiceIds'])[-MAX_ROLLUP_IDS:]
+    else:
+        merged['firstDay'] = min(rollup['firstDay'], entry['firstDay'])
+        merged['lastDay'] = max(rollup['lastDay'], entry['lastDay'])
+    return merged
+
+
+def merge_rollup_entries(entries: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """{rollup id: entry} with the entries of one batch combined"""
+    merged = {}
+    for entry in entries:
+        merged[entry['_id']] = apply_rollup(merged.get(entry['_id']), entry)
+    return merged
+
+
+def window_rollup_ids(invoice_data: Dict[str, Any]) -> List[str]:
+    """Ids of every rollup a cluster containing this invoice could touch (none when it is not near the threshold)"""
+    if not is_near_threshold(_amount(invoice_data.get('total_amount'))):
+        return []
+    day = invoice_day(invoice_data)
+    return [rollup for key in split_keys(invoice_data)
+            for rollup in [total_id(key)] + [rollup_id(key, day + offset) for offset in range(1 - WINDOW_DAYS, WINDOW_DAYS)]]
+
+
+def split_billing_anomaly(invoice_data: Dict[str, Any], invoice_id: str,
+                          rollups: Dict[str, Dict[str, Any]]) -> List[Dict]:
+    """SPLIT_BILLING when the invoice is part of a near-threshold cluster (`rollups`: by id, see window_rollup_ids)"""
+    amount = _amount(invoice_data.get('total_amount'))
+    if not is_near_threshold(amount):
+        return []
+    day = invoice_day(invoice_data)
+    best = None
+    for key in split_keys(invoice_data):
+        days = [rollups.get(rollup_id(key, day + offset)) or {'count': 0, 'amount': 0.0, 'invoiceIds': []}
+                for offset in range(1 - WINDOW_DAYS, WINDOW_DAYS)]
+        total = rollups.get(total_id(key)) or {'count': 0, 'firstDay': day, 'lastDay': day}
+        own = days[WINDOW_DAYS - 1]
+        if invoice_id not in own['invoiceIds']:  # not stored yet (or stored before the rollups existed)
+            days[WINDOW_DAYS - 1] = apply_rollup(own, {'count': 1, 'amount': amount, 'invoiceIds': [invoice_id]})
+            total = {'count': total['count'] + 1, 'firstDay': min(total['firstDay'], day),
+                     'lastDay': max(total['lastDay'], day)}
+        # Every WINDOW_DAYS-day window that contains the invoice date
+        for start in range(WINDOW_DAYS):
+            window = days[start:start + WINDOW_DAYS]
+            count = sum(d['count'] for d in window)
+            if count < MIN_SPLIT_INVOICES or (best and count <= best['count']):
+                continue
+            p_value = cluster_p_value(count, total['count'], total['firstDay'], total['lastDay'])
+            if p_value < SPLIT_P_VALUE:
+                best = {'key': key, 'count': count, 'amount': sum(d['amount'] for d in window), 'p_value': p_value,
+                        'related': [i for d in window for i in d['invoiceIds'] if i != invoice_id]}
+    if best is None:
+        return []
+    source = 'GST number' if best['key'].startswith('gst:') else 'vendor'
+    return [{
+        'type': 'SPLIT_BILLING',
+        'severity': 'HIGH',
+        'description': f"{best['count']} invoices from the same {source} ({invoice_data.get('vendor_name')}) "
+                       f"dated within {WINDOW_DAYS} days, each just under the ₹{APPROVAL_THRESHOLD:,.0f} approval "
+                       f"threshold (₹{best['amount']:,.0f} together) - possible split billing",
+        'relatedInvoiceId': best['related'][0] if best['related'] else None
+    }]
+
+
+def find_split_clusters(keys: List[str], days: np.ndarray, amounts: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    Clusters among near-threshold rows in one sort: rows of a key within WINDOW_DAYS of each other,
+    at least MIN_SPLIT_INVOICES of them. Returns [{'key', 'rows' (indexes), 'first_day', 'last_day', 'amount',
+    'count' (the most rows in one window), 'p_value'}], keeping clusters the key's own rate makes unlikely
+    """
+    if not keys:
+        return []
+    names, codes = np.unique(np.asarray(keys), return_inverse=True)
+    days = np.asarray(days, dtype=np.int64)
+    order = np.lexsort((days, codes))
+    position = codes[order] * (1 << 22) + days[order]  # ordinals stay far below 2**22
+    # Rows in the window ending at each row, same key (the key term keeps keys apart)
+    first = np.searchsorted(position, position - (WINDOW_DAYS - 1), side='left')
+    in_window = np.arange(len(order)) - first + 1
+    full = np.flatnonzero(in_window >= MIN_SPLIT_INVOICES)
+    cover = np.zeros(len(order) + 1, dtype=np.int64)
+    np.add.at(cover, first[full], 1)
+    np.add.at(cover, full + 1, -1)
+    flagged = np.cumsum(cover[:-1]) > 0
+    # A cluster is a run of flagged rows of one key without a WINDOW_DAYS gap
+    sorted_days, sorted_codes = days[order], codes[order]
+    # Near-threshold totals and span per key, for the rate outside the cluster
+    key_totals = np.bincount(codes, minlength=len(names))
+    key_first = np.full(len(names), np.iinfo(np.int64).max)
+    key_last = np.full(len(names), np.iinfo(np.int64).min)
+    np.minimum.at(key_first, codes, days)
+    np.maximum.at(key_last, codes, days)
+    breaks = np.ones(len(order), dtype=bool)
+    breaks[1:] = ~flagged[:-1] | (sorted_codes[1:] != sorted_codes[:-1]) | (np.diff(sorted_days) >= WINDOW_DAYS)
+    clusters = []
+    for run in np.split(np.flatnonzero(flagged), np.flatnonzero(breaks[flagged])[1:]):
+        if len(run) < MIN_SPLIT_INVOICES:
+            continue
+        code, count = sorted_codes[run[0]], int(in_window[run].max())
+        p_value = cluster_p_value(count, int(key_totals[code]), int(key_first[code]), int(key_last[code]))
+        if p_value < SPLIT_P_VALUE:
+            rows = order[run]
+            clusters.append({'key': str(names[code]), 'rows': rows.tolist(),
+                             'first_day': int(sorted_days[run[0]]), 'last_day': int(sorted_days[run[-1]]),
+                             'amount': float(np.asarray(amounts, dtype=float)[rows].sum()),
+                             'count': count, 'p_value': p_value})
+    return clusters
+
+
+def scan_store(store, since: Optional[datetime] = None, rebuild: bool = False, dry_run: bool = False,
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+    """Batch mode: one streaming pass, every cluster flagged on all of its invoices; returns the run summary"""
+    from storage import anomaly_record, invoice_data_from_doc
+
+    if rebuild and since is not None:
+        # Rollups of older invoices (and the running totals the rate test relies on) would be lost
+        raise ValueError("rebuild replaces every split rollup, so it needs the full history - drop since")
+
+    started = time.perf_counter()
+    seen, keys, days, amounts, rows, entries = 0, [], [], [], [], []
+    for invoice in store.iter_invoices(start_date=since, batch_size=chunk_size):
+        seen += 1
+        record = invoice_data_from_doc(invoice)
+        amount = _amount(record['total_amount'])
+        if not is_near_threshold(amount):
+            continue
+        record['upload_date'] = invoice.get('uploadDate')
+        invoice_id, day = str(invoice['_id']), invoice_day(record)
+        for key in split_keys(record):
+            keys.append(key)
+            days.append(day)
+            amounts.append(amount)
+            rows.append((invoice_id, record))
+        if rebuild:
+            entries.extend(rollup_entries(record, invoice_id))
+    stream_seconds = time.perf_counter() - started
+
+    clusters = find_split_clusters(keys, np.array(days, dtype=np.int64), np.array(amounts))
+    flagged = {}
+    for cluster in sorted(clusters, key=lambda c: len(c['rows'])):  # an invoice keeps its largest cluster
+        members = [rows[i][0] for i in cluster['rows']]
+        source = 'GST number' if cluster['key'].startswith('gst:') else 'vendor'
+        for i in cluster['rows']:
+            invoice_id, record = rows[i]
+            related = next((m for m in members if m != invoice_id), None)
+            flagged[invoice_id] = anomaly_record(invoice_id, record, {
+                'type': 'SPLIT_BILLING',
+                'severity': 'HIGH',
+                'description': f"{len(members)} invoices from the same {source} ({record.get('vendor_name')}) dated "
+                               f"{date.fromordinal(cluster['first_day'])} to {date.fromordinal(cluster['last_day'])}, "
+                               f"each just under the ₹{APPROVAL_THRESHOLD:,.0f} approval threshold "
+                               f"(₹{cluster['amount']:,.0f} together) - possible split billing",
+                'relatedInvoiceId': related
+            })
+    summary = {
+        'invoices': seen,
+        'near_threshold': len({invoice_id for invoice_id, _ in rows}),
+        'clusters': len(clusters),
+        'flagged': len(flagged),
+        'threshold': APPROVAL_THRESHOLD,
+        'window_days': WINDOW_DAYS,
+        'since': since.isoformat() if since else None,
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+    print(f"📥 {seen:,} invoices in {stream_seconds:.1f}s ({seen / max(stream_seconds, 1e-9):,.0f}/s), "
+          f"{summary['near_threshold']:,} within {1 - NEAR_SHARE:.0%} under ₹{APPROVAL_THRESHOLD:,.0f}")
+    print(f"✂️ {len(clusters):,} split-billing clusters, {len(flagged):,} invoices flagged")
+    if dry_run:
+        print("🔍 Dry run - nothing written")
+        return summary
+    store.insert_anomalies(list(flagged.values()))
+    if rebuild:
+        rollups = merge_rollup_entries(entries)
+        store.replace_split_rollups(rollups)
+        print(f"💾 Rebuilt {len(rollups):,} split rollups")
+    store.save_reference_snapshot(SNAPSHOT_NAME, summary)
+    return summary
+
+
+if __name__ == "__main__":
+    from database import DEFAULT_CONNECTION_STRING, get_database
+
+    has_url = len(sys.argv) > 1 and not sys.argv[1].startswith('--')
+    since = sys.argv[sys.argv.index('--since') + 1] if '--since' in sys.argv else None
+    if since and '--rebuild' in sys.argv:
+        print("❌ --rebuild replaces every split rollup and needs the full history; run it without --since")
+        sys.exit(2)
+    scan_store(get_database(sys.argv[1] if has_url else DEFAULT_CONNECTION_STRING),
+               since=datetime.fromisoformat(since) if since else None,
+               rebuild='--rebuild' in sys.argv, dry_run='--dry-run' in sys.argv)
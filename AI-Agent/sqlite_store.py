@@ -0,0 +1,740 @@
+"""
+Embedded SQLite Storage for FINTEL AI
+SQLite / in-memory implementation of storage.InvoiceStore with the same
+query semantics and indexes as the MongoDB backend. Lets the pipeline run
+in tests, CI and local benchmarks without a mongod.
+
+Select it with FINTEL_DATABASE_URL=sqlite:///fintel.db (or sqlite:///:memory:)
+"""
+
+import json
+import secrets
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Iterator
+
+from storage import (
+    InvoiceStore, build_invoice_doc, build_invoice_details, compress_details, decompress_details, DETAILS_ENCODING,
+    json_default, json_object_hook, tokenize, SEARCH_FACET_LIMIT, search_page,
+    serialize_invoice, serialize_vendor, serialize_anomaly, shape_anomaly_trends
+)
+from price_index import KLLSketch, build_sketches, merge_into, price_index_doc, price_observations
+from vendor_baselines import apply_observation
+from split_billing import apply_rollup, merge_rollup_entries, rollup_entries
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    id TEXT PRIMARY KEY,
+    invoiceNumber TEXT,
+    vendorName TEXT,
+    gstNumber TEXT,
+    totalAmount REAL,
+    uploadDate TEXT,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS invoice_details (
+    invoice_id TEXT PRIMARY KEY,
+    encoding TEXT NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS invoice_hsn (
+    invoice_id TEXT NOT NULL,
+    hsn TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS invoice_deps (
+    invoice_id TEXT NOT NULL,
+    dep TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reference_snapshots (
+    name TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS invoice_search USING fts5(
+    invoice_id UNINDEXED,
+    itemDescriptions,
+    vendorName,
+    searchTerms
+);
+CREATE TABLE IF NOT EXISTS vendors (
+    id TEXT NOT NULL,
+    gstNumber TEXT PRIMARY KEY,
+    vendorName TEXT,
+    totalInvoices INTEGER,
+    totalAmount REAL,
+    firstInvoiceDate TEXT,
+    lastInvoiceDate TEXT
+);
+CREATE TABLE IF NOT EXISTS anomalies (
+    id TEXT PRIMARY KEY,
+    invoiceId TEXT,
+    invoiceNumber TEXT,
+    vendorName TEXT,
+    anomalyType TEXT,
+    severity TEXT,
+    detectedDate TEXT,
+    detectedAt TEXT,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS price_index (
+    key TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS vendor_clusters (
+    gstNumber TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS vendor_baselines (
+    gstNumber TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS split_rollups (
+    id TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hsn_codes (
+    key TEXT,
+    hsn_code TEXT,
+    description TEXT,
+    gst_rate TEXT,
+    version INTEGER,
+    updatedAt TEXT
+);
+"""
+
+RISK_LEVEL = "json_extract(doc, '$.complianceResults.risk_level')"
+
+# Same indexes as FintelDatabase.create_indexes (vendors.gstNumber is the primary key)
+INDEXES = f"""
+DROP INDEX IF EXISTS idx_invoices_gst;
+DROP INDEX IF EXISTS idx_invoices_vendor;
+DROP INDEX IF EXISTS idx_anomalies_type;
+DROP INDEX IF EXISTS idx_anomalies_invoice;
+DROP INDEX IF EXISTS idx_anomalies_severity;
+CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices(invoiceNumber);
+CREATE INDEX IF NOT EXISTS idx_invoices_gst_upload ON invoices(gstNumber, uploadDate);
+CREATE INDEX IF NOT EXISTS idx_invoices_vendor_upload ON invoices(vendorName, uploadDate);
+CREATE INDEX IF NOT EXISTS idx_invoices_gst_vendor ON invoices(gstNumber, vendorName);
+CREATE INDEX IF NOT EXISTS idx_invoices_risk_upload ON invoices({RISK_LEVEL}, uploadDate);
+CREATE INDEX IF NOT EXISTS idx_invoices_upload ON invoices(uploadDate);
+CREATE INDEX IF NOT EXISTS idx_invoices_amount ON invoices(totalAmount);
+CREATE INDEX IF NOT EXISTS idx_invoice_hsn ON invoice_hsn(hsn, invoice_id);
+CREATE INDEX IF NOT EXISTS idx_invoice_deps ON invoice_deps(dep, invoice_id);
+CREATE INDEX IF NOT EXISTS idx_invoice_deps_invoice ON invoice_deps(invoice_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_hsn_codes_key ON hsn_codes(key);
+CREATE INDEX IF NOT EXISTS idx_vendors_name ON vendors(vendorName);
+CREATE INDEX IF NOT EXISTS idx_vendors_amount ON vendors(totalAmount);
+-- one anomaly per invoice and type (older files are deduplicated first)
+DELETE FROM anomalies WHERE rowid NOT IN (SELECT MIN(rowid) FROM anomalies GROUP BY invoiceId, anomalyType);
+DROP INDEX IF EXISTS idx_anomalies_invoice_type;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_anomalies_key ON anomalies(invoiceId, anomalyType);
+CREATE INDEX IF NOT EXISTS idx_anomalies_type_invoice ON anomalies(anomalyType, invoiceId);
+CREATE INDEX IF NOT EXISTS idx_anomalies_severity_detected ON anomalies(severity, detectedDate);
+CREATE INDEX IF NOT EXISTS idx_anomalies_detected ON anomalies(detectedDate);
+CREATE INDEX IF NOT EXISTS idx_anomalies_detected_at ON anomalies(detectedAt);
+CREATE INDEX IF NOT EXISTS idx_anomalies_vendor ON anomalies(vendorName);
+"""
+
+# Invoice fields copied into indexed columns
+MIRRORED_COLUMNS = ('invoiceNumber', 'vendorName', 'gstNumber', 'totalAmount', 'uploadDate')
+
+VENDOR_COLUMNS = ['id', 'gstNumber', 'vendorName', 'totalInvoices', 'totalAmount', 'firstInvoiceDate', 'lastInvoiceDate']
+
+
+def _new_id() -> str:
+    """24 hex chars, same shape as a Mongo ObjectId string"""
+    return secrets.token_hex(12)
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _dump(doc: Dict) -> str:
+    return json.dumps({k: v for k, v in doc.items() if k != '_id'}, default=json_default, ensure_ascii=False)
+
+
+def _load(row_id: str, doc_json: str) -> Dict:
+    doc = json.loads(doc_json, object_hook=json_object_hook)
+    doc['_id'] = row_id
+    return doc
+
+
+def _vendor_from_row(row) -> Dict:
+    vendor = dict(zip(VENDOR_COLUMNS, row))
+    vendor['_id'] = vendor.pop('id')
+    for key in ('firstInvoiceDate', 'lastInvoiceDate'):
+        if vendor.get(key):
+            vendor[key] = datetime.fromisoformat(vendor[key])
+    return vendor
+
+
+class SQLiteFintelDatabase(InvoiceStore):
+    """
+    SQLite-backed repository
+    Queried fields live in indexed columns, the full document in a JSON column
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+
+        with self._lock:
+            self.conn.executescript(SCHEMA)
+            self._migrate_hsn_codes()
+        # No separate deploy step for an embedded database
+        self.create_indexes()
+
+    @classmethod
+    def from_url(cls, url: str) -> "SQLiteFintelDatabase":
+        """
+        sqlite:///fintel.db -> fintel.db, sqlite:////var/data/fintel.db -> /var/data/fintel.db,
+        sqlite:///:memory: or sqlite:// -> in-memory (one slash after sqlite:// is dropped, as in SQLAlchemy)
+        """
+        path = url[len("sqlite://"):]
+        path = (path[1:] if path.startswith('/') else path) or ":memory:"
+        return cls(path)
+
+    def _migrate_hsn_codes(self):
+        """Files from before diff-based HSN refreshes: add the key/version columns"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(hsn_codes)")}
+        with self.conn:
+            for column, kind in (('key', 'TEXT'), ('version', 'INTEGER'), ('updatedAt', 'TEXT')):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE hsn_codes ADD COLUMN {column} {kind}")
+            self.conn.execute("UPDATE hsn_codes SET key = 'legacy:' || rowid WHERE key IS NULL")
+
+    def create_indexes(self):
+        """Create indexes (idempotent)"""
+        with self._lock:
+            self.conn.executescript(INDEXES)
+
+    def disconnect(self):
+        with self._lock:
+            self.conn.close()
+
+    def _query(self, sql: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # ----- writes -----------------------------------------------------------
+
+    def store_invoice(self, invoice_data: Dict[str, Any]) -> str:
+        """
+        Store invoice in database
+        Returns: invoice_id
+        """
+        invoice_doc = build_invoice_doc(invoice_data)
+        invoice_id = _new_id()
+
+        with self._lock, self.conn:
+            self._insert_invoices([invoice_id], [invoice_doc], [invoice_data])
+            self._update_vendor_stats([invoice_doc])
+            self._merge_price_sketches(build_sketches(price_observations(invoice_doc['lineItems'])))
+            self._merge_split_rollups(rollup_entries(invoice_data, invoice_id))
+
+        print(f"✅ Invoice stored: {invoice_doc['invoiceNumber']} (ID: {invoice_id})")
+        return invoice_id
+
+    def store_invoices(self, invoices: List[Dict[str, Any]]) -> List[str]:
+        """Bulk store in one transaction: executemany per table, vendor and price rows merged per batch"""
+        invoice_docs = [build_invoice_doc(invoice_data) for invoice_data in invoices]
+        invoice_ids = [_new_id() for _ in invoices]
+        with self._lock, self.conn:
+            self._insert_invoices(invoice_ids, invoice_docs, invoices)
+            self._update_vendor_stats(invoice_docs)
+            self._merge_price_sketches(build_sketches(price_observations(
+                [item for doc in invoice_docs for item in doc['lineItems']]
+            )))
+            self._merge_split_rollups([entry for invoice_id, invoice_data in zip(invoice_ids, invoices)
+                                       for entry in rollup_entries(invoice_data, invoice_id)])
+        return invoice_ids
+
+    def _insert_invoices(self, invoice_ids: List[str], invoice_docs: List[Dict], invoices: List[Dict[str, Any]]):
+        """Rows of the invoice tables (caller holds the lock/transaction)"""
+        self.conn.executemany(
+            "INSERT INTO invoices (id, invoiceNumber, vendorName, gstNumber, totalAmount, uploadDate, doc) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(invoice_id, doc['invoiceNumber'], doc['vendorName'], doc['gstNumber'], doc['totalAmount'],
+              _iso(doc['uploadDate']), _dump(doc)) for invoice_id, doc in zip(invoice_ids, invoice_docs)]
+        )
+        self.conn.executemany(
+            "INSERT INTO invoice_details (invoice_id, encoding, payload) VALUES (?, ?, ?)",
+            [(invoice_id, DETAILS_ENCODING, compress_details(build_invoice_details(invoice_data)))
+             for invoice_id, invoice_data in zip(invoice_ids, invoices)]
+        )
+        self.conn.executemany(
+            "INSERT INTO invoice_hsn (invoice_id, hsn) VALUES (?, ?)",
+            [(invoice_id, hsn) for invoice_id, doc in zip(invoice_ids, invoice_docs) for hsn in set(doc['hsnCodes'] or [])]
+        )
+        self.conn.executemany(
+            "INSERT INTO invoice_deps (invoice_id, dep) VALUES (?, ?)",
+            [(invoice_id, dep) for invoice_id, doc in zip(invoice_ids, invoice_docs) for dep in doc['complianceDeps']]
+        )
+        self.conn.executemany(
+            "INSERT INTO invoice_search (invoice_id, itemDescriptions, vendorName, searchTerms) VALUES (?, ?, ?, ?)",
+            [(invoice_id, ' '.join(map(str, doc['itemDescriptions'] or [])), doc['vendorName'] or '',
+              ' '.join(doc['searchTerms'])) for invoice_id, doc in zip(invoice_ids, invoice_docs)]
+        )
+
+    def _update_vendor_stats(self, invoice_docs: List[Dict]):
+        """Same upsert as the Mongo backend, one row per vendor in the batch (caller holds the lock/transaction)"""
+        totals: Dict[str, List] = {}
+        for doc in invoice_docs:
+            gst_number = doc.get('gstNumber')
+            if not gst_number or gst_number == 'Unknown':
+                continue
+            count, amount, _ = totals.get(gst_number, (0, 0.0, None))
+            totals[gst_number] = [count + 1, amount + (doc.get('totalAmount') or 0), doc.get('vendorName')]
+        if not totals:
+            return
+
+        now = datetime.now().isoformat()
+        self.conn.executemany(
+            "INSERT INTO vendors (id, gstNumber, vendorName, totalInvoices, totalAmount, firstInvoiceDate, lastInvoiceDate) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(gstNumber) DO UPDATE SET "
+            "totalInvoices = totalInvoices + excluded.totalInvoices, totalAmount = totalAmount + excluded.totalAmount, "
+            "lastInvoiceDate = excluded.lastInvoiceDate, vendorName = excluded.vendorName",
+            [(_new_id(), gst_number, vendor_name, count, amount, now, now)
+             for gst_number, (count, amount, vendor_name) in totals.items()]
+        )
+
+    def _merge_price_sketches(self, sketches: Dict[str, KLLSketch]):
+        """Read-merge-write under the caller's lock/transaction"""
+        for key, sketch in sketches.items():
+            row = self.conn.execute("SELECT doc FROM price_index WHERE key = ?", (key,)).fetchone()
+            stored = json.loads(row[0], object_hook=json_object_hook) if row else None
+            doc = price_index_doc(merge_into(stored, sketch), (stored or {}).get('version', 0) + 1)
+            self.conn.execute(
+                "INSERT INTO price_index (key, doc) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET doc = excluded.doc",
+                (key, json.dumps(doc, default=json_default))
+            )
+
+    def merge_price_sketches(self, sketches: Dict[str, KLLSketch]) -> None:
+        with self._lock, self.conn:
+            self._merge_price_sketches(sketches)
+
+    def replace_price_index(self, sketches: Dict[str, KLLSketch]) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM price_index")
+            self.conn.executemany(
+                "INSERT INTO price_index (key, doc) VALUES (?, ?)",
+                [(key, json.dumps(price_index_doc(sketch, 0), default=json_default)) for key, sketch in sketches.items()]
+            )
+
+    def replace_vendor_clusters(self, assignments: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM vendor_clusters")
+            self.conn.executemany(
+                "INSERT INTO vendor_clusters (gstNumber, doc) VALUES (?, ?)",
+                [(gst_number, json.dumps(assignment, default=json_default)) for gst_number, assignment in assignments.items()]
+            )
+
+    def merge_vendor_baseline(self, gst_number: str, observation: Dict[str, Any]) -> None:
+        """Read-merge-write under the lock (same result as the Mongo $inc update)"""
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT doc FROM vendor_baselines WHERE gstNumber = ?", (gst_number,)).fetchone()
+            baseline = apply_observation(json.loads(row[0], object_hook=json_object_hook) if row else None, observation)
+            self.conn.execute(
+                "INSERT INTO vendor_baselines (gstNumber, doc) VALUES (?, ?) "
+                "ON CONFLICT(gstNumber) DO UPDATE SET doc = excluded.doc",
+                (gst_number, json.dumps(baseline, default=json_default))
+            )
+
+    def replace_vendor_baselines(self, baselines: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM vendor_baselines")
+            self.conn.executemany(
+                "INSERT INTO vendor_baselines (gstNumber, doc) VALUES (?, ?)",
+                [(gst_number, json.dumps(baseline, default=json_default)) for gst_number, baseline in baselines.items()]
+            )
+
+    def merge_split_rollups(self, entries: List[Dict[str, Any]]) -> None:
+        with self._lock, self.conn:
+            self._merge_split_rollups(entries)
+
+    def _merge_split_rollups(self, entries: List[Dict[str, Any]]):
+        """Read-merge-write of the touched rollups (caller holds the lock/transaction)"""
+        merged = merge_rollup_entries(entries)
+        if not merged:
+            return
+        ids = list(merged)
+        stored = {row_id: json.loads(doc) for row_id, doc in self.conn.execute(
+            f"SELECT id, doc FROM split_rollups WHERE id IN ({', '.join('?' * len(ids))})", ids
+        )}
+        self.conn.executemany(
+            "INSERT INTO split_rollups (id, doc) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET doc = excluded.doc",
+            [(rollup_id, json.dumps(apply_rollup(stored.get(rollup_id), entry))) for rollup_id, entry in merged.items()]
+        )
+
+    def replace_split_rollups(self, rollups: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM split_rollups")
+            self.conn.executemany(
+                "INSERT INTO split_rollups (id, doc) VALUES (?, ?)",
+                [(rollup_id, json.dumps(rollup)) for rollup_id, rollup in rollups.items()]
+            )
+
+    def insert_anomalies(self, records: List[Dict]) -> None:
+        """Insert already-built anomaly records (an existing invoiceId/anomalyType pair is kept)"""
+        rows = []
+        for record in records:
+            rows.append((
+                _new_id(), record.get('invoiceId'), record.get('invoiceNumber'), record.get('vendorName'),
+                record.get('anomalyType'), record.get('severity'),
+                _iso(record.get('detectedDate')), _iso(record.get('detectedAt')), _dump(record)
+            ))
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO anomalies (id, invoiceId, invoiceNumber, vendorName, anomalyType, severity, "
+                "detectedDate, detectedAt, doc) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def set_invoice_fields(self, updates: Dict[str, Dict[str, Any]]) -> int:
+        """json_set on the document, plus the mirrored columns"""
+        rows = 0
+        with self._lock, self.conn:
+            for invoice_id, fields in updates.items():
+                paths = ', '.join('?, json(?)' for _ in fields)
+                params = []
+                for path, value in fields.items():
+                    params.extend([f"$.{path}", json.dumps(value, default=json_default)])
+                columns = ''.join(f", {path} = ?" for path in fields if path in MIRRORED_COLUMNS)
+                mirrored = [_iso(value) for path, value in fields.items() if path in MIRRORED_COLUMNS]
+                rows += self.conn.execute(
+                    f"UPDATE invoices SET doc = json_set(doc, {paths}){columns} WHERE id = ?",
+                    (*params, *mirrored, invoice_id)
+                ).rowcount
+                if 'complianceDeps' in fields:
+                    self.conn.execute("DELETE FROM invoice_deps WHERE invoice_id = ?", (invoice_id,))
+                    self.conn.executemany(
+                        "INSERT INTO invoice_deps (invoice_id, dep) VALUES (?, ?)",
+                        [(invoice_id, dep) for dep in fields['complianceDeps']]
+                    )
+        return rows
+
+    def apply_hsn_changes(self, upserts: List[Dict[str, Any]], deletes: List[Any], version: int) -> int:
+        """Upsert changed HSN rows by key and drop removed ones in one transaction"""
+        now = datetime.now().isoformat()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO hsn_codes (key, hsn_code, description, gst_rate, version, updatedAt) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET hsn_code = excluded.hsn_code, "
+                "description = excluded.description, gst_rate = excluded.gst_rate, "
+                "version = excluded.version, updatedAt = excluded.updatedAt",
+                [(row['key'], row.get('hsn_code'), row.get('description'), row.get('gst_rate'), version, now)
+                 for row in upserts]
+            )
+            self.conn.executemany("DELETE FROM hsn_codes WHERE key = ?", [(key,) for key in deletes])
+        return len(upserts) + len(deletes)
+
+    def get_hsn_codes(self) -> List[Dict[str, Any]]:
+        rows = self._query("SELECT key, hsn_code, description, gst_rate, version FROM hsn_codes")
+        return [dict(zip(('key', 'hsn_code', 'description', 'gst_rate', 'version'), row)) for row in rows]
+
+    def save_reference_snapshot(self, name: str, snapshot: Dict[str, Any]):
+        doc = {**snapshot, 'savedAt': datetime.now()}
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO reference_snapshots (name, doc) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET doc = excluded.doc",
+                (name, json.dumps(doc, default=json_default))
+            )
+
+    # ----- point lookups ----------------------------------------------------
+
+    def get_invoice(self, invoice_id: str) -> Optional[Dict]:
+        rows = self._query("SELECT id, doc FROM invoices WHERE id = ?", (invoice_id,))
+        return _load(*rows[0]) if rows else None
+
+    def get_invoice_details(self, invoice_id: str) -> Optional[Dict]:
+        rows = self._query("SELECT payload FROM invoice_details WHERE invoice_id = ?", (invoice_id,))
+        return decompress_details(rows[0][0]) if rows else None
+
+    def get_invoice_details_many(self, invoice_ids: List[str]) -> Dict[str, Dict]:
+        details = {}
+        for start in range(0, len(invoice_ids), 500):  # stay under SQLite's variable limit
+            chunk = invoice_ids[start:start + 500]
+            rows = self._query(
+                f"SELECT invoice_id, payload FROM invoice_details WHERE invoice_id IN ({', '.join('?' * len(chunk))})",
+                chunk
+            )
+            details.update((invoice_id, decompress_details(payload)) for invoice_id, payload in rows)
+        return details
+
+    def get_reference_snapshot(self, name: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT doc FROM reference_snapshots WHERE name = ?", (name,))
+        return json.loads(rows[0][0], object_hook=json_object_hook) if rows else None
+
+    def get_price_stats(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        keys, stats = list(keys), {}
+        for start in range(0, len(keys), 500):  # stay under SQLite's variable limit
+            chunk = keys[start:start + 500]
+            rows = self._query(
+                f"SELECT key, json_extract(doc, '$.stats') FROM price_index WHERE key IN ({', '.join('?' * len(chunk))})",
+                chunk
+            )
+            stats.update((key, json.loads(entry)) for key, entry in rows)
+        return stats
+
+    def get_vendor_cluster(self, gst_number: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT doc FROM vendor_clusters WHERE gstNumber = ?", (gst_number,))
+        return json.loads(rows[0][0], object_hook=json_object_hook) if rows else None
+
+    def get_vendor_baseline(self, gst_number: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT doc FROM vendor_baselines WHERE gstNumber = ?", (gst_number,))
+        return json.loads(rows[0][0], object_hook=json_object_hook) if rows else None
+
+    def get_split_rollups(self, rollup_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        rollup_ids = list(rollup_ids)
+        if not rollup_ids:
+            return {}
+        rows = self._query(f"SELECT id, doc FROM split_rollups WHERE id IN ({', '.join('?' * len(rollup_ids))})",
+                           rollup_ids)
+        return {row_id: json.loads(doc) for row_id, doc in rows}
+
+    def get_latest_invoice(self) -> Optional[Dict]:
+        rows = self._query("SELECT id, doc FROM invoices ORDER BY uploadDate DESC, rowid DESC LIMIT 1")
+        return _load(*rows[0]) if rows else None
+
+    def find_invoice_by_number(self, invoice_number: Optional[str], exclude_id: Optional[str] = None) -> Optional[Dict]:
+        # IS / IS NOT match Mongo's null handling for equality and $ne
+        rows = self._query(
+            "SELECT id, doc FROM invoices WHERE invoiceNumber IS ? AND id IS NOT ? LIMIT 1",
+            (invoice_number, exclude_id)
+        )
+        return _load(*rows[0]) if rows else None
+
+    def find_gst_vendor_mismatch(self, gst_number: str, vendor_name: Optional[str],
+                                 exclude_id: Optional[str] = None) -> Optional[Dict]:
+        rows = self._query(
+            "SELECT id, doc FROM invoices WHERE gstNumber = ? AND vendorName IS NOT ? AND id IS NOT ? LIMIT 1",
+            (gst_number, vendor_name, exclude_id)
+        )
+        return _load(*rows[0]) if rows else None
+
+    def find_invoices_with_hsn(self, hsn: str, exclude_id: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        rows = self._query(
+            "SELECT i.id, i.doc FROM invoice_hsn h JOIN invoices i ON i.id = h.invoice_id "
+            "WHERE h.hsn = ? AND i.id IS NOT ? LIMIT ?",
+            (hsn, exclude_id, limit)
+        )
+        return [_load(*row) for row in rows]
+
+    def vendors_stats(self, vendor_name: str) -> List[Dict]:
+        rows = self._query(
+            "SELECT AVG(totalAmount), MAX(totalAmount), MIN(totalAmount), COUNT(*) FROM invoices WHERE vendorName = ?",
+            (vendor_name,)
+        )
+        avg_amount, max_amount, min_amount, count = rows[0]
+        if not count:
+            return []
+        return [{'_id': None, 'avgAmount': avg_amount, 'maxAmount': max_amount,
+                 'minAmount': min_amount, 'totalInvoices': count}]
+
+    def anomaly_exists(self, invoice_id: str, anomaly_type: str) -> bool:
+        rows = self._query(
+            "SELECT 1 FROM anomalies WHERE invoiceId = ? AND anomalyType = ? LIMIT 1",
+            (invoice_id, anomaly_type)
+        )
+        return bool(rows)
+
+    # ----- listings and aggregates -------------------------------------------
+
+    def get_invoice_history(self, limit: int = 50) -> List[Dict]:
+        rows = self._query("SELECT id, doc FROM invoices ORDER BY uploadDate DESC LIMIT ?", (limit,))
+        return [serialize_invoice(_load(*row)) for row in rows]
+
+    def iter_invoices(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                      vendor_name: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict]:
+        """Keyset-paginated so no lock or cursor is held between batches"""
+        conditions, params = [], []
+        if start_date:
+            conditions.append("uploadDate >= ?")
+            params.append(_iso(start_date))
+        if end_date:
+            conditions.append("uploadDate < ?")
+            params.append(_iso(end_date))
+        if vendor_name:
+            conditions.append("vendorName = ?")
+            params.append(vendor_name)
+
+        last_key = ('', 0)
+        while True:
+            where = conditions + ["(uploadDate > ? OR (uploadDate = ? AND rowid > ?))"]
+            rows = self._query(
+                f"SELECT id, doc, uploadDate, rowid FROM invoices WHERE {' AND '.join(where)} "
+                f"ORDER BY uploadDate, rowid LIMIT ?",
+                (*params, last_key[0], last_key[0], last_key[1], batch_size)
+            )
+            for row_id, doc_json, _, _ in rows:
+                invoice = _load(row_id, doc_json)
+                invoice.pop('rawText', None)
+                invoice.pop('searchTerms', None)
+                yield invoice
+            if len(rows) < batch_size:
+                return
+            last_key = (rows[-1][2], rows[-1][3])
+
+    def iter_invoices_with_dependencies(self, dependencies: List[str], batch_size: int = 500) -> Iterator[Dict]:
+        """Ids from the invoice_deps index first, then the documents a batch at a time"""
+        invoice_ids = set()
+        for start in range(0, len(dependencies), 500):
+            chunk = dependencies[start:start + 500]
+            invoice_ids.update(row[0] for row in self._query(
+                f"SELECT invoice_id FROM invoice_deps WHERE dep IN ({', '.join('?' * len(chunk))})", chunk
+            ))
+        invoice_ids = sorted(invoice_ids)
+        batch_size = min(batch_size, 500)
+        for start in range(0, len(invoice_ids), batch_size):
+            chunk = invoice_ids[start:start + batch_size]
+            for row_id, doc_json in self._query(
+                    f"SELECT id, doc FROM invoices WHERE id IN ({', '.join('?' * len(chunk))})", chunk):
+                invoice = _load(row_id, doc_json)
+                invoice.pop('rawText', None)
+                invoice.pop('searchTerms', None)
+                yield invoice
+
+    def iter_anomalies(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                       vendor_name: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict]:
+        conditions, params = [], []
+        if start_date or end_date:
+            low, high = _iso(start_date) or '', _iso(end_date) or '9999'
+            conditions.append("((detectedDate >= ? AND detectedDate < ?) OR (detectedAt >= ? AND detectedAt < ?))")
+            params.extend([low, high, low, high])
+        if vendor_name:
+            conditions.append("vendorName = ?")
+            params.append(vendor_name)
+
+        last_rowid = 0
+        while True:
+            where = conditions + ["rowid > ?"]
+            rows = self._query(
+                f"SELECT id, doc, rowid FROM anomalies WHERE {' AND '.join(where)} ORDER BY rowid LIMIT ?",
+                (*params, last_rowid, batch_size)
+            )
+            for row_id, doc_json, _ in rows:
+                yield _load(row_id, doc_json)
+            if len(rows) < batch_size:
+                return
+            last_rowid = rows[-1][2]
+
+    def search_invoices(self, filters: Dict[str, Any], text: Optional[str] = None,
+                        page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+        """
+        Same filters and facets as the Mongo $facet pipeline
+        Text goes through the FTS5 index (any word matches, like $text), ranked by bm25
+        """
+        source, conditions, params = "invoices i", [], []
+        order = "i.uploadDate DESC, i.rowid DESC"
+        if text:
+            words = tokenize(text)
+            if not words:
+                return search_page([], 0, page, page_size, {'vendorName': [], 'riskLevel': [], 'anomalyType': []})
+            source = (
+                "invoices i JOIN (SELECT invoice_id, bm25(invoice_search, 0, 5, 3, 1) AS score "
+                "FROM invoice_search WHERE invoice_search MATCH ?) s ON s.invoice_id = i.id"
+            )
+            params.append(' OR '.join(f'"{word}"' for word in words))
+            order = "s.score, " + order
+
+        for column, key in (('vendorName', 'vendorName'), ('gstNumber', 'gstNumber')):
+            if filters.get(key):
+                conditions.append(f"i.{column} = ?")
+                params.append(filters[key])
+        if filters.get('hsnCode'):
+            conditions.append("i.id IN (SELECT invoice_id FROM invoice_hsn WHERE hsn = ?)")
+            params.append(filters['hsnCode'])
+        if filters.get('anomalyType'):
+            conditions.append("i.id IN (SELECT invoiceId FROM anomalies WHERE anomalyType = ?)")
+            params.append(filters['anomalyType'])
+        if filters.get('riskLevel'):
+            conditions.append(f"{RISK_LEVEL} = ?")
+            params.append(filters['riskLevel'])
+        for column, key, op in (('uploadDate', 'startDate', '>='), ('uploadDate', 'endDate', '<'),
+                                ('totalAmount', 'minAmount', '>='), ('totalAmount', 'maxAmount', '<=')):
+            if filters.get(key) is not None:
+                conditions.append(f"i.{column} {op} ?")
+                params.append(_iso(filters[key]))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        matched = f"SELECT i.id, i.vendorName, {RISK_LEVEL} AS riskLevel FROM {source} {where}"
+
+        with self._lock:
+            rows = self._query(
+                f"SELECT i.id, i.doc, (SELECT group_concat(DISTINCT a.anomalyType) FROM anomalies a "
+                f"WHERE a.invoiceId = i.id) FROM {source} {where} ORDER BY {order} LIMIT ? OFFSET ?",
+                (*params, page_size, (page - 1) * page_size)
+            )
+            (total,), = self._query(f"SELECT COUNT(*) FROM ({matched})", params)
+            vendor_rows = self._query(
+                f"SELECT vendorName, COUNT(*) AS n FROM ({matched}) GROUP BY vendorName ORDER BY n DESC LIMIT ?",
+                (*params, SEARCH_FACET_LIMIT)
+            )
+            risk_rows = self._query(
+                f"SELECT riskLevel, COUNT(*) AS n FROM ({matched}) GROUP BY riskLevel ORDER BY n DESC", params
+            )
+            anomaly_rows = self._query(
+                f"SELECT anomalyType, COUNT(DISTINCT invoiceId) AS n FROM anomalies "
+                f"WHERE invoiceId IN (SELECT id FROM ({matched})) GROUP BY anomalyType ORDER BY n DESC", params
+            )
+
+        results = []
+        for row_id, doc_json, anomaly_types in rows:
+            invoice = _load(row_id, doc_json)
+            if anomaly_types:
+                invoice['anomalyTypes'] = sorted(anomaly_types.split(','))
+            results.append(invoice)
+
+        facets = {
+            name: [{'value': value, 'count': count} for value, count in facet_rows]
+            for name, facet_rows in (('vendorName', vendor_rows), ('riskLevel', risk_rows), ('anomalyType', anomaly_rows))
+        }
+        return search_page(results, total, page, page_size, facets)
+
+    def get_vendor_list(self) -> List[Dict]:
+        rows = self._query(f"SELECT {', '.join(VENDOR_COLUMNS)} FROM vendors ORDER BY totalAmount DESC")
+        return [serialize_vendor(_vendor_from_row(row)) for row in rows]
+
+    def get_anomalies(self, severity: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        if severity:
+            rows = self._query(
+                "SELECT id, doc FROM anomalies WHERE severity = ? ORDER BY detectedDate DESC LIMIT ?",
+                (severity, limit)
+            )
+        else:
+            rows = self._query("SELECT id, doc FROM anomalies ORDER BY detectedDate DESC LIMIT ?", (limit,))
+        return [serialize_anomaly(_load(*row)) for row in rows]
+
+    def anomaly_type_counts(self) -> List[Dict]:
+        rows = self._query("SELECT anomalyType, COUNT(*) FROM anomalies GROUP BY anomalyType")
+        return [{'_id': anomaly_type, 'count': count} for anomaly_type, count in rows]
+
+    def get_dashboard_stats(self) -> Dict:
+        (total_invoices, total_amount), = self._query("SELECT COUNT(*), SUM(totalAmount) FROM invoices")
+        (total_vendors,), = self._query("SELECT COUNT(*) FROM vendors")
+        (total_anomalies,), = self._query("SELECT COUNT(*) FROM anomalies")
+        (high_severity_anomalies,), = self._query("SELECT COUNT(*) FROM anomalies WHERE severity = 'HIGH'")
+
+        return {
+            'totalInvoices': total_invoices,
+            'totalVendors': total_vendors,
+            'totalAnomalies': total_anomalies,
+            'highSeverityAnomalies': high_severity_anomalies,
+            'totalAmountProcessed': total_amount or 0
+        }
+
+    def get_anomaly_trends(self, days: int = 30) -> List[Dict[str, Any]]:
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
+
+        rows = self._query(
+            "SELECT substr(detectedAt, 1, 10) AS day, anomalyType, COUNT(*) FROM anomalies "
+            "WHERE detectedAt >= ? AND detectedAt <= ? GROUP BY day, anomalyType ORDER BY day",
+            (_iso(start_date), _iso(end_date))
+        )
+        results = [{'_id': {'date': day, 'type': anomaly_type}, 'count': count} for day, anomaly_type, count in rows]
+        return shape_anomaly_trends(results, start_date, end_date)
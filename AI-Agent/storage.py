@@ -0,0 +1,650 @@
+"""
+Storage Interface for FINTEL AI
+Backend-neutral repository contract, document building and anomaly rules.
+Implemented by FintelDatabase (MongoDB, database.py) and
+SQLiteFintelDatabase (embedded SQLite / in-memory, sqlite_store.py).
+"""
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+import json
+import re
+import zlib
+
+from hsn_index import get_hsn_index, parse_rate
+from ml_features import parse_invoice_date
+from price_index import KLLSketch, line_item_keys, normalize_line_items, price_deviation_anomalies
+from split_billing import split_billing_anomaly, window_rollup_ids
+
+
+# ---------------------------------------------------------------------------
+# Document building and anomaly rules shared by every backend.
+# Only the I/O differs between them.
+# ---------------------------------------------------------------------------
+
+# Fields of complianceResults / mlPrediction kept on the hot invoice document
+# (used by list views and dashboards); everything else lives in the compressed details
+HOT_COMPLIANCE_FIELDS = ('compliance_score', 'compliance_status', 'checks_passed', 'risk_score', 'risk_level')
+HOT_ML_FIELDS = ('is_anomaly', 'anomaly_score', 'model_version', 'vendor_baseline')
+
+DETAILS_ENCODING = 'zlib+json'
+
+# rawText moves to the compressed details, so the hot document keeps a bounded
+# set of distinct words from it for full-text search
+SEARCH_TERMS_LIMIT = 300
+SEARCH_TOKEN_PATTERN = re.compile(r'[a-z0-9][a-z0-9./-]{2,}')
+
+# Invoice search paging and facets
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_FACET_LIMIT = 10
+SEARCH_FILTERS = ('vendorName', 'gstNumber', 'startDate', 'endDate', 'minAmount', 'maxAmount',
+                  'hsnCode', 'anomalyType', 'riskLevel')
+
+
+def json_default(value):
+    """JSON encoder fallback for datetimes and numpy scalars"""
+    if isinstance(value, datetime):
+        return {'$date': value.isoformat()}
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def json_object_hook(obj):
+    """Restore datetimes encoded by json_default"""
+    if len(obj) == 1 and '$date' in obj:
+        return datetime.fromisoformat(obj['$date'])
+    return obj
+
+
+def _plain(value):
+    """numpy scalar -> Python scalar (Mongo cannot encode numpy types)"""
+    return value.item() if hasattr(value, 'item') else value
+
+
+def summarize_payload(payload: Optional[Dict], fields) -> Dict:
+    payload = payload or {}
+    return {field: _plain(payload[field]) for field in fields if field in payload}
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase words of 3+ characters (keeps GSTINs, HSN codes and invoice numbers intact)"""
+    return SEARCH_TOKEN_PATTERN.findall((text or '').lower())
+
+
+def search_terms(invoice_data: Dict[str, Any]) -> List[str]:
+    """Distinct words of the raw OCR text in first-seen order, capped at SEARCH_TERMS_LIMIT"""
+    return list(dict.fromkeys(tokenize(invoice_data.get('raw_text'))))[:SEARCH_TERMS_LIMIT]
+
+
+def build_invoice_doc(invoice_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Map extracted invoice data onto the stored (hot) invoice document
+    Bulky payloads go to build_invoice_details instead
+    """
+    gst_numbers = invoice_data.get('gst_numbers', [])
+    invoice_doc = {
+        'filename': invoice_data.get('filename'),
+        'uploadDate': invoice_data.get('upload_date') or datetime.now(),  # set by imports of past invoices
+        'invoiceNumber': invoice_data.get('invoice_number'),
+        'vendorName': invoice_data.get('vendor_name'),
+        'gstNumber': gst_numbers[0] if gst_numbers else None,
+        'totalAmount': float(invoice_data.get('total_amount', 0)),
+        'invoiceDate': invoice_data.get('invoice_date'),
+        'gstRate': invoice_data.get('gst_rate', 'Unknown'),
+        'hsnNumber': invoice_data.get('hsn_number', 'Unknown'),
+        'hsnCodes': invoice_data.get('hsn_sac_codes', []),
+        'itemDescriptions': invoice_data.get('item_descriptions', []),
+        'quantities': invoice_data.get('quantities', []),
+        'lineItems': normalize_line_items(invoice_data),
+        'ocrConfidence': float(invoice_data.get('ocr_confidence', 0)),
+        'complianceResults': summarize_payload(invoice_data.get('compliance_results'), HOT_COMPLIANCE_FIELDS),
+        'mlPrediction': summarize_payload(invoice_data.get('ml_prediction'), HOT_ML_FIELDS),
+        'complianceDeps': (invoice_data.get('compliance_results') or {}).get('dependencies', []),
+        'searchTerms': search_terms(invoice_data)
+    }
+    # gstNumber already holds the first GST; only keep the list when there is more than one
+    if len(gst_numbers) > 1:
+        invoice_doc['allGstNumbers'] = gst_numbers
+    # Price index entries the compliance score was computed with (re-scoring reads them back)
+    price_stats = (invoice_data.get('compliance_results') or {}).get('price_stats')
+    if price_stats:
+        invoice_doc['priceStats'] = price_stats
+    return invoice_doc
+
+
+def build_invoice_details(invoice_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Bulky analysis payloads, fetched only by detail views"""
+    return {
+        'complianceResults': invoice_data.get('compliance_results', {}),
+        'mlPrediction': invoice_data.get('ml_prediction', {}),
+        'gstVerification': invoice_data.get('gst_verification', []),
+        'rawText': invoice_data.get('raw_text', '')
+    }
+
+
+def compress_details(details: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(details, default=json_default, ensure_ascii=False).encode('utf-8'), 6)
+
+
+def decompress_details(payload: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(payload).decode('utf-8'), object_hook=json_object_hook)
+
+
+def merge_invoice_details(invoice: Dict, details: Dict) -> Dict:
+    """
+    Hot document + decompressed details for detail views
+    The hot summaries win: batch re-scoring only rewrites those
+    """
+    merged = {**invoice, **details}
+    for field in ('complianceResults', 'mlPrediction'):
+        if field in details:
+            merged[field] = {**(details[field] or {}), **(invoice.get(field) or {})}
+    return merged
+
+
+def all_gst_numbers(invoice: Dict) -> List[str]:
+    """Every GST number on an invoice, for both compact and legacy documents"""
+    if invoice.get('allGstNumbers'):
+        return invoice['allGstNumbers']
+    return [invoice['gstNumber']] if invoice.get('gstNumber') else []
+
+
+def invoice_data_from_doc(invoice: Dict, details: Optional[Dict] = None) -> Dict[str, Any]:
+    """Rebuild upload-shaped invoice data from a stored invoice, for re-running the anomaly and compliance rules"""
+    details = details or {}
+    return {
+        'invoice_number': invoice.get('invoiceNumber'),
+        'vendor_name': invoice.get('vendorName'),
+        'gst_numbers': all_gst_numbers(invoice),
+        'total_amount': invoice.get('totalAmount', 0),
+        'invoice_date': invoice.get('invoiceDate'),
+        'gst_rate': invoice.get('gstRate'),
+        'hsn_sac_codes': invoice.get('hsnCodes', []),
+        'item_descriptions': invoice.get('itemDescriptions', []),
+        'quantities': invoice.get('quantities', []),
+        'line_items': invoice.get('lineItems', []),
+        'ocr_confidence': invoice.get('ocrConfidence', 0),
+        'raw_text': details.get('rawText', invoice.get('rawText', '')),
+        'gst_verification': details.get('gstVerification', invoice.get('gst_verification', []))
+    }
+
+
+def duplicate_anomaly(invoice_data: Dict[str, Any], duplicate: Optional[Dict]) -> List[Dict]:
+    """1. Duplicate invoice number"""
+    if not duplicate:
+        return []
+    return [{
+        'type': 'DUPLICATE_INVOICE',
+        'severity': 'HIGH',
+        'description': f"Duplicate invoice number: {invoice_data.get('invoice_number')}",
+        'relatedInvoiceId': str(duplicate['_id'])
+    }]
+
+
+def gst_status_anomalies(invoice_data: Dict[str, Any]) -> List[Dict]:
+    """2./3. Missing GST number, or GST found but verification failed"""
+    anomalies = []
+    gst_numbers = invoice_data.get('gst_numbers', [])
+    gst_missing = invoice_data.get('gst_missing', False)
+    
+    if not gst_numbers or len(gst_numbers) == 0 or gst_missing:
+        anomalies.append({
+            'type': 'MISSING_GST',
+            'severity': 'HIGH',
+            'description': f"No GST number found in invoice - Vendor: {invoice_data.get('vendor_name', 'Unknown')}",
+        })
+    
+    gst_number = gst_numbers[0] if gst_numbers else None
+    if gst_number:
+        gst_verification = invoice_data.get('gst_verification', [])
+        if gst_verification and len(gst_verification) > 0:
+            verification_result = gst_verification[0]
+            if not verification_result.get('success') or not verification_result.get('is_active'):
+                anomalies.append({
+                    'type': 'INVALID_GST',
+                    'severity': 'HIGH',
+                    'description': f"Invalid GST number: {gst_number} - Verification failed",
+                })
+    return anomalies
+
+
+def gst_vendor_mismatch_anomaly(invoice_data: Dict[str, Any], gst_number: str,
+                                different_vendor: Optional[Dict]) -> List[Dict]:
+    """4. Same GST number used by a different vendor"""
+    if not different_vendor:
+        return []
+    return [{
+        'type': 'GST_VENDOR_MISMATCH',
+        'severity': 'HIGH',
+        'description': f"GST {gst_number} used by different vendor: {different_vendor['vendorName']} vs {invoice_data.get('vendor_name')}",
+        'relatedInvoiceId': str(different_vendor['_id'])
+    }]
+
+
+def unusual_amount_anomaly(invoice_data: Dict[str, Any], stats: List[Dict]) -> List[Dict]:
+    """5. Amount 3x higher than the vendor average"""
+    if not stats:
+        return []
+    avg_amount = stats[0].get('avgAmount', 0)
+    current_amount = float(invoice_data.get('total_amount', 0))
+    if avg_amount > 0 and current_amount > (avg_amount * 3):
+        return [{
+            'type': 'UNUSUAL_AMOUNT',
+            'severity': 'MEDIUM',
+            'description': f"Amount ₹{current_amount} is 3x higher than vendor average ₹{avg_amount:.2f}"
+        }]
+    return []
+
+
+def vendor_behaviour_anomaly(invoice_data: Dict[str, Any], cluster: Optional[Dict[str, Any]]) -> List[Dict]:
+    """Vendor whose billing behaviour fits no peer cluster (vendor_clusters.py)"""
+    if not cluster or not cluster.get('outlier'):
+        return []
+    if cluster.get('reason') == 'small_cluster':
+        detail = f"one of the few vendors in behaviour cluster {cluster['cluster']}"
+    else:
+        detail = f"distance {cluster['distance']:.1f} from its cluster, threshold {cluster['threshold']:.1f}"
+    return [{
+        'type': 'VENDOR_BEHAVIOUR_OUTLIER',
+        'severity': 'LOW',
+        'description': f"Vendor {invoice_data.get('vendor_name')}'s billing pattern is unlike its peers ({detail})"
+    }]
+
+
+def hsn_rate_mismatch_anomaly(invoice_data: Dict[str, Any]) -> List[Dict]:
+    """7. GST rate charged differs from the rate in force for the first known HSN code"""
+    charged = parse_rate(invoice_data.get('gst_rate'))
+    if charged is None:
+        return []
+    hsn_index = get_hsn_index()
+    for hsn in invoice_data.get('hsn_sac_codes', [])[:3]:
+        known = hsn_index.known(hsn)
+        if not known:
+            continue
+        expected = hsn_index.rate_on(known[0], parse_invoice_date(invoice_data.get('invoice_date')))
+        if abs(charged - expected) > 0.01:
+            return [{
+                'type': 'GST_RATE_MISMATCH',
+                'severity': 'MEDIUM',
+                'description': f"HSN {hsn}: GST charged at {charged:g}% but the rate for {known[0]} is {expected:g}%"
+            }]
+        return []
+    return []
+
+
+def anomaly_lookups(invoice_data: Dict[str, Any], invoice_id: str,
+                    price_stats: Optional[Dict] = None) -> Dict[str, Tuple[str, tuple]]:
+    """
+    The stored history the anomaly rules read: {name: (repository method, args)}
+    Sync and async repositories both have these methods and feed the results to apply_anomaly_rules
+    price_stats: the price index entries read before the invoice was stored (the upload path), so
+    its own prices are not part of the distribution it is compared with; read from the index otherwise
+    """
+    gst_numbers = invoice_data.get('gst_numbers', [])
+    gst_number = gst_numbers[0] if gst_numbers else None
+    vendor_name = invoice_data.get('vendor_name')
+    lookups = {'duplicate': ('find_invoice_by_number', (invoice_data.get('invoice_number'), invoice_id))}
+    if gst_number:
+        lookups['different_vendor'] = ('find_gst_vendor_mismatch', (gst_number, vendor_name, invoice_id))
+        lookups['vendor_cluster'] = ('get_vendor_cluster', (gst_number,))
+    if vendor_name and vendor_name != 'Unknown':
+        lookups['vendor_stats'] = ('vendors_stats', (vendor_name,))
+    rollup_ids = window_rollup_ids(invoice_data)  # empty unless the amount is just under the threshold
+    if rollup_ids:
+        lookups['split_rollups'] = ('get_split_rollups', (rollup_ids,))
+    if price_stats is None:
+        lookups['price_stats'] = ('get_price_stats', (line_item_keys(normalize_line_items(invoice_data)),))
+    return lookups
+
+
+def apply_anomaly_rules(invoice_data: Dict[str, Any], invoice_id: str, found: Dict[str, Any],
+                        price_stats: Optional[Dict] = None) -> List[Dict]:
+    """Every anomaly rule, in order, over the results of anomaly_lookups (price_stats as passed to it)"""
+    anomalies = duplicate_anomaly(invoice_data, found['duplicate'])
+    anomalies.extend(gst_status_anomalies(invoice_data))
+    if 'different_vendor' in found:
+        gst_number = invoice_data['gst_numbers'][0]
+        anomalies.extend(gst_vendor_mismatch_anomaly(invoice_data, gst_number, found['different_vendor']))
+    if 'vendor_stats' in found:
+        anomalies.extend(unusual_amount_anomaly(invoice_data, found['vendor_stats']))
+    if 'vendor_cluster' in found:
+        anomalies.extend(vendor_behaviour_anomaly(invoice_data, found['vendor_cluster']))
+    if 'split_rollups' in found:
+        anomalies.extend(split_billing_anomaly(invoice_data, invoice_id, found['split_rollups']))
+    anomalies.extend(hsn_rate_mismatch_anomaly(invoice_data))
+    anomalies.extend(price_deviation_anomalies(normalize_line_items(invoice_data),
+                                               found['price_stats'] if price_stats is None else price_stats))
+    return anomalies
+
+
+def anomaly_record(invoice_id: str, invoice_data: Dict[str, Any], anomaly: Dict) -> Dict:
+    """Stored form of a detected anomaly"""
+    return {
+        'invoiceId': invoice_id,
+        'invoiceNumber': invoice_data.get('invoice_number'),
+        'vendorName': invoice_data.get('vendor_name'),
+        'anomalyType': anomaly['type'],
+        'severity': anomaly['severity'],
+        'description': anomaly['description'],
+        'detectedDate': datetime.now(),
+        'relatedInvoiceId': anomaly.get('relatedInvoiceId')
+    }
+
+
+def serialize_invoice(inv: Dict) -> Dict:
+    inv.pop('searchTerms', None)  # index material, not part of the API shape
+    inv.pop('complianceDeps', None)
+    inv.pop('priceStats', None)
+    inv['_id'] = str(inv['_id'])
+    inv['allGstNumbers'] = all_gst_numbers(inv)
+    inv['uploadDate'] = inv['uploadDate'].isoformat() if inv.get('uploadDate') else None
+    return inv
+
+
+def search_page(results: List[Dict], total: int, page: int, page_size: int,
+                facets: Dict[str, List[Dict]]) -> Dict[str, Any]:
+    """Common response shape of InvoiceStore.search_invoices"""
+    return {
+        'results': [serialize_invoice(invoice) for invoice in results],
+        'total': total,
+        'page': page,
+        'pageSize': page_size,
+        'pages': (total + page_size - 1) // page_size,
+        'facets': facets
+    }
+
+
+def serialize_vendor(vendor: Dict) -> Dict:
+    vendor['_id'] = str(vendor['_id'])
+    vendor['firstInvoiceDate'] = vendor['firstInvoiceDate'].isoformat() if vendor.get('firstInvoiceDate') else None
+    vendor['lastInvoiceDate'] = vendor['lastInvoiceDate'].isoformat() if vendor.get('lastInvoiceDate') else None
+    return vendor
+
+
+def serialize_anomaly(anomaly: Dict) -> Dict:
+    anomaly['_id'] = str(anomaly['_id'])
+    anomaly['detectedDate'] = anomaly['detectedDate'].isoformat() if anomaly.get('detectedDate') else None
+    return anomaly
+
+
+def shape_anomaly_trends(results: List[Dict], start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+    """Organize aggregated counts by date, filling missing dates with zeros"""
+    from datetime import timedelta
+    
+    trends_by_date = {}
+    for result in results:
+        date = result['_id']['date']
+        anomaly_type = result['_id']['type']
+        count = result['count']
+        
+        if date not in trends_by_date:
+            trends_by_date[date] = {
+                'date': date,
+                'duplicates': 0,
+                'invalidGst': 0,
+                'missingGst': 0,
+                'total': 0
+            }
+        
+        # Map anomaly types to keys
+        if anomaly_type == 'DUPLICATE_INVOICE':
+            trends_by_date[date]['duplicates'] = count
+        elif anomaly_type == 'INVALID_GST':
+            trends_by_date[date]['invalidGst'] = count
+        elif anomaly_type == 'MISSING_GST':
+            trends_by_date[date]['missingGst'] = count
+        
+        trends_by_date[date]['total'] += count
+    
+    all_trends = []
+    current_date = start_date
+    while current_date <= end_date:
+        date_str = current_date.strftime('%Y-%m-%d')
+        if date_str in trends_by_date:
+            all_trends.append(trends_by_date[date_str])
+        else:
+            all_trends.append({
+                'date': date_str,
+                'duplicates': 0,
+                'invalidGst': 0,
+                'missingGst': 0,
+                'total': 0
+            })
+        current_date += timedelta(days=1)
+    
+    return all_trends
+
+
+class InvoiceStore(ABC):
+    """
+    Repository contract covering everything the API, the agents and the
+    maintenance scripts need. Documents are returned in the stored (camelCase)
+    shape with an '_id' key, whatever the backend.
+    """
+
+    # ----- writes -----------------------------------------------------------
+
+    @abstractmethod
+    def store_invoice(self, invoice_data: Dict[str, Any]) -> str:
+        """Store invoice (and update vendor statistics and the price index). Returns: invoice_id"""
+
+    @abstractmethod
+    def store_invoices(self, invoices: List[Dict[str, Any]]) -> List[str]:
+        """
+        Bulk store_invoice for imports and load tests: one round of writes per batch, vendor
+        statistics and price sketches merged once per batch. Returns: invoice_ids in order
+        """
+
+    @abstractmethod
+    def insert_anomalies(self, records: List[Dict]) -> None:
+        """
+        Insert already-built anomaly records
+        Idempotent: (invoiceId, anomalyType) is unique, an existing record is kept as is
+        """
+
+    @abstractmethod
+    def set_invoice_fields(self, updates: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Bulk partial update: {invoice_id: {'dotted.path': value}}
+        Returns: number of invoices updated
+        """
+
+    @abstractmethod
+    def apply_hsn_changes(self, upserts: List[Dict[str, Any]], deletes: List[Any], version: int) -> int:
+        """
+        Apply a computed HSN table diff in place: rows ({key, hsn_code, description, gst_rate})
+        are upserted by key before `deletes` (keys) go, so readers never see a partial table
+        Returns: number of rows written or removed
+        """
+
+    @abstractmethod
+    def save_reference_snapshot(self, name: str, snapshot: Dict[str, Any]):
+        """Remember the reference data a batch job last applied (see compliance.reference_snapshot)"""
+
+    @abstractmethod
+    def merge_price_sketches(self, sketches: Dict[str, KLLSketch]) -> None:
+        """
+        Merge unit-price sketches into the price index ({'hsn:8517': sketch, ...})
+        Safe against concurrent uploads touching the same keys
+        """
+
+    @abstractmethod
+    def replace_price_index(self, sketches: Dict[str, KLLSketch]) -> None:
+        """Swap in a rebuilt price index (keys missing from `sketches` are dropped)"""
+
+    @abstractmethod
+    def replace_vendor_clusters(self, assignments: Dict[str, Dict[str, Any]]) -> None:
+        """Swap in the vendor-behaviour clusters ({gstNumber: assignment}, see vendor_clusters.py)"""
+
+    @abstractmethod
+    def merge_vendor_baseline(self, gst_number: str, observation: Dict[str, Any]) -> None:
+        """Fold one invoice (vendor_baselines.baseline_observation) into the vendor's running sums"""
+
+    @abstractmethod
+    def replace_vendor_baselines(self, baselines: Dict[str, Dict[str, Any]]) -> None:
+        """Swap in rebuilt vendor baselines ({gstNumber: baseline}, see vendor_baselines.py)"""
+
+    @abstractmethod
+    def merge_split_rollups(self, entries: List[Dict[str, Any]]) -> None:
+        """Fold near-threshold invoices (split_billing.rollup_entries) into their daily split rollups"""
+
+    @abstractmethod
+    def replace_split_rollups(self, rollups: Dict[str, Dict[str, Any]]) -> None:
+        """Swap in rebuilt split rollups ({rollup id: rollup}, see split_billing.py)"""
+
+    # ----- point lookups ----------------------------------------------------
+
+    @abstractmethod
+    def get_invoice(self, invoice_id: str) -> Optional[Dict]:
+        """Fetch one invoice by id"""
+
+    @abstractmethod
+    def get_invoice_details(self, invoice_id: str) -> Optional[Dict]:
+        """Decompressed detail payload (complianceResults, mlPrediction, gstVerification, rawText)"""
+
+    def get_invoice_details_many(self, invoice_ids: List[str]) -> Dict[str, Dict]:
+        """{invoice_id: details} for a batch of invoices (backends override with one query)"""
+        details = {}
+        for invoice_id in invoice_ids:
+            payload = self.get_invoice_details(invoice_id)
+            if payload is not None:
+                details[invoice_id] = payload
+        return details
+
+    @abstractmethod
+    def get_latest_invoice(self) -> Optional[Dict]:
+        """Most recently uploaded invoice"""
+
+    @abstractmethod
+    def find_invoice_by_number(self, invoice_number: Optional[str], exclude_id: Optional[str] = None) -> Optional[Dict]:
+        """Another invoice carrying the same invoice number"""
+
+    @abstractmethod
+    def find_gst_vendor_mismatch(self, gst_number: str, vendor_name: Optional[str],
+                                 exclude_id: Optional[str] = None) -> Optional[Dict]:
+        """An invoice with this GST number but a different vendor name"""
+
+    @abstractmethod
+    def find_invoices_with_hsn(self, hsn: str, exclude_id: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        """Invoices containing an HSN code"""
+
+    @abstractmethod
+    def vendors_stats(self, vendor_name: str) -> List[Dict]:
+        """[{avgAmount, maxAmount, minAmount, totalInvoices}] or [] when the vendor is unknown"""
+
+    @abstractmethod
+    def anomaly_exists(self, invoice_id: str, anomaly_type: str) -> bool:
+        """Whether an anomaly of this type is already recorded for the invoice"""
+
+    # ----- listings and aggregates -------------------------------------------
+
+    @abstractmethod
+    def get_invoice_history(self, limit: int = 50) -> List[Dict]:
+        """Get recent invoice history (serialized)"""
+
+    @abstractmethod
+    def iter_invoices(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                      vendor_name: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict]:
+        """Stream invoices in upload order with constant memory (start_date inclusive, end_date exclusive)"""
+
+    @abstractmethod
+    def iter_invoices_with_dependencies(self, dependencies: List[str], batch_size: int = 500) -> Iterator[Dict]:
+        """Stream the invoices whose complianceDeps contain any of `dependencies` (indexed)"""
+
+    @abstractmethod
+    def get_hsn_codes(self) -> List[Dict[str, Any]]:
+        """Every stored HSN row: key, hsn_code, description, gst_rate, version"""
+
+    @abstractmethod
+    def get_reference_snapshot(self, name: str) -> Optional[Dict[str, Any]]:
+        """Last snapshot saved under `name`, or None"""
+
+    @abstractmethod
+    def get_price_stats(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Precomputed percentiles of the price index entries that exist among `keys`"""
+
+    @abstractmethod
+    def get_vendor_baseline(self, gst_number: str) -> Optional[Dict[str, Any]]:
+        """Running sums of one vendor's amounts, billing gaps and days of the month"""
+
+    @abstractmethod
+    def get_vendor_cluster(self, gst_number: str) -> Optional[Dict[str, Any]]:
+        """The vendor's behaviour-cluster assignment from the last clustering run"""
+
+    @abstractmethod
+    def get_split_rollups(self, rollup_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """{rollup id: rollup} for the split rollups that exist among `rollup_ids`"""
+
+    @abstractmethod
+    def iter_anomalies(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                       vendor_name: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict]:
+        """Stream anomalies in insertion order with constant memory (start_date inclusive, end_date exclusive)"""
+
+    @abstractmethod
+    def search_invoices(self, filters: Dict[str, Any], text: Optional[str] = None,
+                        page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+        """
+        Filtered, paged invoice search, newest first (best text match first when text is given)
+        filters: any of SEARCH_FILTERS. Returns search_page() with facet counts
+        (vendorName, riskLevel, anomalyType) over the whole matching set
+        """
+
+    @abstractmethod
+    def get_vendor_list(self) -> List[Dict]:
+        """Get list of all vendors (serialized)"""
+
+    @abstractmethod
+    def get_anomalies(self, severity: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        """Get detected anomalies (serialized)"""
+
+    @abstractmethod
+    def anomaly_type_counts(self) -> List[Dict]:
+        """[{'_id': anomalyType, 'count': n}]"""
+
+    @abstractmethod
+    def get_dashboard_stats(self) -> Dict:
+        """Get statistics for dashboard"""
+
+    @abstractmethod
+    def get_anomaly_trends(self, days: int = 30) -> List[Dict[str, Any]]:
+        """Daily anomaly counts by type for the last N days"""
+
+    # ----- lifecycle --------------------------------------------------------
+
+    @abstractmethod
+    def create_indexes(self):
+        """Create indexes (deploy/migration step, idempotent)"""
+
+    def close(self):
+        """
+        Release this repository
+        Backends are shared per process and stay open; see database.close_all_clients()
+        """
+        pass
+
+    def disconnect(self):
+        """Actually close the underlying connection (called on shutdown)"""
+        pass
+
+    # ----- anomaly detection --------------------------------------------------
+
+    def detect_anomalies(self, invoice_data: Dict[str, Any], invoice_id: str,
+                         price_stats: Optional[Dict] = None) -> List[Dict]:
+        """
+        Detect anomalies by comparing with historical data
+        price_stats: price index entries read before store_invoice (see anomaly_lookups)
+        Returns: List of detected anomalies
+        """
+        anomalies = self.find_anomalies(invoice_data, invoice_id, price_stats)
+        if anomalies:
+            self.insert_anomalies([anomaly_record(invoice_id, invoice_data, a) for a in anomalies])
+        return anomalies
+
+    def find_anomalies(self, invoice_data: Dict[str, Any], invoice_id: str,
+                       price_stats: Optional[Dict] = None) -> List[Dict]:
+        """Run every anomaly rule against the stored history without recording anything"""
+        found = {name: getattr(self, method)(*args)
+                 for name, (method, args) in anomaly_lookups(invoice_data, invoice_id, price_stats).items()}
+        return apply_anomaly_rules(invoice_data, invoice_id, found, price_stats)
@@ -0,0 +1,342 @@
+"""
+Per-Vendor Anomaly Baselines for FINTEL AI
+The global Isolation Forest judges an amount against every vendor at once; a
+baseline judges it against the vendor's own history. Each vendor (GST number)
+keeps a handful of running sums: log-amount mean and spread, the gaps between
+its invoice dates (billing cadence) and a day-of-month histogram. Merging one
+invoice is one update of those sums, scoring one is a few arithmetic operations,
+so both are O(1) whatever the number of vendors. The cadence gap is measured in
+the write itself, against the stored latest date (not a cached copy), so uploads
+for one vendor on several workers still count each gap once.
+An invoice dated before the vendor's latest one adds no gap, where --rebuild
+(which sorts by date) would split an existing gap in two; rebuild after
+backfilling old invoices.
+
+`--rebuild` recomputes every baseline from the stored invoices in one streaming
+pass; uploads then merge into them (InvoiceStore.merge_vendor_baseline). The API
+keeps the baselines it reads in a bounded LRU cache (BaselineCache), and vendors
+with fewer than MIN_BASELINE_INVOICES invoices fall back to the global model.
+
+Usage:
+    python vendor_baselines.py [database_url] --rebuild
+    python vendor_baselines.py [database_url] --show 27AAPFU0939F1ZV
+"""
+
+import math
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from ml_features import parse_invoice_date
+
+SNAPSHOT_NAME = 'vendor_baselines'
+MIN_BASELINE_INVOICES = 20  # fewer and the global model decides
+MIN_CADENCE_GAPS = 10
+Z_THRESHOLD = 3.5           # log-amount / log-gap z-score beyond which an invoice is unusual for its vendor
+MIN_LOG_STD = 0.15          # vendors billing the same amount every time still allow ~15% either way
+MIN_GAP_LOG_STD = 0.25
+DAY_WINDOW = 2              # day-of-month pattern compares the share of invoices within ±2 days
+DAY_SHARE_MIN = 0.02
+DAY_SMOOTHING = 0.1         # pseudo-count per day of the month
+BASELINE_CACHE_SIZE = 10_000
+BASELINE_CACHE_TTL = 300.0  # seconds before a cached baseline is re-read (other workers' merges, rebuilds)
+
+
+def _amount(value: Any) -> Optional[float]:
+    try:
+        amount = float(str(value).replace(',', '').replace('₹', '').strip()) if value is not None else None
+    except ValueError:
+        return None
+    return amount if amount and amount > 0 and math.isfinite(amount) else None
+
+
+def _spread(total: float, total_sq: float, count: float, floor: float) -> tuple:
+    mean = total / count
+    return mean, max(math.sqrt(max(total_sq / count - mean * mean, 0.0)), floor)
+
+
+# ----- running sums ---------------------------------------------------------
+
+def baseline_observation(invoice_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """What one invoice adds to its vendor's baseline (None when it has neither amount nor date)"""
+    amount = _amount(invoice_data.get('total_amount'))
+    day = parse_invoice_date(invoice_data.get('invoice_date'))
+    if amount is None and day is None:
+        return None
+    return {
+        'vendorName': invoice_data.get('vendor_name'),
+        'logAmount': math.log1p(amount) if amount is not None else None,
+        'day': day.toordinal() if day else None,
+        'dayOfMonth': day.day if day else None
+    }
+
+
+def observation_gap(baseline: Optional[Dict[str, Any]], observation: Dict[str, Any]) -> Optional[float]:
+    """log1p(days since the baseline's latest invoice date); None for the first or an older-dated invoice"""
+    last_day, day = (baseline or {}).get('lastDay'), observation['day']
+    return math.log1p(day - last_day) if day and last_day and day >= last_day else None
+
+
+def apply_observation(baseline: Optional[Dict[str, Any]], observation: Dict[str, Any]) -> Dict[str, Any]:
+    """Baseline with `observation` merged (a new dict; the same fields the Mongo pipeline update touches)"""
+    gap_log = observation_gap(baseline, observation)
+    merged = dict(baseline or {})
+    merged['days'] = dict(merged.get('days') or {})
+    merged['vendorName'] = observation['vendorName']
+    if observation['logAmount'] is not None:
+        merged['count'] = merged.get('count', 0) + 1
+        merged['logSum'] = merged.get('logSum', 0.0) + observation['logAmount']
+        merged['logSumSq'] = merged.get('logSumSq', 0.0) + observation['logAmount'] ** 2
+    if observation['day'] is not None:
+        merged['dated'] = merged.get('dated', 0) + 1
+        key = str(observation['dayOfMonth'])
+        merged['days'][key] = merged['days'].get(key, 0) + 1
+        merged['lastDay'] = max(merged.get('lastDay') or 0, observation['day'])
+    if gap_log is not None:
+        merged['gapCount'] = merged.get('gapCount', 0) + 1
+        merged['gapLogSum'] = merged.get('gapLogSum', 0.0) + gap_log
+        merged['gapLogSumSq'] = merged.get('gapLogSumSq', 0.0) + gap_log ** 2
+    merged['updatedAt'] = datetime.now()
+    return merged
+
+
+# ----- scoring --------------------------------------------------------------
+
+def score_invoice(baseline: Optional[Dict[str, Any]], invoice_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Judge an invoice against its vendor's baseline, in the global model's convention
+    (anomaly_score < 0 is an anomaly). None when the vendor has too little history
+    """
+    amount = _amount(invoice_data.get('total_amount'))
+    if not baseline or baseline.get('count', 0) < MIN_BASELINE_INVOICES or amount is None:
+        return None
+    mean, std = _spread(baseline['logSum'], baseline['logSumSq'], baseline['count'], MIN_LOG_STD)
+    amount_z = (math.log1p(amount) - mean) / std
+    margins = {'amount': (Z_THRESHOLD - abs(amount_z)) / Z_THRESHOLD}
+    reasons = []
+    if margins['amount'] < 0:
+        reasons.append(f"₹{amount:,.0f} against this vendor's usual ₹{math.expm1(mean):,.0f} (z {amount_z:+.1f})")
+
+    day = parse_invoice_date(invoice_data.get('invoice_date'))
+    gap_days = None
+    if day:
+        last_day = baseline.get('lastDay')
+        if baseline.get('gapCount', 0) >= MIN_CADENCE_GAPS and last_day and day.toordinal() >= last_day:
+            gap_days = day.toordinal() - last_day
+            gap_mean, gap_std = _spread(baseline['gapLogSum'], baseline['gapLogSumSq'], baseline['gapCount'],
+                                        MIN_GAP_LOG_STD)
+            # Only billing sooner than usual counts; a late invoice is not suspicious
+            margins['cadence'] = (Z_THRESHOLD + (math.log1p(gap_days) - gap_mean) / gap_std) / Z_THRESHOLD
+            if margins['cadence'] < 0:
+                reasons.append(f"{gap_days} days after the previous invoice; this vendor bills about every "
+                               f"{math.expm1(gap_mean):,.0f} days")
+        dated = baseline.get('dated', 0)
+        if dated >= MIN_BASELINE_INVOICES:
+            days = baseline.get('days') or {}
+            window = [(day.day - 1 + offset) % 31 + 1 for offset in range(-DAY_WINDOW, DAY_WINDOW + 1)]
+            share = ((sum(days.get(str(d), 0) for d in window) + DAY_SMOOTHING * len(window))
+                     / (dated + DAY_SMOOTHING * 31))
+            margins['day_of_month'] = min((share - DAY_SHARE_MIN) / DAY_SHARE_MIN, 1.0)
+            if margins['day_of_month'] < 0:
+                reasons.append(f"dated day {day.day} of the month; {share:.1%} of this vendor's invoices fall "
+                               f"within {DAY_WINDOW} days of it")
+
+    score = float(np.clip(min(margins.values()), -1.0, 1.0))
+    return {
+        'is_anomaly': score < 0,
+        'anomaly_score': round(score, 4),
+        'confidence': round(abs(score) * 100, 2),
+        'method': 'vendor_baseline',
+        'baseline_invoices': baseline['count'],
+        'amount_z': round(amount_z, 2),
+        'gap_days': gap_days,
+        'reasons': reasons
+    }
+
+
+def combine_predictions(global_result: Optional[Dict[str, Any]],
+                        baseline_result: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    The vendor's baseline decides when it has one; the global model's verdict is kept alongside.
+    `vendor_baseline` records the baseline verdict on the hot invoice document: it judged the invoice
+    against the vendor's history before it, so batch re-scoring keeps it instead of recomputing it
+    """
+    if baseline_result is None:
+        return global_result
+    combined = dict(baseline_result)
+    combined['vendor_baseline'] = {'is_anomaly': bool(baseline_result['is_anomaly']),
+                                   'anomaly_score': float(baseline_result['anomaly_score'])}
+    if global_result:
+        combined['model_version'] = global_result.get('model_version')
+        combined['global_prediction'] = {'is_anomaly': global_result['is_anomaly'],
+                                         'anomaly_score': global_result['anomaly_score']}
+    return combined
+
+
+# ----- cache ----------------------------------------------------------------
+
+class BaselineCache:
+    """
+    Bounded LRU of vendor baselines for one process. Misses (and vendors without a
+    baseline, cached as None) cost one point lookup through the caller's `load`;
+    entries older than `ttl_seconds` are re-read so other workers' merges show up
+    """
+
+    def __init__(self, maxsize: int = BASELINE_CACHE_SIZE, ttl_seconds: float = BASELINE_CACHE_TTL):
+        self.maxsize, self.ttl_seconds = maxsize, ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _cached(self, gst_number: str) -> tuple:
+        with self._lock:
+            entry = self._entries.get(gst_number)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(gst_number)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, gst_number: str, baseline: Optional[Dict[str, Any]]):
+        with self._lock:
+            self._entries[gst_number] = (time.monotonic(), baseline)
+            self._entries.move_to_end(gst_number)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, gst_number: str, load: Callable[[str], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        found, baseline = self._cached(gst_number)
+        if not found:
+            baseline = load(gst_number)
+            self.put(gst_number, baseline)
+        return baseline
+
+    async def aget(self, gst_number: str,
+                   load: Callable[[str], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        found, baseline = self._cached(gst_number)
+        if not found:
+            baseline = await load(gst_number)
+            self.put(gst_number, baseline)
+        return baseline
+
+    def apply(self, gst_number: str, observation: Dict[str, Any]):
+        """Mirror a merge this process just wrote (only when the vendor is cached)"""
+        with self._lock:
+            entry = self._entries.get(gst_number)
+            if entry is not None:
+                self._entries[gst_number] = (entry[0], apply_observation(entry[1], observation))
+
+    def stats(self) -> Dict[str, Any]:
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+# ----- batch rebuild --------------------------------------------------------
+
+def build_baselines(store, chunk_size: int = 5000) -> Dict[str, Dict[str, Any]]:
+    """
+    Every vendor's baseline from one streaming pass over the stored invoices.
+    Only four compact columns per invoice are kept (vendor, log amount, date), then
+    summed per vendor with bincount; the gaps come from one sort by (vendor, date)
+    """
+    codes: Dict[str, int] = {}
+    names: List[Optional[str]] = []
+    vendor, log_amount, day, day_of_month = array('q'), array('d'), array('q'), array('b')
+    for invoice in store.iter_invoices(batch_size=chunk_size):
+        gst_number = invoice.get('gstNumber')
+        if not gst_number or gst_number == 'Unknown':
+            continue
+        code = codes.setdefault(gst_number, len(codes))
+        if code == len(names):
+            names.append(None)
+        names[code] = invoice.get('vendorName')
+        amount = _amount(invoice.get('totalAmount'))
+        parsed = parse_invoice_date(invoice.get('invoiceDate'))
+        vendor.append(code)
+        log_amount.append(math.log1p(amount) if amount is not None else math.nan)
+        day.append(parsed.toordinal() if parsed else 0)
+        day_of_month.append(parsed.day if parsed else 0)
+
+    n = len(codes)
+    vendor, log_amount = np.frombuffer(vendor, dtype=np.int64), np.frombuffer(log_amount)
+    day, day_of_month = np.frombuffer(day, dtype=np.int64), np.frombuffer(day_of_month, dtype=np.int8)
+    priced = ~np.isnan(log_amount)
+    count = np.bincount(vendor[priced], minlength=n)
+    log_sum = np.bincount(vendor[priced], log_amount[priced], minlength=n)
+    log_sum_sq = np.bincount(vendor[priced], log_amount[priced] ** 2, minlength=n)
+
+    dated = day > 0
+    days = np.bincount(vendor[dated] * 31 + day_of_month[dated] - 1, minlength=n * 31).reshape(n, 31)
+    order = np.lexsort((day[dated], vendor[dated]))
+    sorted_vendor, sorted_day = vendor[dated][order], day[dated][order]
+    last_day = np.zeros(n, dtype=np.int64)
+    np.maximum.at(last_day, sorted_vendor, sorted_day)
+    same_vendor = sorted_vendor[1:] == sorted_vendor[:-1]
+    gap_vendor = sorted_vendor[1:][same_vendor]
+    gap_log = np.log1p(np.diff(sorted_day)[same_vendor])
+    gap_count = np.bincount(gap_vendor, minlength=n)
+    gap_sum = np.bincount(gap_vendor, gap_log, minlength=n)
+    gap_sum_sq = np.bincount(gap_vendor, gap_log ** 2, minlength=n)
+
+    now = datetime.now()
+    baselines = {}
+    for gst_number, code in codes.items():
+        baselines[gst_number] = {
+            'vendorName': names[code],
+            'count': int(count[code]), 'logSum': float(log_sum[code]), 'logSumSq': float(log_sum_sq[code]),
+            'dated': int(days[code].sum()),
+            'days': {str(d + 1): int(c) for d, c in enumerate(days[code]) if c},
+            'lastDay': int(last_day[code]) or None,
+            'gapCount': int(gap_count[code]), 'gapLogSum': float(gap_sum[code]), 'gapLogSumSq': float(gap_sum_sq[code]),
+            'updatedAt': now
+        }
+    return baselines
+
+
+def rebuild_vendor_baselines(store, chunk_size: int = 5000) -> Dict[str, Any]:
+    """
+    Recompute and swap in every baseline
+    (uploads merged while the scan runs are lost - run it when uploads are quiet)
+    """
+    started = time.perf_counter()
+    baselines = build_baselines(store, chunk_size)
+    invoices = sum(baseline['count'] for baseline in baselines.values())
+    ready = sum(baseline['count'] >= MIN_BASELINE_INVOICES for baseline in baselines.values())
+    store.replace_vendor_baselines(baselines)
+    summary = {'version': datetime.now(), 'vendors': len(baselines), 'vendors_with_baseline': ready,
+               'invoices': invoices, 'seconds': round(time.perf_counter() - started, 2)}
+    store.save_reference_snapshot(SNAPSHOT_NAME, summary)
+    print(f"✅ Baselines rebuilt for {len(baselines):,} vendors from {invoices:,} invoices in {summary['seconds']:.1f}s "
+          f"({ready:,} with {MIN_BASELINE_INVOICES}+ invoices, the rest use the global model)")
+    return summary
+
+
+if __name__ == "__main__":
+    from database import get_database, DEFAULT_CONNECTION_STRING
+
+    has_url = len(sys.argv) > 1 and not sys.argv[1].startswith('--')
+    store = get_database(sys.argv[1] if has_url else DEFAULT_CONNECTION_STRING)
+    if "--rebuild" in sys.argv:
+        rebuild_vendor_baselines(store)
+    elif "--show" in sys.argv:
+        for gst_number in sys.argv[sys.argv.index("--show") + 1:]:
+            baseline = store.get_vendor_baseline(gst_number)
+            if not baseline or not baseline.get('count'):
+                print(f"⚠️ {gst_number}: no baseline")
+                continue
+            mean, std = _spread(baseline['logSum'], baseline['logSumSq'], baseline['count'], MIN_LOG_STD)
+            cadence = (f"every ~{math.expm1(baseline['gapLogSum'] / baseline['gapCount']):,.0f} days"
+                       if baseline.get('gapCount') else "cadence unknown")
+            top_days = sorted((baseline.get('days') or {}).items(), key=lambda item: -item[1])[:3]
+            print(f"📊 {gst_number} {baseline.get('vendorName')}: {baseline['count']} invoices, "
+                  f"typical ₹{math.expm1(mean):,.0f} (×/÷ {math.exp(std):.2f}), {cadence}, "
+                  f"busiest days {', '.join(d for d, _ in top_days) or '-'}")
+    else:
+        print(__doc__)
+        sys.exit(2)
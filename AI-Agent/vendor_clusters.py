@@ -0,0 +1,228 @@
+"""
+Vendor Behaviour Clustering for FINTEL AI
+Groups vendors (by GST number) with similar billing behaviour and flags the ones
+that fit no group. One streaming pass over the stored invoices builds a small
+behaviour vector per vendor (volume, amount level and spread, round-amount /
+weekend / month-end shares, items per invoice, billing cadence, ML anomaly
+share); mini-batch k-means then clusters the vectors, which is linear in the
+number of vendors (DBSCAN on the invoice matrix was not).
+
+Assignments are written to the `vendor_clusters` collection, keyed by GST
+number; the anomaly rules read them with one point lookup per upload and raise
+VENDOR_BEHAVIOUR_OUTLIER for invoices from vendors far from every centroid or
+in a cluster of only a handful of vendors.
+Run it nightly (or after large imports).
+
+Usage:
+    python vendor_clusters.py [database_url] [--clusters 8] [--chunk-size 5000] [--dry-run]
+"""
+
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+
+from database import DEFAULT_CONNECTION_STRING, get_database
+from ml_features import FEATURE_NAMES, INPUT_FIELDS, column_features, parse_invoice_date
+from storage import InvoiceStore, invoice_data_from_doc
+
+SNAPSHOT_NAME = 'vendor_clusters'
+DEFAULT_CLUSTERS = 8
+DEFAULT_CHUNK_SIZE = 5000
+MIN_VENDOR_INVOICES = 5      # vendors with less history are assigned a cluster but never flagged
+OUTLIER_QUANTILE = 0.99      # distance to the own centroid beyond which a vendor is an outlier
+SMALL_CLUSTER_SHARE = 0.02   # a cluster holding fewer of the vendors is a group of outliers
+COMBINE_ROWS = 200_000       # merge per-chunk aggregates once this many rows are pending
+
+BEHAVIOUR_FEATURES = (
+    'log_invoices', 'mean_log_amount', 'std_log_amount', 'round_share', 'weekend_share',
+    'month_end_share', 'mean_items', 'log_cadence_days', 'ml_anomaly_share'
+)
+
+_COLUMN = {name: index for index, name in enumerate(FEATURE_NAMES)}
+_AGGREGATION = {
+    'vendor_name': 'last', 'invoices': 'sum', 'amounts': 'sum', 'log_amount': 'sum', 'log_amount_sq': 'sum',
+    'round': 'sum', 'dated': 'sum', 'weekend': 'sum', 'month_end': 'sum', 'items': 'sum', 'ml_anomaly': 'sum',
+    'first_day': 'min', 'last_day': 'max'
+}
+
+
+def _chunk_aggregates(invoices: List[Dict]) -> pd.DataFrame:
+    """Per-vendor sums for one chunk of stored invoices (invoices without a GST number are skipped)"""
+    invoices = [inv for inv in invoices if inv.get('gstNumber') and inv.get('gstNumber') != 'Unknown']
+    records = [invoice_data_from_doc(inv) for inv in invoices]
+    features = column_features({field: [record[field] for record in records] for field in INPUT_FIELDS})
+    log_amount = features[:, _COLUMN['log_amount']]
+    known_amount = ~np.isnan(log_amount)
+    day_of_month = features[:, _COLUMN['day_of_month']]
+    dated = ~np.isnan(day_of_month)
+    days = [parse_invoice_date(record['invoice_date']) or inv.get('uploadDate')
+            for record, inv in zip(records, invoices)]
+    frame = pd.DataFrame({
+        'key': [inv['gstNumber'] for inv in invoices],
+        'vendor_name': [record['vendor_name'] for record in records],
+        'invoices': 1,
+        'amounts': known_amount.astype(int),
+        'log_amount': np.where(known_amount, log_amount, 0.0),
+        'log_amount_sq': np.where(known_amount, log_amount ** 2, 0.0),
+        'round': np.nan_to_num(features[:, _COLUMN['round_amount']]),
+        'dated': dated.astype(int),
+        'weekend': np.nan_to_num(features[:, _COLUMN['weekend']]),
+        'month_end': (day_of_month >= 25).astype(int),
+        'items': features[:, _COLUMN['item_count']],
+        'ml_anomaly': [int(bool((inv.get('mlPrediction') or {}).get('is_anomaly'))) for inv in invoices],
+        'first_day': [day.toordinal() if isinstance(day, datetime) else np.nan for day in days]
+    })
+    frame['last_day'] = frame['first_day']
+    return frame.groupby('key').agg(_AGGREGATION)
+
+
+def vendor_aggregates(store: InvoiceStore, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[pd.DataFrame, int]:
+    """One streaming pass over every stored invoice; memory is O(vendors), not O(invoices)"""
+    totals, pending, pending_rows, chunk, seen = None, [], 0, [], 0
+
+    def combine():
+        nonlocal totals, pending, pending_rows
+        frames = pending + ([totals] if totals is not None else [])
+        totals = pd.concat(frames).groupby(level=0).agg(_AGGREGATION) if frames else totals
+        pending, pending_rows = [], 0
+
+    for invoice in store.iter_invoices(batch_size=chunk_size):
+        chunk.append(invoice)
+        if len(chunk) == chunk_size:
+            pending.append(_chunk_aggregates(chunk))
+            pending_rows += len(pending[-1])
+            seen += len(chunk)
+            chunk = []
+            if pending_rows >= COMBINE_ROWS:
+                combine()
+    if chunk:
+        pending.append(_chunk_aggregates(chunk))
+        seen += len(chunk)
+    combine()
+    return (totals if totals is not None else pd.DataFrame(columns=list(_AGGREGATION))), seen
+
+
+def behaviour_vectors(totals: pd.DataFrame) -> pd.DataFrame:
+    """BEHAVIOUR_FEATURES per vendor from the streamed sums"""
+    invoices = totals['invoices'].to_numpy(float)
+    amounts = np.maximum(totals['amounts'].to_numpy(float), 1)
+    dated = np.maximum(totals['dated'].to_numpy(float), 1)
+    mean_log = totals['log_amount'].to_numpy(float) / amounts
+    variance = np.maximum(totals['log_amount_sq'].to_numpy(float) / amounts - mean_log ** 2, 0)
+    span = (totals['last_day'] - totals['first_day']).to_numpy(float)
+    cadence = np.where(invoices > 1, span / np.maximum(invoices - 1, 1), np.nan)
+    vectors = pd.DataFrame({
+        'log_invoices': np.log1p(invoices),
+        'mean_log_amount': mean_log,
+        'std_log_amount': np.sqrt(variance),
+        'round_share': totals['round'].to_numpy(float) / invoices,
+        'weekend_share': totals['weekend'].to_numpy(float) / dated,
+        'month_end_share': totals['month_end'].to_numpy(float) / dated,
+        'mean_items': totals['items'].to_numpy(float) / invoices,
+        'log_cadence_days': np.log1p(cadence),
+        'ml_anomaly_share': totals['ml_anomaly'].to_numpy(float) / invoices
+    }, index=totals.index)
+    # Single-invoice vendors have no cadence yet: give them the typical one
+    return vectors.fillna(vectors.median()).fillna(0.0)
+
+
+def cluster_vendors(vectors: np.ndarray, eligible: np.ndarray, n_clusters: int = DEFAULT_CLUSTERS,
+                    seed: int = 0) -> Dict[str, Any]:
+    """
+    Mini-batch k-means on the vendors with enough history, then every vendor assigned to its
+    nearest centroid. Returns labels, distances, the outlier threshold and the fitted model
+    """
+    scaler = StandardScaler().fit(vectors[eligible])
+    scaled = scaler.transform(vectors)
+    n_clusters = min(n_clusters, int(eligible.sum()))
+    model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=4096, n_init=3, random_state=seed)
+    model.fit(scaled[eligible])
+    labels = model.predict(scaled)
+    distances = np.linalg.norm(scaled - model.cluster_centers_[labels], axis=1)
+    threshold = float(np.quantile(distances[eligible], OUTLIER_QUANTILE))
+    return {'labels': labels, 'distances': distances, 'threshold': threshold, 'model': model,
+            'centroids': scaler.inverse_transform(model.cluster_centers_)}
+
+
+def run_clustering(store: InvoiceStore, n_clusters: int = DEFAULT_CLUSTERS, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   dry_run: bool = False) -> Optional[Dict[str, Any]]:
+    """Stream, cluster and store the assignments; returns the run summary (None with too few vendors)"""
+    started = time.perf_counter()
+    totals, seen = vendor_aggregates(store, chunk_size)
+    stream_seconds = time.perf_counter() - started
+    print(f"📥 {seen:,} invoices from {len(totals):,} vendors in {stream_seconds:.1f}s "
+          f"({seen / max(stream_seconds, 1e-9):,.0f} invoices/s)")
+
+    vectors = behaviour_vectors(totals)
+    eligible = (totals['invoices'] >= MIN_VENDOR_INVOICES).to_numpy()
+    if eligible.sum() < 2 * n_clusters:
+        print(f"⚠️ Only {int(eligible.sum())} vendors with {MIN_VENDOR_INVOICES}+ invoices - "
+              f"need {2 * n_clusters} to form {n_clusters} clusters")
+        return None
+
+    started = time.perf_counter()
+    result = cluster_vendors(vectors.to_numpy(), eligible, n_clusters)
+    cluster_seconds = time.perf_counter() - started
+    sizes = np.bincount(result['labels'][eligible], minlength=len(result['centroids']))
+    far = result['distances'] > result['threshold']
+    small = sizes[result['labels']] < SMALL_CLUSTER_SHARE * eligible.sum()
+    outliers = eligible & (far | small)
+
+    version = datetime.now()
+    profiles = vectors.to_numpy().round(4).tolist()
+    assignments = {}
+    for i, (gst_number, vendor_name, invoices) in enumerate(zip(totals.index, totals['vendor_name'],
+                                                                 totals['invoices'].astype(int).tolist())):
+        assignments[gst_number] = {
+            'vendorName': vendor_name,
+            'cluster': int(result['labels'][i]),
+            'distance': round(float(result['distances'][i]), 4),
+            'threshold': round(result['threshold'], 4),
+            'outlier': bool(outliers[i]),
+            'reason': ('distance' if far[i] else 'small_cluster') if outliers[i] else None,
+            'invoices': invoices,
+            'profile': dict(zip(BEHAVIOUR_FEATURES, profiles[i])),
+            'version': version
+        }
+    summary = {
+        'version': version,
+        'features': list(BEHAVIOUR_FEATURES),
+        'threshold': result['threshold'],
+        'vendors': len(assignments),
+        'outliers': int(outliers.sum()),
+        'clusters': [{'cluster': c, 'vendors': int(sizes[c]),
+                      'centroid': {name: round(float(v), 4) for name, v in zip(BEHAVIOUR_FEATURES, centroid)}}
+                     for c, centroid in enumerate(result['centroids'])]
+    }
+    print(f"🧩 {len(sizes)} clusters over {len(assignments):,} vendors in {cluster_seconds:.2f}s, "
+          f"{summary['outliers']} outliers (distance > {result['threshold']:.2f} or a cluster under "
+          f"{SMALL_CLUSTER_SHARE:.0%} of vendors)")
+    for cluster in summary['clusters']:
+        centroid = cluster['centroid']
+        print(f"   #{cluster['cluster']}: {cluster['vendors']:>6,} vendors, ~₹{np.expm1(centroid['mean_log_amount']):,.0f}"
+              f"/invoice, every {np.expm1(centroid['log_cadence_days']):,.0f} days")
+
+    if dry_run:
+        print("🔍 Dry run - nothing written")
+    else:
+        store.replace_vendor_clusters(assignments)
+        store.save_reference_snapshot(SNAPSHOT_NAME, summary)
+        print(f"💾 Stored {len(assignments):,} vendor cluster assignments")
+    return summary
+
+
+if __name__ == "__main__":
+    def option(name: str, default: int) -> int:
+        return int(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+    has_url = len(sys.argv) > 1 and not sys.argv[1].startswith('--')
+    store = get_database(sys.argv[1] if has_url else DEFAULT_CONNECTION_STRING)
+    summary = run_clustering(store, n_clusters=option('--clusters', DEFAULT_CLUSTERS),
+                             chunk_size=option('--chunk-size', DEFAULT_CHUNK_SIZE), dry_run='--dry-run' in sys.argv)
+    sys.exit(0 if summary else 1)